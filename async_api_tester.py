@@ -0,0 +1,162 @@
+"""Async, in-process runner for the Pikkles API test suites.
+
+Tests are plain ``async def`` functions registered on an ``AsyncAPITester``.
+They call the FastAPI app through httpx's ASGI transport (no network, no
+deployed preview), each one against its own throwaway database and client
+address, and run concurrently. Every test is timed individually.
+
+    tester = AsyncAPITester("Pikkles API Backend Tests")
+
+    @tester.test("Health Check")
+    async def health_check(api):
+        await api.check("Health endpoint", "GET", "health", 200)
+
+    sys.exit(tester.main())
+"""
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+import uuid
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import httpx
+
+sys.path.insert(0, str(Path(__file__).resolve().parent / "backend"))
+
+from local_stack import bind_database, local_stack, make_database  # noqa: E402
+
+
+@dataclass
+class TestResult:
+    name: str
+    passed: bool
+    duration_ms: float
+    checks: int = 0
+    error: Optional[str] = None
+    log: List[str] = field(default_factory=list)
+
+
+class APIClient:
+    """Per-test HTTP client; ``check`` mirrors the old ``run_test`` helper.
+
+    ``db`` is the test's own database, for arranging or inspecting state
+    that has no API.
+    """
+
+    def __init__(self, http: httpx.AsyncClient, result: TestResult, db=None):
+        self.http = http
+        self.result = result
+        self.db = db
+
+    def log(self, message: str):
+        self.result.log.append(message)
+
+    async def request(self, method: str, endpoint: str, **kwargs) -> httpx.Response:
+        return await self.http.request(method, f"/api/{endpoint}", **kwargs)
+
+    async def check(self, name: str, method: str, endpoint: str, expected_status: int,
+                    data: Optional[Dict[str, Any]] = None, **kwargs) -> Any:
+        """Call the API, assert the status code and return the decoded body."""
+        self.result.checks += 1
+        response = await self.request(method, endpoint, json=data, **kwargs)
+        try:
+            body = response.json()
+        except ValueError:
+            body = response.text
+        if response.status_code != expected_status:
+            raise AssertionError(
+                f"{name}: expected {expected_status}, got {response.status_code} - {str(body)[:300]}"
+            )
+        self.log(f"✅ {name} - Status: {response.status_code}")
+        return body
+
+
+class AsyncAPITester:
+    def __init__(self, title: str, concurrency: int = 32, mongo_url: Optional[str] = None):
+        self.title = title
+        self.concurrency = concurrency
+        self.mongo_url = mongo_url or os.environ.get("TEST_MONGO_URL")
+        self.tests: List[tuple] = []
+
+    def test(self, name: str) -> Callable:
+        """Register ``async def fn(api)`` as an independent test."""
+        def decorator(fn: Callable[[APIClient], Awaitable[None]]):
+            self.tests.append((name, fn))
+            return fn
+        return decorator
+
+    async def _run_one(self, app, client, semaphore, name, fn) -> TestResult:
+        result = TestResult(name=name, passed=False, duration_ms=0.0)
+        test_id = uuid.uuid4()
+        db = client[f"pikkles_test_{test_id.hex[:12]}"]
+        # A distinct client address per test keeps per-IP rate limits isolated too
+        client_ip = ".".join(str(b) for b in (10,) + tuple(test_id.bytes[:3]))
+        transport = httpx.ASGITransport(app=app, client=(client_ip, 50000))
+        async with semaphore:
+            start = time.perf_counter()
+            with bind_database(db):
+                async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+                    try:
+                        await fn(APIClient(http, result, db))
+                        result.passed = True
+                    except AssertionError as exc:
+                        result.error = str(exc)
+                    except Exception as exc:  # pragma: no cover - reported, not raised
+                        result.error = f"{type(exc).__name__}: {exc}"
+            result.duration_ms = (time.perf_counter() - start) * 1000
+            if self.mongo_url:
+                await client.drop_database(db.name)
+        return result
+
+    async def run(self, only: Optional[List[str]] = None) -> List[TestResult]:
+        selected = [(n, fn) for n, fn in self.tests if not only or n in only]
+        semaphore = asyncio.Semaphore(self.concurrency)
+        client, _ = make_database(self.mongo_url)
+        try:
+            async with local_stack(mongo_url=self.mongo_url, isolated=True) as app:
+                return await asyncio.gather(
+                    *(self._run_one(app, client, semaphore, name, fn) for name, fn in selected)
+                )
+        finally:
+            client.close()
+
+    def report(self, results: List[TestResult], elapsed: float, verbose: bool = False) -> bool:
+        print(f"🚀 {self.title}")
+        print("=" * 60)
+        for result in sorted(results, key=lambda r: -r.duration_ms):
+            status = "✅" if result.passed else "❌"
+            print(f"{status} {result.name:<55} {result.duration_ms:8.1f} ms  ({result.checks} checks)")
+            if verbose:
+                for line in result.log:
+                    print(f"      {line}")
+            if result.error:
+                print(f"      {result.error}")
+        passed = sum(r.passed for r in results)
+        print("=" * 60)
+        print(f"📊 Tests passed: {passed}/{len(results)} in {elapsed:.2f}s")
+        return passed == len(results)
+
+    def run_sync(self) -> List[TestResult]:
+        logging.getLogger("httpx").setLevel(logging.WARNING)
+        return asyncio.run(self.run())
+
+    def assert_all_pass(self):
+        """pytest entry point: run the whole suite and fail on any failed test."""
+        results = self.run_sync()
+        failures = [f"{r.name}: {r.error}" for r in results if not r.passed]
+        assert not failures, "\n".join(failures)
+
+    def main(self, argv: Optional[List[str]] = None) -> int:
+        argv = sys.argv[1:] if argv is None else argv
+        logging.getLogger("httpx").setLevel(logging.WARNING)
+        start = time.perf_counter()
+        results = asyncio.run(self.run(only=[a for a in argv if not a.startswith("-")] or None))
+        ok = self.report(results, time.perf_counter() - start, verbose="-v" in argv)
+        if "--json" in argv:
+            print(json.dumps([r.__dict__ for r in results], default=str, indent=2))
+        return 0 if ok else 1
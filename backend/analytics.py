@@ -0,0 +1,238 @@
+"""Registration funnel rollups.
+
+``RollupSink`` is an outbox sink (see events.py) maintaining one
+``stats_daily`` document per UTC day with incremental counters:
+
+    {"_id": "2026-10-19", "created": 12,
+     "steps": {"1": 12, "2": 9, ...},              # drivers reaching each wizard step
+     "statuses": {"pending": 12, "approved": 3},   # transitions into each status
+     "cities": {"Paris": {"created": 5, "steps": {...}, "statuses": {...}}}}
+
+Reports (``funnel``, ``/admin/funnel``, ``export_frame``) read only these
+documents, never ``drivers``, so they cost a few small reads whatever the
+traffic. The only ``drivers`` read is the batched city lookup when events
+are rolled up.
+
+The outbox delivers at least once: every event id is recorded in
+``stats_events`` before its counters are applied, and events already
+recorded are skipped. A crash between the two steps loses those
+increments instead of double counting them; ``rebuild`` recomputes days
+from the outbox (kept ``events.OUTBOX_RETENTION``).
+
+    python analytics.py export 2026-09-01 2026-09-30 -o funnel.csv
+    python analytics.py rebuild 2026-10-12 2026-10-19
+"""
+import argparse
+import asyncio
+import logging
+import os
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+import events
+import geo
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+STEPS = range(1, 7)
+UNKNOWN_CITY = "Inconnue"
+
+
+async def ensure_indexes(db):
+    await db.stats_events.create_index(
+        "created_at", expireAfterSeconds=int(events.OUTBOX_RETENTION.total_seconds())
+    )
+
+
+def _field(name: str) -> str:
+    # City names become field names
+    return name.replace(".", " ").replace("$", " ").strip() or UNKNOWN_CITY
+
+
+def event_counters(event: Dict, city: Optional[str]) -> Dict[str, int]:
+    """Counter increments (dotted paths) for one lifecycle event."""
+    payload = event.get("payload") or {}
+    increments: Dict[str, int] = {}
+    if event["type"] == "driver.created":
+        increments["created"] = 1
+        increments.update({f"steps.{step}": 1 for step in range(1, (payload.get("registration_step") or 1) + 1)})
+        increments[f"statuses.{payload.get('status') or 'pending'}"] = 1
+    elif event["type"] == "driver.updated" and payload.get("registration_step"):
+        previous = payload.get("previous_step") or 0
+        increments.update({f"steps.{step}": 1 for step in range(previous + 1, payload["registration_step"] + 1)})
+    elif event["type"] == "driver.status_changed":
+        increments[f"statuses.{payload['status']}"] = 1
+    city = _field(city or UNKNOWN_CITY)
+    increments.update({f"cities.{city}.{key}": value for key, value in list(increments.items())})
+    return increments
+
+
+async def _cities(db, driver_ids: List[str]) -> Dict[str, Optional[str]]:
+    projection = {"id": 1, "profile.city": 1, "profile.address": 1}
+    return {
+        driver["id"]: geo.profile_city(driver.get("profile") or {})
+        async for driver in db.drivers.find({"id": {"$in": driver_ids}}, projection)
+    }
+
+
+async def apply_events(db, batch: List[Dict]) -> int:
+    """Add ``batch`` to the daily counters; returns the number of events counted."""
+    counted = [event for event in batch if event_counters(event, None)]
+    if not counted:
+        return 0
+    cities = await _cities(db, list({event["driver_id"] for event in counted}))
+    per_day: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+    for event in counted:
+        day = event["created_at"].strftime("%Y-%m-%d")
+        for path, value in event_counters(event, cities.get(event["driver_id"])).items():
+            per_day[day][path] += value
+    now = datetime.utcnow()
+    await db.stats_daily.bulk_write([
+        UpdateOne({"_id": day}, {"$inc": dict(counters), "$set": {"updated_at": now}}, upsert=True)
+        for day, counters in per_day.items()
+    ], ordered=False)
+    return len(counted)
+
+
+class RollupSink:
+    """Outbox sink folding lifecycle events into ``stats_daily``."""
+
+    name = "analytics"
+
+    def __init__(self, get_db: Callable):
+        self._get_db = get_db
+
+    async def send(self, batch: List[Dict]):
+        db = self._get_db()
+        batch = [event for event in batch if event_counters(event, None)]
+        if not batch:
+            return
+        markers = [{"_id": event["id"], "created_at": event["created_at"]} for event in batch]
+        fresh = set(range(len(batch)))
+        try:
+            await db.stats_events.insert_many(markers, ordered=False)
+        except BulkWriteError as exc:
+            for error in exc.details["writeErrors"]:
+                if error["code"] != 11000:
+                    raise
+                fresh.discard(error["index"])
+        await apply_events(db, [event for index, event in enumerate(batch) if index in fresh])
+
+
+async def rebuild(db, start: date, end: date) -> int:
+    """Recompute the rollups of ``start``..``end`` (inclusive) from the outbox."""
+    since = datetime.combine(start, datetime.min.time())
+    until = datetime.combine(end + timedelta(days=1), datetime.min.time())
+    days = [(start + timedelta(days=n)).isoformat() for n in range((end - start).days + 1)]
+    await db.stats_daily.delete_many({"_id": {"$in": days}})
+    counted = 0
+    cursor = db.outbox.find({"created_at": {"$gte": since, "$lt": until}}).sort("_id", 1)
+    batch: List[Dict] = []
+    async for event in cursor:
+        batch.append(event)
+        if len(batch) >= 1000:
+            counted += await apply_events(db, batch)
+            batch = []
+    if batch:
+        counted += await apply_events(db, batch)
+    return counted
+
+
+# --- Reports -----------------------------------------------------------------
+
+async def load_days(db, start: date, end: date) -> List[Dict]:
+    return await db.stats_daily.find(
+        {"_id": {"$gte": start.isoformat(), "$lte": end.isoformat()}}
+    ).sort("_id", 1).to_list(None)
+
+
+def _percent(part: int, whole: int) -> Optional[float]:
+    return round(100.0 * part / whole, 1) if whole else None
+
+
+def funnel(days: List[Dict], city: Optional[str] = None) -> Dict:
+    """Sum daily rollups into a step funnel, status counts and per-city totals."""
+    created, steps, statuses = 0, defaultdict(int), defaultdict(int)
+    cities: Dict[str, Dict[str, int]] = defaultdict(lambda: {"created": 0, "completed": 0})
+    for day in days:
+        scope = (day.get("cities") or {}).get(_field(city), {}) if city else day
+        created += scope.get("created", 0)
+        for step, count in (scope.get("steps") or {}).items():
+            steps[int(step)] += count
+        for status, count in (scope.get("statuses") or {}).items():
+            statuses[status] += count
+        for name, counters in (day.get("cities") or {}).items():
+            cities[name]["created"] += counters.get("created", 0)
+            cities[name]["completed"] += (counters.get("steps") or {}).get(str(STEPS[-1]), 0)
+
+    funnel_steps = []
+    previous = created
+    for step in STEPS:
+        count = steps.get(step, 0)
+        funnel_steps.append({
+            "step": step,
+            "drivers": count,
+            "from_previous": _percent(count, previous),
+            "from_start": _percent(count, created),
+        })
+        previous = count
+    return {
+        "created": created,
+        "steps": funnel_steps,
+        "statuses": dict(statuses),
+        "cities": dict(sorted(cities.items(), key=lambda item: -item[1]["created"])),
+    }
+
+
+def export_frame(days: List[Dict]) -> "pd.DataFrame":
+    """Long-format frame: one row per (day, city, metric, key) counter; city ``"*"`` is all cities."""
+    import pandas as pd  # ~200 ms to import, only paid by the CSV export
+
+    rows = []
+
+    def add(day, city, scope):
+        rows.append((day, city, "created", "", scope.get("created", 0)))
+        rows.extend((day, city, "step", step, count) for step, count in (scope.get("steps") or {}).items())
+        rows.extend((day, city, "status", status, count)
+                    for status, count in (scope.get("statuses") or {}).items())
+
+    for doc in days:
+        add(doc["_id"], "*", doc)
+        for city, scope in (doc.get("cities") or {}).items():
+            add(doc["_id"], city, scope)
+    frame = pd.DataFrame.from_records(rows, columns=["day", "city", "metric", "key", "count"])
+    frame["day"] = pd.to_datetime(frame["day"])
+    return frame
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    parser = argparse.ArgumentParser(description="Registration funnel rollups")
+    parser.add_argument("command", choices=["export", "rebuild"])
+    parser.add_argument("start", type=date.fromisoformat)
+    parser.add_argument("end", type=date.fromisoformat)
+    parser.add_argument("-o", "--output", default="funnel.csv", help="export file (.csv or .parquet)")
+    args = parser.parse_args()
+
+    load_dotenv(os.path.join(os.path.dirname(__file__), ".env"))
+    logging.basicConfig(level=logging.INFO)
+    client = AsyncIOMotorClient(os.environ["MONGO_URL"])
+    db = client[os.environ["DB_NAME"]]
+    if args.command == "rebuild":
+        print(asyncio.run(rebuild(db, args.start, args.end)), "events counted")
+    else:
+        frame = export_frame(asyncio.run(load_days(db, args.start, args.end)))
+        if args.output.endswith(".parquet"):
+            frame.to_parquet(args.output, index=False)
+        else:
+            frame.to_csv(args.output, index=False)
+        print(f"{len(frame)} rows written to {args.output}")
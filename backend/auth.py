@@ -0,0 +1,340 @@
+"""Authentication: password credentials and short-lived JWT access tokens.
+
+Credentials live in ``credentials``, one document per account with a
+unique index on the lowercased email, so a login is one indexed read:
+
+    {"id": ..., "email": "jean@example.fr", "password_hash": "$2b$12$...",
+     "role": "driver" | "admin", "driver_id": ..., "created_at": ...}
+
+A driver's login is only created once they prove they own the profile
+e-mail: ``request_registration`` keeps the hashed password in
+``registrations`` with a single-use token (stored as its SHA-256) that is
+e-mailed to them, and ``confirm_registration`` turns it into credentials.
+Unconfirmed registrations expire after ``REGISTRATION_TTL``.
+
+Passwords are hashed with bcrypt through passlib. One check costs ~200 ms
+of CPU at the default cost, so hashing runs in a small dedicated thread
+pool (bcrypt releases the GIL): logins never stall the event loop, and a
+burst of logins queues on that pool instead of starving the default
+executor. Unknown emails are checked against a dummy hash so they take as
+long as wrong passwords; hashes made with an older cost are upgraded on
+the next successful login.
+
+Access tokens are JWTs valid ``AUTH_TOKEN_TTL`` seconds (15 minutes by
+default), signed with HS256 by default or with RS256/ES256 from PEM keys.
+HS256 needs ``JWT_SECRET``, shared by every worker; only in development
+does a missing secret fall back to a per-process random one.
+``TokenService`` prepares its verification keys once, selected by the
+token's ``kid`` header, instead of letting pyjwt re-prepare (and for PEM
+keys re-parse) them on every decode. Tokens that verified are then kept in
+a small LRU until they expire, so a request carrying a recently seen token
+costs a dict lookup and a clock read, under a microsecond, against
+100-150 us for a full decode and signature check (benchmarks/auth_bench.py).
+
+    python auth.py create-admin ops@pikkle.fr
+"""
+import argparse
+import asyncio
+import getpass
+import hashlib
+import logging
+import os
+import secrets
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Optional, Tuple
+
+import jwt
+from fastapi import Depends, HTTPException
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from passlib.context import CryptContext
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+MIN_PASSWORD_LENGTH = 8
+ROLES = ("driver", "admin")
+ISSUER = "pikkle"
+REGISTRATION_TTL = timedelta(hours=24)
+
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__rounds=int(os.environ.get("AUTH_BCRYPT_ROUNDS", "12")),
+)
+
+_hash_pool: Optional[ThreadPoolExecutor] = None
+_dummy_hash: Optional[str] = None
+
+
+class AccountExists(Exception):
+    pass
+
+
+def _pool() -> ThreadPoolExecutor:
+    global _hash_pool
+    if _hash_pool is None:
+        workers = int(os.environ.get("AUTH_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+        _hash_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="auth-hash")
+    return _hash_pool
+
+
+def shutdown_pool():
+    global _hash_pool
+    if _hash_pool is not None:
+        _hash_pool.shutdown(wait=False, cancel_futures=True)
+        _hash_pool = None
+
+
+async def hash_password(password: str) -> str:
+    return await asyncio.get_running_loop().run_in_executor(_pool(), pwd_context.hash, password)
+
+
+async def verify_password(password: str, password_hash: str) -> Tuple[bool, Optional[str]]:
+    """``(valid, new hash)``; the new hash is set when the stored one needs an upgrade."""
+    return await asyncio.get_running_loop().run_in_executor(
+        _pool(), pwd_context.verify_and_update, password, password_hash
+    )
+
+
+# --- Credentials -------------------------------------------------------------
+
+async def ensure_indexes(db):
+    await db.credentials.create_index("email", unique=True)
+    await db.credentials.create_index("id", unique=True)
+    await db.registrations.create_index("email", unique=True)
+    await db.registrations.create_index("token_sha256", unique=True)
+    await db.registrations.create_index("expires_at", expireAfterSeconds=0)
+
+
+async def create_credentials(db, email: str, password: str, role: str = "driver",
+                             driver_id: Optional[str] = None, password_hash: Optional[str] = None) -> Dict:
+    """Store a new account; raises ``AccountExists`` if the email is taken."""
+    if role not in ROLES:
+        raise ValueError(f"Unknown role {role!r}")
+    credential = {
+        "id": str(uuid.uuid4()),
+        "email": email.strip().lower(),
+        "password_hash": password_hash or await hash_password(password),
+        "role": role,
+        "driver_id": driver_id,
+        "created_at": datetime.utcnow(),
+    }
+    try:
+        await db.credentials.insert_one(credential)
+    except DuplicateKeyError:
+        raise AccountExists(email) from None
+    return credential
+
+
+def _token_digest(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+async def request_registration(db, email: str, password: str, driver_id: str) -> str:
+    """Keep a pending login for ``driver_id`` and return the token to e-mail to ``email``.
+
+    Raises ``AccountExists`` if the email already has an account. A new
+    request replaces the previous one, whose token stops working.
+    """
+    email = email.strip().lower()
+    if await db.credentials.find_one({"email": email}, {"_id": 1}):
+        raise AccountExists(email)
+    token = secrets.token_urlsafe(32)
+    now = datetime.utcnow()
+    await db.registrations.update_one({"email": email}, {"$set": {
+        "driver_id": driver_id,
+        "password_hash": await hash_password(password),
+        "token_sha256": _token_digest(token),
+        "created_at": now,
+        "expires_at": now + REGISTRATION_TTL,
+    }}, upsert=True)
+    return token
+
+
+async def confirm_registration(db, token: str) -> Optional[Dict]:
+    """Credentials of the registration ``token`` was e-mailed for, else None (unknown or expired)."""
+    registration = await db.registrations.find_one_and_delete(
+        {"token_sha256": _token_digest(token), "expires_at": {"$gt": datetime.utcnow()}}
+    )
+    if registration is None:
+        return None
+    return await create_credentials(db, registration["email"], "", driver_id=registration["driver_id"],
+                                    password_hash=registration["password_hash"])
+
+
+async def authenticate(db, email: str, password: str) -> Optional[Dict]:
+    """The account matching ``email`` and ``password``, else None."""
+    global _dummy_hash
+    credential = await db.credentials.find_one({"email": email.strip().lower()})
+    if credential is None:
+        # Same cost as a wrong password, so response times do not reveal accounts
+        _dummy_hash = _dummy_hash or await hash_password(secrets.token_urlsafe(16))
+        await verify_password(password, _dummy_hash)
+        return None
+    valid, new_hash = await verify_password(password, credential["password_hash"])
+    if not valid:
+        return None
+    if new_hash:
+        await db.credentials.update_one({"_id": credential["_id"]}, {"$set": {"password_hash": new_hash}})
+    await db.credentials.update_one({"_id": credential["_id"]}, {"$set": {"last_login_at": datetime.utcnow()}})
+    return credential
+
+
+# --- Tokens ------------------------------------------------------------------
+
+def key_id(key: str) -> str:
+    """Stable ``kid`` of a key, so tokens keep verifying after it becomes the previous key."""
+    return hashlib.sha256(key.encode()).hexdigest()[:12]
+
+
+class TokenService:
+    """Issues and verifies access tokens.
+
+    ``keys`` maps a key id to ``(signing key, verification key)``: the same
+    secret for HS256, PEM private/public keys for RS256/ES256. Tokens are
+    signed with ``current``; every key in ``keys`` still verifies, which
+    lets keys be rotated without logging everybody out.
+    """
+
+    def __init__(self, keys: Dict[str, Tuple[str, str]], current: str, algorithm: str = "HS256",
+                 ttl: int = 900, cache_size: int = 10_000, leeway: int = 5):
+        self.algorithm = algorithm
+        self.ttl = ttl
+        self.leeway = leeway
+        self.current = current
+        algorithm_impl = jwt.get_algorithm_by_name(algorithm)
+        self._signing_key = algorithm_impl.prepare_key(keys[current][0])
+        self._verification_keys = {kid: algorithm_impl.prepare_key(pair[1]) for kid, pair in keys.items()}
+        self._cache: "OrderedDict[str, Dict]" = OrderedDict()
+        self._cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_env(cls, development: bool = False) -> "TokenService":
+        """Keys from the environment; without ``JWT_SECRET`` this raises, unless ``development``."""
+        algorithm = os.environ.get("JWT_ALGORITHM", "HS256")
+        ttl = int(os.environ.get("AUTH_TOKEN_TTL", "900"))
+        if algorithm.startswith("HS"):
+            secret = os.environ.get("JWT_SECRET")
+            if not secret:
+                if not development:
+                    # A per-process secret would reject tokens issued by the other workers
+                    raise RuntimeError("JWT_SECRET is not set (only optional with APP_ENV=development)")
+                logger.warning("JWT_SECRET is not set: tokens are signed with a per-process random secret")
+                secret = secrets.token_urlsafe(32)
+            keys = {key_id(secret): (secret, secret)}
+            if os.environ.get("JWT_PREVIOUS_SECRET"):
+                keys[key_id(os.environ["JWT_PREVIOUS_SECRET"])] = (os.environ["JWT_PREVIOUS_SECRET"],) * 2
+            return cls(keys, key_id(secret), algorithm, ttl)
+        with open(os.environ["JWT_PRIVATE_KEY_FILE"]) as private, open(os.environ["JWT_PUBLIC_KEY_FILE"]) as public:
+            public_key = public.read()
+            return cls({key_id(public_key): (private.read(), public_key)}, key_id(public_key), algorithm, ttl)
+
+    def issue(self, subject: str, role: str, driver_id: Optional[str] = None) -> str:
+        now = int(time.time())
+        claims = {"sub": subject, "role": role, "iss": ISSUER, "iat": now, "exp": now + self.ttl}
+        if driver_id:
+            claims["driver_id"] = driver_id
+        return jwt.encode(claims, self._signing_key, algorithm=self.algorithm, headers={"kid": self.current})
+
+    def verify(self, token: str) -> Dict:
+        """Claims of a valid token; raises ``jwt.InvalidTokenError`` otherwise."""
+        claims = self._cache.get(token)
+        if claims is not None:
+            if claims["exp"] + self.leeway > time.time():
+                self._cache.move_to_end(token)
+                self.hits += 1
+                return claims
+            del self._cache[token]
+            raise jwt.ExpiredSignatureError("Signature has expired")
+
+        self.misses += 1
+        key = self._verification_keys.get(jwt.get_unverified_header(token).get("kid"))
+        if key is None:
+            raise jwt.InvalidTokenError("Unknown key id")
+        claims = jwt.decode(token, key, algorithms=[self.algorithm], issuer=ISSUER, leeway=self.leeway,
+                            options={"require": ["exp", "iat", "sub", "role"]})
+        self._cache[token] = claims
+        if len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+        return claims
+
+    def issue_for(self, credential: Dict) -> Dict:
+        """Token response body for a logged-in account."""
+        return {
+            "access_token": self.issue(credential["id"], credential["role"], credential.get("driver_id")),
+            "token_type": "bearer",
+            "expires_in": self.ttl,
+        }
+
+
+_bearer = HTTPBearer(auto_error=False)
+
+
+def requires(get_tokens: Callable[[], TokenService], *roles: str):
+    """FastAPI dependency returning the caller's claims; 401 without a valid token, 403 for other roles.
+
+    ``get_tokens`` is called per request, so the dependency can be declared
+    before the app (and its ``TokenService``) is built.
+    """
+
+    async def dependency(credentials: Optional[HTTPAuthorizationCredentials] = Depends(_bearer)) -> Dict:
+        if credentials is None:
+            raise HTTPException(status_code=401, detail="Authentification requise",
+                                headers={"WWW-Authenticate": "Bearer"})
+        try:
+            claims = get_tokens().verify(credentials.credentials)
+        except jwt.ExpiredSignatureError:
+            raise HTTPException(status_code=401, detail="Session expirée",
+                                headers={"WWW-Authenticate": "Bearer"}) from None
+        except jwt.InvalidTokenError:
+            raise HTTPException(status_code=401, detail="Jeton invalide",
+                                headers={"WWW-Authenticate": "Bearer"}) from None
+        if roles and claims["role"] not in roles:
+            raise HTTPException(status_code=403, detail="Accès refusé")
+        return claims
+
+    return dependency
+
+
+def requires_driver(get_tokens: Callable[[], TokenService], *roles: str):
+    """Like ``requires``, for the routes of one driver (``driver_id`` path parameter): the
+    caller must hold that driver's token, or have one of ``roles``; 403 otherwise."""
+    authenticated = requires(get_tokens)
+
+    async def dependency(driver_id: str, claims: Dict = Depends(authenticated)) -> Dict:
+        if claims.get("driver_id") != driver_id and claims["role"] not in roles:
+            raise HTTPException(status_code=403, detail="Accès refusé")
+        return claims
+
+    return dependency
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    parser = argparse.ArgumentParser(description="Account administration")
+    parser.add_argument("command", choices=["create-admin"])
+    parser.add_argument("email")
+    args = parser.parse_args()
+
+    load_dotenv(os.path.join(os.path.dirname(__file__), ".env"))
+    logging.basicConfig(level=logging.INFO)
+    password = getpass.getpass("Mot de passe : ")
+    if len(password) < MIN_PASSWORD_LENGTH:
+        raise SystemExit(f"Mot de passe trop court ({MIN_PASSWORD_LENGTH} caractères minimum)")
+    client = AsyncIOMotorClient(os.environ["MONGO_URL"])
+    db = client[os.environ["DB_NAME"]]
+
+    async def main():
+        await ensure_indexes(db)
+        credential = await create_credentials(db, args.email, password, role="admin")
+        return credential["id"]
+
+    print(asyncio.run(main()))
@@ -0,0 +1,147 @@
+"""Document expiry tracking and the compliance sweeper.
+
+Insurance certificates and residence permits expire. Their expiry date is
+recorded when the document is uploaded, in ``document_expiry``:
+
+    {"vehicle_insurance": {"expires_at": datetime(2026, 11, 30), "reminders": [30]}}
+
+Every driver with a tracked document also carries ``compliance_check_at``,
+the next time something is due for them: the next reminder (``REMINDER_DAYS``
+before expiry) or the expiry itself. It is indexed, so the daily sweep is a
+single range query on drivers with something due, whatever the size of
+the fleet; drivers with nothing due are never read.
+
+For each due driver the sweep emits ``driver.document_expiring`` reminders
+(notifications.py turns them into email/SMS), and once a document has
+expired moves the driver from an operating status to ``suspended``. Each
+driver's update is guarded on the values read, and its events are emitted
+only when it matched; the updates of a batch are committed with their
+outbox events (events.py). Reinstating a suspended driver is left to
+staff, after the new document is uploaded.
+"""
+import logging
+from datetime import date, datetime, time, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import events
+
+logger = logging.getLogger(__name__)
+
+EXPIRING_DOCUMENTS = {
+    "civil_liability_insurance": "Assurance responsabilité civile",
+    "vehicle_insurance": "Assurance véhicule",
+    "residence_permit": "Titre de séjour",
+}
+
+# Days before expiry at which a reminder is sent, largest first
+REMINDER_DAYS = (30, 7)
+
+OPERATING_STATUSES = ("approved", "contract_pending", "active")
+SUSPENDED = "suspended"
+
+
+async def ensure_indexes(db):
+    await db.drivers.create_index("compliance_check_at", sparse=True)
+
+
+def expiry_datetime(expires_on: date) -> datetime:
+    """A document is valid through its expiry date: it expires at the next midnight UTC."""
+    return datetime.combine(expires_on + timedelta(days=1), time.min)
+
+
+def _due_dates(record: Dict) -> List[Tuple[datetime, Optional[int]]]:
+    """Pending ``(when, reminder days)`` of one document; ``None`` days is the expiry itself."""
+    if record.get("expired"):
+        return []
+    expires_at = record["expires_at"]
+    due = [(expires_at - timedelta(days=days), days) for days in REMINDER_DAYS
+           if days not in record.get("reminders", [])]
+    return due + [(expires_at, None)]
+
+
+def next_check(document_expiry: Dict[str, Dict]) -> Optional[datetime]:
+    """When the sweeper next has to look at a driver; None once nothing is pending."""
+    return min((when for record in document_expiry.values() for when, _ in _due_dates(record)), default=None)
+
+
+def record_expiry(document_expiry: Dict[str, Dict], document_type: str, expires_on: date,
+                  now: Optional[datetime] = None) -> Dict[str, Dict]:
+    """``document_expiry`` with a freshly uploaded document; reminders already past are skipped."""
+    now = now or datetime.utcnow()
+    expires_at = expiry_datetime(expires_on)
+    return {
+        **document_expiry,
+        document_type: {
+            "expires_at": expires_at,
+            "reminders": [days for days in REMINDER_DAYS if expires_at - timedelta(days=days) <= now],
+        },
+    }
+
+
+def review(driver: Dict, now: datetime) -> Tuple[Dict, List[Dict]]:
+    """``($set, events)`` for one driver whose ``compliance_check_at`` is due."""
+    document_expiry = {key: dict(record) for key, record in (driver.get("document_expiry") or {}).items()}
+    outbox: List[Dict] = []
+    expired = []
+    for document_type, record in document_expiry.items():
+        due = [days for when, days in _due_dates(record) if when <= now]
+        if not due:
+            continue
+        label = EXPIRING_DOCUMENTS.get(document_type, document_type)
+        expires_on = (record["expires_at"] - timedelta(days=1)).strftime("%d/%m/%Y")
+        if None in due:
+            record["expired"] = True
+            expired.append(document_type)
+            outbox.append(events.driver_event("driver.document_expired", driver["id"],
+                                              document_type=document_type, document_label=label,
+                                              expires_on=expires_on))
+        else:
+            # Only the most urgent reminder when several are due (e.g. after downtime)
+            record["reminders"] = sorted(set(record.get("reminders", [])) | set(due), reverse=True)
+            outbox.append(events.driver_event("driver.document_expiring", driver["id"],
+                                              document_type=document_type, document_label=label,
+                                              expires_on=expires_on, days=str(min(due))))
+
+    update = {"document_expiry": document_expiry, "compliance_check_at": next_check(document_expiry)}
+    if expired and driver.get("status") in OPERATING_STATUSES:
+        update.update({"status": SUSPENDED, "suspension_reason": "document_expired", "updated_at": now})
+        outbox += events.status_events(driver["id"], driver.get("status"), SUSPENDED, documents=expired)
+    return update, outbox
+
+
+async def sweep(db, now: Optional[datetime] = None, batch_size: int = 500) -> Dict[str, int]:
+    """Send due reminders and suspend drivers with expired documents."""
+    now = now or datetime.utcnow()
+    counts = {"drivers": 0, "reminders": 0, "suspended": 0}
+    projection = {"id": 1, "status": 1, "document_expiry": 1, "compliance_check_at": 1}
+    while True:
+        due = await db.drivers.find(
+            {"compliance_check_at": {"$lte": now}}, projection
+        ).sort("compliance_check_at", 1).limit(batch_size).to_list(None)
+        if not due:
+            break
+        reviews = [(driver, *review(driver, now)) for driver in due]
+        outbox: List[Dict] = []
+
+        async def write(session):
+            for driver, update, driver_events in reviews:
+                # Guarded on the values read, so a concurrent upload or status change is not
+                # overwritten; that driver is still due and is reviewed again next sweep
+                result = await db.drivers.update_one(
+                    {"_id": driver["_id"], "compliance_check_at": driver["compliance_check_at"],
+                     "status": driver.get("status")},
+                    {"$set": update}, session=session,
+                )
+                if not result.matched_count:
+                    continue
+                outbox.extend(driver_events)
+                counts["reminders"] += sum(event["type"] == "driver.document_expiring" for event in driver_events)
+                counts["suspended"] += update.get("status") == SUSPENDED
+
+        await events.commit(db, write, outbox)
+        counts["drivers"] += len(due)
+        if len(due) < batch_size:
+            break
+    if counts["drivers"]:
+        logger.info("Compliance sweep: %s", counts)
+    return counts
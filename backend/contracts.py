@@ -0,0 +1,237 @@
+"""KYC contract rendering.
+
+Contract templates (``templates/*.txt``, ``string.Template`` syntax, lines
+starting with ``# `` are headings) are parsed once per process and cached.
+Rendering to PDF is CPU bound, so it runs in a process pool and never on
+the event loop; the PDF is a small self-contained writer (Helvetica,
+WinAnsi encoding) so no extra dependency is needed.
+
+The rendered PDF is stored in the upload store next to the driver's other
+documents, named after its SHA-256 so identical renders are deduplicated
+and the hash recorded on the driver proves which document was sent.
+"""
+import asyncio
+import hashlib
+import multiprocessing
+import os
+import textwrap
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from functools import lru_cache
+from pathlib import Path
+from string import Template
+from typing import Dict, List, Optional, Tuple
+
+import events
+
+TEMPLATE_DIR = Path(__file__).parent / "templates"
+DEFAULT_TEMPLATE = "kyc_contract"
+
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842  # A4 in points
+MARGIN = 56
+FONT_SIZE = 10
+LEADING = 14
+WRAP_WIDTH = 95
+LINES_PER_PAGE = (PAGE_HEIGHT - 2 * MARGIN) // LEADING
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+@lru_cache(maxsize=None)
+def load_template(name: str = DEFAULT_TEMPLATE) -> Template:
+    return Template((TEMPLATE_DIR / f"{name}.txt").read_text(encoding="utf-8"))
+
+
+def contract_context(driver: Dict, now: Optional[datetime] = None) -> Dict[str, str]:
+    """Template variables for a driver document."""
+    now = now or datetime.utcnow()
+    profile = driver.get("profile") or {}
+    business = driver.get("business_info") or {}
+    contract = driver.get("contract") or {}
+    if profile.get("postal_code") and profile.get("city"):
+        street = " ".join(filter(None, [profile.get("street_number"), profile.get("street_name")]))
+        address = ", ".join(filter(None, [street, f"{profile['postal_code']} {profile['city']}",
+                                          profile.get("country") or "France"]))
+    else:
+        address = profile.get("address", "")
+    return {
+        "full_name": f"{profile.get('firstname', '')} {profile.get('lastname', '')}".strip(),
+        "address": address,
+        "tax_id": business.get("siret", ""),
+        "vehicle_type": business.get("vehicle_type") or "À préciser",
+        "insurance_provider": business.get("insurance_provider") or "À préciser",
+        "insurance_number": business.get("insurance_number") or "À préciser",
+        "commission_rate": f"{contract.get('commission_rate', 15.0):g}",
+        "date": now.strftime("%d/%m/%Y"),
+        "contract_id": f"PKL-{driver['id'][:8].upper()}-{now.strftime('%Y%m%d')}",
+    }
+
+
+def _pdf_escape(text: str) -> bytes:
+    encoded = text.encode("cp1252", errors="replace")
+    return encoded.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)")
+
+
+def build_pdf(lines: List[Tuple[str, str]]) -> bytes:
+    """Minimal multi-page PDF from ``(font, text)`` lines; font is ``F1`` or ``F2`` (bold)."""
+    pages = [lines[i:i + LINES_PER_PAGE] for i in range(0, len(lines), LINES_PER_PAGE)] or [[]]
+    objects: List[bytes] = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"",  # page tree, filled once page object numbers are known
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>",
+    ]
+    page_refs = []
+    for page in pages:
+        stream = [b"BT", f"{LEADING} TL {MARGIN} {PAGE_HEIGHT - MARGIN} Td".encode()]
+        for font, text in page:
+            stream.append(f"/{font} {FONT_SIZE} Tf".encode())
+            stream.append(b"(" + _pdf_escape(text) + b") Tj T*")
+        stream.append(b"ET")
+        content = b"\n".join(stream)
+        objects.append(b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream")
+        content_ref = len(objects)
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] "
+            f"/Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> /Contents {content_ref} 0 R >>".encode()
+        )
+        page_refs.append(len(objects))
+    kids = " ".join(f"{ref} 0 R" for ref in page_refs)
+    objects[1] = f"<< /Type /Pages /Kids [{kids}] /Count {len(page_refs)} >>".encode()
+
+    out = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+def render_contract(context: Dict[str, str], template: str = DEFAULT_TEMPLATE) -> bytes:
+    """Render a contract to PDF bytes. CPU bound: call through ``render_async``."""
+    text = load_template(template).safe_substitute(context)
+    lines: List[Tuple[str, str]] = []
+    for raw in text.splitlines():
+        if raw.startswith("# "):
+            lines.append(("F2", raw[2:]))
+            continue
+        for wrapped in textwrap.wrap(raw, WRAP_WIDTH, replace_whitespace=False, drop_whitespace=False) or [""]:
+            lines.append(("F1", wrapped))
+    return build_pdf(lines)
+
+
+def get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn: the API process runs driver threads, which do not survive fork
+        _pool = ProcessPoolExecutor(
+            max_workers=int(os.environ.get("CONTRACT_RENDER_WORKERS", "2")),
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _pool
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+async def render_async(context: Dict[str, str], template: str = DEFAULT_TEMPLATE) -> bytes:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_pool(), render_contract, context, template)
+
+
+def _write_file(path: Path, data: bytes):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if not path.exists():
+        tmp = path.with_suffix(".tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+
+
+async def store_contract(pdf: bytes, driver_id: str, upload_dir: Path, root_dir: Path,
+                         vault=None) -> Dict[str, str]:
+    digest = hashlib.sha256(pdf).hexdigest()
+    path = upload_dir / driver_id / f"kyc_contract_{digest[:16]}.pdf"
+    if vault is not None:
+        await vault.write_bytes(path, driver_id, pdf)
+    else:
+        await asyncio.to_thread(_write_file, path, pdf)
+    return {"path": str(path.relative_to(root_dir)), "sha256": digest}
+
+
+def contract_update(driver: Dict, stored: Dict[str, str], now: datetime) -> Dict:
+    """``$set`` marking the contract as generated and sent, to apply with ``contract_filter``.
+
+    Field by field over an existing contract, so what changed in it while
+    the PDF rendered (the commission rate, say) is kept.
+    """
+    fields = {
+        "kyc_contract_generated": True,
+        "kyc_contract_sent_date": now,
+        "kyc_contract_document": stored["path"],
+        "kyc_contract_sha256": stored["sha256"],
+    }
+    if driver.get("contract"):
+        update = {f"contract.{field}": value for field, value in fields.items()}
+    else:
+        update = {"contract": {**fields, "commission_rate": 15.0}}
+    return {**update, "status": "contract_pending", "updated_at": now}
+
+
+def contract_filter(driver: Dict) -> Dict:
+    """Guard of ``contract_update``: the driver is still approved, and still has no contract if it had none."""
+    guard = {"id": driver["id"], "status": "approved"}
+    if not driver.get("contract"):
+        guard["contract"] = None
+    return guard
+
+
+async def generate_contract(driver: Dict, upload_dir: Path, root_dir: Path,
+                            vault=None) -> Tuple[Dict, Dict, Dict]:
+    """Render and store one driver's contract (encrypted with ``vault``); returns ``(context, stored, $set)``."""
+    now = datetime.utcnow()
+    context = contract_context(driver, now)
+    stored = await store_contract(await render_async(context), driver["id"], upload_dir, root_dir, vault)
+    return context, stored, contract_update(driver, stored, now)
+
+
+async def generate_pending_contracts(db, upload_dir: Path, root_dir: Path, limit: int = 500,
+                                     vault=None) -> Dict[str, int]:
+    """Batch mode: contracts for every approved driver that has none yet."""
+    drivers = await db.drivers.find(
+        {"status": "approved", "contract.kyc_contract_generated": {"$ne": True}}
+    ).to_list(limit)
+    results = await asyncio.gather(
+        *(generate_contract(driver, upload_dir, root_dir, vault) for driver in drivers), return_exceptions=True
+    )
+    generated, failed = [], 0
+    for driver, result in zip(drivers, results):
+        if isinstance(result, BaseException):
+            failed += 1
+        else:
+            generated.append((driver, *result[1:]))
+    outbox: List[Dict] = []
+
+    async def write(session) -> int:
+        updated = 0
+        for driver, stored, update in generated:
+            # Guarded so a driver changed meanwhile is not overwritten, nor notified
+            result = await db.drivers.update_one(contract_filter(driver), {"$set": update}, session=session)
+            if not result.matched_count:
+                continue
+            updated += 1
+            outbox.append(events.driver_event("driver.kyc_contract_generated", driver["id"],
+                                              document=stored["path"], sha256=stored["sha256"]))
+            outbox.extend(events.status_events(driver["id"], "approved", update["status"]))
+        return updated
+
+    updated = await events.commit(db, write, outbox) if generated else 0
+    return {"generated": updated, "failed": failed}
@@ -0,0 +1,130 @@
+"""Compliance dossiers: a driver's documents as one ZIP, streamed.
+
+Auditors ask for every document of a driver, or of every driver in a
+city:
+
+    GET /api/admin/drivers/{id}/dossier.zip
+    GET /api/admin/dossiers.zip?city=Lyon[&status=approved]
+
+The archive is written while it is sent. ``zipfile`` writes into a sink
+with no ``seek``, so it follows each member with a data descriptor
+(its CRC and sizes) instead of patching the local header, and the sink
+is drained into the response after every write. Documents are read in
+``vault.CHUNK_SIZE`` chunks, decrypted on the fly, and drivers come from
+a cursor: memory holds a chunk, a cursor batch and the central directory
+(~1 KB per member, 10 MB for 10,000 documents), whatever their size, and
+nothing is staged on disk. Documents are stored, not deflated: scans and
+photos are already compressed, and exports run at ~300 MB/s, encrypted
+or not, faster than they leave over the network
+(benchmarks/dossier_bench.py).
+
+Each driver is a folder named after its id, holding its documents, its
+KYC contract and a ``manifest.json`` written last: the ``Driver`` record
+as the API returns it, and for each document its member name, size and
+SHA-256, or why it is missing.
+"""
+import hashlib
+import json
+import logging
+import zipfile
+from datetime import datetime
+from pathlib import Path
+from typing import AsyncIterable, AsyncIterator, Dict, List, Optional, Tuple
+
+from pydantic import ValidationError
+
+import vault
+from models import Driver
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = "manifest.json"
+
+
+class _Sink:
+    """Write-only file for ``zipfile``; what it receives is taken out with ``drain``."""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def document_locations(driver: Dict) -> List[Tuple[str, str]]:
+    """``(name, location)`` of the files of a driver's dossier."""
+    locations = [(name, location) for name, location in (driver.get("documents") or {}).items() if location]
+    contract = (driver.get("contract") or {}).get("kyc_contract_document")
+    if contract:
+        locations.append(("kyc_contract", contract))
+    return locations
+
+
+def driver_record(driver: Dict) -> Dict:
+    try:
+        return Driver(**driver).dict()
+    except ValidationError:
+        # Exported as stored rather than failing the whole archive midway
+        return {key: value for key, value in driver.items() if key != "_id"}
+
+
+async def _write_driver(archive: zipfile.ZipFile, sink: _Sink, driver: Dict, root_dir: Path,
+                        document_vault: Optional[vault.Vault]) -> AsyncIterator[bytes]:
+    folder = driver["id"]
+    entries = []
+    for name, location in document_locations(driver):
+        entry = {"document": name, "location": location}
+        entries.append(entry)
+        if "://" in location:
+            entry["missing"] = "stored outside the server"
+            continue
+        path = root_dir / location
+        if not path.is_file():
+            entry["missing"] = "file not found"
+            continue
+        stat = path.stat()
+        modified = datetime.fromtimestamp(stat.st_mtime).timetuple()[:6]
+        info = zipfile.ZipInfo(f"{folder}/{name}{path.suffix}", modified)
+        info.file_size = stat.st_size  # an upper bound, so zipfile picks ZIP64 for large files
+        digest, size = hashlib.sha256(), 0
+        with archive.open(info, "w") as member:
+            try:
+                async for chunk in vault.read_document(path, document_vault):
+                    member.write(chunk)
+                    digest.update(chunk)
+                    size += len(chunk)
+                    yield sink.drain()
+            except vault.DecryptionError:
+                # Headers are sent: the member is cut short and flagged in the manifest
+                logger.error("Dossier of %s: %s failed authentication", folder, location)
+                entry["error"] = "decryption failed, content truncated"
+        entry.update({"member": info.filename, "size": size, "sha256": digest.hexdigest()})
+
+    manifest = {"driver": driver_record(driver), "documents": entries, "exported_at": datetime.utcnow()}
+    archive.writestr(f"{folder}/{MANIFEST}", json.dumps(manifest, default=str, ensure_ascii=False, indent=2),
+                     compress_type=zipfile.ZIP_DEFLATED)
+    yield sink.drain()
+
+
+async def stream_dossiers(drivers: AsyncIterable[Dict], root_dir: Path,
+                          document_vault: Optional[vault.Vault] = None) -> AsyncIterator[bytes]:
+    """ZIP archive of the dossiers of ``drivers``, in pieces."""
+    sink = _Sink()
+    count = 0
+    with zipfile.ZipFile(sink, "w", zipfile.ZIP_STORED) as archive:
+        async for driver in drivers:
+            async for data in _write_driver(archive, sink, driver, root_dir, document_vault):
+                if data:
+                    yield data
+            count += 1
+    yield sink.drain()  # central directory
+    logger.info("Exported %d dossier(s)", count)
@@ -0,0 +1,280 @@
+"""Transactional outbox for driver lifecycle events.
+
+State changes on drivers go through ``commit``: the ``drivers`` write and
+the matching ``outbox`` documents are written in one transaction when the
+deployment supports it (replica set, detected at startup); on a standalone
+mongod the state is written first, then the events.
+
+``OutboxDispatcher`` tails the outbox in ``_id`` order and hands batches to
+pluggable sinks. Each sink has its own committed position in
+``outbox_consumers``, advanced only after the sink accepted the batch, so
+delivery is at-least-once per sink and one slow or failing sink does not
+hold the others back. Only the worker holding the ``outbox-dispatcher``
+lease dispatches.
+
+ObjectIds are generated by each worker with its own clock, to the second,
+so ids are only ordered across seconds: an event written now by another
+worker may sort before one already seen in the same second. The
+dispatcher only takes events whose ``_id`` second is ``settle_delay``
+old, which must exceed clock skew between workers plus the time a write
+takes to commit; past that, no event can appear behind a position.
+
+Events are kept ``OUTBOX_RETENTION`` (SSE replay, ``analytics.rebuild``)
+and deleted by ``prune`` only once every sink has consumed them: a sink
+that keeps failing holds its events, however old.
+"""
+import asyncio
+import json
+import logging
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+from bson import ObjectId
+
+from jobs import acquire_lease
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_RETENTION = timedelta(days=7)
+
+# Set at startup by detect_transactions(); False until proven otherwise
+TRANSACTIONS = False
+
+
+def driver_event(event_type: str, driver_id: str, **payload) -> Dict:
+    return {
+        "id": str(uuid.uuid4()),
+        "type": event_type,
+        "driver_id": driver_id,
+        "payload": payload,
+        "created_at": datetime.utcnow(),
+    }
+
+
+def status_events(driver_id: str, previous: Optional[str], current: Optional[str], **payload) -> List[Dict]:
+    """A ``driver.status_changed`` event if the status actually changed."""
+    if current is None or current == previous:
+        return []
+    return [driver_event("driver.status_changed", driver_id, previous=previous, status=current, **payload)]
+
+
+async def ensure_indexes(db):
+    # Was a TTL index, which deleted events sinks had not consumed yet (see prune)
+    created_at = (await db.outbox.index_information()).get("created_at_1")
+    if created_at and "expireAfterSeconds" in created_at:
+        await db.outbox.drop_index("created_at_1")
+    await db.outbox.create_index("created_at")
+    # Replay of a driver's missed events (live.py, Last-Event-ID)
+    await db.outbox.create_index([("driver_id", 1), ("_id", 1)])
+
+
+async def detect_transactions(db) -> bool:
+    global TRANSACTIONS
+    try:
+        hello = await db.command("hello")
+        TRANSACTIONS = bool(hello.get("setName") or hello.get("msg") == "isdbgrid")
+    except Exception:
+        TRANSACTIONS = False
+    logger.info("Outbox transactions %s", "enabled" if TRANSACTIONS else "unavailable")
+    return TRANSACTIONS
+
+
+async def commit(db, write: Callable[..., Awaitable], events: List[Dict]):
+    """Run ``write(session)`` and store ``events`` in the outbox alongside it.
+
+    ``events`` is read once ``write`` has returned, so ``write`` may fill it,
+    for instance with events only for the guarded updates that matched.
+    """
+    if TRANSACTIONS:
+        async with await db.client.start_session() as session:
+            async with session.start_transaction():
+                result = await write(session)
+                if events:
+                    await db.outbox.insert_many(events, session=session)
+                return result
+    result = await write(None)
+    if events:
+        await db.outbox.insert_many(events)
+    return result
+
+
+# --- Sinks -------------------------------------------------------------------
+
+class EventBus:
+    """In-process fan-out; subscribers receive events on bounded queues."""
+
+    name = "bus"
+
+    def __init__(self, queue_size: int = 1000):
+        self.queue_size = queue_size
+        self._subscribers: Set[asyncio.Queue] = set()
+
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue(self.queue_size)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+
+    def publish(self, event: Dict):
+        for queue in self._subscribers:
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                logger.warning("Event bus subscriber full, dropping %s", event["type"])
+
+    async def send(self, events: List[Dict]):
+        for event in events:
+            self.publish(event)
+
+
+class FileSink:
+    """Appends events as JSON lines to a file."""
+
+    name = "file"
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+
+    def _append(self, lines: str):
+        with open(self.path, "a", encoding="utf-8") as handle:
+            handle.write(lines)
+
+    async def send(self, events: List[Dict]):
+        lines = "".join(json.dumps(_public(event), default=str) + "\n" for event in events)
+        await asyncio.to_thread(self._append, lines)
+
+
+class WebhookSink:
+    """Posts event batches to a URL; without a URL it only records them (stub)."""
+
+    name = "webhook"
+
+    def __init__(self, url: Optional[str] = None, timeout: float = 5.0):
+        self.url = url
+        self.timeout = timeout
+        self.delivered: List[Dict] = []
+
+    async def send(self, events: List[Dict]):
+        payload = [_public(event) for event in events]
+        if not self.url:
+            self.delivered.extend(payload)
+            return
+        import httpx
+        async with httpx.AsyncClient(timeout=self.timeout) as client:
+            response = await client.post(self.url, content=json.dumps(payload, default=str),
+                                         headers={"Content-Type": "application/json"})
+            response.raise_for_status()
+
+
+def _public(event: Dict) -> Dict:
+    return {k: v for k, v in event.items() if k != "_id"}
+
+
+# --- Dispatcher --------------------------------------------------------------
+
+class OutboxDispatcher:
+    def __init__(self, get_db: Callable, sinks: List, batch_size: int = 200,
+                 poll_interval: float = 0.5, settle_delay: float = 2.0):
+        self._get_db = get_db
+        self.sinks = sinks
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        # Events are only eligible once their _id second is this old (see above)
+        self.settle_delay = timedelta(seconds=settle_delay)
+        self.delivered: Dict[str, int] = defaultdict(int)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.last_error: Dict[str, str] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    async def _position(self, db, sink) -> Optional[ObjectId]:
+        consumer = await db.outbox_consumers.find_one({"_id": sink.name})
+        return consumer["position"] if consumer else None
+
+    async def dispatch_sink(self, db, sink, now: Optional[datetime] = None) -> int:
+        position = await self._position(db, sink)
+        # Filtered on _id, the key positions advance on, never on created_at
+        query = {"_id": {"$lt": ObjectId.from_datetime((now or datetime.utcnow()) - self.settle_delay)}}
+        if position is not None:
+            query["_id"]["$gt"] = position
+        batch = await db.outbox.find(query).sort("_id", 1).to_list(self.batch_size)
+        if not batch:
+            return 0
+        try:
+            await sink.send(batch)
+        except Exception as exc:
+            self.errors[sink.name] += 1
+            self.last_error[sink.name] = f"{type(exc).__name__}: {exc}"
+            logger.warning("Outbox sink %s failed: %s", sink.name, exc)
+            return 0
+        await db.outbox_consumers.update_one(
+            {"_id": sink.name},
+            {"$set": {"position": batch[-1]["_id"], "updated_at": datetime.utcnow()}},
+            upsert=True,
+        )
+        self.delivered[sink.name] += len(batch)
+        return len(batch)
+
+    async def dispatch_once(self, db=None, now: Optional[datetime] = None) -> int:
+        """One pass over all sinks; returns the number of deliveries."""
+        db = db or self._get_db()
+        counts = await asyncio.gather(*(self.dispatch_sink(db, sink, now) for sink in self.sinks))
+        return sum(counts)
+
+    async def prune(self, db=None, now: Optional[datetime] = None) -> int:
+        """Delete events older than ``OUTBOX_RETENTION`` that every sink has consumed."""
+        db = db or self._get_db()
+        positions = [await self._position(db, sink) for sink in self.sinks]
+        if not positions or None in positions:
+            return 0
+        result = await db.outbox.delete_many({
+            "_id": {"$lte": min(positions)},
+            "created_at": {"$lt": (now or datetime.utcnow()) - OUTBOX_RETENTION},
+        })
+        if result.deleted_count:
+            logger.info("Pruned %d delivered outbox event(s)", result.deleted_count)
+        return result.deleted_count
+
+    async def _loop(self):
+        while True:
+            try:
+                db = self._get_db()
+                lease_ttl = timedelta(seconds=max(10 * self.poll_interval, 5))
+                if await acquire_lease(db, "outbox-dispatcher", lease_ttl):
+                    # Drain quickly while there is a backlog, then poll
+                    while await self.dispatch_once(db) >= self.batch_size:
+                        pass
+            except Exception:
+                logger.exception("Outbox dispatcher pass failed")
+            await asyncio.sleep(self.poll_interval)
+
+    def start(self):
+        self._task = asyncio.create_task(self._loop(), name="outbox-dispatcher")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def metrics(self, db=None) -> Dict:
+        """Consumer lag per sink: pending events and age of the oldest one."""
+        db = db or self._get_db()
+        now = datetime.utcnow()
+        sinks = {}
+        for sink in self.sinks:
+            position = await self._position(db, sink)
+            pending = {"_id": {"$gt": position}} if position is not None else {}
+            oldest = await db.outbox.find(pending).sort("_id", 1).limit(1).to_list(1)
+            sinks[sink.name] = {
+                "lag_events": await db.outbox.count_documents(pending),
+                "lag_seconds": round((now - oldest[0]["created_at"]).total_seconds(), 3) if oldest else 0.0,
+                "delivered": self.delivered[sink.name],
+                "errors": self.errors[sink.name],
+                "last_error": self.last_error.get(sink.name),
+            }
+        return {"transactions": TRANSACTIONS, "sinks": sinks}
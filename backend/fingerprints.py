@@ -0,0 +1,211 @@
+"""Near-duplicate detection of identity document photos.
+
+Registering several driver accounts with the same ID card is a classic
+fraud, and comparing each upload with every stored document does not
+scale. Each identity photo instead gets a 64-bit fingerprint, looked up
+among the fingerprints of the whole fleet by Hamming distance.
+
+The fingerprint is a perceptual hash (pHash) of the upright image: in
+grayscale, shrunk to 32x32, the 8x8 lowest frequencies of its DCT, one
+bit each, set when above their median. Recompressing, halving or
+brightening a photo moves it by 0-2 bits, while different documents are
+mostly 10-40 bits apart (benchmarks/fingerprint_bench.py). Cropping is
+not covered: a 2% crop moves it by ~12 bits. A difference hash (dHash)
+moved by up to 12 bits when brightened. Cards of one template framed
+alike can come out close: a match is a lead for staff, not a verdict.
+
+The index uses multi-index hashing: the 64 bits are split into four
+16-bit bands, each with a table from band value to fingerprints. Two
+fingerprints within distance ``r`` have, by pigeonhole, a band within
+``r // 4`` of each other, so a query probes every table with the band
+values that close to its own (17 per table at the default radius) and
+checks the candidates found there on all 64 bits. A lookup takes
+60-85 µs among 100k fingerprints and 0.5-0.6 ms among a million, where a
+linear scan takes 10-20 and 150-200 ms; the index holds ~300 bytes per
+fingerprint, owner included.
+
+Fingerprints are stored in ``document_fingerprints``, one per driver and
+document type. Each worker loads them all at startup and, before each
+check, pulls the ones any worker wrote since its last sync (indexed on
+``updated_at``). A match is not reported to the uploader: it is logged,
+kept on the fingerprint, and listed for staff by
+``GET /api/admin/drivers/{id}/similar-documents``.
+"""
+import asyncio
+import logging
+from array import array
+from datetime import datetime, timedelta
+from functools import lru_cache
+from itertools import combinations
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import images
+
+logger = logging.getLogger(__name__)
+
+IDENTITY_DOCUMENTS = ("identity_card_front", "identity_card_back", "residence_permit")
+HASH_BITS = 64
+RADIUS = 6
+DCT_SIZE, LOW_FREQUENCIES = 32, 8
+SYNC_OVERLAP = timedelta(seconds=5)  # clock skew and writes in flight between workers
+
+Owner = Tuple[str, str]  # (driver id, document type)
+
+
+# (shift, width) of each band; ~log2 of the number of fingerprints is best
+_BANDS = ((0, 16), (16, 16), (32, 16), (48, 16))
+
+
+def phash(path: str) -> int:
+    """Perceptual hash of the image at ``path``; runs in the image pool."""
+    import numpy as np
+    from PIL import Image, ImageOps
+
+    with Image.open(path) as image:
+        if image.format == "JPEG":
+            image.draft("L", (DCT_SIZE * 4, DCT_SIZE * 4))
+        image = ImageOps.exif_transpose(image).convert("L").resize((DCT_SIZE, DCT_SIZE), Image.LANCZOS)
+        pixels = np.asarray(image, dtype=float)
+    # DCT-II rows for the lowest frequencies only: low = C @ pixels @ C.T
+    frequency, sample = np.ogrid[:LOW_FREQUENCIES, :DCT_SIZE]
+    basis = np.cos(np.pi * (2 * sample + 1) * frequency / (2 * DCT_SIZE))
+    low = (basis @ pixels @ basis.T).flatten()
+    bits = low > np.median(low[1:])  # the DC term, the mean brightness, would skew the median
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+async def compute(path: Path) -> Optional[int]:
+    """Fingerprint of an image file, or None if it cannot be read."""
+    if not images.available():
+        return None
+    try:
+        return await asyncio.get_running_loop().run_in_executor(images.get_pool(), phash, str(path))
+    except Exception:
+        logger.warning("Could not fingerprint %s", path, exc_info=True)
+        return None
+
+
+@lru_cache(maxsize=None)
+def _band_masks(width: int, distance: int) -> Tuple[int, ...]:
+    """Every ``width``-bit mask with at most ``distance`` bits set."""
+    return tuple(
+        sum(1 << bit for bit in bits)
+        for flips in range(distance + 1)
+        for bits in combinations(range(width), flips)
+    )
+
+
+class HammingIndex:
+    """64-bit fingerprints searchable by Hamming distance (multi-index hashing)."""
+
+    def __init__(self):
+        # Slots are append-only; a replaced fingerprint leaves a dead slot (owner None)
+        self._hashes = array("Q")
+        self._owners: List[Optional[Owner]] = []
+        self._slots: Dict[Owner, int] = {}
+        self._tables: List[Dict[int, List[int]]] = [{} for _ in _BANDS]
+
+    def __len__(self):
+        return len(self._slots)
+
+    def get(self, owner: Owner) -> Optional[int]:
+        slot = self._slots.get(owner)
+        return None if slot is None else self._hashes[slot]
+
+    def add(self, owner: Owner, value: int):
+        slot = self._slots.get(owner)
+        if slot is not None:
+            if self._hashes[slot] == value:
+                return
+            self._owners[slot] = None
+        slot = len(self._hashes)
+        self._hashes.append(value)
+        self._owners.append(owner)
+        self._slots[owner] = slot
+        for (shift, width), table in zip(_BANDS, self._tables):
+            table.setdefault((value >> shift) & ((1 << width) - 1), []).append(slot)
+
+    def remove(self, owner: Owner):
+        slot = self._slots.pop(owner, None)
+        if slot is not None:
+            self._owners[slot] = None
+
+    def search(self, value: int, radius: int = RADIUS) -> List[Tuple[int, Owner]]:
+        """``(distance, owner)`` of the fingerprints within ``radius`` of ``value``, closest first."""
+        hashes, found = self._hashes, {}
+        for (shift, width), table in zip(_BANDS, self._tables):
+            key = (value >> shift) & ((1 << width) - 1)
+            for mask in _band_masks(width, radius // len(_BANDS)):
+                # A fingerprint close in several bands is checked again: cheaper than tracking it
+                for slot in table.get(key ^ mask, ()):
+                    distance = (hashes[slot] ^ value).bit_count()
+                    if distance <= radius:
+                        found[slot] = distance
+        return sorted((distance, self._owners[slot]) for slot, distance in found.items()
+                      if self._owners[slot] is not None)
+
+
+class FingerprintIndex:
+    """The fleet's identity fingerprints: ``document_fingerprints`` mirrored in a ``HammingIndex``."""
+
+    def __init__(self, get_db: Callable, radius: int = RADIUS):
+        self._get_db = get_db
+        self.radius = radius
+        self.index = HammingIndex()
+        self._synced_at: Optional[datetime] = None
+
+    async def ensure_indexes(self):
+        db = self._get_db()
+        await db.document_fingerprints.create_index([("driver_id", 1), ("document_type", 1)], unique=True)
+        await db.document_fingerprints.create_index("updated_at")
+
+    async def load(self):
+        """Rebuild from the database (startup)."""
+        self.index, self._synced_at = HammingIndex(), None
+        await self.sync()
+        logger.info("Loaded %d document fingerprints", len(self.index))
+
+    async def sync(self):
+        """Pull the fingerprints written since the last sync, by any worker."""
+        now = datetime.utcnow()
+        query = {} if self._synced_at is None else {"updated_at": {"$gte": self._synced_at - SYNC_OVERLAP}}
+        cursor = self._get_db().document_fingerprints.find(
+            query, {"_id": 0, "driver_id": 1, "document_type": 1, "hash": 1}
+        )
+        async for fingerprint in cursor:
+            self.index.add((fingerprint["driver_id"], fingerprint["document_type"]), int(fingerprint["hash"], 16))
+        self._synced_at = now
+
+    def _similar(self, driver_id: str, value: int) -> List[Dict]:
+        return [
+            {"driver_id": other, "document_type": document_type, "distance": distance}
+            for distance, (other, document_type) in self.index.search(value, self.radius)
+            if other != driver_id
+        ]
+
+    async def check(self, driver_id: str, document_type: str, value: int) -> List[Dict]:
+        """Record a driver's fingerprint; returns other drivers' documents it is close to."""
+        await self.sync()
+        matches = self._similar(driver_id, value)
+        await self._get_db().document_fingerprints.update_one(
+            {"driver_id": driver_id, "document_type": document_type},
+            {"$set": {"hash": f"{value:016x}", "matches": matches, "updated_at": datetime.utcnow()}},
+            upsert=True,
+        )
+        self.index.add((driver_id, document_type), value)
+        if matches:
+            logger.warning("Driver %s %s looks like %d document(s) of other drivers: %s", driver_id,
+                           document_type, len(matches), ", ".join(match["driver_id"] for match in matches))
+        return matches
+
+    async def similar(self, driver_id: str) -> List[Dict]:
+        """Other drivers' documents close to any of this driver's identity documents."""
+        await self.sync()
+        results = []
+        for document_type in IDENTITY_DOCUMENTS:
+            value = self.index.get((driver_id, document_type))
+            if value is not None:
+                results.extend({"document_type": document_type, "similar_to": match}
+                               for match in self._similar(driver_id, value))
+        return results
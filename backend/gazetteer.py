@@ -0,0 +1,280 @@
+"""French postal code / city gazetteer.
+
+Loaded once per process from a La Poste "base officielle des codes
+postaux" export: ``;``-separated, columns found by header name
+(``Nom_de_la_commune``, ``Code_postal``, ``Libellé_d_acheminement``).
+The full ~39k-row file is downloaded at deploy time,
+
+    python gazetteer.py fetch
+
+into ``data/laposte_hexasmal_full.csv`` (``make backend`` does it once),
+or given through ``GAZETTEER_FILE``. ``data/laposte_hexasmal.csv`` bundles
+a subset (every prefecture and the large cities) for tests and offline
+development; with it, postcodes outside the subset are unknown and their
+addresses go unchecked, so loading it logs a warning.
+
+Memory layout, compact and allocation-free at lookup time:
+
+* city names are interned once, with an id per folded key (lowercase, no
+  accents, ``st`` -> ``saint``); display names are derived on demand;
+* the postcode index is in CSR form: postcode ``p`` (an int below 100000)
+  has the name ids ``entries[offsets[p]:offsets[p + 1]]``, two
+  ``array('I')`` of ~400 KB together, so ``cities`` is O(1);
+* city names are found in free text by looking up the token n-grams
+  starting at each token, longest first, in the folded-key dict: a flat
+  hashed trie that costs nothing to build on top of the intern table.
+
+Parsing the full export takes ~200 ms, so the built structures are cached
+with ``marshal`` in a writable cache directory (``GAZETTEER_CACHE_DIR``,
+else ``$XDG_CACHE_HOME/pikkle`` or ``~/.cache/pikkle``, else the temp
+directory), never next to the source file, which a deploy may ship
+read-only. Later processes reload it in ~20 ms; the cache is keyed on the
+source file's size and mtime.
+"""
+import argparse
+import csv
+import hashlib
+import logging
+import marshal
+import os
+import re
+import tempfile
+import unicodedata
+from array import array
+from functools import lru_cache
+from itertools import accumulate
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+BUNDLED_FILE = Path(__file__).parent / "data" / "laposte_hexasmal.csv"
+FULL_FILE = Path(__file__).parent / "data" / "laposte_hexasmal_full.csv"
+SOURCE_URL = "https://datanova.laposte.fr/data-fair/api/v1/datasets/laposte-hexasmal/raw"
+MIN_POSTCODES = 5_000  # the full file has ~6,300, the bundled subset ~260
+CACHE_VERSION = 1
+
+_TOKEN = re.compile(r"[0-9a-z]+")
+_ABBREVIATIONS = {"st": "saint", "ste": "sainte"}
+_LOWERCASE_WORDS = {"en", "sur", "sous", "les", "la", "le", "de", "des", "du", "et", "aux", "l", "d"}
+_LIGATURES = str.maketrans({"œ": "oe", "Œ": "OE", "æ": "ae", "Æ": "AE"})
+
+POSTCODE_SPACE = 100_000
+
+
+def fold(text: str) -> str:
+    """Lowercase ASCII: accents stripped, ligatures expanded."""
+    if not text.isascii():
+        text = unicodedata.normalize("NFKD", text.translate(_LIGATURES)).encode("ascii", "ignore").decode()
+    return text.lower()
+
+
+def tokens(text: str) -> List[str]:
+    """Folded tokens: ``"Saint-Étienne"`` and ``"ST ETIENNE"`` both give ``["saint", "etienne"]``."""
+    return [_ABBREVIATIONS.get(token, token) for token in _TOKEN.findall(fold(text))]
+
+
+def display_name(name: str) -> str:
+    """``"AIX EN PROVENCE"`` -> ``"Aix en Provence"``."""
+    words = name.replace("-", " ").split()
+    return " ".join(
+        word.lower() if index and word.lower() in _LOWERCASE_WORDS else word.capitalize()
+        for index, word in enumerate(words)
+    )
+
+
+def _column(header: List[str], *candidates: str) -> int:
+    keys = [" ".join(tokens(column)) for column in header]
+    for candidate in candidates:
+        if candidate in keys:
+            return keys.index(candidate)
+    raise ValueError(f"Gazetteer file has no {candidates[0]!r} column")
+
+
+class Gazetteer:
+    def __init__(self, offsets: array, entries: array, names: List[str], keys: List[str]):
+        self.offsets = offsets
+        self.entries = entries
+        self._names = names
+        self._ids: Dict[str, int] = {key: name_id for name_id, key in enumerate(keys)}
+        self._max_tokens = max((key.count(" ") + 1 for key in keys), default=0)
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Tuple[str, str, str]]) -> "Gazetteer":
+        """``rows``: ``(commune, postcode, libellé d'acheminement)``."""
+        names: List[str] = []
+        ids: Dict[str, int] = {}
+        raw_ids: Dict[str, int] = {}
+
+        def intern(name: str) -> int:
+            name_id = raw_ids.get(name)
+            if name_id is None:
+                key = " ".join(tokens(name))
+                name_id = ids.get(key)
+                if name_id is None:
+                    name_id = ids[key] = len(names)
+                    names.append(name)
+                raw_ids[name] = name_id
+            return name_id
+
+        pairs: List[Tuple[int, int]] = []
+        for commune, postcode, label in rows:
+            code = int(postcode)
+            # The delivery label first: it is what people write on addresses
+            pairs.append((code, intern(label or commune)))
+            if commune and commune != label:
+                pairs.append((code, intern(commune)))
+        # Deduplicated, grouped by postcode; the stable sort keeps labels first
+        pairs = sorted(dict.fromkeys(pairs), key=lambda pair: pair[0])
+
+        counts = array("I", bytes(4 * (POSTCODE_SPACE + 1)))
+        for code, _ in pairs:
+            counts[code + 1] += 1
+        return cls(array("I", accumulate(counts)), array("I", (name_id for _, name_id in pairs)), names, list(ids))
+
+    @classmethod
+    def parse(cls, path: Path) -> "Gazetteer":
+        with open(path, encoding="utf-8-sig", newline="") as handle:
+            reader = csv.reader(handle, delimiter=";")
+            header = next(reader)
+            commune = _column(header, "nom de la commune", "nom commune")
+            postcode = _column(header, "code postal")
+            label = _column(header, "libelle d acheminement", "libelle acheminement")
+            return cls.from_rows((row[commune], row[postcode], row[label]) for row in reader if row)
+
+    @classmethod
+    def load(cls, path: Optional[Path] = None, cache_dir: Optional[Path] = None) -> "Gazetteer":
+        """Load ``path``, from its compiled cache when it is up to date."""
+        path = Path(path or BUNDLED_FILE)
+        stat = path.stat()
+        stamp = (CACHE_VERSION, stat.st_size, stat.st_mtime_ns)
+        candidates = _cache_paths(path, cache_dir)
+        for cache in candidates:
+            try:
+                data = marshal.loads(cache.read_bytes())
+            except (OSError, EOFError, ValueError, TypeError):
+                continue
+            if tuple(data[0]) == stamp:
+                offsets, entries = array("I"), array("I")
+                offsets.frombytes(data[1])
+                entries.frombytes(data[2])
+                return cls(offsets, entries, data[3], data[4])
+
+        gazetteer = cls.parse(path)
+        payload = marshal.dumps((stamp, gazetteer.offsets.tobytes(), gazetteer.entries.tobytes(),
+                                 gazetteer._names, list(gazetteer._ids)))
+        for cache in candidates:
+            try:
+                cache.parent.mkdir(parents=True, exist_ok=True)
+                tmp = cache.with_suffix(f".{os.getpid()}.tmp")
+                tmp.write_bytes(payload)
+                os.replace(tmp, cache)
+                break
+            except OSError:
+                continue
+        return gazetteer
+
+    # --- Lookups -------------------------------------------------------------
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    @property
+    def size(self) -> int:
+        """Number of distinct postcodes."""
+        return sum(1 for code in range(POSTCODE_SPACE) if self.offsets[code + 1] > self.offsets[code])
+
+    def name(self, name_id: int) -> str:
+        return display_name(self._names[name_id])
+
+    def city_ids(self, postcode: str) -> array:
+        if not (len(postcode) == 5 and postcode.isdigit()):
+            return array("I")
+        code = int(postcode)
+        return self.entries[self.offsets[code]:self.offsets[code + 1]]
+
+    def cities(self, postcode: str) -> List[str]:
+        """Display names of the cities served by ``postcode`` (empty if unknown)."""
+        return [self.name(name_id) for name_id in self.city_ids(postcode)]
+
+    def city_id(self, name: str) -> Optional[int]:
+        return self._ids.get(" ".join(tokens(name)))
+
+    def serves(self, postcode: str, city: str) -> bool:
+        return self.city_id(city) in self.city_ids(postcode)
+
+    def find_cities(self, text: str) -> List[Tuple[int, int, int]]:
+        """Non-overlapping city names in ``text``: ``(first token, end token, name id)``, longest first."""
+        words = tokens(text)
+        found = []
+        start = 0
+        while start < len(words):
+            for end in range(min(len(words), start + self._max_tokens), start, -1):
+                name_id = self._ids.get(" ".join(words[start:end]))
+                if name_id is not None:
+                    found.append((start, end, name_id))
+                    start = end
+                    break
+            else:
+                start += 1
+        return found
+
+
+def cache_dir() -> Path:
+    if os.environ.get("GAZETTEER_CACHE_DIR"):
+        return Path(os.environ["GAZETTEER_CACHE_DIR"])
+    return Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache") / "pikkle"
+
+
+def _cache_paths(path: Path, directory: Optional[Path] = None) -> List[Path]:
+    """Where the cache of ``path`` may be: the cache directory, else the temp directory."""
+    name = f"gazetteer-{hashlib.sha1(str(path.resolve()).encode()).hexdigest()[:12]}.marshal"
+    return [(directory or cache_dir()) / name, Path(tempfile.gettempdir()) / name]
+
+
+@lru_cache(maxsize=None)
+def default() -> Gazetteer:
+    """Process-wide gazetteer from ``GAZETTEER_FILE``, the fetched full file or the bundled subset."""
+    path = os.environ.get("GAZETTEER_FILE") or (FULL_FILE if FULL_FILE.exists() else None)
+    if path is None:
+        logger.warning("Full La Poste file not installed (python gazetteer.py fetch): "
+                       "addresses outside the bundled subset are not checked")
+        path = BUNDLED_FILE
+    return Gazetteer.load(path)
+
+
+def fetch(url: str = SOURCE_URL, output: Path = FULL_FILE) -> Gazetteer:
+    """Download the La Poste export to ``output`` and compile its cache."""
+    import httpx  # deploy-time only
+
+    response = httpx.get(url, follow_redirects=True, timeout=120)
+    response.raise_for_status()
+    try:
+        text = response.content.decode("utf-8-sig")
+    except UnicodeDecodeError:  # older exports are Latin-1
+        text = response.content.decode("latin-1")
+    tmp = output.with_suffix(f".{os.getpid()}.tmp")
+    try:
+        tmp.write_text(text, encoding="utf-8")
+        try:
+            gazetteer = Gazetteer.parse(tmp)
+        except IndexError:  # a row cut short
+            raise ValueError(f"{url} is truncated") from None
+        if gazetteer.size < MIN_POSTCODES:
+            raise ValueError(f"{url} has only {gazetteer.size} postcodes, not the full file")
+        os.replace(tmp, output)
+    finally:
+        tmp.unlink(missing_ok=True)
+    return Gazetteer.load(output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Postal code gazetteer")
+    parser.add_argument("command", choices=["fetch"])
+    parser.add_argument("--url", default=SOURCE_URL)
+    parser.add_argument("--output", type=Path, default=FULL_FILE)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    loaded = fetch(args.url, args.output)
+    print(f"{args.output}: {loaded.size} postcodes, {len(loaded)} city names")
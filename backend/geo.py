@@ -0,0 +1,161 @@
+"""Postal code / city matching for French addresses.
+
+Driver addresses are parsed once, when the profile is written:
+``normalize_address`` splits the free-text address into the structured
+``street_number``, ``street_name``, ``postal_code``, ``city`` and
+``country`` profile fields, stored next to the raw ``address`` and indexed
+on postcode and city. Contracts and analytics read those fields and never
+re-parse; ``backfill`` (``python geo.py``) fills them in for drivers
+written before they existed. Cities come from the gazetteer (see
+gazetteer.py), which knows every French postcode once the full La Poste
+file is installed.
+
+Addresses are written ``street, postcode city``: the city is looked for
+after the postcode first. Street names are full of city names ("Rue de
+Lyon", and Rue is a commune), so text before the postcode only counts when
+a whole comma-separated part is a city name ("Paris, 75001").
+"""
+import asyncio
+import logging
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+
+from pymongo import UpdateOne
+
+import gazetteer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_COUNTRY = "France"
+
+_POSTAL_CODE = re.compile(r'\b\d{5}\b')
+_STREET_NUMBER = re.compile(r'^(\d+(?:\s*(?:bis|ter|quater|[a-z]))?)\b[\s,]*(.*)$', re.IGNORECASE)
+
+
+def expected_cities(postal_code: str) -> List[str]:
+    """Cities served by ``postal_code``, delivery label first; empty when unknown."""
+    return gazetteer.default().cities(postal_code)
+
+
+def _whole_part(names: gazetteer.Gazetteer, part: str) -> Optional[int]:
+    return names.city_id(part) if part.strip() else None
+
+
+def _parse(address: str) -> Tuple[Optional[str], Optional[str], str]:
+    """``(postal_code, city, street)``; the street is the text before the postcode."""
+    names = gazetteer.default()
+    parts = address.split(',')
+    for index, part in enumerate(parts):
+        postal_match = _POSTAL_CODE.search(part)
+        if not postal_match:
+            continue
+        postal_found = postal_match.group()
+        street = [*(before for before in parts[:index] if _whole_part(names, before) is None),
+                  part[:postal_match.start()]]
+        street = ", ".join(filter(None, (text.strip(" ,") for text in street)))
+        candidates = [name_id for after in [part[postal_match.end():], *parts[index + 1:]]
+                      for _, _, name_id in names.find_cities(after)]
+        candidates += [name_id for before in reversed(parts[:index])
+                       if (name_id := _whole_part(names, before)) is not None]
+        if not candidates:
+            return postal_found, None, street
+        served = names.city_ids(postal_found)
+        # Prefer a name the postcode serves: "75001 Paris 01" also contains "Paris"
+        city_id = next((name_id for name_id in candidates if name_id in served), candidates[0])
+        return postal_found, names.name(city_id), street
+
+    for index in range(len(parts) - 1, -1, -1):
+        name_id = _whole_part(names, parts[index])
+        if name_id is None:
+            found = names.find_cities(parts[index])
+            name_id = found[-1][2] if found else None
+        if name_id is not None:
+            return None, names.name(name_id), ", ".join(part.strip() for part in parts[:index] if part.strip())
+    return None, None, address.strip()
+
+
+def parse_address(address: str) -> Tuple[Optional[str], Optional[str]]:
+    """``(postal_code, city)`` found in a free-text address, either may be None."""
+    postal_code, city, _ = _parse(address)
+    return postal_code, city
+
+
+def normalize_address(address: str) -> Dict[str, Optional[str]]:
+    """Structured profile fields of a free-text address.
+
+    ``city`` is the city named in the address, or the delivery city of its
+    postcode when none is named; fields that cannot be found are None.
+    """
+    postal_code, city, street = _parse(address or "")
+    if postal_code and not city:
+        city = next(iter(expected_cities(postal_code)), None)
+    street_number, street_name = None, street or None
+    number_match = _STREET_NUMBER.match(street)
+    if number_match and number_match.group(2):
+        street_number, street_name = number_match.group(1), number_match.group(2)
+    return {
+        "street_number": street_number,
+        "street_name": street_name,
+        "postal_code": postal_code,
+        "city": city,
+        "country": DEFAULT_COUNTRY,
+    }
+
+
+def city_for_address(address: str) -> Optional[str]:
+    """City of an address: the delivery city of its postal code, else the city named in it."""
+    postal_code, city = parse_address(address or "")
+    cities = expected_cities(postal_code) if postal_code else []
+    if city and gazetteer.default().serves(postal_code or "", city):
+        return city
+    return cities[0] if cities else city
+
+
+def profile_city(profile: Dict) -> Optional[str]:
+    """Stored city of a driver profile, parsed from the raw address only for profiles not backfilled yet."""
+    if "city" in profile:
+        return profile["city"]
+    return city_for_address(profile.get("address"))
+
+
+async def ensure_indexes(db):
+    await db.drivers.create_index("profile.postal_code")
+    await db.drivers.create_index("profile.city")
+
+
+async def backfill(db, batch_size: int = 1000) -> int:
+    """Store the structured address fields of drivers that do not have them yet."""
+    updated = 0
+    operations = []
+    query = {"profile.address": {"$exists": True}, "profile.postal_code": {"$exists": False}}
+    async for driver in db.drivers.find(query, {"profile.address": 1}):
+        fields = normalize_address(driver["profile"]["address"])
+        operations.append(UpdateOne(
+            {"_id": driver["_id"]}, {"$set": {f"profile.{field}": value for field, value in fields.items()}}
+        ))
+        if len(operations) >= batch_size:
+            await db.drivers.bulk_write(operations, ordered=False)
+            updated += len(operations)
+            operations = []
+    if operations:
+        await db.drivers.bulk_write(operations, ordered=False)
+        updated += len(operations)
+    logger.info("Structured addresses backfilled for %d drivers", updated)
+    return updated
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(os.path.join(os.path.dirname(__file__), ".env"))
+    logging.basicConfig(level=logging.INFO)
+    client = AsyncIOMotorClient(os.environ["MONGO_URL"])
+    db = client[os.environ["DB_NAME"]]
+
+    async def main():
+        await ensure_indexes(db)
+        return await backfill(db)
+
+    print(asyncio.run(main()))
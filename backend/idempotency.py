@@ -0,0 +1,262 @@
+"""Idempotency-Key support for retried POST requests.
+
+Mobile clients retry ``POST /drivers``, ``upload-document`` and course
+applications on flaky networks. When a request carries an
+``Idempotency-Key`` header the first execution's response is stored
+(in-memory LRU + ``idempotency_keys`` TTL collection) and replayed for
+every retry with the same key, without re-running validation, uniqueness
+queries or file writes.
+
+Concurrent duplicates are serialised: inside a worker they wait on a
+per-key ``asyncio.Lock`` and then replay; across workers the in-progress
+marker document makes the loser answer ``409`` with ``Retry-After``.
+
+A key belongs to its request: the stored response records the SHA-256 of
+the request body (multipart boundaries, random per attempt, left out),
+and a retry with another body gets ``422`` instead of the old response.
+Keys are also scoped to the caller's ``Authorization`` header, so two
+clients picking the same key do not see each other's responses.
+"""
+import asyncio
+import hashlib
+import json
+import re
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterable, Optional
+
+from pymongo.errors import DuplicateKeyError
+
+IDEMPOTENCY_HEADER = b"idempotency-key"
+REPLAY_HEADER = (b"idempotent-replayed", b"true")
+KEY_TTL_SECONDS = 24 * 3600
+IN_PROGRESS_TIMEOUT = timedelta(seconds=60)  # marker left by a crashed worker
+MAX_KEY_LENGTH = 255
+MAX_STORED_BODY = 256 * 1024  # larger responses are executed but not stored
+STORED_HEADERS = {b"content-type", b"location"}
+BOUNDARY = re.compile(rb'boundary="?([^";]+)"?', re.IGNORECASE)
+
+
+class BodyDigest:
+    """SHA-256 of a request body fed in chunks, without its multipart boundary."""
+
+    def __init__(self, content_type: bytes = b""):
+        match = BOUNDARY.search(content_type)
+        self._boundary = match.group(1) if match else b""
+        self._hash = hashlib.sha256()
+        self._tail = b""  # may hold the start of a boundary split across chunks
+
+    def feed(self, chunk: bytes):
+        if not self._boundary:
+            self._hash.update(chunk)
+            return
+        data = (self._tail + chunk).replace(self._boundary, b"")
+        keep = min(len(data), len(self._boundary) - 1)
+        self._hash.update(data[:len(data) - keep])
+        self._tail = data[len(data) - keep:]
+
+    def hexdigest(self) -> str:
+        self._hash.update(self._tail)
+        self._tail = b""
+        return self._hash.hexdigest()
+
+
+class IdempotencyStore:
+    """Stored responses keyed by ``"<method> <path>:<key>"``."""
+
+    def __init__(self, get_db: Callable, lru_size: int = 10_000):
+        self._get_db = get_db
+        self._lru: "OrderedDict[str, dict]" = OrderedDict()
+        self._lru_size = lru_size
+        self._locks: Dict[str, list] = {}
+
+    @property
+    def collection(self):
+        return self._get_db().idempotency_keys
+
+    async def ensure_indexes(self):
+        await self.collection.create_index("created_at", expireAfterSeconds=KEY_TTL_SECONDS)
+
+    def acquire(self, scoped_key: str) -> asyncio.Lock:
+        """Per-key lock shared by concurrent duplicates in this worker."""
+        entry = self._locks.get(scoped_key)
+        if entry is None:
+            entry = self._locks[scoped_key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        return entry[0]
+
+    def release(self, scoped_key: str):
+        entry = self._locks[scoped_key]
+        entry[1] -= 1
+        if entry[1] == 0:
+            del self._locks[scoped_key]
+
+    def _remember(self, scoped_key: str, record: dict):
+        self._lru[scoped_key] = record
+        self._lru.move_to_end(scoped_key)
+        if len(self._lru) > self._lru_size:
+            self._lru.popitem(last=False)
+
+    async def get(self, scoped_key: str) -> Optional[dict]:
+        """Return the stored record (completed or in progress), if any and not expired."""
+        expired = datetime.utcnow() - timedelta(seconds=KEY_TTL_SECONDS)
+        record = self._lru.get(scoped_key)
+        if record is not None:
+            if record["created_at"] >= expired:
+                self._lru.move_to_end(scoped_key)
+                return record
+            del self._lru[scoped_key]
+        # The TTL index removes expired records only about once a minute
+        record = await self.collection.find_one({"_id": scoped_key, "created_at": {"$gte": expired}})
+        if record and record.get("status") == "completed":
+            self._remember(scoped_key, record)
+        return record
+
+    async def begin(self, scoped_key: str) -> bool:
+        """Claim the key across workers; False if another worker holds it.
+
+        Takes over a marker left by a crashed worker, and an expired record
+        the TTL index has not removed yet.
+        """
+        now = datetime.utcnow()
+        try:
+            await self.collection.insert_one({"_id": scoped_key, "status": "in_progress", "created_at": now})
+            return True
+        except DuplicateKeyError:
+            stale = await self.collection.find_one_and_update(
+                {"_id": scoped_key, "$or": [
+                    {"status": "in_progress", "created_at": {"$lt": now - IN_PROGRESS_TIMEOUT}},
+                    {"created_at": {"$lt": now - timedelta(seconds=KEY_TTL_SECONDS)}},
+                ]},
+                {"$set": {"status": "in_progress", "created_at": now}},
+            )
+            return stale is not None
+
+    async def complete(self, scoped_key: str, status_code: int, headers: list, body: bytes,
+                       request_sha256: Optional[str] = None):
+        record = {
+            "_id": scoped_key,
+            "status": "completed",
+            "request_sha256": request_sha256,
+            "status_code": status_code,
+            "headers": [[k.decode("latin-1"), v.decode("latin-1")] for k, v in headers],
+            "body": body,
+            "created_at": datetime.utcnow(),
+        }
+        await self.collection.replace_one({"_id": scoped_key}, record, upsert=True)
+        self._remember(scoped_key, record)
+
+    async def abandon(self, scoped_key: str):
+        """Drop the in-progress marker so a retry executes the request again."""
+        self._lru.pop(scoped_key, None)
+        await self.collection.delete_one({"_id": scoped_key, "status": "in_progress"})
+
+
+class IdempotencyMiddleware:
+    """ASGI middleware applying ``IdempotencyStore`` to selected POST routes."""
+
+    def __init__(self, app, store: IdempotencyStore, paths: Iterable[str]):
+        self.app = app
+        self.store = store
+        self.paths = [re.compile(p) for p in paths]
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST":
+            return await self.app(scope, receive, send)
+        key, authorization = None, b""
+        for name, value in scope["headers"]:
+            if name == IDEMPOTENCY_HEADER:
+                key = value.decode("latin-1").strip()
+            elif name == b"authorization":
+                authorization = value
+        if key is None or not any(p.fullmatch(scope["path"]) for p in self.paths):
+            return await self.app(scope, receive, send)
+        if not key or len(key) > MAX_KEY_LENGTH:
+            return await _send_json(send, 400, {"detail": "Idempotency-Key invalide"})
+
+        caller = hashlib.sha256(authorization).hexdigest()[:16] if authorization else "-"
+        scoped_key = f"POST {scope['path']}?{scope.get('query_string', b'').decode('latin-1')}:{caller}:{key}"
+        lock = self.store.acquire(scoped_key)
+        try:
+            async with lock:
+                await self._handle(scoped_key, scope, receive, send)
+        finally:
+            self.store.release(scoped_key)
+
+    async def _handle(self, scoped_key, scope, receive, send):
+        record = await self.store.get(scoped_key)
+        if record is None or record.get("status") != "completed":
+            # An in-progress marker may be stale, left by a crashed worker: begin() takes it over
+            record = None if await self.store.begin(scoped_key) else await self.store.get(scoped_key)
+        content_type = dict(scope["headers"]).get(b"content-type", b"")
+        if record is not None:
+            if record.get("status") != "completed":
+                return await _send_json(
+                    send, 409, {"detail": "Requête déjà en cours de traitement"}, [(b"retry-after", b"1")]
+                )
+            digest = BodyDigest(content_type)
+            more_body = True
+            while more_body:
+                message = await receive()
+                if message["type"] != "http.request":
+                    return
+                digest.feed(message.get("body", b""))
+                more_body = message.get("more_body", False)
+            if record.get("request_sha256") not in (None, digest.hexdigest()):
+                return await _send_json(send, 422, {"detail": "Idempotency-Key déjà utilisée pour une autre requête"})
+            return await _replay(send, record)
+
+        digest = BodyDigest(content_type)
+        request = {"more_body": True}
+
+        async def hashing_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                digest.feed(message.get("body", b""))
+                request["more_body"] = message.get("more_body", False)
+            return message
+
+        captured = {"status": 500, "headers": [], "body": bytearray(), "too_large": False}
+
+        async def capture_send(message):
+            if message["type"] == "http.response.start":
+                captured["status"] = message["status"]
+                captured["headers"] = [(k, v) for k, v in message.get("headers", []) if k in STORED_HEADERS]
+            elif message["type"] == "http.response.body" and not captured["too_large"]:
+                captured["body"] += message.get("body", b"")
+                if len(captured["body"]) > MAX_STORED_BODY:
+                    captured["too_large"] = True
+                    captured["body"] = bytearray()
+            await send(message)
+
+        try:
+            await self.app(scope, hashing_receive, capture_send)
+        except Exception:
+            await self.store.abandon(scoped_key)
+            raise
+        if captured["status"] >= 500 or captured["too_large"]:
+            await self.store.abandon(scoped_key)
+            return
+        # The body the app left unread (a request rejected early) is part of the request too
+        while request["more_body"]:
+            message = await hashing_receive()
+            if message["type"] != "http.request":
+                break
+        await self.store.complete(
+            scoped_key, captured["status"], captured["headers"], bytes(captured["body"]), digest.hexdigest()
+        )
+
+
+async def _replay(send, record: dict):
+    headers = [(k.encode("latin-1"), v.encode("latin-1")) for k, v in record["headers"]]
+    body = bytes(record["body"])
+    headers += [(b"content-length", str(len(body)).encode()), REPLAY_HEADER]
+    await send({"type": "http.response.start", "status": record["status_code"], "headers": headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _send_json(send, status: int, payload: dict, extra_headers: Optional[list] = None):
+    body = json.dumps(payload).encode()
+    headers = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+    await send({"type": "http.response.start", "status": status, "headers": headers + (extra_headers or [])})
+    await send({"type": "http.response.body", "body": body})
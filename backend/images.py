@@ -0,0 +1,177 @@
+"""Recompression of photographed documents.
+
+Most identity documents arrive as phone photos: 12 to 50 megapixels,
+5-10 MB, sideways according to their EXIF orientation, with GPS position
+and device details in their metadata. Before a photo is stored for review
+it is normalized:
+
+* rotated upright from its EXIF orientation;
+* downscaled to at most ``MAX_SIDE`` pixels on its long side, enough to
+  read an ID card or a permit;
+* re-encoded as JPEG (or WebP with ``IMAGE_FORMAT=webp``), without EXIF,
+  XMP or ICC metadata.
+
+The output is 400-500 KB in JPEG, 300-400 KB in WebP, whatever the
+camera: 10-20x less than the 5-10 MB photos phones send, 5-9x less than
+the 2-4 MB synthetic photos of benchmarks/image_bench.py. JPEGs are
+decoded with ``draft``, which lets libjpeg scale by 1/2 to 1/8 while
+decoding: a 24 megapixel photo takes 18 MB of memory in a worker instead
+of 73 MB.
+
+Decoding and encoding are CPU-bound and run in a process pool (see
+contracts.py), one process per core unless ``IMAGE_WORKERS`` says
+otherwise. The pool works on paths, so the image bytes are not pickled
+between processes. Only photos go to the pool: the file's header is
+checked first (``recompressible``), and PDFs, unreadable images, and
+every file when Pillow is not installed are stored untouched, without
+queueing behind the photos being recompressed. The original is kept in
+a cold tier (``ORIGINALS_DIR``), away from the files reviewers download.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import BinaryIO, Dict, Optional, Tuple
+
+import storage
+
+logger = logging.getLogger(__name__)
+
+MAX_SIDE = 2000
+QUALITY = 82
+FORMATS = {"jpeg": ".jpg", "webp": ".webp"}
+IMAGE_TYPES = ("image/jpeg", "image/png", "image/webp")
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def available() -> bool:
+    try:
+        import PIL  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def normalize(source: str, destination: str, image_format: str = "jpeg", max_side: int = MAX_SIDE,
+              quality: int = QUALITY) -> Dict:
+    """Write the normalized image of ``source`` to ``destination``; runs in the pool."""
+    from PIL import Image, ImageOps
+
+    with Image.open(source) as image:
+        original = image.size
+        if image.format == "JPEG":
+            image.draft("RGB", (max_side, max_side))  # DCT scaling, before rotation swaps the sides
+        image = ImageOps.exif_transpose(image)
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+        tmp = f"{destination}.tmp"
+        try:
+            if image_format == "webp":
+                image.save(tmp, "WEBP", quality=quality, method=4)
+            else:
+                image.save(tmp, "JPEG", quality=quality, optimize=True, progressive=True)
+            os.replace(tmp, destination)
+        finally:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+    return {"original": original, "size": image.size, "bytes": os.path.getsize(destination)}
+
+
+def _well_formed(source: BinaryIO) -> bool:
+    """Whether ``source`` starts with a well-formed PNG, WebP or JPEG header.
+
+    For JPEG, the marker segments are walked up to the frame header: a few
+    seeks, where ``Image.open`` can take 100 ms to give up on a damaged file.
+    """
+    source.seek(0)
+    head = source.read(16)
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return head[12:16] == b"IHDR"
+    if head[:4] == b"RIFF":
+        return head[8:12] == b"WEBP"
+    if head[:2] != b"\xff\xd8":
+        return False
+    source.seek(2)
+    while True:
+        marker = source.read(4)
+        if len(marker) < 4 or marker[0] != 0xFF:
+            return False
+        if marker[1] == 0xFF:  # fill byte
+            source.seek(-3, os.SEEK_CUR)
+            continue
+        if 0xC0 <= marker[1] <= 0xCF and marker[1] not in (0xC4, 0xC8, 0xCC):
+            return True  # start of frame
+        length = int.from_bytes(marker[2:], "big")
+        if length < 2:
+            return False
+        source.seek(length - 2, os.SEEK_CUR)
+
+
+def recompressible(content_type: Optional[str], source: BinaryIO) -> bool:
+    """Whether the file ``source`` (sniffed as ``content_type``) is a photo to normalize."""
+    if content_type not in IMAGE_TYPES or not available():
+        return False
+    try:
+        if _well_formed(source):
+            return True
+    finally:
+        source.seek(0)
+    logger.warning("Unreadable %s image, storing it untouched", content_type)
+    return False
+
+
+def _recompressible_file(path: Path) -> bool:
+    with open(path, "rb") as f:
+        return recompressible(storage.sniff_type(f.read(storage.SNIFF_LENGTH)), f)
+
+
+def get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn: the API process runs driver threads, which do not survive fork
+        _pool = ProcessPoolExecutor(
+            max_workers=int(os.environ.get("IMAGE_WORKERS", "0")) or os.cpu_count(),
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _pool
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+async def normalize_document(path: Path, originals_dir: Path,
+                             image_format: str = "jpeg") -> Tuple[Path, Optional[Path]]:
+    """Recompress the photo at ``path`` and move the original to ``originals_dir``.
+
+    Returns ``(file to record, original)``: the normalized image and where
+    the original went, or ``(path, None)`` when it is left untouched.
+    """
+    if not await storage.run_io(path.stat().st_size, _recompressible_file, path):
+        return path, None
+
+    stamp = datetime.utcnow().strftime("%Y%m%dT%H%M%S%f")
+    original = originals_dir / path.parent.name / f"{path.stem}-{stamp}{path.suffix}"
+    original.parent.mkdir(parents=True, exist_ok=True)
+    await asyncio.to_thread(shutil.move, path, original)  # the cold tier may be another volume
+    destination = path.with_suffix(FORMATS[image_format])
+    try:
+        info = await asyncio.get_running_loop().run_in_executor(
+            get_pool(), normalize, str(original), str(destination), image_format
+        )
+    except Exception as e:
+        logger.warning("Could not normalize %s (%s), storing it untouched", path, e)
+        await asyncio.to_thread(shutil.move, original, path)
+        return path, None
+    logger.info("Normalized %s: %dx%d, %d -> %d bytes", destination, *info["size"],
+                original.stat().st_size, info["bytes"])
+    return destination, original
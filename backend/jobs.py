@@ -0,0 +1,115 @@
+"""Minimal in-process scheduler for background jobs.
+
+Jobs are coroutines ``func(db)`` run either every N seconds or once a day
+at a fixed UTC time. With several workers each one runs the scheduler, so
+every run first takes a lease in the ``job_leases`` collection: only the
+worker holding the lease executes that occurrence.
+"""
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, time, timedelta
+from typing import Awaitable, Callable, List, Optional
+
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+JobFunc = Callable[..., Awaitable]
+
+_worker_id = (None, "")
+
+
+def worker_id() -> str:
+    """This process's lease holder id; recomputed after a fork, as the master imports this module."""
+    global _worker_id
+    pid = os.getpid()
+    if _worker_id[0] != pid:
+        _worker_id = (pid, f"{socket.gethostname()}-{pid}-{uuid.uuid4().hex[:6]}")
+    return _worker_id[1]
+
+
+async def acquire_lease(db, name: str, ttl: timedelta) -> bool:
+    """Take (or renew) the named lease for ``ttl``; False if another worker holds it."""
+    now, holder = datetime.utcnow(), worker_id()
+    try:
+        # Matches only an expired lease or our own; otherwise the upsert collides on _id
+        await db.job_leases.update_one(
+            {"_id": name, "$or": [{"expires_at": {"$lt": now}}, {"holder": holder}]},
+            {"$set": {"holder": holder, "expires_at": now + ttl, "acquired_at": now}},
+            upsert=True,
+        )
+    except DuplicateKeyError:
+        return False
+    return True
+
+
+class Job:
+    def __init__(self, name: str, func: JobFunc, interval: Optional[timedelta] = None,
+                 daily_at: Optional[time] = None):
+        if (interval is None) == (daily_at is None):
+            raise ValueError("A job needs exactly one of interval or daily_at")
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.daily_at = daily_at
+        self.last_run: Optional[datetime] = None
+        self.last_error: Optional[str] = None
+
+    def next_run(self, now: datetime) -> datetime:
+        if self.interval is not None:
+            return now + self.interval
+        candidate = datetime.combine(now.date(), self.daily_at)
+        return candidate if candidate > now else candidate + timedelta(days=1)
+
+    @property
+    def lease_ttl(self) -> timedelta:
+        # Long enough to cover the run, short enough to fail over to another worker
+        return min(self.interval or timedelta(hours=1), timedelta(hours=1))
+
+
+class Scheduler:
+    def __init__(self, get_db: Callable):
+        self._get_db = get_db
+        self.jobs: List[Job] = []
+        self._tasks: List[asyncio.Task] = []
+
+    def every(self, name: str, seconds: float, func: JobFunc) -> Job:
+        job = Job(name, func, interval=timedelta(seconds=seconds))
+        self.jobs.append(job)
+        return job
+
+    def daily(self, name: str, at: time, func: JobFunc) -> Job:
+        job = Job(name, func, daily_at=at)
+        self.jobs.append(job)
+        return job
+
+    async def run_now(self, job: Job):
+        """Run one occurrence of ``job`` if this worker wins the lease."""
+        db = self._get_db()
+        if not await acquire_lease(db, f"job:{job.name}", job.lease_ttl):
+            return
+        try:
+            await job.func(db)
+            job.last_error = None
+        except Exception as exc:
+            job.last_error = f"{type(exc).__name__}: {exc}"
+            logger.exception("Job %s failed", job.name)
+        job.last_run = datetime.utcnow()
+
+    async def _loop(self, job: Job):
+        while True:
+            now = datetime.utcnow()
+            await asyncio.sleep((job.next_run(now) - now).total_seconds())
+            await self.run_now(job)
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._loop(job), name=f"job:{job.name}") for job in self.jobs]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
@@ -0,0 +1,214 @@
+"""Payments ledger: per-driver totals for the dashboard.
+
+Every payment goes through ``record_payment``, which inserts the
+``PaymentHistory`` document and, for completed payments, increments the
+driver's running totals in ``driver_balances``. Dashboards read that one
+document instead of summing the payment history.
+
+Payout runs (``payouts.py``) call ``apply_payouts`` to move paid amounts
+from ``current_balance`` to ``total_paid_out``.
+
+``reconcile`` re-derives the totals from ``payments`` and ``payouts`` with
+aggregation pipelines and rewrites the balances that drifted; it runs
+nightly and can be started by hand with ``python ledger.py``. Payments
+keep flowing meanwhile, so a balance is only rewritten if it is unchanged
+since it was read (its ``updated_at``), and drivers paid within ``SETTLE``
+are left for the next run: ``record_payment`` inserts the payment before
+it increments the balance.
+"""
+import asyncio
+import logging
+import os
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional
+
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger(__name__)
+
+PAYOUT_DAY = 15  # payouts are sent on the 15th of each month
+SETTLE = timedelta(minutes=1)
+
+EMPTY_BALANCE = {
+    "total_deliveries": 0,
+    "total_earnings": 0.0,
+    "total_paid_out": 0.0,
+    "current_balance": 0.0,
+}
+
+
+async def ensure_indexes(db):
+    await db.driver_balances.create_index("driver_id", unique=True)
+    await db.payments.create_index([("driver_id", ASCENDING), ("created_at", ASCENDING)])
+    await db.payments.create_index([("status", ASCENDING), ("created_at", ASCENDING)])
+
+
+def next_payout_date(today: Optional[date] = None) -> date:
+    today = today or datetime.utcnow().date()
+    if today.day < PAYOUT_DAY:
+        return today.replace(day=PAYOUT_DAY)
+    if today.month == 12:
+        return date(today.year + 1, 1, PAYOUT_DAY)
+    return date(today.year, today.month + 1, PAYOUT_DAY)
+
+
+async def record_payment(db, payment: dict):
+    """Insert a payment and apply it to the driver's running totals."""
+    await db.payments.insert_one(dict(payment))
+    if payment["status"] != "completed":
+        return
+    amount = round(payment["amount"], 2)
+    await db.driver_balances.update_one(
+        {"driver_id": payment["driver_id"]},
+        {
+            "$inc": {
+                "total_deliveries": 1 if payment.get("delivery_id") else 0,
+                "total_earnings": amount,
+                "current_balance": amount,
+            },
+            "$setOnInsert": {"total_paid_out": 0.0},
+            "$set": {"updated_at": datetime.utcnow()},
+        },
+        upsert=True,
+    )
+
+
+async def get_balance(db, driver_id: str) -> Dict:
+    balance = {**EMPTY_BALANCE, **(await db.driver_balances.find_one({"driver_id": driver_id}, {"_id": 0}) or {})}
+    # Amounts are summed as floats; present them at cent precision
+    for key in ("total_earnings", "total_paid_out", "current_balance"):
+        balance[key] = round(balance[key], 2)
+    return balance
+
+
+def totals_pipeline(driver_ids: Optional[List[str]] = None) -> List[Dict]:
+    """Aggregation re-deriving per-driver totals from completed payments."""
+    match: Dict = {"status": "completed"}
+    if driver_ids is not None:
+        match["driver_id"] = {"$in": driver_ids}
+    return [
+        {"$match": match},
+        {"$group": {
+            "_id": "$driver_id",
+            "total_deliveries": {"$sum": {"$cond": [{"$ifNull": ["$delivery_id", False]}, 1, 0]}},
+            "total_earnings": {"$sum": "$amount"},
+            "last_payment_at": {"$max": "$created_at"},
+        }},
+    ]
+
+
+async def _paid_out(db, driver_ids: List[str]) -> Dict[str, float]:
+    pipeline = [
+        {"$match": {"driver_id": {"$in": driver_ids}}},
+        {"$group": {"_id": "$driver_id", "paid_out": {"$sum": "$gross_amount"}}},
+    ]
+    return {row["_id"]: round(row["paid_out"], 2) async for row in db.payouts.aggregate(pipeline)}
+
+
+async def apply_payouts(db, driver_ids: List[str]):
+    """Refresh ``total_paid_out``/``current_balance`` from the drivers' payouts.
+
+    Idempotent: the paid-out total is re-derived rather than incremented, and
+    the balance is computed server side so concurrent payments are not lost.
+    """
+    paid_out = await _paid_out(db, driver_ids)
+    now = datetime.utcnow()
+    await db.driver_balances.bulk_write([
+        UpdateOne(
+            {"driver_id": driver_id},
+            [{"$set": {
+                "total_paid_out": amount,
+                "current_balance": {"$subtract": [{"$ifNull": ["$total_earnings", 0.0]}, amount]},
+                "total_deliveries": {"$ifNull": ["$total_deliveries", 0]},
+                "total_earnings": {"$ifNull": ["$total_earnings", 0.0]},
+                "updated_at": now,
+            }}],
+            upsert=True,
+        )
+        for driver_id, amount in paid_out.items()
+    ], ordered=False)
+
+
+async def _reconcile_batch(db, driver_ids: List[str], now: datetime) -> int:
+    # Balances are read before the payments they are checked against: a payment
+    # applied after the read changes updated_at, and the guarded write skips it
+    stored_by_driver = {
+        balance["driver_id"]: balance
+        async for balance in db.driver_balances.find({"driver_id": {"$in": driver_ids}}, {"_id": 0})
+    }
+    totals_by_driver = {row["_id"]: row async for row in db.payments.aggregate(totals_pipeline(driver_ids))}
+    paid_out = await _paid_out(db, driver_ids)
+    operations = []
+    for driver_id in driver_ids:
+        totals = totals_by_driver.get(driver_id, {"total_deliveries": 0, "total_earnings": 0.0})
+        if totals.get("last_payment_at") and totals["last_payment_at"] > now - SETTLE:
+            continue  # possibly inserted but not applied yet
+        raw = stored_by_driver.get(driver_id)
+        stored = {**EMPTY_BALANCE, **(raw or {})}
+        earnings = round(totals["total_earnings"], 2)
+        expected = {
+            "total_deliveries": totals["total_deliveries"],
+            "total_earnings": earnings,
+            "total_paid_out": paid_out.get(driver_id, 0.0),
+            "current_balance": round(earnings - paid_out.get(driver_id, 0.0), 2),
+        }
+        if any(abs(stored[k] - v) > 0.005 for k, v in expected.items()):
+            logger.warning("Ledger drift for driver %s: stored %s, expected %s", driver_id, stored, expected)
+            operations.append(UpdateOne(
+                {"driver_id": driver_id, "updated_at": (raw or {}).get("updated_at")},
+                {"$set": {**expected, "updated_at": datetime.utcnow()}},
+                upsert=raw is None,
+            ))
+    if not operations:
+        return 0
+    try:
+        result = await db.driver_balances.bulk_write(operations, ordered=False)
+    except BulkWriteError as e:
+        # A balance created meanwhile (unique driver_id): checked again next run
+        if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+            raise
+        return e.details["nModified"] + e.details["nUpserted"]
+    return result.modified_count + result.upserted_count
+
+
+async def reconcile(db, batch_size: int = 1000, now: Optional[datetime] = None) -> Dict[str, int]:
+    """Rewrite every driver balance that differs from the payment history."""
+    now = now or datetime.utcnow()
+    checked = corrected = 0
+    seen = set()
+    batch: List[str] = []
+    drivers = db.payments.aggregate([{"$match": {"status": "completed"}}, {"$group": {"_id": "$driver_id"}}],
+                                    allowDiskUse=True)
+    async for row in drivers:
+        batch.append(row["_id"])
+        seen.add(row["_id"])
+        if len(batch) >= batch_size:
+            corrected += await _reconcile_batch(db, batch, now)
+            checked += len(batch)
+            batch = []
+
+    # Balances with earnings but no completed payment left behind them
+    async for balance in db.driver_balances.find({"total_earnings": {"$ne": 0}}, {"driver_id": 1}):
+        if balance["driver_id"] not in seen:
+            batch.append(balance["driver_id"])
+            if len(batch) >= batch_size:
+                corrected += await _reconcile_batch(db, batch, now)
+                checked += len(batch)
+                batch = []
+    if batch:
+        corrected += await _reconcile_batch(db, batch, now)
+        checked += len(batch)
+
+    logger.info("Ledger reconciliation: %d drivers checked, %d corrected", checked, corrected)
+    return {"checked": checked, "corrected": corrected}
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(os.path.join(os.path.dirname(__file__), ".env"))
+    logging.basicConfig(level=logging.INFO)
+    client = AsyncIOMotorClient(os.environ["MONGO_URL"])
+    print(asyncio.run(reconcile(client[os.environ["DB_NAME"]])))
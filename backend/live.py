@@ -0,0 +1,190 @@
+"""Live driver events for the dashboard (Server-Sent Events).
+
+Each API worker runs one feed over the ``outbox`` collection and fans the
+events out to the connections subscribed to their driver id, so the cost
+on MongoDB does not grow with the number of open dashboards:
+
+* on a replica set the feed is a single change stream on ``outbox``
+  inserts, resumed from its last token after an error;
+* on a standalone mongod it polls the outbox by ``_id``, re-reading a
+  short overlap window so events written by other workers with a slightly
+  older ObjectId are not skipped. Nothing is queried while no dashboard is
+  connected.
+
+Connections are bounded overall and per driver. A subscriber whose queue
+fills up is disconnected rather than slowing the feed down; the browser
+reconnects with ``Last-Event-ID`` and the missed events are replayed from
+the outbox.
+"""
+import asyncio
+import json
+import logging
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Callable, Dict, Optional, Set
+
+from bson import ObjectId
+from bson.errors import InvalidId
+
+import events
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT_SECONDS = 15
+RETRY_MS = 3000
+REPLAY_LIMIT = 100
+
+
+class HubFull(Exception):
+    pass
+
+
+def format_event(event: Dict) -> str:
+    data = {k: event.get(k) for k in ("id", "type", "driver_id", "payload", "created_at")}
+    return f"id: {event['_id']}\nevent: {event['type']}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+def _close(queue: asyncio.Queue):
+    """Make the subscriber's stream end after its next read."""
+    if queue.full():
+        queue.get_nowait()
+    queue.put_nowait(None)
+
+
+class DriverEventHub:
+    def __init__(self, get_db: Callable, max_subscribers: int = 1000, per_driver: int = 5,
+                 queue_size: int = 100, poll_interval: float = 0.5, overlap: float = 2.0):
+        self._get_db = get_db
+        self.max_subscribers = max_subscribers
+        self.per_driver = per_driver
+        self.queue_size = queue_size
+        self.poll_interval = poll_interval
+        self.overlap = timedelta(seconds=overlap)
+        self.subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self.count = 0
+        self._seen: "OrderedDict[ObjectId, None]" = OrderedDict()
+        self._task: Optional[asyncio.Task] = None
+
+    # --- Subscriptions -------------------------------------------------------
+
+    def subscribe(self, driver_id: str) -> asyncio.Queue:
+        queues = self.subscribers.setdefault(driver_id, set())
+        if self.count >= self.max_subscribers or len(queues) >= self.per_driver:
+            if not queues:
+                del self.subscribers[driver_id]
+            raise HubFull(driver_id)
+        queue = asyncio.Queue(self.queue_size)
+        queues.add(queue)
+        self.count += 1
+        return queue
+
+    def unsubscribe(self, driver_id: str, queue: asyncio.Queue):
+        queues = self.subscribers.get(driver_id)
+        if queues and queue in queues:
+            queues.discard(queue)
+            self.count -= 1
+            if not queues:
+                del self.subscribers[driver_id]
+
+    def publish(self, event: Dict):
+        for queue in list(self.subscribers.get(event.get("driver_id"), ())):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # Slow client: disconnect it, it will resume from Last-Event-ID
+                self.unsubscribe(event["driver_id"], queue)
+                _close(queue)
+
+    # --- Feed ----------------------------------------------------------------
+
+    async def _watch(self, db):
+        token = None
+        while True:
+            try:
+                pipeline = [{"$match": {"operationType": "insert"}}]
+                async with db.outbox.watch(pipeline, resume_after=token) as stream:
+                    async for change in stream:
+                        token = stream.resume_token
+                        self.publish(change["fullDocument"])
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Outbox change stream failed, resuming")
+                await asyncio.sleep(self.poll_interval)
+
+    async def poll_once(self, db) -> int:
+        """Publish outbox events not seen yet; returns how many were published."""
+        if not self.subscribers:
+            self._seen.clear()
+            return 0
+        if not self._seen:
+            # First subscriber since idle: start from the newest event
+            newest = await db.outbox.find({}, {"_id": 1}).sort("_id", -1).to_list(1)
+            self._seen[newest[0]["_id"] if newest else ObjectId()] = None
+            return 0
+        latest = next(reversed(self._seen))
+        since = ObjectId.from_datetime(latest.generation_time - self.overlap)
+        published = 0
+        async for event in db.outbox.find({"_id": {"$gt": since}}).sort("_id", 1):
+            if event["_id"] in self._seen:
+                continue
+            self._seen[event["_id"]] = None
+            self.publish(event)
+            published += 1
+        while len(self._seen) > 1 and next(iter(self._seen)) < since:
+            self._seen.popitem(last=False)
+        return published
+
+    async def _poll(self, db):
+        while True:
+            try:
+                await self.poll_once(db)
+            except Exception:
+                logger.exception("Outbox poll failed")
+            await asyncio.sleep(self.poll_interval)
+
+    def start(self):
+        db = self._get_db()
+        feed = self._watch(db) if events.TRANSACTIONS else self._poll(db)
+        self._task = asyncio.create_task(feed, name="live-driver-events")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        for driver_id, queues in list(self.subscribers.items()):
+            for queue in list(queues):
+                self.unsubscribe(driver_id, queue)
+                _close(queue)
+
+    # --- SSE stream ----------------------------------------------------------
+
+    async def replay(self, db, driver_id: str, last_event_id: Optional[str]):
+        try:
+            after = ObjectId(last_event_id)
+        except (InvalidId, TypeError):
+            return []
+        return await db.outbox.find({"driver_id": driver_id, "_id": {"$gt": after}}).sort("_id", 1).to_list(REPLAY_LIMIT)
+
+    async def stream(self, driver_id: str, queue: asyncio.Queue, last_event_id: Optional[str] = None):
+        """SSE body for one subscriber; the queue must come from ``subscribe``."""
+        try:
+            yield f"retry: {RETRY_MS}\n\n"
+            last = None
+            for event in await self.replay(self._get_db(), driver_id, last_event_id):
+                last = event["_id"]
+                yield format_event(event)
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": heartbeat\n\n"
+                    continue
+                if event is None:
+                    return
+                if last is not None and event["_id"] <= last:
+                    continue
+                yield format_event(event)
+        finally:
+            self.unsubscribe(driver_id, queue)
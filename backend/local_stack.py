@@ -0,0 +1,75 @@
+"""Local stand-in stack for benchmarks and offline tests.
+
+Builds the FastAPI app with ``server.create_app`` against either mongomock-motor
+(default, no external service) or a local mongod, with uploads redirected
+to a temporary directory so nothing is written under ``backend/uploads``,
+and documents encrypted with a throwaway master key.
+
+With ``isolated=True`` every asyncio task can bind its own database through
+``bind_database`` so concurrent tests never see each other's documents.
+"""
+import base64
+import contextvars
+import os
+import tempfile
+import uuid
+from contextlib import asynccontextmanager, contextmanager
+from pathlib import Path
+from typing import Optional
+
+
+def make_database(mongo_url: Optional[str] = None, db_name: Optional[str] = None):
+    """Return a ``(client, db)`` pair, mongomock-backed unless ``mongo_url`` is given."""
+    db_name = db_name or f"pikkles_local_{uuid.uuid4().hex[:8]}"
+    if mongo_url:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        client = AsyncIOMotorClient(mongo_url)
+    else:
+        from mongomock_motor import AsyncMongoMockClient
+        client = AsyncMongoMockClient()
+    return client, client[db_name]
+
+
+_current_db = contextvars.ContextVar("pikkles_current_db")
+
+
+class DatabaseRouter:
+    """Stand-in for ``server.db`` resolving to the database bound to the current task."""
+
+    def __getattr__(self, name):
+        return getattr(_current_db.get(), name)
+
+    def __getitem__(self, name):
+        return _current_db.get()[name]
+
+
+@contextmanager
+def bind_database(db):
+    """Route ``server.db`` to ``db`` for the current task (see ``isolated=True``)."""
+    token = _current_db.set(db)
+    try:
+        yield db
+    finally:
+        _current_db.reset(token)
+
+
+@asynccontextmanager
+async def local_stack(mongo_url: Optional[str] = None, db_name: Optional[str] = None,
+                      isolated: bool = False):
+    """Yield the ASGI app wired to a throwaway database and upload directory."""
+    import server
+    from settings import Settings
+
+    client, db = make_database(mongo_url, db_name)
+    with tempfile.TemporaryDirectory(prefix="pikkles-") as tmp:
+        app = server.create_app(Settings(
+            db_name=db.name, environment="development", root_dir=Path(tmp), upload_dir=Path(tmp) / "uploads",
+            document_master_key=base64.b64encode(os.urandom(32)).decode(),
+        ))
+        server.db = DatabaseRouter() if isolated else db
+        try:
+            yield app
+        finally:
+            if mongo_url:
+                await client.drop_database(db.name)
+            client.close()
@@ -0,0 +1,147 @@
+"""Pydantic models of the API, importable without side effects."""
+import uuid
+from datetime import date, datetime
+from typing import List, Optional
+
+from pydantic import BaseModel, EmailStr, Field
+
+
+# Driver Models
+class DriverProfile(BaseModel):
+    firstname: str
+    lastname: str
+    email: EmailStr
+    phone: str
+    date_of_birth: Optional[str] = None
+    address: str
+    # Parsed from ``address`` on write (geo.normalize_address)
+    street_number: Optional[str] = None
+    street_name: Optional[str] = None
+    postal_code: Optional[str] = None
+    city: Optional[str] = None
+    country: Optional[str] = None
+
+class DriverDocuments(BaseModel):
+    identity_card_front: Optional[str] = None
+    identity_card_back: Optional[str] = None
+    proof_of_residence: Optional[str] = None
+    residence_permit: Optional[str] = None
+    civil_liability_insurance: Optional[str] = None
+    vehicle_insurance: Optional[str] = None
+    vehicle_contract: Optional[str] = None
+    kbis_document: Optional[str] = None
+
+class DriverBusinessInfo(BaseModel):
+    siret: str
+    company_name: str
+    business_address: str
+    vehicle_type: Optional[str] = None
+    insurance_provider: Optional[str] = None
+    insurance_number: Optional[str] = None
+    siret_verified: bool = False
+
+class DriverBankInfo(BaseModel):
+    bank_name: str
+    iban: str
+    bic: str
+    account_holder_name: str
+
+class DriverContractUpdate(BaseModel):
+    auto_entrepreneur_status: bool = False
+    accepts_cgu: bool = False
+    accepts_privacy_policy: bool = False
+    accepts_app_download: bool = False
+    signature_date: Optional[datetime] = None
+    kyc_contract_generated: bool = False
+    kyc_contract_sent_date: Optional[datetime] = None
+    kyc_contract_signed: bool = False
+    kyc_contract_received_date: Optional[datetime] = None
+    kyc_contract_document: Optional[str] = None  # PDF rendu, relatif à ROOT_DIR
+    kyc_contract_sha256: Optional[str] = None
+
+class DriverContract(DriverContractUpdate):
+    commission_rate: float = 15.0  # % de commission par défaut, fixé par l'équipe (CommissionRate)
+
+class CommissionRate(BaseModel):
+    commission_rate: float = Field(ge=0, le=100)
+
+class Driver(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    profile: Optional[DriverProfile] = None
+    documents: Optional[DriverDocuments] = None
+    business_info: Optional[DriverBusinessInfo] = None
+    bank_info: Optional[DriverBankInfo] = None
+    contract: Optional[DriverContract] = None
+    registration_step: int = 1
+    status: str = "pending"  # pending, under_review, approved, rejected
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+class DriverUpdate(BaseModel):
+    profile: Optional[DriverProfile] = None
+    documents: Optional[DriverDocuments] = None
+    business_info: Optional[DriverBusinessInfo] = None
+    bank_info: Optional[DriverBankInfo] = None
+    contract: Optional[DriverContractUpdate] = None
+    registration_step: Optional[int] = None
+    status: Optional[str] = None
+
+# Payment Models (placeholder for future Stripe integration)
+class PaymentHistory(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    driver_id: str
+    amount: float
+    currency: str = "EUR"
+    payment_method: str  # apple_pay, google_pay, bank_transfer
+    status: str  # completed, pending, failed
+    delivery_id: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+class PaymentCreate(BaseModel):
+    amount: float = Field(gt=0)
+    currency: str = "EUR"
+    payment_method: str
+    delivery_id: Optional[str] = None
+
+# --- Courses Feature ---
+class Course(BaseModel):
+    id: str
+    title: str
+    applicants: list[str] = []
+
+# Authentication
+class Credentials(BaseModel):
+    email: EmailStr
+    password: str
+
+class RegistrationConfirmation(BaseModel):
+    token: str
+
+# Resumable uploads (see uploads.py)
+class UploadSessionCreate(BaseModel):
+    document_type: str
+    filename: str
+    size: int = Field(gt=0)
+    sha256: Optional[str] = Field(default=None, pattern="^[0-9a-f]{64}$")
+    expires_at: Optional[date] = None
+
+# Direct-to-storage uploads (see storage.py)
+class DirectUploadCreate(BaseModel):
+    document_type: str
+    filename: str
+    content_type: str
+    size: int = Field(gt=0)
+    sha256: str = Field(pattern="^[0-9a-f]{64}$")
+    expires_at: Optional[date] = None
+
+# Live tracking (see tracking.py)
+class LocationPoint(BaseModel):
+    lat: float = Field(ge=-90, le=90)
+    lng: float = Field(ge=-180, le=180)
+    recorded_at: datetime
+    accuracy: Optional[float] = Field(default=None, ge=0)  # mètres
+    speed: Optional[float] = Field(default=None, ge=0)  # m/s
+    heading: Optional[float] = Field(default=None, ge=0, lt=360)
+
+class LocationBatch(BaseModel):
+    points: List[LocationPoint] = Field(min_length=1, max_length=500)
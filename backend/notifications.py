@@ -0,0 +1,395 @@
+"""Driver notifications (email and SMS) triggered by lifecycle events.
+
+``NotificationSink`` is an outbox sink (see events.py): for every event
+with a matching rule it queues one document per channel in
+``notifications``. The unique ``(event_id, template, channel)`` index makes
+the at-least-once outbox delivery idempotent here, so a redelivered batch
+never sends twice.
+
+``NotificationWorker`` drains that queue outside of any API request. Each
+pass claims due notifications per channel with a claim token (a worker
+that dies mid-send leaves claims that expire and are picked up again),
+sends them in batches through the channel's provider with at most
+``provider.concurrency`` batches in flight, and records the outcome:
+``sent``, retried later with exponential backoff, or ``dead`` once
+``max_attempts`` is reached. Dead-lettered notifications stay in the
+collection for operators to inspect and requeue.
+
+Providers come from the environment (``providers_from_env``). A channel
+without one is not faked: each pass marks its notifications ``skipped``,
+visible in ``metrics``, rather than leaving them pending for a provider
+that may never come. Sent, skipped and dead notifications are deleted
+``RETENTION`` after they finished (TTL index on ``finished_at``).
+
+Templates live in ``templates/notifications/<template>.<channel>.txt``;
+emails start with a ``Subject:`` line. Each is parsed once per process.
+"""
+import abc
+import asyncio
+import logging
+import os
+import smtplib
+import uuid
+from collections import deque
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+from functools import lru_cache
+from pathlib import Path
+from string import Template
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+import vault
+from jobs import worker_id
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE_DIR = Path(__file__).parent / "templates" / "notifications"
+
+# (event type, new status or None) -> [(template, channel)]
+RULES: Dict[Tuple[str, Optional[str]], List[Tuple[str, str]]] = {
+    ("driver.status_changed", "approved"): [("status_approved", "email")],
+    ("driver.status_changed", "rejected"): [("status_rejected", "email")],
+    ("driver.kyc_contract_generated", None): [("kyc_contract", "email"), ("kyc_contract", "sms")],
+    ("driver.status_changed", "active"): [("account_active", "email"), ("account_active", "sms")],
+    ("driver.status_changed", "suspended"): [("account_suspended", "email"), ("account_suspended", "sms")],
+    ("driver.document_expiring", None): [("document_expiring", "email"), ("document_expiring", "sms")],
+}
+
+CLAIM_TTL = timedelta(minutes=5)
+RETENTION = timedelta(days=30)
+
+
+@lru_cache(maxsize=None)
+def load_template(template: str, channel: str) -> Tuple[Optional[Template], Template]:
+    """``(subject, body)`` templates; subject is None for SMS."""
+    text = (TEMPLATE_DIR / f"{template}.{channel}.txt").read_text(encoding="utf-8")
+    if channel == "email" and text.startswith("Subject:"):
+        subject, _, body = text.partition("\n")
+        return Template(subject[len("Subject:"):].strip()), Template(body.lstrip("\n"))
+    return None, Template(text.strip())
+
+
+def render(template: str, channel: str, context: Dict[str, str]) -> Dict[str, Optional[str]]:
+    subject, body = load_template(template, channel)
+    return {
+        "subject": subject.safe_substitute(context) if subject else None,
+        "body": body.safe_substitute(context),
+    }
+
+
+async def ensure_indexes(db):
+    await db.notifications.create_index(
+        [("event_id", 1), ("template", 1), ("channel", 1)], unique=True
+    )
+    await db.notifications.create_index([("status", 1), ("channel", 1), ("next_attempt_at", 1)])
+    await db.notifications.create_index("finished_at", expireAfterSeconds=int(RETENTION.total_seconds()))
+
+
+# --- Providers ---------------------------------------------------------------
+
+class Provider(abc.ABC):
+    """Sends batches of rendered notifications for one channel.
+
+    ``send_batch`` returns one entry per message: None when it was accepted,
+    otherwise the error message.
+    """
+
+    channel = "email"
+    concurrency = 4
+    batch_size = 20
+
+    @abc.abstractmethod
+    async def send_batch(self, messages: List[Dict]) -> List[Optional[str]]:
+        ...
+
+
+class FakeProvider(Provider):
+    """For tests: records the last ``keep`` messages instead of sending them;
+    ``fail`` makes the next sends fail. Never used by ``providers_from_env``."""
+
+    def __init__(self, channel: str, concurrency: int = 4, batch_size: int = 20, fail: int = 0,
+                 keep: int = 100):
+        self.channel = channel
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.fail = fail
+        self.sent: Deque[Dict] = deque(maxlen=keep)
+
+    async def send_batch(self, messages):
+        results = []
+        for message in messages:
+            if self.fail:
+                self.fail -= 1
+                results.append("provider unavailable")
+            else:
+                self.sent.append(message)
+                results.append(None)
+        return results
+
+
+class SmtpProvider(Provider):
+    """Email over SMTP, one connection per batch, in a worker thread.
+
+    Attachments are stored documents (the KYC contract), read through the
+    document vault when there is one: they may be encrypted at rest.
+    """
+
+    def __init__(self, host: str, root_dir: Path, port: int = 587, username: Optional[str] = None,
+                 password: Optional[str] = None, sender: str = "Pikkle <no-reply@pikkle.fr>",
+                 concurrency: int = 2, document_vault: Optional[vault.Vault] = None):
+        self.host, self.port = host, port
+        self.root_dir = root_dir
+        self.username, self.password = username, password
+        self.sender = sender
+        self.concurrency = concurrency
+        self.document_vault = document_vault
+
+    async def _attachment(self, message: Dict) -> Optional[Tuple[str, bytes]]:
+        if not message.get("attachment"):
+            return None
+        path = self.root_dir / message["attachment"]
+        return path.name, b"".join([chunk async for chunk in vault.read_document(path, self.document_vault)])
+
+    def _send(self, messages: List[Dict], attachments: List) -> List[Optional[str]]:
+        results = []
+        with smtplib.SMTP(self.host, self.port, timeout=30) as smtp:
+            smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password)
+            for message, attachment in zip(messages, attachments):
+                if isinstance(attachment, Exception):
+                    results.append(f"{type(attachment).__name__}: {attachment}")
+                    continue
+                email = EmailMessage()
+                email["From"], email["To"], email["Subject"] = self.sender, message["to"], message["subject"]
+                email.set_content(message["body"])
+                if attachment:
+                    filename, data = attachment
+                    email.add_attachment(data, maintype="application", subtype="pdf", filename=filename)
+                try:
+                    smtp.send_message(email)
+                    results.append(None)
+                except (OSError, smtplib.SMTPException) as exc:
+                    results.append(f"{type(exc).__name__}: {exc}")
+        return results
+
+    async def send_batch(self, messages):
+        attachments = await asyncio.gather(*(self._attachment(message) for message in messages),
+                                           return_exceptions=True)
+        return await asyncio.to_thread(self._send, messages, attachments)
+
+
+def providers_from_env(root_dir: Path, document_vault: Optional[vault.Vault] = None) -> Dict[str, Provider]:
+    """SMTP when ``SMTP_HOST`` is set. The notifications of a channel without
+    a provider are marked ``skipped`` by the worker."""
+    providers: Dict[str, Provider] = {}
+    if os.environ.get("SMTP_HOST"):
+        providers["email"] = SmtpProvider(
+            os.environ["SMTP_HOST"], root_dir, int(os.environ.get("SMTP_PORT", "587")),
+            os.environ.get("SMTP_USERNAME"), os.environ.get("SMTP_PASSWORD"),
+            document_vault=document_vault,
+        )
+    for channel in sorted({channel for rules in RULES.values() for _, channel in rules} - set(providers)):
+        logger.warning("No %s provider configured: %s notifications are skipped", channel, channel)
+    return providers
+
+
+# --- Queueing ----------------------------------------------------------------
+
+def notification(event_id: str, driver_id: str, template: str, channel: str, to: str,
+                 context: Dict[str, str], attachment: Optional[str] = None,
+                 now: Optional[datetime] = None) -> Dict:
+    """A rendered notification, ready to be queued with ``enqueue``."""
+    now = now or datetime.utcnow()
+    return {
+        "id": str(uuid.uuid4()),
+        "event_id": event_id,
+        "driver_id": driver_id,
+        "template": template,
+        "channel": channel,
+        "to": to,
+        **render(template, channel, context),
+        # Upload-store path, relative to the backend root
+        "attachment": attachment,
+        "status": "pending",
+        "attempts": 0,
+        "next_attempt_at": now,
+        "created_at": now,
+    }
+
+
+async def enqueue(db, documents: List[Dict]):
+    """Queue notifications; the ones already queued for the same event are dropped."""
+    try:
+        await db.notifications.insert_many(documents, ordered=False)
+    except BulkWriteError as exc:
+        # Redelivered events: the unique index drops the duplicates
+        if any(error["code"] != 11000 for error in exc.details["writeErrors"]):
+            raise
+
+
+class NotificationSink:
+    """Outbox sink turning lifecycle events into queued notifications."""
+
+    name = "notifications"
+
+    def __init__(self, get_db: Callable, on_queued: Optional[Callable] = None):
+        self._get_db = get_db
+        self.on_queued = on_queued
+
+    def _rules(self, event: Dict) -> List[Tuple[str, str]]:
+        status = event["payload"].get("status") if event["type"] == "driver.status_changed" else None
+        return RULES.get((event["type"], status), [])
+
+    async def send(self, events: List[Dict]):
+        events = [event for event in events if self._rules(event)]
+        if not events:
+            return
+        db = self._get_db()
+        driver_ids = list({event["driver_id"] for event in events})
+        drivers = {
+            driver["id"]: driver
+            async for driver in db.drivers.find({"id": {"$in": driver_ids}}, {"id": 1, "profile": 1})
+        }
+        now = datetime.utcnow()
+        documents = []
+        for event in events:
+            profile = (drivers.get(event["driver_id"]) or {}).get("profile") or {}
+            context = {key: value for key, value in event["payload"].items() if isinstance(value, str)}
+            context.update(firstname=profile.get("firstname", ""), lastname=profile.get("lastname", ""))
+            for template, channel in self._rules(event):
+                to = profile.get("email") if channel == "email" else profile.get("phone")
+                if not to:
+                    continue
+                attachment = event["payload"].get("document") if channel == "email" else None
+                documents.append(notification(event["id"], event["driver_id"], template, channel, to,
+                                              context, attachment, now))
+        if not documents:
+            return
+        await enqueue(db, documents)
+        if self.on_queued:
+            self.on_queued()
+
+
+# --- Worker ------------------------------------------------------------------
+
+class NotificationWorker:
+    def __init__(self, get_db: Callable, providers: Dict[str, Provider], max_attempts: int = 5,
+                 backoff: float = 30.0, poll_interval: float = 5.0):
+        self._get_db = get_db
+        self.providers = providers
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.poll_interval = poll_interval
+        self._semaphores = {channel: asyncio.Semaphore(p.concurrency) for channel, p in providers.items()}
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def wake(self):
+        self._wake.set()
+
+    async def _claim(self, db, channel: str, limit: int) -> List[Dict]:
+        now = datetime.utcnow()
+        due = {"channel": channel, "$or": [
+            {"status": "pending", "next_attempt_at": {"$lte": now}},
+            {"status": "sending", "claim_expires": {"$lt": now}},
+        ]}
+        ids = [doc["_id"] for doc in await db.notifications.find(due, {"_id": 1}).limit(limit).to_list(limit)]
+        if not ids:
+            return []
+        token = f"{worker_id()}:{uuid.uuid4().hex}"
+        await db.notifications.update_many(
+            {"_id": {"$in": ids}, **due},
+            {"$set": {"status": "sending", "claim": token, "claim_expires": now + CLAIM_TTL}},
+        )
+        return await db.notifications.find({"claim": token}).to_list(limit)
+
+    async def _send(self, provider: Provider, channel: str, batch: List[Dict]) -> List[Optional[str]]:
+        async with self._semaphores[channel]:
+            try:
+                return await provider.send_batch(batch)
+            except Exception as exc:
+                logger.warning("Provider %s failed on a batch of %d: %s", channel, len(batch), exc)
+                return [f"{type(exc).__name__}: {exc}"] * len(batch)
+
+    def _outcome(self, message: Dict, error: Optional[str], now: datetime) -> Dict:
+        if error is None:
+            return {"$set": {"status": "sent", "sent_at": now, "finished_at": now, "error": None},
+                    "$unset": {"claim": ""}}
+        attempts = message["attempts"] + 1
+        update = {"attempts": attempts, "error": error}
+        if attempts >= self.max_attempts:
+            logger.error("Notification %s dead-lettered after %d attempts: %s", message["id"], attempts, error)
+            update.update(status="dead", dead_at=now, finished_at=now)
+        else:
+            update.update(status="pending", next_attempt_at=now + timedelta(seconds=self.backoff * 2 ** (attempts - 1)))
+        return {"$set": update, "$unset": {"claim": ""}}
+
+    async def process_channel(self, db, channel: str) -> Dict[str, int]:
+        provider = self.providers[channel]
+        messages = await self._claim(db, channel, provider.batch_size * provider.concurrency)
+        batches = [messages[i:i + provider.batch_size] for i in range(0, len(messages), provider.batch_size)]
+        results = await asyncio.gather(*(self._send(provider, channel, batch) for batch in batches))
+        now = datetime.utcnow()
+        operations, counts = [], {"sent": 0, "failed": 0}
+        for batch, errors in zip(batches, results):
+            for message, error in zip(batch, errors):
+                operations.append(UpdateOne({"_id": message["_id"], "claim": message["claim"]},
+                                            self._outcome(message, error, now)))
+                counts["sent" if error is None else "failed"] += 1
+        if operations:
+            await db.notifications.bulk_write(operations, ordered=False)
+        return counts
+
+    async def skip_unconfigured(self, db) -> int:
+        """Mark the pending notifications of channels without a provider ``skipped``."""
+        now = datetime.utcnow()
+        result = await db.notifications.update_many(
+            {"status": "pending", "channel": {"$nin": list(self.providers)}},
+            {"$set": {"status": "skipped", "error": "no provider configured", "finished_at": now}},
+        )
+        return result.modified_count
+
+    async def process_once(self, db=None) -> Dict[str, int]:
+        """One pass over every channel; returns sent/failed/skipped counts."""
+        db = db or self._get_db()
+        totals = {"sent": 0, "failed": 0}
+        for counts in await asyncio.gather(*(self.process_channel(db, channel) for channel in self.providers)):
+            for key in totals:
+                totals[key] += counts[key]
+        totals["skipped"] = await self.skip_unconfigured(db)
+        return totals
+
+    async def _loop(self):
+        while True:
+            try:
+                counts = await self.process_once()
+                if counts["sent"] or counts["failed"]:
+                    continue  # more may be due right away
+            except Exception:
+                logger.exception("Notification pass failed")
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    def start(self):
+        self._task = asyncio.create_task(self._loop(), name="notifications")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def metrics(self, db=None) -> Dict[str, Dict[str, int]]:
+        db = db or self._get_db()
+        pipeline = [{"$group": {"_id": {"channel": "$channel", "status": "$status"}, "count": {"$sum": 1}}}]
+        metrics: Dict[str, Dict[str, int]] = {channel: {} for channel in self.providers}
+        async for row in db.notifications.aggregate(pipeline):
+            metrics.setdefault(row["_id"]["channel"], {})[row["_id"]["status"]] = row["count"]
+        return metrics
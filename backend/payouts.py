@@ -0,0 +1,282 @@
+"""Payout batch computation, once per pay period.
+
+A pay period is a calendar month (``"2026-09"``); its payouts are computed
+on ``ledger.PAYOUT_DAY`` of the following month. A run:
+
+1. streams the period's completed, not yet paid-out payments in ``_id``
+   order, ``batch_size`` documents at a time, sums them per driver with
+   pandas and stores the batch's partial sums in ``payout_partials``; the
+   last ``_id`` processed is checkpointed in ``payout_runs`` after every
+   batch, so an interrupted run resumes where it stopped. Partials of a
+   batch that was not checkpointed are deleted on resume: the batches
+   that follow may group payments differently (another ``--batch-size``);
+2. combines the partials per driver, applies each driver's
+   ``contract.commission_rate`` with vectorized operations and writes
+   ``payouts`` documents with ``bulk_write``;
+3. stamps the payments with the run id and refreshes the ledger balances.
+
+Every write is an idempotent upsert or ``$set``, so replaying a step after
+a crash never double counts. Memory stays bounded by one batch of payments
+plus one chunk of drivers.
+
+The daily ``scheduled_run`` runs every closed period (payout day passed)
+that still has unpaid payments or an unfinished run, so a missed or
+failed day is caught up the next one.
+
+    python payouts.py 2026-09 --batch-size 20000
+"""
+import argparse
+import asyncio
+import logging
+import os
+from datetime import datetime
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+from pymongo import UpdateOne
+
+import ledger
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_COMMISSION_RATE = 15.0
+DRIVER_CHUNK = 1000
+
+
+def period_bounds(period: str) -> Tuple[datetime, datetime]:
+    start = datetime.strptime(period, "%Y-%m")
+    end = start.replace(year=start.year + 1, month=1) if start.month == 12 else start.replace(month=start.month + 1)
+    return start, end
+
+
+def previous_period(today: datetime) -> str:
+    first = today.replace(day=1)
+    return (first.replace(year=first.year - 1, month=12) if first.month == 1
+            else first.replace(month=first.month - 1)).strftime("%Y-%m")
+
+
+async def ensure_indexes(db):
+    await db.payments.create_index([("status", 1), ("payout_id", 1), ("created_at", 1)])
+    await db.payout_partials.create_index([("run_id", 1), ("driver_id", 1)])
+    await db.payouts.create_index([("driver_id", 1), ("period", 1)])
+
+
+def summarize_batch(rows: List[Tuple[str, float]]) -> "pd.DataFrame":
+    """Per-driver gross amount and payment count for one batch of payments."""
+    import pandas as pd  # ~300 ms to import, only paid by the payout run
+
+    frame = pd.DataFrame.from_records(rows, columns=["driver_id", "amount"])
+    return frame.groupby("driver_id", sort=False)["amount"].agg(gross="sum", payments="count")
+
+
+def compute_payouts(totals: "pd.DataFrame", rates: Dict[str, float]) -> "pd.DataFrame":
+    """Apply commission rates to per-driver gross totals (index: driver_id)."""
+    import numpy as np
+    import pandas as pd
+
+    rate = pd.Series(rates, dtype=float).reindex(totals.index).fillna(DEFAULT_COMMISSION_RATE).to_numpy()
+    gross = totals["gross"].to_numpy(float)
+    commission = np.round(gross * rate / 100.0, 2)
+    return totals.assign(
+        gross=np.round(gross, 2),
+        commission_rate=rate,
+        commission=commission,
+        net=np.round(gross - commission, 2),
+    )
+
+
+async def _commission_rates(db, driver_ids: List[str]) -> Dict[str, float]:
+    rates = {}
+    async for driver in db.drivers.find({"id": {"$in": driver_ids}}, {"id": 1, "contract.commission_rate": 1}):
+        rate = (driver.get("contract") or {}).get("commission_rate")
+        if rate is None:
+            continue
+        if not 0 <= float(rate) <= 100:
+            logger.warning("Commission rate %s of driver %s out of range, using %s",
+                           rate, driver["id"], DEFAULT_COMMISSION_RATE)
+            continue
+        rates[driver["id"]] = float(rate)
+    return rates
+
+
+async def _accumulate(db, run: dict, batch_size: int) -> dict:
+    """Step 1: stream payments into per-batch partial sums, checkpointing each batch."""
+    # Partials of a batch cut short before its checkpoint
+    await db.payout_partials.delete_many({"run_id": run["_id"], "batch": {"$gte": run.get("batches", 0)}})
+    start, end = period_bounds(run["period"])
+    query = {"status": "completed", "payout_id": None, "created_at": {"$gte": start, "$lt": end}}
+    if run.get("checkpoint") is not None:
+        query["_id"] = {"$gt": run["checkpoint"]}
+    cursor = db.payments.find(query, {"_id": 1, "driver_id": 1, "amount": 1}).sort("_id", 1).batch_size(batch_size)
+
+    rows: List[Tuple[str, float]] = []
+    last_id = None
+    async for payment in cursor:
+        rows.append((payment["driver_id"], payment["amount"]))
+        last_id = payment["_id"]
+        if len(rows) >= batch_size:
+            run = await _flush_batch(db, run, rows, last_id)
+            rows = []
+    if rows:
+        run = await _flush_batch(db, run, rows, last_id)
+    return run
+
+
+async def _flush_batch(db, run: dict, rows, last_id) -> dict:
+    batch_no = run.get("batches", 0)
+    summary = summarize_batch(rows)
+    await db.payout_partials.bulk_write([
+        UpdateOne(
+            {"_id": f"{run['_id']}:{batch_no}:{row.Index}"},
+            {"$set": {"run_id": run["_id"], "batch": batch_no, "driver_id": row.Index,
+                      "gross": float(row.gross), "payments": int(row.payments)}},
+            upsert=True,
+        )
+        for row in summary.itertuples()
+    ], ordered=False)
+    checkpoint = {
+        "checkpoint": last_id,
+        "last_payment_id": last_id,
+        "batches": batch_no + 1,
+        "payments": run.get("payments", 0) + len(rows),
+        "updated_at": datetime.utcnow(),
+    }
+    await db.payout_runs.update_one({"_id": run["_id"]}, {"$set": checkpoint})
+    logger.info("Payout run %s: batch %d, %d payments", run["_id"], batch_no, len(rows))
+    return {**run, **checkpoint}
+
+
+async def _write_payouts(db, run: dict) -> dict:
+    """Step 2: combine partials per driver, apply commissions and write payouts."""
+    import pandas as pd
+
+    drivers = 0
+    totals = {"gross": 0.0, "commission": 0.0, "net": 0.0}
+    payout_date = ledger.next_payout_date(period_bounds(run["period"])[1].date())
+    pipeline = [
+        {"$match": {"run_id": run["_id"]}},
+        {"$group": {"_id": "$driver_id", "gross": {"$sum": "$gross"}, "payments": {"$sum": "$payments"}}},
+    ]
+    chunk: List[dict] = []
+
+    async def flush(chunk):
+        frame = pd.DataFrame.from_records(chunk, index="_id")
+        payouts = compute_payouts(frame, await _commission_rates(db, list(frame.index)))
+        now = datetime.utcnow()
+        await db.payouts.bulk_write([
+            UpdateOne(
+                {"_id": f"{run['_id']}:{row.Index}"},
+                {"$set": {
+                    "id": f"{run['_id']}:{row.Index}",
+                    "run_id": run["_id"],
+                    "driver_id": row.Index,
+                    "period": run["period"],
+                    "gross_amount": float(row.gross),
+                    "commission_rate": float(row.commission_rate),
+                    "commission_amount": float(row.commission),
+                    "net_amount": float(row.net),
+                    "payment_count": int(row.payments),
+                    "currency": "EUR",
+                    "payout_date": payout_date.isoformat(),
+                    "updated_at": now,
+                }, "$setOnInsert": {"status": "scheduled", "created_at": now}},
+                upsert=True,
+            )
+            for row in payouts.itertuples()
+        ], ordered=False)
+        await ledger.apply_payouts(db, list(payouts.index))
+        for key in totals:
+            totals[key] += float(payouts[key].sum())
+        return len(payouts)
+
+    async for row in db.payout_partials.aggregate(pipeline, allowDiskUse=True):
+        chunk.append(row)
+        if len(chunk) >= DRIVER_CHUNK:
+            drivers += await flush(chunk)
+            chunk = []
+    if chunk:
+        drivers += await flush(chunk)
+    return {"drivers": drivers, **{key: round(value, 2) for key, value in totals.items()}}
+
+
+async def run_payouts(db, period: str, batch_size: int = 5000) -> dict:
+    """Compute (or resume) the payouts of ``period``; returns the run summary."""
+    run_id = f"payout-{period}"
+    run = await db.payout_runs.find_one({"_id": run_id})
+    if run and run["status"] == "completed":
+        return run
+    if run is None:
+        run = {"_id": run_id, "period": period, "status": "accumulating", "started_at": datetime.utcnow()}
+        await db.payout_runs.insert_one(run)
+
+    if run["status"] == "accumulating":
+        run = await _accumulate(db, run, batch_size)
+        await db.payout_runs.update_one({"_id": run_id}, {"$set": {"status": "writing"}})
+
+    summary = await _write_payouts(db, run)
+    start, end = period_bounds(period)
+    if run.get("last_payment_id") is not None:
+        await db.payments.update_many(
+            {"status": "completed", "payout_id": None, "created_at": {"$gte": start, "$lt": end},
+             "_id": {"$lte": run["last_payment_id"]}},
+            {"$set": {"payout_id": run_id}},
+        )
+    await db.payout_partials.delete_many({"run_id": run_id})
+    completed = {"status": "completed", "summary": summary, "completed_at": datetime.utcnow()}
+    await db.payout_runs.update_one({"_id": run_id}, {"$set": completed})
+    logger.info("Payout run %s completed: %s", run_id, summary)
+    return {**run, **completed}
+
+
+def closed_period(today: datetime) -> str:
+    """The latest period whose payout day has come."""
+    period = previous_period(today)
+    return period if today.day >= ledger.PAYOUT_DAY else previous_period(period_bounds(period)[0])
+
+
+async def unpaid_periods(db, today: datetime) -> List[str]:
+    """Closed periods with an unfinished run or completed payments not paid out, oldest first."""
+    latest = closed_period(today)
+    periods = {run["period"] async for run in db.payout_runs.find(
+        {"status": {"$ne": "completed"}, "period": {"$lte": latest}}, {"period": 1})}
+    oldest = await db.payments.find(
+        {"status": "completed", "payout_id": None, "created_at": {"$lt": period_bounds(latest)[1]}},
+        {"created_at": 1},
+    ).sort("created_at", 1).limit(1).to_list(1)
+    if oldest:
+        period = oldest[0]["created_at"].strftime("%Y-%m")
+        while period <= latest:
+            periods.add(period)
+            period = period_bounds(period)[1].strftime("%Y-%m")
+    return sorted(periods)
+
+
+async def scheduled_run(db, today: Optional[datetime] = None) -> List[str]:
+    """Daily job: compute the payouts of every closed period not paid yet; returns the periods run."""
+    today = today or datetime.utcnow()
+    ran = []
+    for period in await unpaid_periods(db, today):
+        run = await db.payout_runs.find_one({"_id": f"payout-{period}"}, {"status": 1})
+        if run and run["status"] == "completed":
+            continue  # payments recorded late into a period already paid out are left to staff
+        await run_payouts(db, period)
+        ran.append(period)
+    return ran
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    parser = argparse.ArgumentParser(description="Compute the payouts of a pay period")
+    parser.add_argument("period", help="pay period as YYYY-MM")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    args = parser.parse_args()
+
+    load_dotenv(os.path.join(os.path.dirname(__file__), ".env"))
+    logging.basicConfig(level=logging.INFO)
+    client = AsyncIOMotorClient(os.environ["MONGO_URL"])
+    result = asyncio.run(run_payouts(client[os.environ["DB_NAME"]], args.period, args.batch_size))
+    print(result.get("summary"))
@@ -0,0 +1,190 @@
+"""Per-client rate limiting with token buckets.
+
+Each ``RouteLimit`` matches a method and a path pattern and owns one bucket
+per client IP. When the pattern captures a driver id (named group
+``driver_id``) the client also gets one bucket per driver, and its IP
+bucket is ``drivers_per_client`` times larger: a depot behind one address
+can act for a few drivers at full rate, but cycling through driver ids
+does not multiply the budget. The routes taking a driver id need no
+login, so a bucket keyed by the id alone would let anyone lock that
+driver out.
+Buckets refill lazily on access, so an update is O(1) and needs no timer.
+Idle buckets that would be full anyway are dropped a few at a time, from
+the least recently used, on each request; no request pays for a sweep of
+every client.
+
+State lives in a pluggable backend: ``InMemoryBackend`` (per worker, the
+default) or ``MongoBackend`` for limits shared between workers. Rejected
+requests get ``429`` with a ``Retry-After`` header.
+"""
+import json
+import math
+import re
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable, List, NamedTuple, Pattern
+
+from pymongo import ReturnDocument
+
+
+class RouteLimit(NamedTuple):
+    name: str
+    method: str
+    pattern: Pattern
+    capacity: float  # burst size
+    refill_rate: float  # tokens per second
+    drivers_per_client: int = 5  # size of the IP bucket of driver routes, in driver buckets
+
+    @classmethod
+    def per_minute(cls, name: str, method: str, path: str, burst: int, per_minute: float,
+                   drivers_per_client: int = 5):
+        return cls(name, method, re.compile(path), float(burst), per_minute / 60.0, drivers_per_client)
+
+    def per_client(self) -> "RouteLimit":
+        """The limit of a client's IP bucket on a driver route, over all the drivers it acts for."""
+        return self._replace(capacity=self.capacity * self.drivers_per_client,
+                             refill_rate=self.refill_rate * self.drivers_per_client)
+
+
+def _refilled(bucket: list, now: float) -> float:
+    return bucket[0] + (now - bucket[1]) * bucket[2].refill_rate
+
+
+class InMemoryBackend:
+    """Buckets stored as ``[tokens, last_refill, limit]`` lists, least recently used first."""
+
+    def __init__(self, sweep_step: int = 2, clock: Callable[[], float] = time.monotonic):
+        self._buckets: "OrderedDict[tuple, list]" = OrderedDict()
+        self._sweep_step = sweep_step
+        self._clock = clock
+
+    def __len__(self):
+        return len(self._buckets)
+
+    async def consume(self, key: tuple, limit: RouteLimit) -> float:
+        """Take one token; return 0 if allowed, else seconds until one is available."""
+        now = self._clock()
+        self._sweep_oldest(now)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            self._buckets[key] = [limit.capacity - 1.0, now, limit]
+            return 0.0
+        self._buckets.move_to_end(key)
+        tokens = _refilled(bucket, now)
+        if tokens > limit.capacity:
+            tokens = limit.capacity
+        bucket[1] = now
+        if tokens >= 1.0:
+            bucket[0] = tokens - 1.0
+            return 0.0
+        bucket[0] = tokens
+        return (1.0 - tokens) / limit.refill_rate
+
+    def _sweep_oldest(self, now: float):
+        """Drop up to ``sweep_step`` least recently used buckets that have refilled completely.
+
+        Dropping more than one per request keeps the dict from outgrowing the
+        clients seen within the slowest refill time.
+        """
+        for _ in range(self._sweep_step):
+            if not self._buckets:
+                return
+            key = next(iter(self._buckets))
+            bucket = self._buckets[key]
+            if _refilled(bucket, now) < bucket[2].capacity:
+                return
+            del self._buckets[key]
+
+
+class MongoBackend:
+    """Buckets shared between workers in the ``rate_limits`` collection.
+
+    Refill and consumption happen in a single atomic pipeline update, at the
+    cost of one round trip per limited request.
+    """
+
+    def __init__(self, get_db: Callable, idle_ttl_seconds: int = 3600):
+        self._get_db = get_db
+        self._idle_ttl = idle_ttl_seconds
+
+    async def ensure_indexes(self):
+        await self._get_db().rate_limits.create_index("updated", expireAfterSeconds=self._idle_ttl)
+
+    async def consume(self, key: tuple, limit: RouteLimit) -> float:
+        now = datetime.utcnow()
+        elapsed = {"$divide": [{"$subtract": [now, {"$ifNull": ["$updated", now]}]}, 1000]}
+        refilled = {"$min": [limit.capacity, {"$add": [
+            {"$ifNull": ["$tokens", limit.capacity]}, {"$multiply": [elapsed, limit.refill_rate]}
+        ]}]}
+        bucket = await self._get_db().rate_limits.find_one_and_update(
+            {"_id": "|".join(key)},
+            [
+                {"$set": {"tokens": refilled, "updated": now}},
+                {"$set": {
+                    "allowed": {"$gte": ["$tokens", 1]},
+                    "tokens": {"$cond": [{"$gte": ["$tokens", 1]}, {"$subtract": ["$tokens", 1]}, "$tokens"]},
+                }},
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        if bucket["allowed"]:
+            return 0.0
+        return (1.0 - bucket["tokens"]) / limit.refill_rate
+
+
+class RateLimitMiddleware:
+    """ASGI middleware enforcing ``RouteLimit`` rules before routing."""
+
+    def __init__(self, app, limits: List[RouteLimit], backend=None, trust_forwarded: bool = False):
+        self.app = app
+        self.limits = limits
+        self._client_limits = {limit.name: limit.per_client() for limit in limits
+                               if "driver_id" in limit.pattern.groupindex}
+        self.backend = backend if backend is not None else InMemoryBackend()
+        self.trust_forwarded = trust_forwarded
+
+    def client_key(self, scope) -> str:
+        if self.trust_forwarded:
+            for name, value in scope["headers"]:
+                if name == b"x-forwarded-for":
+                    return value.split(b",", 1)[0].strip().decode("latin-1")
+        client = scope.get("client")
+        return client[0] if client else "unknown"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            method, path = scope["method"], scope["path"]
+            for limit in self.limits:
+                if limit.method != method:
+                    continue
+                match = limit.pattern.fullmatch(path)
+                if match is None:
+                    continue
+                driver_id = match.groupdict().get("driver_id")
+                key = (limit.name, self.client_key(scope))
+                if driver_id:
+                    retry_after = await self.backend.consume(key, self._client_limits[limit.name])
+                    if not retry_after:
+                        retry_after = await self.backend.consume(key + (driver_id,), limit)
+                else:
+                    retry_after = await self.backend.consume(key, limit)
+                if retry_after:
+                    return await _too_many_requests(send, retry_after)
+                break
+        await self.app(scope, receive, send)
+
+
+async def _too_many_requests(send, retry_after: float):
+    body = json.dumps({"detail": "Trop de requêtes, réessayez plus tard"}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": 429,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
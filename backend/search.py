@@ -0,0 +1,181 @@
+"""Driver search for support staff.
+
+Every driver document carries ``search_keys``, an array of normalized,
+field-prefixed keys recomputed whenever the profile or business info is
+written:
+
+* ``n:<token>`` for each name token (lowercase, accents stripped),
+* ``e:<email>`` lowercased,
+* ``p:<digits>`` phone in national format (``+33 6…`` -> ``06…``),
+* ``s:<digits>`` SIRET, and ``s:<first 9 digits>`` (SIREN).
+
+A single multikey index on ``search_keys`` serves every lookup: a query
+token becomes an anchored, case-sensitive regex (``^n:dup``), which MongoDB
+turns into a bounded index range scan, and several tokens are combined
+with ``$and``. Exact matches are fetched first, then prefix matches, and
+only a few candidates are ranked here, so the cost does not depend on the
+number of drivers.
+
+Drivers written before the field existed are filled in by ``backfill``
+(``python search.py``).
+"""
+import asyncio
+import logging
+import os
+import re
+import unicodedata
+from typing import Dict, List
+
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+MIN_QUERY_LENGTH = 2
+CANDIDATE_FACTOR = 5
+
+# Weight of an exact (vs prefix) match per field
+FIELD_WEIGHTS = {"s": 10, "p": 8, "e": 8, "n": 3}
+
+_NON_ALNUM = re.compile(r"[^0-9a-z]+")
+_NON_DIGIT = re.compile(r"\D+")
+
+
+def fold(text: str) -> str:
+    """Lowercase and strip accents: ``"Hélène"`` -> ``"helene"``."""
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).lower()
+
+
+def name_tokens(text: str) -> List[str]:
+    return [token for token in _NON_ALNUM.split(fold(text)) if token]
+
+
+def normalize_phone(phone: str) -> str:
+    phone = phone.strip()
+    digits = _NON_DIGIT.sub("", phone)
+    if phone.startswith("+33"):
+        return "0" + digits[2:]
+    if digits.startswith("0033"):
+        return "0" + digits[4:]
+    return digits
+
+
+def search_keys(driver: Dict) -> List[str]:
+    profile = driver.get("profile") or {}
+    business = driver.get("business_info") or {}
+    keys = set()
+    for field in ("firstname", "lastname"):
+        keys.update(f"n:{token}" for token in name_tokens(profile.get(field) or ""))
+    if profile.get("email"):
+        keys.add(f"e:{profile['email'].strip().lower()}")
+    if profile.get("phone"):
+        keys.add(f"p:{normalize_phone(profile['phone'])}")
+    siret = _NON_DIGIT.sub("", business.get("siret") or "")
+    if siret:
+        keys.update({f"s:{siret}", f"s:{siret[:9]}"})
+    return sorted(keys)
+
+
+async def ensure_indexes(db):
+    await db.drivers.create_index("search_keys")
+
+
+def query_terms(q: str) -> List[List[str]]:
+    """Query terms, each a list of alternative key prefixes; a driver must match every term."""
+    q = q.strip()
+    if "@" in q:
+        return [[f"e:{q.lower()}"]]
+    digits = _NON_DIGIT.sub("", q)
+    if digits and not re.search(r"[a-zA-Z]", fold(q)):
+        return [[f"p:{normalize_phone(q)}", f"s:{digits}"]]
+    return [[f"n:{token}"] for token in name_tokens(q)]
+
+
+def _criteria(terms: List[List[str]], exact: bool = False) -> Dict:
+    # One $in per term, of keys or anchored regexes: each is an index range scan
+    return {"$and": [
+        {"search_keys": {"$in": term if exact else [re.compile("^" + re.escape(prefix)) for prefix in term]}}
+        for term in terms
+    ]}
+
+
+def score(keys: List[str], terms: List[List[str]]) -> int:
+    """Sum over terms of the best match: field weight, doubled for an exact match."""
+    total = 0
+    for term in terms:
+        best = 0
+        for key in keys:
+            for prefix in term:
+                if key.startswith(prefix):
+                    weight = FIELD_WEIGHTS[key[0]]
+                    best = max(best, weight * 2 if key == prefix else weight)
+        total += best
+    return total
+
+
+async def search_drivers(db, q: str, limit: int = 20) -> List[Dict]:
+    terms = query_terms(q)
+    if not terms:
+        return []
+    projection = {"_id": 0, "id": 1, "profile.firstname": 1, "profile.lastname": 1, "profile.email": 1,
+                  "profile.phone": 1, "business_info.siret": 1, "status": 1, "registration_step": 1,
+                  "search_keys": 1}
+    wanted = limit * CANDIDATE_FACTOR
+    candidates = await db.drivers.find(_criteria(terms, exact=True), projection).limit(wanted).to_list(None)
+    if len(candidates) < wanted:
+        seen = {driver["id"] for driver in candidates}
+        prefixed = await db.drivers.find(_criteria(terms), projection).limit(wanted).to_list(None)
+        candidates += [driver for driver in prefixed if driver["id"] not in seen][:wanted - len(candidates)]
+    ranked = sorted(
+        candidates,
+        key=lambda d: (-score(d["search_keys"], terms), fold((d.get("profile") or {}).get("lastname") or "")),
+    )
+    results = []
+    for driver in ranked[:limit]:
+        profile = driver.get("profile") or {}
+        results.append({
+            "id": driver["id"],
+            "firstname": profile.get("firstname"),
+            "lastname": profile.get("lastname"),
+            "email": profile.get("email"),
+            "phone": profile.get("phone"),
+            "siret": (driver.get("business_info") or {}).get("siret"),
+            "status": driver.get("status"),
+            "registration_step": driver.get("registration_step"),
+            "score": score(driver["search_keys"], terms),
+        })
+    return results
+
+
+async def backfill(db, batch_size: int = 1000) -> int:
+    """Compute ``search_keys`` for drivers that do not have it yet."""
+    updated = 0
+    operations = []
+    projection = {"id": 1, "profile": 1, "business_info": 1}
+    async for driver in db.drivers.find({"search_keys": {"$exists": False}}, projection):
+        operations.append(UpdateOne({"_id": driver["_id"]}, {"$set": {"search_keys": search_keys(driver)}}))
+        if len(operations) >= batch_size:
+            await db.drivers.bulk_write(operations, ordered=False)
+            updated += len(operations)
+            operations = []
+    if operations:
+        await db.drivers.bulk_write(operations, ordered=False)
+        updated += len(operations)
+    logger.info("Search keys backfilled for %d drivers", updated)
+    return updated
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(os.path.join(os.path.dirname(__file__), ".env"))
+    logging.basicConfig(level=logging.INFO)
+    client = AsyncIOMotorClient(os.environ["MONGO_URL"])
+    db = client[os.environ["DB_NAME"]]
+
+    async def main():
+        await ensure_indexes(db)
+        return await backfill(db)
+
+    print(asyncio.run(main()))
@@ -0,0 +1,234 @@
+"""Production launcher: uvicorn workers prefork'd from one master process.
+
+    python serve.py --workers 4 --port 8001
+
+The master binds the listening socket (with ``--backlog``), builds the app
+once and forks the workers, which share the socket and the imported code
+(copy-on-write) and each run their own event loop. The app's database
+handle connects on first use, so each worker opens its own Mongo client;
+nothing created before the fork holds connections or threads.
+
+uvloop and httptools are used when installed (``--loop auto``/``--http
+auto``), else the asyncio loop and h11.
+
+Signals on the master:
+
+* ``SIGTERM``/``SIGINT``: graceful drain. Workers stop accepting, finish
+  in-flight requests for up to ``--graceful-timeout`` seconds and run the
+  shutdown handlers; stragglers are then killed.
+* ``SIGHUP``: rolling restart, one worker at a time.
+
+Workers that die are restarted; a worker that keeps dying at startup
+stops the whole server instead of looping.
+
+``--local`` serves against mongomock (one in-memory database per worker)
+for demos and benchmarks without a mongod.
+
+Settings also come from the environment: ``WEB_CONCURRENCY``, ``HOST``,
+``PORT``.
+"""
+import argparse
+import logging
+import os
+import signal
+import sys
+import time
+from typing import Dict, Optional
+
+import uvicorn
+from uvicorn.config import LOGGING_CONFIG
+
+logger = logging.getLogger("serve")
+
+APP = "server:app"
+# A worker dying this soon after start is a crash loop, not a one-off
+MIN_WORKER_UPTIME = 5.0
+STARTUP_FAILURE = 3
+
+
+def event_loop_name(loop: str) -> str:
+    if loop != "auto":
+        return loop
+    try:
+        import uvloop  # noqa: F401
+        return "uvloop"
+    except ImportError:
+        return "asyncio"
+
+
+def http_protocol_name(http: str) -> str:
+    if http != "auto":
+        return http
+    try:
+        import httptools  # noqa: F401
+        return "httptools"
+    except ImportError:
+        return "h11"
+
+
+def build_config(args) -> uvicorn.Config:
+    return uvicorn.Config(
+        APP,
+        host=args.host,
+        port=args.port,
+        loop=event_loop_name(args.loop),
+        http=http_protocol_name(args.http),
+        backlog=args.backlog,
+        timeout_keep_alive=args.keep_alive,
+        timeout_graceful_shutdown=args.graceful_timeout,
+        limit_concurrency=args.limit_concurrency,
+        limit_max_requests=args.max_requests,
+        proxy_headers=True,
+        forwarded_allow_ips=args.forwarded_allow_ips,
+        access_log=args.access_log,
+        log_config=LOGGING_CONFIG,
+        lifespan="on",
+    )
+
+
+def use_local_database():
+    import local_stack
+    import server
+
+    _, server.db = local_stack.make_database()
+
+
+def run_worker(config: uvicorn.Config, sockets, local: bool) -> int:
+    """Serve until shutdown; the exit status is 3 if the app failed to start."""
+    if local:
+        if not config.loaded:
+            config.load()  # build the app, then swap its database
+        use_local_database()
+    server = uvicorn.Server(config)
+    server.run(sockets=sockets)
+    return 0 if server.started else STARTUP_FAILURE
+
+
+class Supervisor:
+    def __init__(self, config: uvicorn.Config, workers: int, graceful_timeout: int, local: bool):
+        self.config = config
+        self.workers = workers
+        self.graceful_timeout = graceful_timeout
+        self.local = local
+        self.children: Dict[int, float] = {}  # pid -> start time
+        self.sockets = []
+        self._stopping: Optional[int] = None
+        self._reload = False
+
+    def spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            # Child: uvicorn installs its own SIGTERM/SIGINT handlers
+            for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+                signal.signal(signum, signal.SIG_DFL)
+            code = 1
+            try:
+                code = run_worker(self.config, self.sockets, self.local)
+            finally:
+                os._exit(code)
+        self.children[pid] = time.monotonic()
+        logger.info("Worker %d started", pid)
+
+    def _on_stop(self, signum, frame):
+        self._stopping = signum
+
+    def _on_reload(self, signum, frame):
+        self._reload = True
+
+    def reap(self) -> bool:
+        """Collect exited workers; False if one crashed right after starting."""
+        healthy = True
+        while self.children:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                break
+            started = self.children.pop(pid, None)
+            if started is None:
+                continue
+            code = os.waitstatus_to_exitcode(status)
+            if self._stopping is None:
+                logger.warning("Worker %d exited with status %d", pid, code)
+                if time.monotonic() - started < MIN_WORKER_UPTIME and code != 0:
+                    healthy = False
+        return healthy
+
+    def rolling_restart(self):
+        for pid in list(self.children):
+            self.spawn()
+            os.kill(pid, signal.SIGTERM)
+            deadline = time.monotonic() + self.graceful_timeout + 5
+            while pid in self.children and time.monotonic() < deadline:
+                time.sleep(0.1)
+                self.reap()
+
+    def drain(self):
+        logger.info("Stopping %d workers (graceful timeout %ds)", len(self.children), self.graceful_timeout)
+        for pid in self.children:
+            os.kill(pid, signal.SIGTERM)
+        deadline = time.monotonic() + self.graceful_timeout + 5
+        while self.children and time.monotonic() < deadline:
+            time.sleep(0.1)
+            self.reap()
+        for pid in list(self.children):
+            logger.warning("Worker %d did not stop in time, killing it", pid)
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+            self.children.pop(pid)
+
+    def run(self) -> int:
+        self.config.load()  # import the app once, before forking
+        self.sockets = [self.config.bind_socket()]
+        logger.info("Serving on %s:%d with %d workers (%s, %s)", self.config.host, self.config.port,
+                    self.workers, self.config.loop, self.config.http)
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+        signal.signal(signal.SIGHUP, self._on_reload)
+        for _ in range(self.workers):
+            self.spawn()
+        status = 0
+        while self._stopping is None:
+            time.sleep(0.2)
+            if not self.reap():
+                logger.error("A worker crashed on startup, shutting down")
+                status = 1
+                break
+            if self._reload:
+                self._reload = False
+                self.rolling_restart()
+            while len(self.children) < self.workers and self._stopping is None:
+                self.spawn()
+        self._stopping = self._stopping or signal.SIGTERM
+        self.drain()
+        for sock in self.sockets:
+            sock.close()
+        return status
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default=os.environ.get("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", "8001")))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("WEB_CONCURRENCY", "1")))
+    parser.add_argument("--loop", default="auto", choices=["auto", "asyncio", "uvloop"])
+    parser.add_argument("--http", default="auto", choices=["auto", "h11", "httptools"])
+    parser.add_argument("--backlog", type=int, default=2048, help="listen queue length")
+    parser.add_argument("--keep-alive", type=int, default=5, help="idle keep-alive timeout (s)")
+    parser.add_argument("--graceful-timeout", type=int, default=30, help="drain time on SIGTERM (s)")
+    parser.add_argument("--limit-concurrency", type=int, help="per-worker connection limit (503 above)")
+    parser.add_argument("--max-requests", type=int, help="restart a worker after this many requests")
+    parser.add_argument("--forwarded-allow-ips", default=os.environ.get("FORWARDED_ALLOW_IPS", "127.0.0.1"))
+    parser.add_argument("--no-access-log", dest="access_log", action="store_false")
+    parser.add_argument("--local", action="store_true", help="mongomock instead of MONGO_URL")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    config = build_config(args)
+    if args.workers <= 1:
+        return run_worker(config, None, args.local)
+    # Workers leaving after --max-requests exit with status 0 and are replaced
+    return Supervisor(config, args.workers, args.graceful_timeout, args.local).run()
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    sys.exit(main())
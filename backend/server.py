@@ -1,113 +1,95 @@
-from fastapi import FastAPI, APIRouter, HTTPException, UploadFile, File
-from fastapi.responses import FileResponse
-from dotenv import load_dotenv
+from fastapi import FastAPI, APIRouter, Depends, HTTPException, Request, UploadFile, File
+from fastapi.responses import FileResponse, StreamingResponse
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
-import os
 import logging
+import mimetypes
 from pathlib import Path
-from pydantic import BaseModel, Field, EmailStr
 from typing import List, Optional, Dict, Any
 import uuid
-from datetime import datetime, date
+from datetime import datetime, date, time, timedelta
 import shutil
 
-ROOT_DIR = Path(__file__).parent
-load_dotenv(ROOT_DIR / '.env')
+import analytics
+import auth
+import compliance
+import contracts
+import dossiers
+import events
+import fingerprints
+import geo
+import images
+import ledger
+import live
+import notifications
+import payouts
+import search
+import storage
+import tracking
+import uploads
+import vault
+from jobs import Scheduler
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+from idempotency import IdempotencyMiddleware, IdempotencyStore
+from rate_limit import InMemoryBackend, MongoBackend, RateLimitMiddleware, RouteLimit
+from models import (
+    CommissionRate, Course, Credentials, Driver, DriverContract, DriverUpdate, PaymentCreate, PaymentHistory, UploadSessionCreate,
+    DirectUploadCreate, LocationBatch, RegistrationConfirmation,
+)
+from settings import BACKEND_DIR, Settings
+
+logger = logging.getLogger(__name__)
+
+
+class LazyDatabase:
+    """Database handle whose Mongo client is opened on first use.
+
+    serve.py forks its workers from a master that built the app, and a
+    client (its connection pool and monitor threads) must not cross a
+    fork: each worker opens its own the first time it touches the database.
+    """
+
+    def __init__(self, mongo_url: Optional[str], db_name: str):
+        self._mongo_url = mongo_url
+        self._db_name = db_name
+        self._client: Optional[AsyncIOMotorClient] = None
+        self._db = None
+
+    def _database(self):
+        if self._db is None:
+            if not self._mongo_url:
+                raise RuntimeError("MONGO_URL is not configured")
+            self._client = AsyncIOMotorClient(self._mongo_url)
+            self._db = self._client[self._db_name]
+        return self._db
+
+    def __getattr__(self, name):
+        return getattr(self._database(), name)
+
+    def __getitem__(self, name):
+        return self._database()[name]
 
-# Create the main app without a prefix
-app = FastAPI()
+    def close(self):
+        if self._client is not None:
+            self._client.close()
+            self._client = self._db = None
+
+
+# Handles used by the routes, set by create_app(). Importing this module has
+# no side effects: nothing reads the environment, connects or touches the
+# disk until an app is built, and the database connects on first use.
+settings: Optional[Settings] = None
+db = None
+ROOT_DIR: Path = BACKEND_DIR
+UPLOAD_DIR: Path = BACKEND_DIR / "uploads"
+ORIGINALS_DIR: Path = BACKEND_DIR / "originals"
+document_store: Optional[storage.Storage] = None
+document_vault: Optional[vault.Vault] = None  # None: documents stored in plaintext
+fingerprint_index: Optional[fingerprints.FingerprintIndex] = None
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
-# Create uploads directory if it doesn't exist
-UPLOAD_DIR = ROOT_DIR / "uploads"
-UPLOAD_DIR.mkdir(exist_ok=True)
-
-# Driver Models
-class DriverProfile(BaseModel):
-    firstname: str
-    lastname: str
-    email: EmailStr
-    phone: str
-    date_of_birth: Optional[str] = None
-    address: str
-
-class DriverDocuments(BaseModel):
-    identity_card_front: Optional[str] = None
-    identity_card_back: Optional[str] = None
-    proof_of_residence: Optional[str] = None
-    residence_permit: Optional[str] = None
-    civil_liability_insurance: Optional[str] = None
-    vehicle_insurance: Optional[str] = None
-    vehicle_contract: Optional[str] = None
-    kbis_document: Optional[str] = None
-
-class DriverBusinessInfo(BaseModel):
-    siret: str
-    company_name: str
-    business_address: str
-    vehicle_type: Optional[str] = None
-    insurance_provider: Optional[str] = None
-    insurance_number: Optional[str] = None
-    siret_verified: bool = False
-
-class DriverBankInfo(BaseModel):
-    bank_name: str
-    iban: str
-    bic: str
-    account_holder_name: str
-
-class DriverContract(BaseModel):
-    auto_entrepreneur_status: bool = False
-    accepts_cgu: bool = False
-    accepts_privacy_policy: bool = False
-    accepts_app_download: bool = False
-    signature_date: Optional[datetime] = None
-    kyc_contract_generated: bool = False
-    kyc_contract_sent_date: Optional[datetime] = None
-    kyc_contract_signed: bool = False
-    kyc_contract_received_date: Optional[datetime] = None
-    commission_rate: float = 15.0  # % de commission par défaut
-
-class Driver(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    profile: Optional[DriverProfile] = None
-    documents: Optional[DriverDocuments] = None
-    business_info: Optional[DriverBusinessInfo] = None
-    bank_info: Optional[DriverBankInfo] = None
-    contract: Optional[DriverContract] = None
-    registration_step: int = 1
-    status: str = "pending"  # pending, under_review, approved, rejected
-    created_at: datetime = Field(default_factory=datetime.utcnow)
-    updated_at: datetime = Field(default_factory=datetime.utcnow)
-
-class DriverUpdate(BaseModel):
-    profile: Optional[DriverProfile] = None
-    documents: Optional[DriverDocuments] = None
-    business_info: Optional[DriverBusinessInfo] = None
-    bank_info: Optional[DriverBankInfo] = None
-    contract: Optional[DriverContract] = None
-    registration_step: Optional[int] = None
-    status: Optional[str] = None
-
-# Payment Models (placeholder for future Stripe integration)
-class PaymentHistory(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    driver_id: str
-    amount: float
-    currency: str = "EUR"
-    payment_method: str  # apple_pay, google_pay, bank_transfer
-    status: str  # completed, pending, failed
-    delivery_id: Optional[str] = None
-    created_at: datetime = Field(default_factory=datetime.utcnow)
-
 # Driver Routes
 import re
 
@@ -154,41 +136,16 @@ async def create_driver(driver_data: DriverUpdate):
             raise HTTPException(status_code=400, detail="Email jetable non autorisé")
         
         # Validation cohérence code postal / ville
-        postal_code_cities = {
-            '75001': 'Paris', '75002': 'Paris', '75003': 'Paris', '75004': 'Paris', '75005': 'Paris',
-            '75006': 'Paris', '75007': 'Paris', '75008': 'Paris', '75009': 'Paris', '75010': 'Paris',
-            '75011': 'Paris', '75012': 'Paris', '75013': 'Paris', '75014': 'Paris', '75015': 'Paris',
-            '75016': 'Paris', '75017': 'Paris', '75018': 'Paris', '75019': 'Paris', '75020': 'Paris',
-            '13001': 'Marseille', '13002': 'Marseille', '13003': 'Marseille', '13004': 'Marseille',
-            '06000': 'Nice', '31000': 'Toulouse', '44000': 'Nantes', '67000': 'Strasbourg',
-            '34000': 'Montpellier', '33000': 'Bordeaux', '59000': 'Lille', '35000': 'Rennes',
-            '69001': 'Lyon', '69002': 'Lyon', '69003': 'Lyon', '69004': 'Lyon', '69005': 'Lyon'
-        }
-        
-        # Extraction du code postal depuis l'adresse
-        address_parts = profile.address.split(',')
-        postal_found = None
-        city_found = None
-        
-        for part in address_parts:
-            part_clean = part.strip()
-            # Chercher le code postal (5 chiffres)
-            postal_match = re.search(r'\b\d{5}\b', part_clean)
-            if postal_match:
-                postal_found = postal_match.group()
-            # Chercher le nom de ville
-            for city_name in set(postal_code_cities.values()):
-                if city_name.lower() in part_clean.lower():
-                    city_found = city_name
-                    break
+        address_fields = geo.normalize_address(profile.address)
+        postal_found, city_found = address_fields["postal_code"], address_fields["city"]
         
         # Vérifier la cohérence si on trouve les deux
         if postal_found and city_found:
-            expected_city = postal_code_cities.get(postal_found)
-            if expected_city and expected_city.lower() != city_found.lower():
+            expected_cities = geo.expected_cities(postal_found)
+            if expected_cities and city_found not in expected_cities:
                 raise HTTPException(
                     status_code=400, 
-                    detail=f"Incohérence: le code postal {postal_found} correspond à {expected_city}, pas à {city_found}"
+                    detail=f"Incohérence: le code postal {postal_found} correspond à {expected_cities[0]}, pas à {city_found}"
                 )
     
 
@@ -217,7 +174,31 @@ async def create_driver(driver_data: DriverUpdate):
         "created_at": datetime.utcnow(),
         "updated_at": datetime.utcnow()
     }
-    # ...existing code...
+    if driver_data.profile:
+        driver_dict["profile"] = {**driver_data.profile.dict(), **address_fields}
+    if driver_data.documents:
+        driver_dict["documents"] = driver_data.documents.dict()
+    if driver_data.business_info:
+        driver_dict["business_info"] = driver_data.business_info.dict()
+    if driver_data.bank_info:
+        driver_dict["bank_info"] = driver_data.bank_info.dict()
+    if driver_data.contract:
+        driver_dict["contract"] = DriverContract(**driver_data.contract.dict()).dict()
+    if driver_data.registration_step:
+        driver_dict["registration_step"] = driver_data.registration_step
+    if driver_data.status:
+        driver_dict["status"] = driver_data.status
+
+    driver = Driver(**driver_dict)
+    await events.commit(
+        db,
+        lambda session: db.drivers.insert_one(
+            {**driver.dict(), "search_keys": search.search_keys(driver.dict())}, session=session
+        ),
+        [events.driver_event("driver.created", driver.id, status=driver.status,
+                             registration_step=driver.registration_step)],
+    )
+    return driver
 
 @api_router.get("/drivers/{driver_id}", response_model=Driver)
 async def get_driver(driver_id: str):
@@ -244,7 +225,8 @@ async def update_driver(driver_id: str, driver_update: DriverUpdate):
     update_data = {"updated_at": datetime.utcnow()}
     
     if driver_update.profile:
-        update_data["profile"] = driver_update.profile.dict()
+        update_data["profile"] = {**driver_update.profile.dict(),
+                                  **geo.normalize_address(driver_update.profile.address)}
     if driver_update.documents:
         update_data["documents"] = driver_update.documents.dict()
     if driver_update.business_info:
@@ -252,28 +234,38 @@ async def update_driver(driver_id: str, driver_update: DriverUpdate):
     if driver_update.bank_info:
         update_data["bank_info"] = driver_update.bank_info.dict()
     if driver_update.contract:
-        update_data["contract"] = driver_update.contract.dict()
+        contract = driver_update.contract.dict()
+        if driver.get("contract"):
+            # Field by field, keeping the commission rate set by staff
+            update_data.update({f"contract.{field}": value for field, value in contract.items()})
+        else:
+            update_data["contract"] = DriverContract(**contract).dict()
     if driver_update.registration_step:
         update_data["registration_step"] = driver_update.registration_step
     if driver_update.status:
         update_data["status"] = driver_update.status
     
-    await db.drivers.update_one(
-        {"id": driver_id},
-        {"$set": update_data}
+    if "profile" in update_data or "business_info" in update_data:
+        update_data["search_keys"] = search.search_keys({**driver, **update_data})
+
+    changes = list(dict.fromkeys(key.split(".", 1)[0] for key in update_data
+                                 if key not in ("updated_at", "search_keys")))
+    step_change = {}
+    if update_data.get("registration_step", driver.get("registration_step")) != driver.get("registration_step"):
+        step_change = {"registration_step": update_data["registration_step"],
+                       "previous_step": driver.get("registration_step")}
+    outbox = [events.driver_event("driver.updated", driver_id, fields=changes, **step_change)] if changes else []
+    outbox += events.status_events(driver_id, driver.get("status"), update_data.get("status"))
+    await events.commit(
+        db,
+        lambda session: db.drivers.update_one({"id": driver_id}, {"$set": update_data}, session=session),
+        outbox,
     )
     
     updated_driver = await db.drivers.find_one({"id": driver_id})
     return Driver(**updated_driver)
 
-from pydantic import BaseModel
-
 # --- Courses Feature ---
-class Course(BaseModel):
-    id: str
-    title: str
-    applicants: list[str] = []
-
 # Stockage en mémoire (à remplacer par MongoDB plus tard)
 courses_data = [
     Course(id="1", title="Livrer canapé"),
@@ -294,6 +286,13 @@ async def apply_to_course(course_id: str, payload: dict):
             return {"message": "Postulation réussie."}
     raise HTTPException(status_code=404, detail="Course introuvable")
 
+# Access tokens (see auth.py); the routes come further down
+token_service: Optional[auth.TokenService] = None
+require_user = auth.requires(lambda: token_service)
+require_admin = auth.requires(lambda: token_service, "admin")
+require_own_driver = auth.requires_driver(lambda: token_service)
+require_own_driver_or_admin = auth.requires_driver(lambda: token_service, "admin")
+
 # Statistics and Dashboard Routes
 @api_router.get("/drivers/{driver_id}/stats")
 async def get_driver_stats(driver_id: str):
@@ -302,30 +301,31 @@ async def get_driver_stats(driver_id: str):
     if not driver:
         raise HTTPException(status_code=404, detail="Livreur non trouvé")
     
-    # Mock stats for now - will be replaced with real data
+    # Running totals maintained by the payments ledger
+    balance = await ledger.get_balance(db, driver_id)
     stats = {
-        "total_deliveries": 0,
-        "total_earnings": 0.0,
-        "current_balance": 0.0,
+        "total_deliveries": balance["total_deliveries"],
+        "total_earnings": balance["total_earnings"],
+        "current_balance": balance["current_balance"],
         "document_status": {
-            "identity_verified": bool(driver.get("documents", {}).get("identity_card_front")),
+            "identity_verified": bool((driver.get("documents") or {}).get("identity_card_front")),
             "documents_complete": False,
             "bank_info_complete": bool(driver.get("bank_info")),
-            "contract_signed": bool(driver.get("contract", {}).get("accepts_cgu")),
-            "kyc_contract_status": driver.get("contract", {}).get("kyc_contract_signed", False)
+            "contract_signed": bool((driver.get("contract") or {}).get("accepts_cgu")),
+            "kyc_contract_status": (driver.get("contract") or {}).get("kyc_contract_signed", False)
         },
-        "next_payout_date": "2024-08-15",
+        "next_payout_date": ledger.next_payout_date().isoformat(),
         "account_status": driver.get("status", "pending"),
         "kyc_status": {
-            "contract_generated": driver.get("contract", {}).get("kyc_contract_generated", False),
-            "contract_sent": bool(driver.get("contract", {}).get("kyc_contract_sent_date")),
-            "contract_signed": driver.get("contract", {}).get("kyc_contract_signed", False)
+            "contract_generated": (driver.get("contract") or {}).get("kyc_contract_generated", False),
+            "contract_sent": bool((driver.get("contract") or {}).get("kyc_contract_sent_date")),
+            "contract_signed": (driver.get("contract") or {}).get("kyc_contract_signed", False)
         }
     }
     
     # Check document completeness
-    documents = driver.get("documents", {})
-    business_info = driver.get("business_info", {})
+    documents = driver.get("documents") or {}
+    business_info = driver.get("business_info") or {}
     required_docs = ["identity_card_front", "identity_card_back", "proof_of_residence"]
     insurance_docs = ["civil_liability_insurance", "vehicle_insurance", "vehicle_contract"]
     
@@ -336,45 +336,200 @@ async def get_driver_stats(driver_id: str):
     
     return stats
 
+VALID_DOCUMENT_TYPES = [
+    "identity_card_front", "identity_card_back", "proof_of_residence",
+    "residence_permit", "civil_liability_insurance", "vehicle_insurance",
+    "vehicle_contract", "kbis_document"
+]
+
+def check_document(document_type: str, expires_at: Optional[date]):
+    if document_type not in VALID_DOCUMENT_TYPES:
+        raise HTTPException(status_code=400, detail="Type de document invalide")
+    if expires_at is not None:
+        if document_type not in compliance.EXPIRING_DOCUMENTS:
+            raise HTTPException(status_code=400, detail="Ce document n'a pas de date d'expiration")
+        if expires_at < datetime.utcnow().date():
+            raise HTTPException(status_code=400, detail="Document expiré")
+
+def document_path(driver_id: str, document_type: str, filename: str, content_type: Optional[str] = None) -> Path:
+    file_extension = filename.split('.')[-1] if '.' in filename else storage.EXTENSIONS.get(content_type, 'bin')
+    return UPLOAD_DIR / driver_id / f"{document_type}.{file_extension}"
+
+async def record_document(driver: Dict, document_type: str, location: str, expires_at: Optional[date]):
+    """Point the driver's document at its stored file"""
+    documents = driver.get("documents") or {}
+    documents[document_type] = location
+    update = {"documents": documents, "updated_at": datetime.utcnow()}
+    if expires_at is not None:
+        document_expiry = compliance.record_expiry(driver.get("document_expiry") or {}, document_type, expires_at)
+        update.update({"document_expiry": document_expiry,
+                       "compliance_check_at": compliance.next_check(document_expiry)})
+    
+    await db.drivers.update_one(
+        {"id": driver["id"]},
+        {"$set": update}
+    )
+
+def save_upload(source, file_path: Path):
+    with open(file_path, "wb") as buffer:
+        shutil.copyfileobj(source, buffer)
+
+async def store_document_file(driver_id: str, document_type: str, file_path: Path) -> Path:
+    """Recompress photos (originals kept in the cold tier), fingerprint identity photos against
+    the fleet's, then encrypt what stays at rest"""
+    file_path, original = await images.normalize_document(file_path, ORIGINALS_DIR, settings.image_format)
+    if original is not None and document_type in fingerprints.IDENTITY_DOCUMENTS:
+        fingerprint = await fingerprints.compute(file_path)
+        if fingerprint is not None:
+            await fingerprint_index.check(driver_id, document_type, fingerprint)
+    if document_vault is not None:
+        for path in filter(None, (file_path, original)):
+            await document_vault.seal(path, driver_id)
+    return file_path
+
 @api_router.post("/drivers/{driver_id}/upload-document")
-async def upload_document(driver_id: str, document_type: str, file: UploadFile = File(...)):
+async def upload_document(driver_id: str, document_type: str, file: UploadFile = File(...),
+                          expires_at: Optional[date] = None):
     """Upload a document for a driver"""
     driver = await db.drivers.find_one({"id": driver_id})
     if not driver:
         raise HTTPException(status_code=404, detail="Livreur non trouvé")
+    check_document(document_type, expires_at)
     
-    # Validate document type
-    valid_document_types = [
-        "identity_card_front", "identity_card_back", "proof_of_residence",
-        "residence_permit", "civil_liability_insurance", "vehicle_insurance", 
-        "vehicle_contract", "kbis_document"
-    ]
-    
-    if document_type not in valid_document_types:
-        raise HTTPException(status_code=400, detail="Type de document invalide")
-    
-    # Create driver-specific upload directory
-    driver_upload_dir = UPLOAD_DIR / driver_id
-    driver_upload_dir.mkdir(exist_ok=True)
-    
-    # Save file
-    file_extension = file.filename.split('.')[-1] if '.' in file.filename else 'jpg'
-    filename = f"{document_type}.{file_extension}"
-    file_path = driver_upload_dir / filename
-    
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-    
-    # Update driver documents
-    documents = driver.get("documents", {})
-    documents[document_type] = str(file_path.relative_to(ROOT_DIR))
+    # Save file (in a thread once the spooled upload is large enough to be on disk)
+    content_type = storage.sniff_type(await file.read(storage.SNIFF_LENGTH))
+    await file.seek(0)
+    file_path = document_path(driver_id, document_type, file.filename, content_type)
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    if document_vault is not None and not await storage.run_io(
+            file.size, images.recompressible, content_type, file.file):
+        # Encrypted as it is written, no plaintext copy
+        await document_vault.write_file(file_path, driver_id, file.file, file.size)
+    else:
+        await storage.run_io(file.size, save_upload, file.file, file_path)
+        file_path = await store_document_file(driver_id, document_type, file_path)
     
-    await db.drivers.update_one(
-        {"id": driver_id},
-        {"$set": {"documents": documents, "updated_at": datetime.utcnow()}}
+    await record_document(driver, document_type, str(file_path.relative_to(ROOT_DIR)), expires_at)
+    return {"message": "Document uploadé avec succès", "filename": file_path.name}
+
+# Resumable uploads (see uploads.py): create a session, PUT chunks at their offset, complete
+async def get_upload_session(driver_id: str, upload_id: str) -> Dict:
+    session = await db.upload_sessions.find_one({"id": upload_id, "driver_id": driver_id}, {"_id": 0})
+    if not session:
+        raise HTTPException(status_code=404, detail="Session d'upload non trouvée")
+    return session
+
+@api_router.post("/drivers/{driver_id}/uploads")
+async def create_upload_session(driver_id: str, body: UploadSessionCreate):
+    """Start a resumable document upload"""
+    if not await db.drivers.find_one({"id": driver_id}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Livreur non trouvé")
+    check_document(body.document_type, body.expires_at)
+    if body.size > uploads.MAX_SIZE:
+        raise HTTPException(status_code=413, detail="Fichier trop volumineux")
+    session = await uploads.create_session(
+        db, UPLOAD_DIR, driver_id, body.document_type, body.filename, body.size,
+        sha256=body.sha256, document_expires_on=body.expires_at,
+    )
+    return uploads.status(session)
+
+@api_router.get("/drivers/{driver_id}/uploads/{upload_id}")
+async def upload_session_status(driver_id: str, upload_id: str):
+    """Where to resume an interrupted upload"""
+    return uploads.status(await get_upload_session(driver_id, upload_id))
+
+@api_router.put("/drivers/{driver_id}/uploads/{upload_id}")
+async def upload_chunk(driver_id: str, upload_id: str, offset: int, request: Request):
+    """Append the request body at ``offset``"""
+    session = await get_upload_session(driver_id, upload_id)
+    try:
+        received = await uploads.write_chunk(db, UPLOAD_DIR, session, offset, request.stream())
+    except uploads.OffsetMismatch as e:
+        raise HTTPException(status_code=409, detail="Décalage incorrect",
+                            headers={"Upload-Offset": str(e.offset)}) from None
+    except uploads.UploadBusy:
+        raise HTTPException(status_code=409, detail="Upload déjà en cours") from None
+    except uploads.TooLarge:
+        raise HTTPException(status_code=413, detail="Fichier trop volumineux") from None
+    return {"id": upload_id, "offset": received, "size": session["size"]}
+
+@api_router.post("/drivers/{driver_id}/uploads/{upload_id}/complete")
+async def complete_upload(driver_id: str, upload_id: str):
+    """Check the assembled file and attach it to the driver"""
+    session = await get_upload_session(driver_id, upload_id)
+    driver = await db.drivers.find_one({"id": driver_id})
+    if not driver:
+        raise HTTPException(status_code=404, detail="Livreur non trouvé")
+    file_path = document_path(driver_id, session["document_type"], session["filename"])
+    try:
+        await uploads.complete(db, UPLOAD_DIR, session, file_path)
+    except uploads.Incomplete:
+        raise HTTPException(status_code=409, detail="Upload incomplet",
+                            headers={"Upload-Offset": str(session["received"])}) from None
+    except uploads.UploadBusy:
+        raise HTTPException(status_code=409, detail="Upload déjà en cours") from None
+    except uploads.ChecksumMismatch:
+        raise HTTPException(status_code=422, detail="Empreinte SHA-256 incorrecte") from None
+    file_path = await store_document_file(driver_id, session["document_type"], file_path)
+
+    expires_on = session.get("document_expires_on")
+    await record_document(driver, session["document_type"], str(file_path.relative_to(ROOT_DIR)),
+                          date.fromisoformat(expires_on) if expires_on else None)
+    return {"message": "Document uploadé avec succès", "filename": file_path.name}
+
+# Direct-to-storage uploads (see storage.py): the bytes never go through the API
+@api_router.post("/drivers/{driver_id}/documents/presign")
+async def presign_document_upload(driver_id: str, body: DirectUploadCreate):
+    """Presigned URL to PUT a document straight to storage"""
+    if not await db.drivers.find_one({"id": driver_id}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Livreur non trouvé")
+    check_document(body.document_type, body.expires_at)
+    if body.content_type not in storage.CONTENT_TYPES:
+        raise HTTPException(status_code=415, detail="Format de fichier non accepté")
+    if body.size > uploads.MAX_SIZE:
+        raise HTTPException(status_code=413, detail="Fichier trop volumineux")
+    return await storage.create_upload(
+        db, document_store, driver_id, body.document_type, body.filename, body.content_type, body.size,
+        body.sha256, document_expires_on=body.expires_at,
     )
-    
-    return {"message": "Document uploadé avec succès", "filename": filename}
+
+@api_router.post("/drivers/{driver_id}/documents/{upload_id}/complete")
+async def complete_document_upload(driver_id: str, upload_id: str):
+    """Check the stored object and attach it to the driver"""
+    upload = await db.direct_uploads.find_one({"id": upload_id, "driver_id": driver_id})
+    if not upload:
+        raise HTTPException(status_code=404, detail="Upload non trouvé")
+    driver = await db.drivers.find_one({"id": driver_id})
+    if not driver:
+        raise HTTPException(status_code=404, detail="Livreur non trouvé")
+    try:
+        stored = await storage.verify(document_store, upload)
+    except storage.UploadRejected as e:
+        await db.direct_uploads.delete_one({"id": upload_id})
+        raise HTTPException(status_code=422, detail=f"Fichier refusé ({e})") from None
+    if stored is None:
+        raise HTTPException(status_code=409, detail="Fichier non reçu")
+    if not await db.direct_uploads.find_one_and_delete({"id": upload_id}):
+        raise HTTPException(status_code=404, detail="Upload non trouvé")
+
+    expires_on = upload.get("document_expires_on")
+    await record_document(driver, upload["document_type"], document_store.locator(upload["key"]),
+                          date.fromisoformat(expires_on) if expires_on else None)
+    return {"message": "Document uploadé avec succès", "size": stored.size, "sha256": stored.sha256}
+
+@api_router.put("/storage/{key:path}")
+async def local_storage_put(key: str, size: int, sha256: str, expires: int, signature: str, request: Request):
+    """Upload target of LocalStorage presigned URLs (development and tests)"""
+    content_type = request.headers.get("content-type", "")
+    if not isinstance(document_store, storage.LocalStorage) or not document_store.check_signature(
+        key, content_type, size, sha256, expires, signature
+    ):
+        raise HTTPException(status_code=403, detail="Signature invalide ou expirée")
+    try:
+        await document_store.put(key, content_type, size, sha256, request.stream())
+    except storage.UploadRejected as e:
+        raise HTTPException(status_code=400, detail=f"Fichier refusé ({e})") from None
+    return {"key": key, "size": size}
 
 @api_router.post("/drivers/{driver_id}/generate-kyc-contract")
 async def generate_kyc_contract(driver_id: str):
@@ -387,40 +542,29 @@ async def generate_kyc_contract(driver_id: str):
     if driver.get("status") != "approved":
         raise HTTPException(status_code=400, detail="Documents non validés")
     
-    # Extraire les données du livreur
-    profile = driver.get("profile", {})
-    business = driver.get("business_info", {})
-    contract_data = driver.get("contract", {})
-    
-    # Template du contrat KYC avec variables
-    contract_template = {
-        "full_name": f"{profile.get('firstname', '')} {profile.get('lastname', '')}",
-        "address": f"{profile.get('street_number', '')} {profile.get('street_name', '')}, {profile.get('postal_code', '')} {profile.get('city', '')}, {profile.get('country', 'France')}",
-        "tax_id": business.get("siret", ""),
-        "vehicle_type": business.get("vehicle_type", "À préciser"),
-        "insurance_provider": business.get("insurance_provider", "À préciser"),
-        "insurance_number": business.get("insurance_number", "À préciser"),
-        "commission_rate": contract_data.get("commission_rate", 15.0),
-        "date": datetime.utcnow().strftime("%d/%m/%Y"),
-        "contract_id": f"PKL-{driver_id[:8].upper()}-{datetime.utcnow().strftime('%Y%m%d')}"
-    }
-    
-    # Marquer le contrat comme généré
-    await db.drivers.update_one(
-        {"id": driver_id},
-        {
-            "$set": {
-                "contract.kyc_contract_generated": True,
-                "contract.kyc_contract_sent_date": datetime.utcnow(),
-                "status": "contract_pending"
-            }
-        }
-    )
-    
+    # Rendu PDF hors de la boucle d'événements, stocké avec son empreinte SHA-256
+    contract_data, stored, update = await contracts.generate_contract(driver, UPLOAD_DIR, ROOT_DIR, document_vault)
+
+    # Marquer le contrat comme généré, sauf si le livreur a changé pendant le rendu
+    outbox = []
+
+    async def write(session):
+        result = await db.drivers.update_one(contracts.contract_filter(driver), {"$set": update}, session=session)
+        if result.matched_count:
+            outbox.append(events.driver_event("driver.kyc_contract_generated", driver_id, document=stored["path"],
+                                              sha256=stored["sha256"]))
+            outbox.extend(events.status_events(driver_id, driver.get("status"), update["status"]))
+        return result.matched_count
+
+    if not await events.commit(db, write, outbox):
+        raise HTTPException(status_code=409, detail="Le livreur a été modifié pendant la génération du contrat")
+
     return {
         "message": "Contrat KYC généré avec succès",
-        "contract_data": contract_template,
-        "status": "contract_sent"
+        "contract_data": contract_data,
+        "document": stored["path"],
+        "sha256": stored["sha256"],
+        "status": update["status"]
     }
 
 @api_router.post("/drivers/{driver_id}/confirm-kyc-signature")
@@ -431,17 +575,61 @@ async def confirm_kyc_signature(driver_id: str):
         raise HTTPException(status_code=404, detail="Livreur non trouvé")
     
     # Marquer le contrat comme signé et reçu
-    await db.drivers.update_one(
-        {"id": driver_id},
-        {
-            "$set": {
-                "contract.kyc_contract_signed": True,
-                "contract.kyc_contract_received_date": datetime.utcnow(),
-                "status": "active"
-            }
-        }
+    contract = dict(driver.get("contract") or {})
+    contract.update({"kyc_contract_signed": True, "kyc_contract_received_date": datetime.utcnow()})
+    await events.commit(
+        db,
+        lambda session: db.drivers.update_one(
+            {"id": driver_id},
+            {"$set": {"contract": contract, "status": "active", "updated_at": datetime.utcnow()}},
+            session=session,
+        ),
+        [events.driver_event("driver.kyc_contract_signed", driver_id)]
+        + events.status_events(driver_id, driver.get("status"), "active"),
     )
-    
+
+    return {"message": "Contrat KYC validé - Compte livreur activé"}
+
+@api_router.get("/drivers/{driver_id}/events")
+async def stream_driver_events(driver_id: str, request: Request):
+    """Flux Server-Sent Events des changements de statut du livreur"""
+    if not await db.drivers.find_one({"id": driver_id}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Livreur non trouvé")
+    try:
+        queue = live_hub.subscribe(driver_id)
+    except live.HubFull:
+        raise HTTPException(status_code=503, detail="Trop de connexions ouvertes", headers={"Retry-After": "5"})
+    return StreamingResponse(
+        live_hub.stream(driver_id, queue, request.headers.get("last-event-id")),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# Live tracking (see tracking.py): points are buffered, written in batches
+@api_router.post("/drivers/{driver_id}/locations", status_code=202,
+                 dependencies=[Depends(require_own_driver)])
+async def report_locations(driver_id: str, batch: LocationBatch):
+    """Record a batch of GPS points of an active driver, sent with their own token"""
+    active = await location_tracker.may_report(driver_id)
+    if active is None:
+        raise HTTPException(status_code=404, detail="Livreur non trouvé")
+    if not active:
+        raise HTTPException(status_code=403, detail="Livreur non actif")
+    try:
+        accepted = location_tracker.add(driver_id, batch.points)
+    except tracking.Overloaded:
+        raise HTTPException(status_code=503, detail="Service surchargé, réessayez plus tard",
+                            headers={"Retry-After": "5"}) from None
+    return {"accepted": accepted}
+
+@api_router.get("/drivers/{driver_id}/location", dependencies=[Depends(require_own_driver_or_admin)])
+async def get_driver_location(driver_id: str):
+    """Latest known position of a driver, for the driver or staff"""
+    position = await location_tracker.position(driver_id)
+    if position is None:
+        raise HTTPException(status_code=404, detail="Position inconnue")
+    return position
+
 @api_router.get("/drivers/{driver_id}/kyc-status")
 async def get_kyc_status(driver_id: str):
     """Récupérer le statut KYC du livreur"""
@@ -449,7 +637,7 @@ async def get_kyc_status(driver_id: str):
     if not driver:
         raise HTTPException(status_code=404, detail="Livreur non trouvé")
     
-    contract = driver.get("contract", {})
+    contract = driver.get("contract") or {}
     
     return {
         "kyc_status": {
@@ -460,7 +648,6 @@ async def get_kyc_status(driver_id: str):
             "account_status": driver.get("status", "pending")
         }
     }
-    return {"message": "Contrat KYC validé - Compte livreur activé"}
 
 @api_router.get("/validate-siret/{siret}")
 async def validate_siret(siret: str):
@@ -510,6 +697,195 @@ async def get_driver_payments(driver_id: str):
     payments = await db.payments.find({"driver_id": driver_id}).to_list(100)
     return [PaymentHistory(**payment) for payment in payments]
 
+@api_router.post("/drivers/{driver_id}/payments", response_model=PaymentHistory,
+                 dependencies=[Depends(require_admin)])
+async def create_driver_payment(driver_id: str, payment_data: PaymentCreate):
+    """Record a completed payment (staff only) and update the driver's ledger totals"""
+    driver = await db.drivers.find_one({"id": driver_id}, {"_id": 1})
+    if not driver:
+        raise HTTPException(status_code=404, detail="Livreur non trouvé")
+    # The status is not the caller's to choose: only completed payments are paid out
+    payment = PaymentHistory(driver_id=driver_id, status="completed", **payment_data.dict())
+    await ledger.record_payment(db, payment.dict())
+    return payment
+
+@api_router.get("/drivers/{driver_id}/payouts")
+async def get_driver_payouts(driver_id: str):
+    """Get the payouts computed for a driver, most recent period first"""
+    return await db.payouts.find({"driver_id": driver_id}, {"_id": 0}).sort("period", -1).to_list(24)
+
+# Authentication
+@api_router.post("/auth/register", status_code=202)
+async def register(credentials: Credentials):
+    """Start the login of an existing driver: a confirmation code is e-mailed to their profile e-mail"""
+    if len(credentials.password) < auth.MIN_PASSWORD_LENGTH:
+        raise HTTPException(status_code=400,
+                            detail=f"Mot de passe trop court ({auth.MIN_PASSWORD_LENGTH} caractères minimum)")
+    driver = await db.drivers.find_one({"profile.email": credentials.email}, {"id": 1, "profile": 1})
+    if not driver:
+        raise HTTPException(status_code=404, detail="Livreur non trouvé")
+    try:
+        token = await auth.request_registration(db, credentials.email, credentials.password, driver["id"])
+    except auth.AccountExists:
+        raise HTTPException(status_code=400, detail="Compte déjà existant")
+    # Only whoever reads the profile mailbox can finish the registration
+    context = {"firstname": driver["profile"].get("firstname", ""), "token": token}
+    await notifications.enqueue(db, [notifications.notification(
+        f"registration:{uuid.uuid4()}", driver["id"], "account_verification", "email",
+        driver["profile"]["email"], context,
+    )])
+    notification_worker.wake()
+    return {"message": "Code de confirmation envoyé par e-mail"}
+
+@api_router.post("/auth/register/confirm")
+async def confirm_registration(confirmation: RegistrationConfirmation):
+    """Create the login once the driver sends back the code e-mailed by /auth/register"""
+    try:
+        credential = await auth.confirm_registration(db, confirmation.token)
+    except auth.AccountExists:
+        raise HTTPException(status_code=400, detail="Compte déjà existant")
+    if credential is None:
+        raise HTTPException(status_code=400, detail="Code de confirmation invalide ou expiré")
+    return token_service.issue_for(credential)
+
+@api_router.post("/auth/login")
+async def login(credentials: Credentials):
+    credential = await auth.authenticate(db, credentials.email, credentials.password)
+    if not credential:
+        raise HTTPException(status_code=401, detail="Identifiants invalides")
+    return token_service.issue_for(credential)
+
+@api_router.get("/auth/me")
+async def get_current_account(claims: Dict = Depends(require_user)):
+    return {"id": claims["sub"], "role": claims["role"], "driver_id": claims.get("driver_id")}
+
+# Admin Routes
+@api_router.get("/admin/drivers/search", dependencies=[Depends(require_admin)])
+async def search_drivers(q: str, limit: int = 20):
+    """Rechercher un livreur par nom, e-mail, téléphone ou SIRET"""
+    if len(q.strip()) < search.MIN_QUERY_LENGTH:
+        raise HTTPException(status_code=400, detail="Recherche trop courte (2 caractères minimum)")
+    return await search.search_drivers(db, q, min(max(limit, 1), 100))
+
+@api_router.put("/admin/drivers/{driver_id}/commission-rate", dependencies=[Depends(require_admin)])
+async def set_commission_rate(driver_id: str, rate: CommissionRate):
+    """Fixer le taux de commission d'un livreur, appliqué aux prochains versements"""
+    update = {"updated_at": datetime.utcnow()}
+    outbox = []
+
+    async def write(session):
+        result = await db.drivers.update_one(
+            {"id": driver_id, "contract": {"$ne": None}},
+            {"$set": {**update, "contract.commission_rate": rate.commission_rate}}, session=session,
+        )
+        if not result.matched_count:
+            contract = DriverContract(commission_rate=rate.commission_rate).dict()
+            result = await db.drivers.update_one(
+                {"id": driver_id, "contract": None}, {"$set": {**update, "contract": contract}}, session=session
+            )
+        if result.matched_count:
+            outbox.append(events.driver_event("driver.updated", driver_id, fields=["contract"]))
+        return result.matched_count
+
+    if not await events.commit(db, write, outbox):
+        raise HTTPException(status_code=404, detail="Livreur non trouvé")
+    return rate
+
+@api_router.post("/admin/kyc-contracts/generate", dependencies=[Depends(require_admin)])
+async def generate_pending_kyc_contracts():
+    """Générer en lot les contrats KYC de tous les livreurs nouvellement approuvés"""
+    return await contracts.generate_pending_contracts(db, UPLOAD_DIR, ROOT_DIR, vault=document_vault)
+
+@api_router.get("/admin/funnel", dependencies=[Depends(require_admin)])
+async def get_registration_funnel(start: Optional[date] = None, end: Optional[date] = None,
+                                  city: Optional[str] = None):
+    """Entonnoir d'inscription (30 derniers jours par défaut), calculé sur les agrégats quotidiens"""
+    end = end or datetime.utcnow().date()
+    start = start or end - timedelta(days=29)
+    if start > end:
+        raise HTTPException(status_code=400, detail="Période invalide")
+    report = analytics.funnel(await analytics.load_days(db, start, end), city)
+    return {"start": start.isoformat(), "end": end.isoformat(), "city": city, **report}
+
+@api_router.get("/admin/drivers/{driver_id}/documents/{document_type}", dependencies=[Depends(require_admin)])
+async def download_document(driver_id: str, document_type: str):
+    """Stream a stored document, decrypted on the fly"""
+    driver = await db.drivers.find_one({"id": driver_id}, {"documents": 1})
+    location = ((driver or {}).get("documents") or {}).get(document_type)
+    if not location:
+        raise HTTPException(status_code=404, detail="Document non trouvé")
+    if "://" in location:
+        raise HTTPException(status_code=404, detail="Document stocké hors du serveur")
+    path = ROOT_DIR / location
+    if not path.is_file():
+        raise HTTPException(status_code=404, detail="Document non trouvé")
+    media_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+    return StreamingResponse(vault.read_document(path, document_vault), media_type=media_type)
+
+@api_router.get("/admin/drivers/{driver_id}/dossier.zip", dependencies=[Depends(require_admin)])
+async def export_driver_dossier(driver_id: str):
+    """Documents, contract and manifest of a driver, zipped on the fly (see dossiers.py)"""
+    driver = await db.drivers.find_one({"id": driver_id}, {"_id": 0})
+    if not driver:
+        raise HTTPException(status_code=404, detail="Livreur non trouvé")
+
+    async def one():
+        yield driver
+
+    return StreamingResponse(
+        dossiers.stream_dossiers(one(), ROOT_DIR, document_vault), media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="dossier-{driver_id}.zip"'},
+    )
+
+@api_router.get("/admin/dossiers.zip", dependencies=[Depends(require_admin)])
+async def export_city_dossiers(city: str, status: Optional[str] = None):
+    """Dossiers of every driver of a city, zipped on the fly"""
+    query = {"profile.city": city}
+    if status:
+        query["status"] = status
+    if not await db.drivers.find_one(query, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Aucun livreur trouvé")
+    drivers = db.drivers.find(query, {"_id": 0}).batch_size(100)
+    filename = f"dossiers-{datetime.utcnow().date().isoformat()}.zip"
+    return StreamingResponse(
+        dossiers.stream_dossiers(drivers, ROOT_DIR, document_vault), media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+@api_router.get("/admin/drivers/{driver_id}/similar-documents", dependencies=[Depends(require_admin)])
+async def get_similar_documents(driver_id: str):
+    """Identity documents of other drivers that look like this driver's (see fingerprints.py)"""
+    if not await db.drivers.find_one({"id": driver_id}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Livreur non trouvé")
+    results = await fingerprint_index.similar(driver_id)
+    others = {result["similar_to"]["driver_id"] for result in results}
+    profiles = {
+        driver["id"]: driver.get("profile") or {}
+        async for driver in db.drivers.find({"id": {"$in": list(others)}},
+                                            {"_id": 0, "id": 1, "profile.firstname": 1, "profile.lastname": 1})
+    }
+    # Fingerprints of deleted drivers are left out
+    return [
+        {**result, "similar_to": {**result["similar_to"], "profile": profiles[result["similar_to"]["driver_id"]]}}
+        for result in results if result["similar_to"]["driver_id"] in profiles
+    ]
+
+@api_router.get("/admin/locations", dependencies=[Depends(require_admin)])
+async def get_driver_locations(minutes: int = 5):
+    """Latest positions of the drivers that reported in the last ``minutes`` (dispatch map)"""
+    since = datetime.utcnow() - timedelta(minutes=min(max(minutes, 1), 24 * 60))
+    return await location_tracker.recent_positions(since)
+
+@api_router.get("/admin/events/metrics", dependencies=[Depends(require_admin)])
+async def get_event_metrics():
+    """Outbox consumer positions and lag per sink"""
+    return await outbox_dispatcher.metrics(db)
+
+@api_router.get("/admin/notifications/metrics", dependencies=[Depends(require_admin)])
+async def get_notification_metrics():
+    """Notifications par canal et par statut (pending, sent, dead...)"""
+    return await notification_worker.metrics(db)
+
 # General Routes
 @api_router.get("/")
 async def root():
@@ -519,24 +895,187 @@ async def root():
 async def health_check():
     return {"status": "healthy", "timestamp": datetime.utcnow()}
 
-# Include the router in the main app
-app.include_router(api_router)
+# Token-bucket rate limits per client IP, and per client and driver id too when the route has one
+RATE_LIMITS = [
+    RouteLimit.per_minute("validate-siret", "GET", r"/api/validate-siret/[^/]+", burst=30, per_minute=60),
+    RouteLimit.per_minute("create-driver", "POST", r"/api/drivers", burst=20, per_minute=20),
+    RouteLimit.per_minute("login", "POST", r"/api/auth/(login|register)", burst=10, per_minute=10),
+    RouteLimit.per_minute("confirm-registration", "POST", r"/api/auth/register/confirm", burst=10, per_minute=10),
+    RouteLimit.per_minute(
+        "upload-document", "POST", r"/api/drivers/(?P<driver_id>[^/]+)/upload-document", burst=20, per_minute=30
+    ),
+    RouteLimit.per_minute(
+        "upload-session", "POST", r"/api/drivers/(?P<driver_id>[^/]+)/uploads", burst=20, per_minute=30
+    ),
+    RouteLimit.per_minute(
+        "driver-locations", "POST", r"/api/drivers/(?P<driver_id>[^/]+)/locations", burst=30, per_minute=120
+    ),
+    RouteLimit.per_minute(
+        "presign-document", "POST", r"/api/drivers/(?P<driver_id>[^/]+)/documents/presign", burst=20, per_minute=30
+    ),
+]
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_credentials=True,
-    allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+# Background workers, built by create_app()
+idempotency_store: Optional[IdempotencyStore] = None
+rate_limit_backend = None
+scheduler: Optional[Scheduler] = None
+notification_worker: Optional[notifications.NotificationWorker] = None
+outbox_dispatcher: Optional[events.OutboxDispatcher] = None
+live_hub: Optional[live.DriverEventHub] = None
+location_tracker: Optional[tracking.LocationTracker] = None
+
+
+def _build_workers(app_settings: Settings):
+    global idempotency_store, rate_limit_backend, scheduler, notification_worker
+    global outbox_dispatcher, live_hub, location_tracker
+    idempotency_store = IdempotencyStore(lambda: db)
+    rate_limit_backend = MongoBackend(lambda: db) if app_settings.rate_limit_backend == 'mongo' else InMemoryBackend()
+
+    # Background jobs (one worker runs each occurrence, see jobs.py)
+    scheduler = Scheduler(lambda: db)
+    scheduler.daily("ledger-reconciliation", time(3, 0), ledger.reconcile)
+    scheduler.daily("payouts", time(2, 0), payouts.scheduled_run)
+    scheduler.daily("compliance-sweep", time(6, 0), compliance.sweep)
+    scheduler.every(
+        "kyc-contracts", 15 * 60,
+        lambda db: contracts.generate_pending_contracts(db, UPLOAD_DIR, ROOT_DIR, vault=document_vault),
+    )
+    scheduler.every("upload-sessions-sweep", 60 * 60, lambda db: uploads.sweep(db, UPLOAD_DIR))
+    scheduler.daily("outbox-prune", time(4, 0), lambda db: outbox_dispatcher.prune(db))
+
+    # Driver lifecycle events: outbox tailed by one dispatcher (see events.py)
+    notification_worker = notifications.NotificationWorker(
+        lambda: db, notifications.providers_from_env(app_settings.root_dir, document_vault)
+    )
+    event_sinks = [
+        notifications.NotificationSink(lambda: db, on_queued=notification_worker.wake),
+        analytics.RollupSink(lambda: db),
+    ]
+    if app_settings.outbox_file:
+        event_sinks.append(events.FileSink(app_settings.outbox_file))
+    if app_settings.outbox_webhook_url:
+        event_sinks.append(events.WebhookSink(app_settings.outbox_webhook_url))
+    outbox_dispatcher = events.OutboxDispatcher(lambda: db, event_sinks)
+
+    # Dashboard live updates: one outbox feed per worker, fanned out by driver id
+    live_hub = live.DriverEventHub(
+        lambda: db,
+        max_subscribers=app_settings.live_max_subscribers,
+        per_driver=app_settings.live_max_per_driver,
+    )
+
+    # GPS points of active drivers, buffered and written in batches (see tracking.py)
+    location_tracker = tracking.LocationTracker(lambda: db)
+
+
+async def create_indexes():
+    await idempotency_store.ensure_indexes()
+    if isinstance(rate_limit_backend, MongoBackend):
+        await rate_limit_backend.ensure_indexes()
+    await ledger.ensure_indexes(db)
+    await payouts.ensure_indexes(db)
+    await events.ensure_indexes(db)
+    await notifications.ensure_indexes(db)
+    await search.ensure_indexes(db)
+    await geo.ensure_indexes(db)
+    await analytics.ensure_indexes(db)
+    await compliance.ensure_indexes(db)
+    await uploads.ensure_indexes(db)
+    await storage.ensure_indexes(db)
+    if document_vault is not None:
+        await document_vault.keys.ensure_indexes()
+    await fingerprint_index.ensure_indexes()
+    await location_tracker.ensure_indexes()
+    await auth.ensure_indexes(db)
+    await db.drivers.create_index("id")
+
+
+async def load_fingerprints():
+    await fingerprint_index.load()
+
+
+async def start_background_jobs():
+    await events.detect_transactions(db)
+    scheduler.start()
+    outbox_dispatcher.start()
+    live_hub.start()
+    notification_worker.start()
+    location_tracker.start()
+
+
+async def shutdown():
+    await scheduler.stop()
+    await outbox_dispatcher.stop()
+    await live_hub.stop()
+    await notification_worker.stop()
+    await location_tracker.stop()
+    contracts.shutdown_pool()
+    images.shutdown_pool()
+    auth.shutdown_pool()
+    if isinstance(db, LazyDatabase):
+        db.close()
+
+
+def create_app(app_settings: Optional[Settings] = None) -> FastAPI:
+    """Build the API for ``app_settings`` (default: ``Settings.from_env()``).
+
+    One app per process: the routes read the module-level handles set here.
+    """
+    global settings, db, ROOT_DIR, UPLOAD_DIR, ORIGINALS_DIR, document_store, document_vault, token_service
+    global fingerprint_index
+    settings = app_settings or Settings.from_env()
+    db = LazyDatabase(settings.mongo_url, settings.db_name)
+    ROOT_DIR, UPLOAD_DIR = settings.root_dir, settings.upload_dir
+    ORIGINALS_DIR = settings.originals_dir or settings.root_dir / "originals"
+    document_store = storage.storage_from_settings(settings)
+    document_vault = vault.vault_from_settings(lambda: db, settings)
+    fingerprint_index = fingerprints.FingerprintIndex(lambda: db)
+    token_service = auth.TokenService.from_env(development=settings.environment == "development")
+    _build_workers(settings)
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    # Create the main app without a prefix
+    application = FastAPI()
+    application.include_router(api_router)
+
+    # Replay stored responses for client retries carrying an Idempotency-Key
+    application.add_middleware(
+        IdempotencyMiddleware,
+        store=idempotency_store,
+        paths=[
+            r"/api/drivers",
+            r"/api/drivers/[^/]+/upload-document",
+            r"/api/courses/[^/]+/apply",
+        ],
+    )
+    application.add_middleware(
+        RateLimitMiddleware,
+        limits=RATE_LIMITS,
+        backend=rate_limit_backend,
+        trust_forwarded=settings.rate_limit_trust_forwarded,
+    )
+    application.add_middleware(
+        CORSMiddleware,
+        allow_credentials=True,
+        allow_origins=list(settings.cors_origins),
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+
+    application.add_event_handler("startup", create_indexes)
+    application.add_event_handler("startup", load_fingerprints)
+    application.add_event_handler("startup", start_background_jobs)
+    application.add_event_handler("shutdown", shutdown)
+    return application
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-logger = logging.getLogger(__name__)
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+def __getattr__(name):
+    # ``server:app`` (uvicorn, local_stack) builds the app from the environment on first access
+    if name == "app":
+        globals()["app"] = create_app()
+        return globals()["app"]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,67 @@
+"""Application settings, read once by whoever builds the app.
+
+Importing this module reads nothing: ``Settings.from_env()`` loads the
+optional ``.env`` file and the environment when it is called, so tests and
+CLIs can build a ``Settings`` by hand and never need a live environment.
+"""
+import os
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional, Tuple
+
+BACKEND_DIR = Path(__file__).parent
+
+
+@dataclass(frozen=True)
+class Settings:
+    mongo_url: Optional[str] = None
+    db_name: str = "pikkles"
+    # Stored document paths are relative to root_dir
+    root_dir: Path = BACKEND_DIR
+    upload_dir: Path = BACKEND_DIR / "uploads"
+    environment: str = "production"  # or "development": JWT_SECRET becomes optional
+    cors_origins: Tuple[str, ...] = ("*",)
+    rate_limit_backend: str = "memory"  # or "mongo", shared by every worker
+    rate_limit_trust_forwarded: bool = False
+    outbox_file: Optional[Path] = None
+    outbox_webhook_url: Optional[str] = None
+    live_max_subscribers: int = 1000
+    live_max_per_driver: int = 5
+    storage_backend: str = "local"  # or "s3": documents uploaded straight to the bucket
+    s3_bucket: Optional[str] = None
+    s3_endpoint_url: Optional[str] = None  # S3-compatible stores (MinIO, R2, ...)
+    s3_region: Optional[str] = None
+    storage_secret: Optional[str] = None  # signs LocalStorage upload URLs
+    originals_dir: Optional[Path] = None  # cold tier for original photos, default root_dir/originals
+    image_format: str = "jpeg"  # or "webp", for recompressed photos
+    document_master_key: Optional[str] = None  # base64 AES-256 key wrapping the per-driver document keys
+
+    @classmethod
+    def from_env(cls, env_file: Optional[Path] = BACKEND_DIR / ".env") -> "Settings":
+        if env_file is not None:
+            from dotenv import load_dotenv
+            load_dotenv(env_file)
+        env = os.environ
+        root_dir = Path(env.get("ROOT_DIR", BACKEND_DIR))
+        return cls(
+            mongo_url=env.get("MONGO_URL"),
+            db_name=env.get("DB_NAME", cls.db_name),
+            root_dir=root_dir,
+            upload_dir=Path(env.get("UPLOAD_DIR", root_dir / "uploads")),
+            environment=env.get("APP_ENV", cls.environment),
+            cors_origins=tuple(env.get("CORS_ORIGINS", "*").split(",")),
+            rate_limit_backend=env.get("RATE_LIMIT_BACKEND", cls.rate_limit_backend),
+            rate_limit_trust_forwarded=env.get("RATE_LIMIT_TRUST_FORWARDED", "0") == "1",
+            outbox_file=Path(env["OUTBOX_FILE"]) if env.get("OUTBOX_FILE") else None,
+            outbox_webhook_url=env.get("OUTBOX_WEBHOOK_URL") or None,
+            live_max_subscribers=int(env.get("LIVE_MAX_SUBSCRIBERS", cls.live_max_subscribers)),
+            live_max_per_driver=int(env.get("LIVE_MAX_PER_DRIVER", cls.live_max_per_driver)),
+            storage_backend=env.get("STORAGE_BACKEND", cls.storage_backend),
+            s3_bucket=env.get("S3_BUCKET"),
+            s3_endpoint_url=env.get("S3_ENDPOINT_URL") or None,
+            s3_region=env.get("S3_REGION") or None,
+            storage_secret=env.get("STORAGE_SECRET") or None,
+            originals_dir=Path(env["ORIGINALS_DIR"]) if env.get("ORIGINALS_DIR") else None,
+            image_format=env.get("IMAGE_FORMAT", cls.image_format),
+            document_master_key=env.get("DOCUMENT_MASTER_KEY") or None,
+        )
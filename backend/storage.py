@@ -0,0 +1,333 @@
+"""Document storage and direct-to-storage uploads.
+
+Instead of streaming document bytes through an API worker, a client asks
+for a presigned PUT URL, sends the file straight to the object store and
+then reports completion:
+
+    POST /api/drivers/{id}/documents/presign    -> {"id", "url", "method", "headers"}
+    PUT  <url>                                   bytes, to the store
+    POST /api/drivers/{id}/documents/{upload}/complete
+
+The URL is signed for one key, content type, length and SHA-256, and
+expires after ``PRESIGN_TTL``. Completing checks the stored object
+against what was announced (size and SHA-256 from its metadata, type from
+its first bytes) before the document is recorded; a bad object is
+deleted. The API only ever reads metadata and a few magic bytes.
+
+``S3Storage`` talks to any S3-compatible store; it signs the
+``x-amz-checksum-sha256`` header, so the store itself rejects a body that
+does not match, and reports the checksum back on ``HEAD``. boto3 is
+imported and its client built on first use. ``LocalStorage`` is the
+stand-in for tests and development: it keeps objects under the upload
+directory and its URLs point at ``PUT /api/storage/{key}``, signed with
+an HMAC.
+
+Pending uploads live in ``direct_uploads`` until completed, or until a
+TTL index drops them a day after their URL expired.
+"""
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import secrets
+import time
+import uuid
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import AsyncIterator, Callable, Dict, NamedTuple, Optional
+from urllib.parse import quote, urlencode
+
+logger = logging.getLogger(__name__)
+
+PRESIGN_TTL = timedelta(minutes=15)
+PENDING_RETENTION = timedelta(days=1)
+
+# Accepted document types and the magic bytes that identify them
+CONTENT_TYPES = {
+    "application/pdf": (b"%PDF-",),
+    "image/jpeg": (b"\xff\xd8\xff",),
+    "image/png": (b"\x89PNG\r\n\x1a\n",),
+    "image/webp": (b"RIFF",),
+}
+EXTENSIONS = {"application/pdf": "pdf", "image/jpeg": "jpg", "image/png": "png", "image/webp": "webp"}
+SNIFF_LENGTH = 16
+INLINE_IO_SIZE = 1024 * 1024  # Starlette keeps uploaded files up to this size in memory
+
+
+class ObjectInfo(NamedTuple):
+    size: int
+    content_type: Optional[str]
+    sha256: Optional[str]  # hex
+
+
+class UploadRejected(Exception):
+    """The stored object does not match the announced upload."""
+
+
+def sniff_type(head: bytes) -> Optional[str]:
+    """Content type recognised from the first bytes of a file."""
+    for content_type, signatures in CONTENT_TYPES.items():
+        if any(head.startswith(signature) for signature in signatures):
+            if content_type == "image/webp" and head[8:12] != b"WEBP":
+                continue
+            return content_type
+    return None
+
+
+async def run_io(size: Optional[int], func: Callable, *args):
+    """``func(*args)`` on the event loop for files up to ``INLINE_IO_SIZE``, in a thread beyond.
+
+    Reading or writing a small file through the page cache takes well under
+    a millisecond, less than the thread hop costs once the loop is busy
+    (benchmarks/load_bench.py); Starlette's ``UploadFile`` draws the same line
+    for files spooled in memory.
+    """
+    if size is not None and size <= INLINE_IO_SIZE:
+        return func(*args)
+    return await asyncio.to_thread(func, *args)
+
+
+class Storage:
+    """Object store holding driver documents."""
+
+    def presign_put(self, key: str, content_type: str, size: int, sha256: str,
+                    expires_in: timedelta = PRESIGN_TTL) -> Dict:
+        """``{"url", "method", "headers"}`` letting a client store exactly this object."""
+        raise NotImplementedError
+
+    async def stat(self, key: str) -> Optional[ObjectInfo]:
+        raise NotImplementedError
+
+    async def read_head(self, key: str, length: int = SNIFF_LENGTH) -> bytes:
+        raise NotImplementedError
+
+    async def delete(self, key: str):
+        raise NotImplementedError
+
+    def locator(self, key: str) -> str:
+        """What ``DriverDocuments`` records for an object."""
+        raise NotImplementedError
+
+
+class LocalStorage(Storage):
+    """Objects as files under ``root``, uploaded through ``PUT /api/storage/{key}``."""
+
+    def __init__(self, root: Path, root_dir: Path, secret: Optional[str] = None,
+                 url_prefix: str = "/api/storage"):
+        self.root = root
+        self.root_dir = root_dir
+        self.url_prefix = url_prefix
+        if not secret:
+            logger.warning("STORAGE_SECRET is not set: local upload URLs are signed with a per-process secret")
+            secret = secrets.token_urlsafe(32)
+        self._secret = secret.encode()
+
+    def path(self, key: str) -> Path:
+        path = (self.root / key).resolve()
+        if not path.is_relative_to(self.root.resolve()):
+            raise ValueError(f"Invalid key {key!r}")
+        return path
+
+    def _signature(self, key: str, content_type: str, size: int, sha256: str, expires: int) -> str:
+        message = "\n".join((key, content_type, str(size), sha256, str(expires))).encode()
+        return hmac.new(self._secret, message, hashlib.sha256).hexdigest()
+
+    def presign_put(self, key, content_type, size, sha256, expires_in=PRESIGN_TTL):
+        expires = int(time.time() + expires_in.total_seconds())
+        query = urlencode({"size": size, "sha256": sha256, "expires": expires,
+                           "signature": self._signature(key, content_type, size, sha256, expires)})
+        return {
+            "url": f"{self.url_prefix}/{quote(key)}?{query}",
+            "method": "PUT",
+            "headers": {"Content-Type": content_type},
+        }
+
+    def check_signature(self, key: str, content_type: str, size: int, sha256: str, expires: int,
+                        signature: str) -> bool:
+        expected = self._signature(key, content_type, size, sha256, expires)
+        return expires >= time.time() and hmac.compare_digest(expected, signature)
+
+    async def put(self, key: str, content_type: str, size: int, sha256: str,
+                  chunks: AsyncIterator[bytes]) -> ObjectInfo:
+        """Store a signed upload; like S3, the object is only kept if it matches ``size`` and ``sha256``."""
+        path = self.path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+        digest, written = hashlib.sha256(), 0
+        try:
+            with open(tmp, "wb") as f:
+                async for data in chunks:
+                    written += len(data)
+                    if written > size:
+                        raise UploadRejected("size")
+                    digest.update(data)
+                    await asyncio.to_thread(f.write, data)
+            if written != size or digest.hexdigest() != sha256:
+                raise UploadRejected("checksum")
+            path.with_name(path.name + ".json").write_text(json.dumps({"content_type": content_type}))
+            os.replace(tmp, path)
+        finally:
+            tmp.unlink(missing_ok=True)
+        return ObjectInfo(size, content_type, sha256)
+
+    def _stat(self, key: str) -> Optional[ObjectInfo]:
+        path = self.path(key)
+        if not path.is_file():
+            return None
+        digest = hashlib.sha256()  # hashlib.file_digest is Python 3.11+
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+        sha256 = digest.hexdigest()
+        meta = path.with_name(path.name + ".json")
+        content_type = json.loads(meta.read_text())["content_type"] if meta.exists() else None
+        return ObjectInfo(path.stat().st_size, content_type, sha256)
+
+    async def stat(self, key):
+        return await asyncio.to_thread(self._stat, key)
+
+    async def read_head(self, key, length=SNIFF_LENGTH):
+        with open(self.path(key), "rb") as f:
+            return f.read(length)
+
+    async def delete(self, key):
+        path = self.path(key)
+        path.unlink(missing_ok=True)
+        path.with_name(path.name + ".json").unlink(missing_ok=True)
+
+    def locator(self, key):
+        return str(self.path(key).relative_to(self.root_dir.resolve()))
+
+
+class S3Storage(Storage):
+    """S3-compatible bucket (AWS, MinIO, R2, ...); credentials come from the usual boto3 chain."""
+
+    def __init__(self, bucket: str, endpoint_url: Optional[str] = None, region: Optional[str] = None,
+                 prefix: str = "documents/"):
+        self.bucket = bucket
+        self.endpoint_url = endpoint_url
+        self.region = region
+        self.prefix = prefix
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            import boto3
+            from botocore.config import Config
+
+            self._client = boto3.client(
+                "s3", endpoint_url=self.endpoint_url, region_name=self.region,
+                config=Config(signature_version="s3v4"),
+            )
+        return self._client
+
+    def presign_put(self, key, content_type, size, sha256, expires_in=PRESIGN_TTL):
+        checksum = base64.b64encode(bytes.fromhex(sha256)).decode()
+        url = self.client.generate_presigned_url(
+            "put_object",
+            Params={"Bucket": self.bucket, "Key": self.prefix + key, "ContentType": content_type,
+                    "ContentLength": size, "ChecksumSHA256": checksum},
+            ExpiresIn=int(expires_in.total_seconds()),
+        )
+        return {
+            "url": url,
+            "method": "PUT",
+            "headers": {"Content-Type": content_type, "x-amz-checksum-sha256": checksum},
+        }
+
+    async def stat(self, key):
+        from botocore.exceptions import ClientError
+
+        try:
+            head = await asyncio.to_thread(
+                self.client.head_object, Bucket=self.bucket, Key=self.prefix + key, ChecksumMode="ENABLED"
+            )
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+        checksum = head.get("ChecksumSHA256")
+        return ObjectInfo(
+            head["ContentLength"],
+            head.get("ContentType"),
+            base64.b64decode(checksum).hex() if checksum else None,
+        )
+
+    async def read_head(self, key, length=SNIFF_LENGTH):
+        response = await asyncio.to_thread(
+            self.client.get_object, Bucket=self.bucket, Key=self.prefix + key, Range=f"bytes=0-{length - 1}"
+        )
+        return await asyncio.to_thread(response["Body"].read)
+
+    async def delete(self, key):
+        await asyncio.to_thread(self.client.delete_object, Bucket=self.bucket, Key=self.prefix + key)
+
+    def locator(self, key):
+        return f"s3://{self.bucket}/{self.prefix}{key}"
+
+
+def storage_from_settings(settings) -> Storage:
+    if settings.storage_backend == "s3":
+        return S3Storage(settings.s3_bucket, settings.s3_endpoint_url, settings.s3_region)
+    return LocalStorage(settings.upload_dir, settings.root_dir, settings.storage_secret)
+
+
+# --- Direct uploads ----------------------------------------------------------
+
+async def ensure_indexes(db):
+    await db.direct_uploads.create_index("id", unique=True)
+    await db.direct_uploads.create_index("expires_at", expireAfterSeconds=int(PENDING_RETENTION.total_seconds()))
+
+
+def object_key(driver_id: str, document_type: str, upload_id: str, filename: str) -> str:
+    # A new key per upload: the current document stays in place until the new one is verified
+    extension = filename.rsplit(".", 1)[-1].lower() if "." in filename else "bin"
+    return f"{driver_id}/{document_type}-{upload_id[:8]}.{extension}"
+
+
+async def create_upload(db, store: Storage, driver_id: str, document_type: str, filename: str,
+                        content_type: str, size: int, sha256: str,
+                        document_expires_on: Optional[date] = None, now: Optional[datetime] = None) -> Dict:
+    """Record a pending upload and presign its URL."""
+    now = now or datetime.utcnow()
+    upload_id = str(uuid.uuid4())
+    key = object_key(driver_id, document_type, upload_id, filename)
+    presigned = store.presign_put(key, content_type, size, sha256)
+    await db.direct_uploads.insert_one({
+        "id": upload_id,
+        "driver_id": driver_id,
+        "document_type": document_type,
+        "key": key,
+        "content_type": content_type,
+        "size": size,
+        "sha256": sha256,
+        "document_expires_on": document_expires_on.isoformat() if document_expires_on else None,
+        "expires_at": now + PRESIGN_TTL,
+        "created_at": now,
+    })
+    return {"id": upload_id, **presigned, "expires_at": now + PRESIGN_TTL}
+
+
+async def verify(store: Storage, upload: Dict) -> Optional[ObjectInfo]:
+    """The stored object if it matches ``upload``; None if it has not arrived.
+
+    Raises ``UploadRejected`` and deletes the object when it does not match.
+    """
+    info = await store.stat(upload["key"])
+    if info is None:
+        return None
+    problem = None
+    if info.size != upload["size"]:
+        problem = "size"
+    elif info.sha256 != upload["sha256"]:
+        problem = "checksum"
+    elif sniff_type(await store.read_head(upload["key"])) != upload["content_type"]:
+        problem = "content type"
+    if problem:
+        await store.delete(upload["key"])
+        raise UploadRejected(problem)
+    return info
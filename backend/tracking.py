@@ -0,0 +1,242 @@
+"""Live positions of active drivers, for dispatch.
+
+Drivers in ``active`` status send their GPS fixes in batches:
+
+    POST /api/drivers/{id}/locations   {"points": [{"lat", "lng", "recorded_at", ...}]}
+    GET  /api/drivers/{id}/location    latest position
+    GET  /api/admin/locations          latest positions of every reporting driver (dispatch map)
+
+A request does not write to the database. ``LocationTracker.add`` appends
+its points to an in-memory buffer, which a background task writes with
+one unordered ``insert_many`` once it holds ``BATCH_SIZE`` points, or every
+``FLUSH_INTERVAL`` seconds. Thousands of points then cost a handful of
+round trips, and a request costs its parsing plus a list append: a
+worker takes in 17,000 points/s in batches of 10 and over 25,000 in
+batches of 50 or more, flushes aside (benchmarks/location_bench.py). If
+the database is too slow or down and
+the buffer passes ``MAX_BUFFERED`` points, requests get a 503 with
+``Retry-After``: phones keep their points and send them again. A crashing
+worker loses at most a flush interval of points; stopping flushes.
+
+History goes to ``driver_locations``, a time-series collection
+(``recorded_at`` time field, ``driver_id`` meta field, so MongoDB buckets
+each driver's points together) kept for ``RETENTION``. Servers without
+time series (MongoDB < 5.0, mongomock) get a plain collection holding the
+same documents.
+
+The latest position is served from memory: each worker keeps, in
+``latest``, the newest point of every driver it received points from.
+Each flush also upserts the newest point per driver into
+``driver_positions``, for the workers that did not receive it: a read
+falls back there when the local point is older than ``FRESHNESS``.
+
+Only ``active`` drivers may report. That status is cached per worker for
+``STATUS_TTL``, so a suspended driver may still report for a minute.
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Iterable, List, Optional
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, CollectionInvalid, OperationFailure
+
+logger = logging.getLogger(__name__)
+
+COLLECTION = "driver_locations"
+BATCH_SIZE = 5000
+FLUSH_INTERVAL = 1.0
+MAX_BUFFERED = 100_000
+RETENTION = timedelta(days=90)
+FRESHNESS = timedelta(seconds=10)
+STATUS_TTL = 60.0
+MAX_CLOCK_SKEW = timedelta(minutes=5)
+REPORTING_STATUS = "active"
+DUPLICATE_KEY = 11000
+
+
+class Overloaded(Exception):
+    """The buffer is full: the database is not keeping up."""
+
+
+def _utc(moment: datetime) -> datetime:
+    # Stored naive UTC, like every other date of the API
+    return moment.astimezone(timezone.utc).replace(tzinfo=None) if moment.tzinfo else moment
+
+
+def location_document(driver_id: str, point, received_at: datetime) -> Dict:
+    document = {
+        "recorded_at": _utc(point.recorded_at),
+        "driver_id": driver_id,
+        "location": {"type": "Point", "coordinates": [point.lng, point.lat]},
+        "received_at": received_at,
+    }
+    for field in ("accuracy", "speed", "heading"):
+        value = getattr(point, field)
+        if value is not None:
+            document[field] = value
+    return document
+
+
+def public_position(document: Dict) -> Dict:
+    longitude, latitude = document["location"]["coordinates"]
+    position = {"driver_id": document["driver_id"], "lat": latitude, "lng": longitude,
+                "recorded_at": document["recorded_at"]}
+    position.update({field: document[field] for field in ("accuracy", "speed", "heading") if field in document})
+    return position
+
+
+class LocationTracker:
+    def __init__(self, get_db: Callable, batch_size: int = BATCH_SIZE, flush_interval: float = FLUSH_INTERVAL,
+                 max_buffered: int = MAX_BUFFERED):
+        self._get_db = get_db
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffered = max_buffered
+        self.latest: Dict[str, Dict] = {}  # driver id -> newest point received by this worker
+        self._buffer: List[Dict] = []
+        self._active: Dict[str, float] = {}  # driver id -> active until (monotonic)
+        self._flush_lock = asyncio.Lock()
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._running = False
+        self.received = 0
+        self.written = 0
+
+    async def ensure_indexes(self):
+        db = self._get_db()
+        try:
+            await db.create_collection(
+                COLLECTION,
+                timeseries={"timeField": "recorded_at", "metaField": "driver_id", "granularity": "seconds"},
+                expireAfterSeconds=int(RETENTION.total_seconds()),
+            )
+        except CollectionInvalid:
+            pass  # already there
+        except (OperationFailure, NotImplementedError):
+            logger.warning("Time-series collections unavailable: %s is a plain collection", COLLECTION)
+        await db[COLLECTION].create_index([("driver_id", 1), ("recorded_at", -1)])
+        await db.driver_positions.create_index("driver_id", unique=True)
+
+    async def may_report(self, driver_id: str) -> Optional[bool]:
+        """Whether a driver is active (cached ``STATUS_TTL`` when it is); None for an unknown driver."""
+        if self._active.get(driver_id, 0.0) > time.monotonic():
+            return True
+        driver = await self._get_db().drivers.find_one({"id": driver_id}, {"_id": 0, "status": 1})
+        if driver is None:
+            return None
+        if driver.get("status") != REPORTING_STATUS:
+            return False
+        self._active[driver_id] = time.monotonic() + STATUS_TTL
+        return True
+
+    def add(self, driver_id: str, points: Iterable, now: Optional[datetime] = None) -> int:
+        """Buffer a driver's points; returns how many were kept (fixes from the future are not)."""
+        if len(self._buffer) >= self.max_buffered:
+            raise Overloaded()
+        now = now or datetime.utcnow()
+        horizon = now + MAX_CLOCK_SKEW
+        documents = [document for document in (location_document(driver_id, point, now) for point in points)
+                     if document["recorded_at"] <= horizon]
+        if not documents:
+            return 0
+        self._buffer.extend(documents)
+        self.received += len(documents)
+        newest = max(documents, key=lambda document: document["recorded_at"])
+        current = self.latest.get(driver_id)
+        if current is None or newest["recorded_at"] >= current["recorded_at"]:
+            self.latest[driver_id] = newest
+        if len(self._buffer) >= self.batch_size:
+            self._wake.set()
+        return len(documents)
+
+    async def flush(self) -> int:
+        """Write the buffered points; returns how many."""
+        async with self._flush_lock:
+            batch, self._buffer = self._buffer, []
+            if not batch:
+                return 0
+            db = self._get_db()
+            try:
+                await db[COLLECTION].insert_many(batch, ordered=False)
+            except BulkWriteError as e:
+                # Unordered: the others were written; add() refuses points while the buffer is full
+                failed = {error["index"] for error in e.details["writeErrors"] if error["code"] != DUPLICATE_KEY}
+                self._buffer[:0] = [batch[index] for index in sorted(failed)]
+                raise
+            except Exception:
+                self._buffer[:0] = batch
+                raise
+            self.written += len(batch)
+            await self._store_positions(db, batch)
+            return len(batch)
+
+    async def _store_positions(self, db, batch: List[Dict]):
+        newest: Dict[str, Dict] = {}
+        for document in batch:
+            current = newest.get(document["driver_id"])
+            if current is None or document["recorded_at"] >= current["recorded_at"]:
+                newest[document["driver_id"]] = document
+        operations = [
+            # Only replaces an older point; a newer one (from another worker) makes the upsert a duplicate key
+            UpdateOne({"driver_id": driver_id, "recorded_at": {"$lt": document["recorded_at"]}},
+                      {"$set": {key: value for key, value in document.items() if key != "_id"}}, upsert=True)
+            for driver_id, document in newest.items()
+        ]
+        try:
+            await db.driver_positions.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            if any(error["code"] != DUPLICATE_KEY for error in e.details["writeErrors"]):
+                raise
+
+    async def position(self, driver_id: str, now: Optional[datetime] = None) -> Optional[Dict]:
+        """Latest known position of a driver, from memory when this worker has a fresh one."""
+        now = now or datetime.utcnow()
+        local = self.latest.get(driver_id)
+        if local is not None and now - local["received_at"] < FRESHNESS:
+            return public_position(local)
+        stored = await self._get_db().driver_positions.find_one({"driver_id": driver_id}, {"_id": 0})
+        candidates = [document for document in (local, stored) if document is not None]
+        if not candidates:
+            return None
+        return public_position(max(candidates, key=lambda document: document["recorded_at"]))
+
+    async def recent_positions(self, since: datetime) -> List[Dict]:
+        """Latest position of every driver that reported since ``since``, all workers included."""
+        newest = {document["driver_id"]: document
+                  async for document in self._get_db().driver_positions.find({"recorded_at": {"$gte": since}},
+                                                                              {"_id": 0})}
+        for driver_id, document in self.latest.items():
+            if document["recorded_at"] >= since and (
+                    driver_id not in newest or document["recorded_at"] > newest[driver_id]["recorded_at"]):
+                newest[driver_id] = document
+        return [public_position(document) for document in newest.values()]
+
+    async def _loop(self):
+        while self._running:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Location flush failed, %d points buffered", len(self._buffer))
+
+    def start(self):
+        self._running = True
+        self._task = asyncio.create_task(self._loop(), name="location-flush")
+
+    async def stop(self):
+        # wait_for (3.11) drops a cancellation that lands as the event is set: the flag ends the loop anyway
+        self._running = False
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception("Final location flush failed, %d points lost", len(self._buffer))
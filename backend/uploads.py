@@ -0,0 +1,236 @@
+"""Resumable uploads of driver documents.
+
+A scan sent over a flaky mobile connection goes up in chunks, so a dropped
+connection only costs the bytes that did not arrive:
+
+    POST /api/drivers/{id}/uploads                       -> {"id", "offset": 0, "size"}
+    PUT  /api/drivers/{id}/uploads/{upload}?offset=N     raw bytes -> {"offset"}
+    GET  /api/drivers/{id}/uploads/{upload}              -> {"offset"}, after a drop
+    POST /api/drivers/{id}/uploads/{upload}/complete
+
+Session state lives in ``upload_sessions``, so any worker can take the
+next chunk:
+
+    {"id", "driver_id", "document_type", "filename", "size", "sha256",
+     "document_expires_on", "received": 4194304, "writer_until": None,
+     "expires_at": ..., "created_at": ...}
+
+The bytes go to ``<upload_dir>/.incoming/<id>.part``. Each piece of a
+request body is written at its offset with ``os.pwrite`` as it arrives,
+so a worker never holds more than one network read of a file, and bytes
+written before the connection dropped still count: ``received`` is
+recorded when the chunk ends, however it ends. A chunk must start at
+``received``, and one writer at a time holds a session (``writer_until``)
+so retries of the same chunk cannot interleave.
+
+Completing checks the size and the SHA-256 announced at creation, then
+moves the file into place. Sessions expire ``SESSION_TTL`` after their
+last chunk; ``sweep`` (a scheduled job) deletes them with their partial
+files.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import time
+import uuid
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import AsyncIterator, Dict, Optional
+
+from pymongo import ReturnDocument
+
+logger = logging.getLogger(__name__)
+
+MAX_SIZE = 25 * 1024 * 1024
+SESSION_TTL = timedelta(hours=24)
+# A writer that died mid-chunk frees its session after this long
+WRITER_LEASE = timedelta(minutes=5)
+INCOMING_DIR = ".incoming"
+
+
+class UploadError(Exception):
+    pass
+
+
+class OffsetMismatch(UploadError):
+    """The chunk does not start where the stored bytes end."""
+
+    def __init__(self, offset: int):
+        super().__init__(offset)
+        self.offset = offset
+
+
+class UploadBusy(UploadError):
+    """Another request is writing to this session."""
+
+
+class TooLarge(UploadError):
+    """The chunk goes past the announced size."""
+
+
+class Incomplete(UploadError):
+    """Completing before every byte arrived."""
+
+
+class ChecksumMismatch(UploadError):
+    """The assembled file does not match the announced SHA-256."""
+
+
+async def ensure_indexes(db):
+    await db.upload_sessions.create_index("id", unique=True)
+    await db.upload_sessions.create_index("expires_at")
+
+
+def part_path(upload_dir: Path, upload_id: str) -> Path:
+    return upload_dir / INCOMING_DIR / f"{upload_id}.part"
+
+
+def _writer_free(now: datetime) -> Dict:
+    return {"$or": [{"writer_until": None}, {"writer_until": {"$lt": now}}]}
+
+
+def status(session: Dict) -> Dict:
+    """Client view of a session: where to resume from."""
+    return {
+        "id": session["id"],
+        "document_type": session["document_type"],
+        "offset": session["received"],
+        "size": session["size"],
+        "expires_at": session["expires_at"],
+    }
+
+
+async def create_session(db, upload_dir: Path, driver_id: str, document_type: str, filename: str, size: int,
+                         sha256: Optional[str] = None, document_expires_on: Optional[date] = None,
+                         now: Optional[datetime] = None) -> Dict:
+    now = now or datetime.utcnow()
+    session = {
+        "id": str(uuid.uuid4()),
+        "driver_id": driver_id,
+        "document_type": document_type,
+        "filename": filename,
+        "size": size,
+        "sha256": sha256,
+        "document_expires_on": document_expires_on.isoformat() if document_expires_on else None,
+        "received": 0,
+        "writer_until": None,
+        "expires_at": now + SESSION_TTL,
+        "created_at": now,
+    }
+    path = part_path(upload_dir, session["id"])
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.touch()
+    await db.upload_sessions.insert_one(session)
+    return session
+
+
+async def write_chunk(db, upload_dir: Path, session: Dict, offset: int, chunks: AsyncIterator[bytes],
+                      now: Optional[datetime] = None) -> int:
+    """Write ``chunks`` at ``offset``; returns the new offset.
+
+    The bytes that made it to disk are recorded even when ``chunks`` fails
+    (client gone) or overflows the announced size (``TooLarge``).
+    """
+    now = now or datetime.utcnow()
+    if offset != session["received"]:
+        raise OffsetMismatch(session["received"])
+    lease = now + WRITER_LEASE
+    claimed = await db.upload_sessions.find_one_and_update(
+        {"id": session["id"], "received": offset, **_writer_free(now)},
+        {"$set": {"writer_until": lease}},
+        return_document=ReturnDocument.AFTER,
+    )
+    if claimed is None:
+        current = await db.upload_sessions.find_one({"id": session["id"]})
+        if current is not None and current["received"] != offset:
+            raise OffsetMismatch(current["received"])
+        raise UploadBusy(session["id"])
+
+    position = offset
+    fd = os.open(part_path(upload_dir, session["id"]), os.O_WRONLY)
+    try:
+        async for data in chunks:
+            if position + len(data) > session["size"]:
+                raise TooLarge(session["id"])
+            view = memoryview(data)
+            while view:
+                written = await asyncio.to_thread(os.pwrite, fd, view, position)
+                position += written
+                view = view[written:]
+    finally:
+        # On disk before it is recorded: a resumed upload never skips lost bytes
+        await asyncio.to_thread(os.fsync, fd)
+        os.close(fd)
+        await db.upload_sessions.update_one(
+            {"id": session["id"], "writer_until": lease},
+            {"$set": {"received": position, "writer_until": None,
+                      "expires_at": datetime.utcnow() + SESSION_TTL}},
+        )
+    return position
+
+
+def _sha256(path: Path) -> str:
+    # hashlib.file_digest is Python 3.11+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+async def complete(db, upload_dir: Path, session: Dict, destination: Path,
+                   now: Optional[datetime] = None) -> Path:
+    """Check the assembled file and move it to ``destination``; the session is consumed."""
+    now = now or datetime.utcnow()
+    if session["received"] < session["size"]:
+        raise Incomplete(session["id"])
+    claimed = await db.upload_sessions.find_one_and_delete(
+        {"id": session["id"], "received": session["size"], **_writer_free(now)}
+    )
+    if claimed is None:
+        raise UploadBusy(session["id"])
+
+    path = part_path(upload_dir, session["id"])
+    if session.get("sha256") and await asyncio.to_thread(_sha256, path) != session["sha256"]:
+        path.unlink(missing_ok=True)
+        raise ChecksumMismatch(session["id"])
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    os.replace(path, destination)
+    return destination
+
+
+def _remove_orphans(incoming: Path, keep: set, older_than: float) -> int:
+    """Partial files with no session, e.g. left by a crash while completing."""
+    removed = 0
+    for path in incoming.glob("*.part"):
+        try:
+            if path.stem not in keep and path.stat().st_mtime < older_than:
+                path.unlink()
+                removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
+
+
+async def sweep(db, upload_dir: Path, now: Optional[datetime] = None) -> Dict[str, int]:
+    """Delete expired sessions and their partial files."""
+    now = now or datetime.utcnow()
+    expired = await db.upload_sessions.find(
+        {"expires_at": {"$lt": now}, **_writer_free(now)}, {"id": 1}
+    ).to_list(None)
+    ids = [session["id"] for session in expired]
+    if ids:
+        await db.upload_sessions.delete_many({"id": {"$in": ids}, "expires_at": {"$lt": now}})
+        for upload_id in ids:
+            part_path(upload_dir, upload_id).unlink(missing_ok=True)
+
+    files = 0
+    incoming = upload_dir / INCOMING_DIR
+    if incoming.is_dir():
+        live = {session["id"] for session in await db.upload_sessions.find({}, {"id": 1}).to_list(None)}
+        older_than = time.time() - SESSION_TTL.total_seconds()
+        files = await asyncio.to_thread(_remove_orphans, incoming, live, older_than)
+    if ids or files:
+        logger.info("Upload sweep: %d expired sessions, %d orphan files", len(ids), files)
+    return {"sessions": len(ids), "files": files}
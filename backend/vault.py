@@ -0,0 +1,388 @@
+"""Encryption at rest of driver documents.
+
+Identity cards, residence permits and contracts are stored encrypted
+with AES-256-GCM, under envelope encryption:
+
+* each driver has a data key (DEK), created on first use and stored in
+  ``data_keys`` wrapped (encrypted) by the master key
+  (``DOCUMENT_MASTER_KEY``, 32 bytes in base64), which never touches
+  the database;
+* unwrapped data keys are kept in an LRU, so storing or reading a
+  document costs no database read once its driver's key is cached.
+
+Files are encrypted in chunks of ``CHUNK_SIZE`` bytes, each sealed on its
+own, so writing or reading a document holds one chunk in memory whatever
+its size. The format follows the STREAM construction:
+
+    header  = b"PKE1" | data key id (16) | nonce prefix (8) | chunk size (4)
+    chunk i = AES-GCM(dek, nonce = prefix | i, aad = header | last flag)
+
+A random prefix per file keeps nonces unique under a data key. The chunk
+index in the nonce and the last-chunk flag in the associated data mean a
+chunk cannot be reordered, dropped or the file truncated without the
+decryption failing.
+
+Reads are transparent: files without the header are returned as they are,
+so documents stored before encryption was enabled stay readable, and
+``python vault.py seal`` encrypts them in place. Without a master key,
+documents are stored in plaintext as before.
+
+Encryption does not stay under 10% of plaintext I/O everywhere
+(benchmarks/vault_bench.py, 16 MB, 1-CPU VM): file writes cost 5-30%
+more, API uploads stay within run-to-run noise, API downloads cost
+8-42% more, and reads from the page cache take 3.5-5x as long, as
+OpenSSL opens AES-GCM at 5-8 GB/s against a 14 GB/s memory copy.
+Against a 1 Gb/s link the cipher adds 2-3% to a transfer.
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import io
+import logging
+import os
+import secrets
+import struct
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+from typing import AsyncIterator, BinaryIO, Callable, Dict, Iterator, Optional, Tuple
+
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from pymongo.errors import DuplicateKeyError
+
+import storage
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"PKE1"
+HEADER = struct.Struct(">4s16s8sI")
+TAG_SIZE = 16
+CHUNK_SIZE = 256 * 1024
+_ENCRYPT_INTO = hasattr(AESGCM, "encrypt_into")
+
+
+class DecryptionError(Exception):
+    pass
+
+
+def master_key_id(master_key: bytes) -> str:
+    return hashlib.sha256(master_key).hexdigest()[:12]
+
+
+def load_master_key(encoded: str) -> bytes:
+    key = base64.b64decode(encoded)
+    if len(key) != 32:
+        raise ValueError("DOCUMENT_MASTER_KEY must be 32 bytes, base64-encoded")
+    return key
+
+
+# --- Streaming format --------------------------------------------------------
+
+def _nonce(prefix: bytes, index: int) -> bytes:
+    return prefix + index.to_bytes(4, "big")
+
+
+def _fill(source: BinaryIO, buffer: memoryview) -> int:
+    """Read into ``buffer`` until it is full or the source ends; returns the length read.
+
+    ``readinto`` saves a copy per chunk, but only ``read`` is required:
+    ``SpooledTemporaryFile`` (uploads) has no ``readinto`` before Python
+    3.11. A short read must not cut a chunk.
+    """
+    readinto = getattr(source, "readinto", None)
+    filled = 0
+    while filled < len(buffer):
+        if readinto is not None:
+            length = readinto(buffer[filled:])
+        else:
+            data = source.read(len(buffer) - filled)
+            length = len(data)
+            buffer[filled:filled + length] = data
+        if not length:
+            break
+        filled += length
+    return filled
+
+
+_scratch = threading.local()
+
+
+def _buffers(chunk_size: int) -> Tuple[Tuple[memoryview, memoryview], memoryview]:
+    """This thread's buffers for ``encrypt_stream``, kept between files.
+
+    Zeroing three fresh chunks costs more than encrypting a small document.
+    ``encrypt_stream`` never yields, so one set per thread is never shared.
+    """
+    cached = getattr(_scratch, "buffers", None)
+    if cached is None or len(cached[1]) != chunk_size + TAG_SIZE:
+        cached = _scratch.buffers = (
+            (memoryview(bytearray(chunk_size)), memoryview(bytearray(chunk_size))),
+            memoryview(bytearray(chunk_size + TAG_SIZE)),
+        )
+    return cached
+
+
+def encrypt_stream(source: BinaryIO, target: BinaryIO, aead: AESGCM, key_id: bytes,
+                   chunk_size: int = CHUNK_SIZE) -> int:
+    """Encrypt ``source`` into ``target`` chunk by chunk; returns the plaintext size."""
+    header = HEADER.pack(MAGIC, key_id, secrets.token_bytes(8), chunk_size)
+    prefix = header[20:28]
+    target.write(header)
+    # The chunk being sealed, the one read ahead to tell if it is the last,
+    # and the ciphertext
+    buffers, sealed = _buffers(chunk_size)
+    length = _fill(source, buffers[0])
+    size, index = 0, 0
+    while True:
+        following = _fill(source, buffers[(index + 1) % 2])
+        last = not following
+        nonce, aad = _nonce(prefix, index), header + (b"\x01" if last else b"\x00")
+        if _ENCRYPT_INTO:
+            aead.encrypt_into(nonce, buffers[index % 2][:length], aad, sealed[:length + TAG_SIZE])
+            target.write(sealed[:length + TAG_SIZE])
+        else:  # cryptography < 45
+            target.write(aead.encrypt(nonce, buffers[index % 2][:length], aad))
+        size += length
+        if last:
+            return size
+        length, index = following, index + 1
+
+
+def read_header(source: BinaryIO) -> Optional[Tuple[bytes, bytes, bytes, int]]:
+    """``(header, key id, nonce prefix, chunk size)``, or None for a plaintext file (left at offset 0)."""
+    header = source.read(HEADER.size)
+    if len(header) < HEADER.size or not header.startswith(MAGIC):
+        source.seek(0)
+        return None
+    _, key_id, prefix, chunk_size = HEADER.unpack(header)
+    return header, key_id, prefix, chunk_size
+
+
+def decrypt_chunks(source: BinaryIO, aead: AESGCM, header: bytes, prefix: bytes,
+                   chunk_size: int) -> Iterator[bytes]:
+    """Plaintext chunks of an encrypted file positioned after its header."""
+    # Ciphertext goes through two reused buffers; each plaintext chunk is a
+    # new bytes object, as the consumer may keep it
+    block_size = chunk_size + TAG_SIZE
+    buffers = (memoryview(bytearray(block_size)), memoryview(bytearray(block_size)))
+    length = _fill(source, buffers[0])
+    index = 0
+    while True:
+        following = _fill(source, buffers[(index + 1) % 2])
+        last = not following
+        try:
+            yield aead.decrypt(_nonce(prefix, index), buffers[index % 2][:length],
+                               header + (b"\x01" if last else b"\x00"))
+        except Exception as e:
+            raise DecryptionError(f"chunk {index} failed authentication") from e
+        if last:
+            return
+        length, index = following, index + 1
+
+
+# --- Data keys ---------------------------------------------------------------
+
+class DataKeys:
+    """Per-driver data keys, wrapped by the master key in ``data_keys``."""
+
+    def __init__(self, get_db: Callable, master_key: bytes, cache_size: int = 10_000):
+        self._get_db = get_db
+        self._master = AESGCM(master_key)
+        self.master_key_id = master_key_id(master_key)
+        self._cache: "OrderedDict[bytes, Tuple[str, AESGCM]]" = OrderedDict()  # key id -> (driver, cipher)
+        self._by_driver: Dict[str, bytes] = {}
+        self._cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+
+    async def ensure_indexes(self):
+        db = self._get_db()
+        await db.data_keys.create_index("driver_id", unique=True)
+        await db.data_keys.create_index("id", unique=True)
+
+    def _cached(self, key_id: Optional[bytes]) -> Optional[AESGCM]:
+        entry = self._cache.get(key_id)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._cache.move_to_end(key_id)
+        return entry[1]
+
+    def _remember(self, key_id: bytes, driver_id: str, aead: AESGCM) -> AESGCM:
+        self._cache[key_id] = (driver_id, aead)
+        self._by_driver[driver_id] = key_id
+        if len(self._cache) > self._cache_size:
+            _, (evicted_driver, _) = self._cache.popitem(last=False)
+            self._by_driver.pop(evicted_driver, None)
+        return aead
+
+    def _unwrap(self, doc: Dict) -> AESGCM:
+        if doc["master_key_id"] != self.master_key_id:
+            raise DecryptionError(f"data key {doc['id']} is wrapped by another master key")
+        key = self._master.decrypt(doc["nonce"], doc["wrapped_key"], doc["driver_id"].encode())
+        return self._remember(uuid.UUID(doc["id"]).bytes, doc["driver_id"], AESGCM(key))
+
+    async def for_driver(self, driver_id: str) -> Tuple[bytes, AESGCM]:
+        """``(key id, cipher)`` of the driver's data key, created on first use."""
+        key_id = self._by_driver.get(driver_id)
+        aead = self._cached(key_id)
+        if aead is not None:
+            return key_id, aead
+        db = self._get_db()
+        doc = await db.data_keys.find_one({"driver_id": driver_id})
+        if doc is None:
+            key, nonce = AESGCM.generate_key(256), secrets.token_bytes(12)
+            doc = {
+                "id": str(uuid.uuid4()),
+                "driver_id": driver_id,
+                "wrapped_key": self._master.encrypt(nonce, key, driver_id.encode()),
+                "nonce": nonce,
+                "master_key_id": self.master_key_id,
+                "created_at": datetime.utcnow(),
+            }
+            try:
+                await db.data_keys.insert_one(doc)
+            except DuplicateKeyError:  # created concurrently by another request or worker
+                doc = await db.data_keys.find_one({"driver_id": driver_id})
+        aead = self._unwrap(doc)
+        return uuid.UUID(doc["id"]).bytes, aead
+
+    async def by_id(self, key_id: bytes) -> AESGCM:
+        aead = self._cached(key_id)
+        if aead is not None:
+            return aead
+        doc = await self._get_db().data_keys.find_one({"id": str(uuid.UUID(bytes=key_id))})
+        if doc is None:
+            raise DecryptionError(f"unknown data key {uuid.UUID(bytes=key_id)}")
+        return self._unwrap(doc)
+
+
+# --- Files -------------------------------------------------------------------
+
+def _encrypt_file(source: BinaryIO, path: Path, aead: AESGCM, key_id: bytes, chunk_size: int):
+    tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        with open(tmp, "wb") as target:
+            encrypt_stream(source, target, aead, key_id, chunk_size)
+        os.replace(tmp, path)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+def _is_sealed(path: Path) -> bool:
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+class Vault:
+    """Reads and writes driver documents, encrypted with the driver's data key."""
+
+    def __init__(self, keys: DataKeys, chunk_size: int = CHUNK_SIZE):
+        self.keys = keys
+        self.chunk_size = chunk_size
+
+    async def write_file(self, path: Path, driver_id: str, source: BinaryIO, size: Optional[int] = None):
+        """Encrypt the readable ``source`` (of ``size`` bytes, when known) into ``path``."""
+        key_id, aead = await self.keys.for_driver(driver_id)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        await storage.run_io(size, _encrypt_file, source, path, aead, key_id, self.chunk_size)
+
+    async def write_bytes(self, path: Path, driver_id: str, data: bytes):
+        await self.write_file(path, driver_id, io.BytesIO(data), len(data))
+
+    async def seal(self, path: Path, driver_id: str) -> bool:
+        """Encrypt a plaintext file in place; False if it already was."""
+        size = path.stat().st_size
+        if await storage.run_io(size, _is_sealed, path):
+            return False
+        with open(path, "rb") as source:
+            await self.write_file(path, driver_id, source, size)
+        return True
+
+    async def read_chunks(self, path: Path) -> AsyncIterator[bytes]:
+        """Plaintext of ``path`` in chunks; plaintext files are passed through."""
+        with open(path, "rb") as source:
+            parsed = read_header(source)
+            if parsed is None:
+                async for chunk in plain_chunks(source, self.chunk_size):
+                    yield chunk
+                return
+            header, key_id, prefix, chunk_size = parsed
+            chunks = decrypt_chunks(source, await self.keys.by_id(key_id), header, prefix, chunk_size)
+            # One chunk per step, read and opened on the loop when small enough
+            # (storage.run_io): a thread hop per chunk cost more than the chunk
+            while (chunk := await storage.run_io(chunk_size, next, chunks, None)) is not None:
+                yield chunk
+
+    async def read_bytes(self, path: Path) -> bytes:
+        return b"".join([chunk async for chunk in self.read_chunks(path)])
+
+
+async def plain_chunks(source: BinaryIO, chunk_size: int = CHUNK_SIZE) -> AsyncIterator[bytes]:
+    while chunk := await storage.run_io(chunk_size, source.read, chunk_size):
+        yield chunk
+
+
+async def read_document(path: Path, vault: Optional[Vault]) -> AsyncIterator[bytes]:
+    """Chunks of a stored document, decrypted when ``vault`` is set."""
+    if vault is not None:
+        async for chunk in vault.read_chunks(path):
+            yield chunk
+        return
+    with open(path, "rb") as source:
+        async for chunk in plain_chunks(source):
+            yield chunk
+
+
+def vault_from_settings(get_db: Callable, settings) -> Optional[Vault]:
+    if not settings.document_master_key:
+        logger.warning("DOCUMENT_MASTER_KEY is not set: documents are stored unencrypted")
+        return None
+    return Vault(DataKeys(get_db, load_master_key(settings.document_master_key)))
+
+
+async def seal_tree(vault: Vault, upload_dir: Path) -> Dict[str, int]:
+    """Encrypt the plaintext documents under ``upload_dir/<driver_id>/``."""
+    sealed = skipped = 0
+    for driver_dir in sorted(p for p in upload_dir.iterdir() if p.is_dir() and not p.name.startswith(".")):
+        for path in sorted(p for p in driver_dir.iterdir() if p.is_file() and not p.name.startswith(".")):
+            if await vault.seal(path, driver_dir.name):
+                sealed += 1
+            else:
+                skipped += 1
+    return {"sealed": sealed, "already_sealed": skipped}
+
+
+if __name__ == "__main__":
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    from settings import Settings
+
+    parser = argparse.ArgumentParser(description="Document encryption at rest")
+    parser.add_argument("command", choices=["seal", "generate-key"])
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == "generate-key":
+        print(base64.b64encode(AESGCM.generate_key(256)).decode())
+        raise SystemExit(0)
+
+    settings = Settings.from_env()
+    db = AsyncIOMotorClient(settings.mongo_url)[settings.db_name]
+    vault = vault_from_settings(lambda: db, settings)
+    if vault is None:
+        raise SystemExit("DOCUMENT_MASTER_KEY is not set")
+
+    async def main():
+        await vault.keys.ensure_indexes()
+        results = await seal_tree(vault, settings.upload_dir)
+        if (settings.originals_dir or settings.root_dir / "originals").is_dir():
+            originals = await seal_tree(vault, settings.originals_dir or settings.root_dir / "originals")
+            results = {name: count + originals[name] for name, count in results.items()}
+        return results
+
+    print(asyncio.run(main()))
@@ -1,214 +1,112 @@
-import requests
+import asyncio
+import os
 import sys
-import json
-from datetime import datetime
-from typing import Dict, Any
-
-class PikklesAPITester:
-    def __init__(self, base_url="https://driver-signup.preview.emergentagent.com"):
-        self.base_url = base_url
-        self.api_url = f"{base_url}/api"
-        self.tests_run = 0
-        self.tests_passed = 0
-        self.driver_id = None
-
-    def run_test(self, name: str, method: str, endpoint: str, expected_status: int, data: Dict[Any, Any] = None, params: Dict[str, str] = None) -> tuple:
-        """Run a single API test"""
-        url = f"{self.api_url}/{endpoint}" if not endpoint.startswith('http') else endpoint
-        headers = {'Content-Type': 'application/json'}
-
-        self.tests_run += 1
-        print(f"\n🔍 Testing {name}...")
-        print(f"   URL: {url}")
-        
-        try:
-            if method == 'GET':
-                response = requests.get(url, headers=headers, params=params)
-            elif method == 'POST':
-                response = requests.post(url, json=data, headers=headers)
-            elif method == 'PUT':
-                response = requests.put(url, json=data, headers=headers)
-
-            success = response.status_code == expected_status
-            if success:
-                self.tests_passed += 1
-                print(f"✅ Passed - Status: {response.status_code}")
-                try:
-                    response_data = response.json()
-                    print(f"   Response: {json.dumps(response_data, indent=2, default=str)[:200]}...")
-                except:
-                    print(f"   Response: {response.text[:200]}...")
-            else:
-                print(f"❌ Failed - Expected {expected_status}, got {response.status_code}")
-                print(f"   Response: {response.text[:300]}...")
-
-            return success, response.json() if response.text else {}
-
-        except Exception as e:
-            print(f"❌ Failed - Error: {str(e)}")
-            return False, {}
-
-    def test_health_check(self):
-        """Test the health endpoint"""
-        return self.run_test(
-            "Health Check",
-            "GET",
-            "health",
-            200
-        )
+from datetime import date, datetime, timedelta
 
-    def test_api_root(self):
-        """Test the API root endpoint"""
-        return self.run_test(
-            "API Root",
-            "GET",
-            "",
-            200
-        )
+from async_api_tester import AsyncAPITester
 
-    def test_create_driver_step1(self):
-        """Test creating a driver with step 1 data (profile with detailed address)"""
-        profile_data = {
-            "profile": {
-                "firstname": "Jean",
-                "lastname": "Dupont",
-                "email": "jean.dupont@test.com",
-                "phone": "0612345678",
-                "date_of_birth": "1990-01-15",
-                "address": "123 Rue de la Paix, 75001 Paris"
-            },
-            "registration_step": 1
-        }
-        
-        success, response = self.run_test(
-            "Create Driver - Step 1 (Profile)",
-            "POST",
-            "drivers",
-            200,
-            data=profile_data
-        )
-        
-        if success and 'id' in response:
-            self.driver_id = response['id']
-            print(f"   Driver ID: {self.driver_id}")
-            return True
-        return False
-
-    def test_get_driver(self):
-        """Test getting a driver by ID"""
-        if not self.driver_id:
-            print("❌ No driver ID available for testing")
-            return False
-            
-        return self.run_test(
-            "Get Driver",
-            "GET",
-            f"drivers/{self.driver_id}",
-            200
-        )[0]
-
-    def test_update_driver_step2(self):
-        """Test updating driver with step 2 data (documents)"""
-        if not self.driver_id:
-            print("❌ No driver ID available for testing")
-            return False
-            
-        documents_data = {
-            "documents": {
-                "identity_card_front": "uploads/test/identity_front.jpg",
-                "identity_card_back": "uploads/test/identity_back.jpg",
-                "proof_of_residence": "uploads/test/proof_residence.pdf",
-                "residence_permit": "uploads/test/residence_permit.jpg"
-            },
-            "registration_step": 2
-        }
-        
-        return self.run_test(
-            "Update Driver - Step 2 (Documents)",
-            "PUT",
-            f"drivers/{self.driver_id}",
-            200,
-            data=documents_data
-        )[0]
-
-    def test_update_driver_step3_insurance(self):
-        """Test updating driver with step 3 data (insurance documents)"""
-        if not self.driver_id:
-            print("❌ No driver ID available for testing")
-            return False
-            
-        insurance_data = {
-            "documents": {
-                "civil_liability_insurance": "uploads/test/civil_liability.pdf",
-                "vehicle_insurance": "uploads/test/vehicle_insurance.pdf",
-                "vehicle_contract": "uploads/test/vehicle_contract.pdf"
-            },
-            "registration_step": 3
-        }
-        
-        return self.run_test(
-            "Update Driver - Step 3 (Insurance Documents)",
-            "PUT",
-            f"drivers/{self.driver_id}",
-            200,
-            data=insurance_data
-        )[0]
-
-    def test_update_driver_step4_siret(self):
-        """Test updating driver with step 4 data (SIRET business info)"""
-        if not self.driver_id:
-            print("❌ No driver ID available for testing")
-            return False
-            
-        business_data = {
-            "business_info": {
-                "siret": "12345678901234",
-                "company_name": "Jean Dupont Auto-Entrepreneur",
-                "business_address": "123 Rue de la Paix, 75001 Paris",
-                "siret_verified": False
-            },
-            "registration_step": 4
-        }
-        
-        return self.run_test(
-            "Update Driver - Step 4 (SIRET Business Info)",
-            "PUT",
-            f"drivers/{self.driver_id}",
-            200,
-            data=business_data
-        )[0]
-
-    def test_update_driver_step5_bank(self):
-        """Test updating driver with step 5 data (bank info)"""
-        if not self.driver_id:
-            print("❌ No driver ID available for testing")
-            return False
-            
-        bank_data = {
-            "bank_info": {
-                "bank_name": "Crédit Agricole",
-                "iban": "FR1420041010050500013M02606",
-                "bic": "AGRIFRPP",
-                "account_holder_name": "Jean Dupont"
-            },
-            "registration_step": 5
-        }
-        
-        return self.run_test(
-            "Update Driver - Step 5 (Bank Info)",
-            "PUT",
-            f"drivers/{self.driver_id}",
-            200,
-            data=bank_data
-        )[0]
-
-    def test_update_driver_step6_final(self):
-        """Test updating driver with step 6 data (contract with app download)"""
-        if not self.driver_id:
-            print("❌ No driver ID available for testing")
-            return False
-            
-        contract_data = {
+# Cheapest bcrypt cost: the suite checks behaviour, not hashing strength
+os.environ.setdefault("AUTH_BCRYPT_ROUNDS", "4")
+
+tester = AsyncAPITester("Pikkles API Backend Tests")
+
+STEP1_PROFILE = {
+    "profile": {
+        "firstname": "Jean",
+        "lastname": "Dupont",
+        "email": "jean.dupont@test.com",
+        "phone": "0612345678",
+        "date_of_birth": "1990-01-15",
+        "address": "123 Rue de la Paix, 75001 Paris"
+    },
+    "registration_step": 1
+}
+
+
+async def create_driver(api, data=None):
+    """Create a driver with step 1 data and return its id"""
+    response = await api.check(
+        "Create Driver - Step 1 (Profile)", "POST", "drivers", 200, data=data or STEP1_PROFILE
+    )
+    assert 'id' in response, "Driver creation returned no id"
+    api.log(f"Driver ID: {response['id']}")
+    return response['id']
+
+
+def profile_with(**overrides):
+    profile = dict(STEP1_PROFILE["profile"], **overrides)
+    return {"profile": profile}
+
+
+def admin_headers():
+    """Bearer header of a staff account, for the /admin routes"""
+    import server
+    return {"Authorization": f"Bearer {server.token_service.issue('admin-test', 'admin')}"}
+
+
+def driver_headers(driver_id):
+    """Bearer header of the driver's own account"""
+    import server
+    return {"Authorization": f"Bearer {server.token_service.issue(f'account-{driver_id}', 'driver', driver_id)}"}
+
+
+# PHASE 1: Basic API Tests
+
+@tester.test("Health Check")
+async def health_check(api):
+    await api.check("Health Check", "GET", "health", 200)
+
+
+@tester.test("API Root")
+async def api_root(api):
+    await api.check("API Root", "GET", "", 200)
+
+
+# PHASE 2: Driver CRUD Tests - 6 Steps Flow
+
+@tester.test("Driver registration - 6 steps flow")
+async def registration_flow(api):
+    driver_id = await create_driver(api)
+    await api.check("Get Driver", "GET", f"drivers/{driver_id}", 200)
+
+    await api.check("Update Driver - Step 2 (Documents)", "PUT", f"drivers/{driver_id}", 200, data={
+        "documents": {
+            "identity_card_front": "uploads/test/identity_front.jpg",
+            "identity_card_back": "uploads/test/identity_back.jpg",
+            "proof_of_residence": "uploads/test/proof_residence.pdf",
+            "residence_permit": "uploads/test/residence_permit.jpg"
+        },
+        "registration_step": 2
+    })
+    await api.check("Update Driver - Step 3 (Insurance Documents)", "PUT", f"drivers/{driver_id}", 200, data={
+        "documents": {
+            "civil_liability_insurance": "uploads/test/civil_liability.pdf",
+            "vehicle_insurance": "uploads/test/vehicle_insurance.pdf",
+            "vehicle_contract": "uploads/test/vehicle_contract.pdf"
+        },
+        "registration_step": 3
+    })
+    await api.check("Update Driver - Step 4 (SIRET Business Info)", "PUT", f"drivers/{driver_id}", 200, data={
+        "business_info": {
+            "siret": "12345678901234",
+            "company_name": "Jean Dupont Auto-Entrepreneur",
+            "business_address": "123 Rue de la Paix, 75001 Paris",
+            "siret_verified": False
+        },
+        "registration_step": 4
+    })
+    await api.check("Update Driver - Step 5 (Bank Info)", "PUT", f"drivers/{driver_id}", 200, data={
+        "bank_info": {
+            "bank_name": "Crédit Agricole",
+            "iban": "FR1420041010050500013M02606",
+            "bic": "AGRIFRPP",
+            "account_holder_name": "Jean Dupont"
+        },
+        "registration_step": 5
+    })
+    driver = await api.check(
+        "Update Driver - Step 6 (Final Contract with App Download)", "PUT", f"drivers/{driver_id}", 200,
+        data={
             "contract": {
                 "auto_entrepreneur_status": True,
                 "accepts_cgu": True,
@@ -219,491 +117,1228 @@ class PikklesAPITester:
             "registration_step": 6,
             "status": "under_review"
         }
-        
-        return self.run_test(
-            "Update Driver - Step 6 (Final Contract with App Download)",
-            "PUT",
-            f"drivers/{self.driver_id}",
-            200,
-            data=contract_data
-        )[0]
-
-    def test_get_driver_stats(self):
-        """Test getting driver statistics"""
-        if not self.driver_id:
-            print("❌ No driver ID available for testing")
-            return False
-            
-        return self.run_test(
-            "Get Driver Stats",
-            "GET",
-            f"drivers/{self.driver_id}/stats",
-            200
-        )[0]
-
-    def test_get_driver_payments(self):
-        """Test getting driver payment history"""
-        if not self.driver_id:
-            print("❌ No driver ID available for testing")
-            return False
-            
-        return self.run_test(
-            "Get Driver Payments",
-            "GET",
-            f"drivers/{self.driver_id}/payments",
-            200
-        )[0]
-
-    def test_get_nonexistent_driver(self):
-        """Test getting a non-existent driver (should return 404)"""
-        return self.run_test(
-            "Get Non-existent Driver",
-            "GET",
-            "drivers/nonexistent-id-12345",
-            404
-        )[0]
-
-    def test_siret_validation(self):
-        """Test SIRET validation functionality"""
-        if not self.driver_id:
-            print("❌ No driver ID available for testing")
-            return False
-            
-        # Test with invalid SIRET (too short)
-        invalid_siret_data = {
-            "business_info": {
-                "siret": "123456789",  # Only 9 digits instead of 14
-                "company_name": "Test Company",
-                "business_address": "Test Address"
-            }
+    )
+    assert driver["registration_step"] == 6 and driver["status"] == "under_review"
+
+
+# PHASE 3: Dashboard API Tests
+
+@tester.test("Dashboard - Stats and Payments")
+async def dashboard(api):
+    driver_id = await create_driver(api)
+    stats = await api.check("Get Driver Stats", "GET", f"drivers/{driver_id}/stats", 200)
+    assert "document_status" in stats
+    payments = await api.check("Get Driver Payments", "GET", f"drivers/{driver_id}/payments", 200)
+    assert payments == []
+
+
+@tester.test("Ledger - Payments update dashboard totals")
+async def ledger_totals(api):
+    import ledger
+
+    driver_id = await create_driver(api)
+    payment = {"amount": 12.5, "payment_method": "bank_transfer", "delivery_id": "d1"}
+    await api.check("Record payment without login", "POST", f"drivers/{driver_id}/payments", 401, data=payment)
+    # The status of the body is ignored: staff record completed payments
+    await api.check("Record payment", "POST", f"drivers/{driver_id}/payments", 200,
+                    data={**payment, "status": "pending"}, headers=admin_headers())
+    await api.check("Record payment", "POST", f"drivers/{driver_id}/payments", 200,
+                    data={"amount": 30.0, "payment_method": "bank_transfer", "delivery_id": "d2"},
+                    headers=admin_headers())
+    await ledger.record_payment(api.db, {
+        "id": "p3", "driver_id": driver_id, "amount": 8.0, "currency": "EUR", "payment_method": "bank_transfer",
+        "status": "pending", "delivery_id": "d3", "created_at": datetime.utcnow(),
+    })
+    stats = await api.check("Get Driver Stats", "GET", f"drivers/{driver_id}/stats", 200)
+    assert stats["total_deliveries"] == 2 and stats["total_earnings"] == 42.5, stats
+    assert stats["current_balance"] == 42.5
+    payments = await api.check("Get Driver Payments", "GET", f"drivers/{driver_id}/payments", 200)
+    assert len(payments) == 3
+
+
+@tester.test("Ledger - Nightly reconciliation repairs drift")
+async def ledger_reconciliation(api):
+    import ledger
+
+    driver_id = await create_driver(api)
+    await api.check("Record payment", "POST", f"drivers/{driver_id}/payments", 200, data={
+        "amount": 20.0, "payment_method": "bank_transfer", "delivery_id": "d1"
+    }, headers=admin_headers())
+    await api.db.driver_balances.update_one({"driver_id": driver_id}, {"$set": {"total_earnings": 999.0}})
+    # Just paid: the payment may not be applied to the balance yet
+    assert await ledger.reconcile(api.db) == {"checked": 1, "corrected": 0}
+    later = datetime.utcnow() + ledger.SETTLE
+
+    # A payment applied while the drift is being checked is not overwritten
+    from unittest import mock
+
+    paid_out = ledger._paid_out
+
+    async def paid_meanwhile(db, driver_ids):
+        if db is not api.db:  # tests run concurrently, with the module patched for all
+            return await paid_out(db, driver_ids)
+        await ledger.record_payment(db, {
+            "id": "p2", "driver_id": driver_id, "amount": 5.0, "currency": "EUR", "payment_method": "bank_transfer",
+            "status": "completed", "delivery_id": "d2", "created_at": datetime.utcnow(),
+        })
+        return await paid_out(db, driver_ids)
+
+    with mock.patch.object(ledger, "_paid_out", paid_meanwhile):
+        assert await ledger.reconcile(api.db, now=later) == {"checked": 1, "corrected": 0}
+    result = await ledger.reconcile(api.db, now=later + ledger.SETTLE)
+    assert result == {"checked": 1, "corrected": 1}, result
+    stats = await api.check("Get Driver Stats", "GET", f"drivers/{driver_id}/stats", 200)
+    assert stats["total_earnings"] == 25.0 and stats["total_deliveries"] == 2, stats
+
+
+@tester.test("Payouts - Period run applies commission rates")
+async def payout_run(api):
+    import ledger
+    import payouts
+
+    default_rate = await create_driver(api)
+    custom_rate = await create_driver(api, profile_with(email="marie@test.com", phone="0698765432"))
+    rate = f"admin/drivers/{custom_rate}/commission-rate"
+    await api.check("Commission rate without token", "PUT", rate, 401, data={"commission_rate": 20.0})
+    for invalid in (-5.0, 100.5):
+        await api.check("Commission rate out of range", "PUT", rate, 422, data={"commission_rate": invalid},
+                        headers=admin_headers())
+    await api.check("Unknown driver", "PUT", "admin/drivers/nobody/commission-rate", 404,
+                    data={"commission_rate": 20.0}, headers=admin_headers())
+    await api.check("Set commission rate", "PUT", rate, 200, data={"commission_rate": 20.0}, headers=admin_headers())
+    # Not the driver's to change, and kept when the driver updates the rest of the contract
+    await api.check("Driver contract update", "PUT", f"drivers/{custom_rate}", 200,
+                    data={"contract": {"accepts_cgu": True, "commission_rate": 0.0}})
+    contract = (await api.db.drivers.find_one({"id": custom_rate}))["contract"]
+    assert contract["accepts_cgu"] is True and contract["commission_rate"] == 20.0
+    in_period = datetime(2026, 9, 10)
+    for index, (driver_id, amount) in enumerate([(default_rate, 40.0), (default_rate, 60.0), (custom_rate, 50.0)]):
+        await ledger.record_payment(api.db, {
+            "id": f"p{index}", "driver_id": driver_id, "amount": amount, "currency": "EUR",
+            "payment_method": "bank_transfer", "status": "completed", "delivery_id": f"d{index}",
+            "created_at": in_period,
+        })
+
+    run = await payouts.run_payouts(api.db, "2026-09", batch_size=2)
+    assert run["summary"] == {"drivers": 2, "gross": 150.0, "commission": 25.0, "net": 125.0}, run["summary"]
+    driver_payouts = await api.check("Get payouts", "GET", f"drivers/{custom_rate}/payouts", 200)
+    assert driver_payouts[0]["net_amount"] == 40.0 and driver_payouts[0]["payout_date"] == "2026-10-15"
+    stats = await api.check("Get Driver Stats", "GET", f"drivers/{default_rate}/stats", 200)
+    assert stats["current_balance"] == 0.0 and stats["total_earnings"] == 100.0, stats
+
+    # Re-running a completed period changes nothing
+    assert (await payouts.run_payouts(api.db, "2026-09"))["summary"] == run["summary"]
+    assert await api.db.payments.count_documents({"payout_id": "payout-2026-09"}) == 3
+
+    # A run cut short after writing the partials of a batch resumes with another batch size
+    for index, (driver_id, amount) in enumerate([(default_rate, 10.0), (default_rate, 20.0), (custom_rate, 30.0)]):
+        await ledger.record_payment(api.db, {
+            "id": f"a{index}", "driver_id": driver_id, "amount": amount, "currency": "EUR",
+            "payment_method": "bank_transfer", "status": "completed", "delivery_id": f"a{index}",
+            "created_at": datetime(2026, 8, 20),
+        })
+    await api.db.payout_runs.insert_one({"_id": "payout-2026-08", "period": "2026-08", "status": "accumulating"})
+    await api.db.payout_partials.insert_many([
+        {"_id": f"payout-2026-08:0:{driver_id}", "run_id": "payout-2026-08", "batch": 0, "driver_id": driver_id,
+         "gross": gross, "payments": payments}
+        for driver_id, gross, payments in ((default_rate, 30.0, 2), (custom_rate, 30.0, 1))
+    ])
+    run = await payouts.run_payouts(api.db, "2026-08", batch_size=2)
+    assert run["summary"]["gross"] == 60.0, run["summary"]
+
+    # A missed payout day is caught up on the next run
+    await ledger.record_payment(api.db, {
+        "id": "o1", "driver_id": custom_rate, "amount": 25.0, "currency": "EUR", "payment_method": "bank_transfer",
+        "status": "completed", "delivery_id": "o1", "created_at": datetime(2026, 10, 5),
+    })
+    assert await payouts.scheduled_run(api.db, today=datetime(2026, 11, 14)) == []  # October not closed yet
+    assert await payouts.scheduled_run(api.db, today=datetime(2026, 11, 20)) == ["2026-10"]
+    assert await payouts.scheduled_run(api.db, today=datetime(2026, 11, 21)) == []
+
+
+# PHASE 4: New Features Tests
+
+@tester.test("SIRET Validation on update")
+async def siret_validation(api):
+    driver_id = await create_driver(api)
+    # The backend now rejects SIRETs that are not 14 digits
+    await api.check("SIRET Validation - Invalid Format", "PUT", f"drivers/{driver_id}", 400, data={
+        "business_info": {
+            "siret": "123456789",  # Only 9 digits instead of 14
+            "company_name": "Test Company",
+            "business_address": "Test Address"
         }
-        
-        # This should succeed as backend doesn't validate SIRET format yet
-        success, _ = self.run_test(
-            "SIRET Validation - Invalid Format",
-            "PUT",
-            f"drivers/{self.driver_id}",
-            200,
-            data=invalid_siret_data
-        )
-        
-        # Test with valid SIRET format
-        valid_siret_data = {
-            "business_info": {
-                "siret": "12345678901234",  # 14 digits
-                "company_name": "Valid Company",
-                "business_address": "Valid Address"
-            }
+    })
+    await api.check("SIRET Validation - Valid Format", "PUT", f"drivers/{driver_id}", 200, data={
+        "business_info": {
+            "siret": "12345678901234",  # 14 digits
+            "company_name": "Valid Company",
+            "business_address": "Valid Address"
         }
-        
-        success2, _ = self.run_test(
-            "SIRET Validation - Valid Format",
-            "PUT",
-            f"drivers/{self.driver_id}",
-            200,
-            data=valid_siret_data
+    })
+
+
+@tester.test("Insurance document upload")
+async def insurance_document_upload(api):
+    driver_id = await create_driver(api)
+    for document_type in ("civil_liability_insurance", "vehicle_insurance", "vehicle_contract"):
+        # Should fail without actual file
+        await api.check(
+            f"{document_type} Upload Endpoint - missing file", "POST",
+            f"drivers/{driver_id}/upload-document?document_type={document_type}", 422
         )
-        
-        return success and success2
-
-    def test_insurance_document_upload(self):
-        """Test insurance document upload endpoints"""
-        if not self.driver_id:
-            print("❌ No driver ID available for testing")
-            return False
-            
-        # Test civil liability insurance upload endpoint
-        success1 = self.run_test(
-            "Civil Liability Insurance Upload Endpoint",
-            "POST",
-            f"drivers/{self.driver_id}/upload-document?document_type=civil_liability_insurance",
-            422,  # Should fail without actual file
-        )[0]
-        
-        # Test vehicle insurance upload endpoint
-        success2 = self.run_test(
-            "Vehicle Insurance Upload Endpoint",
-            "POST",
-            f"drivers/{self.driver_id}/upload-document?document_type=vehicle_insurance",
-            422,  # Should fail without actual file
-        )[0]
-        
-        # Test vehicle contract upload endpoint
-        success3 = self.run_test(
-            "Vehicle Contract Upload Endpoint",
-            "POST",
-            f"drivers/{self.driver_id}/upload-document?document_type=vehicle_contract",
-            422,  # Should fail without actual file
-        )[0]
-        
-        return success1 and success2 and success3
-
-    def test_validation_email_invalid(self):
-        """Test email validation - should reject invalid emails"""
-        invalid_emails = ["test", "test@", "@test.com", "test.com", "test@test"]
-        
-        for email in invalid_emails:
-            invalid_data = {
-                "profile": {
-                    "firstname": "Jean",
-                    "lastname": "Dupont", 
-                    "email": email,
-                    "phone": "0612345678",
-                    "address": "123 Rue de la Paix, 75001 Paris"
-                }
-            }
-            
-            success, response = self.run_test(
-                f"Email Validation - Invalid: {email}",
-                "POST",
-                "drivers",
-                422,  # Pydantic validation returns 422
-                data=invalid_data
-            )
-            
-            if success and "email" in str(response):
-                print(f"✅ Email validation working for: {email}")
-            else:
-                print(f"❌ Email validation failed for: {email}")
-                return False
-        
-        return True
-
-    def test_validation_disposable_emails(self):
-        """Test disposable email validation - should reject disposable emails"""
-        disposable_emails = [
-            "test@10minutemail.com",
-            "user@guerrillamail.com", 
-            "fake@tempmail.org",
-            "test@mailinator.com",
-            "user@yopmail.com",
-            "test@fake-domain-xyz.com"
-        ]
-        
-        for email in disposable_emails:
-            invalid_data = {
-                "profile": {
-                    "firstname": "Jean",
-                    "lastname": "Dupont",
-                    "email": email,
-                    "phone": "0612345678", 
-                    "address": "123 Rue de la Paix, 75001 Paris"
-                }
-            }
-            
-            success, response = self.run_test(
-                f"Disposable Email Validation - Should Reject: {email}",
-                "POST",
-                "drivers",
-                400,  # Backend validation returns 400
-                data=invalid_data
-            )
-            
-            if success and "jetable" in str(response):
-                print(f"✅ Disposable email blocked: {email}")
-            else:
-                print(f"❌ Disposable email validation failed for: {email}")
-                return False
-        
-        return True
-
-    def test_validation_phone_invalid(self):
-        """Test phone validation - should reject non-French phones and 08 numbers"""
-        invalid_phones = [
-            "123", 
-            "+33123456789", 
-            "1234567890", 
-            "0812345678",  # Surtaxé 08
-            "0823456789",  # Surtaxé 08
-            "0834567890",  # Surtaxé 08
-            "0012345678"
-        ]
-        
-        for phone in invalid_phones:
-            invalid_data = {
-                "profile": {
-                    "firstname": "Jean",
-                    "lastname": "Dupont",
-                    "email": "jean@test.com",
-                    "phone": phone,
-                    "address": "123 Rue de la Paix, 75001 Paris"
-                }
-            }
-            
-            success, response = self.run_test(
-                f"Phone Validation - Invalid: {phone}",
-                "POST", 
-                "drivers",
-                400,  # Backend validation returns 400
-                data=invalid_data
-            )
-            
-            if success and "téléphone" in str(response):
-                print(f"✅ Phone validation working for: {phone}")
-            else:
-                print(f"❌ Phone validation failed for: {phone}")
-                return False
-        
-        return True
-
-    def test_validation_phone_valid(self):
-        """Test phone validation - should accept valid French phones"""
-        valid_phones = [
-            "0612345678",  # Mobile 06
-            "0787654321",  # Mobile 07
-            "0123456789",  # Fixe 01
-            "0445678901",  # Fixe 04
-            "0987654321"   # Fixe 09
-        ]
-        
-        for phone in valid_phones:
-            valid_data = {
-                "profile": {
-                    "firstname": "Jean",
-                    "lastname": "Dupont",
-                    "email": "jean@test.com",
-                    "phone": phone,
-                    "address": "123 Rue de la Paix, 75001 Paris"
-                }
-            }
-            
-            success, response = self.run_test(
-                f"Phone Validation - Valid: {phone}",
-                "POST",
-                "drivers",
-                200,  # Should succeed
-                data=valid_data
-            )
-            
-            if success and 'id' in response:
-                print(f"✅ Valid phone accepted: {phone}")
-            else:
-                print(f"❌ Valid phone validation failed for: {phone}")
-                return False
-        
-        return True
-
-    def test_validation_names_too_short(self):
-        """Test name validation - should reject names < 2 chars"""
-        invalid_names = [
-            {"firstname": "A", "lastname": "Dupont"},
-            {"firstname": "Jean", "lastname": "B"},
-            {"firstname": "", "lastname": "Dupont"},
-            {"firstname": "Jean", "lastname": ""}
-        ]
-        
-        for names in invalid_names:
-            invalid_data = {
-                "profile": {
-                    "firstname": names["firstname"],
-                    "lastname": names["lastname"],
-                    "email": "jean@test.com",
-                    "phone": "0612345678",
-                    "address": "123 Rue de la Paix, 75001 Paris"
-                }
-            }
-            
-            success, response = self.run_test(
-                f"Name Validation - Invalid: {names['firstname']}/{names['lastname']}",
-                "POST",
-                "drivers", 
-                400,  # Backend validation returns 400
-                data=invalid_data
-            )
-            
-            if success and ("prénom" in str(response) or "nom" in str(response)):
-                print(f"✅ Name validation working for: {names}")
-            else:
-                print(f"❌ Name validation failed for: {names}")
-                return False
-        
-        return True
-
-    def test_siret_api_validation(self):
-        """Test SIRET API validation endpoint"""
-        # Test valid SIRET
-        success1, response1 = self.run_test(
-            "SIRET API - Valid SIRET",
-            "GET",
-            "validate-siret/73282932000074",
-            200
+        response = await api.check(
+            f"{document_type} Upload Endpoint", "POST",
+            f"drivers/{driver_id}/upload-document?document_type={document_type}", 200,
+            files={"file": (f"{document_type}.pdf", b"%PDF-1.4\n%%EOF\n", "application/pdf")}
         )
-        
-        if success1 and response1.get('isValid') and response1.get('isActive'):
-            print("✅ Valid SIRET API test passed")
-        else:
-            print("❌ Valid SIRET API test failed")
-            return False
-        
-        # Test blacklisted SIRET
-        success2, response2 = self.run_test(
-            "SIRET API - Blacklisted SIRET",
-            "GET", 
-            "validate-siret/12345678901234",
-            200
+        assert response["filename"] == f"{document_type}.pdf"
+
+    driver = await api.check("Get Driver", "GET", f"drivers/{driver_id}", 200)
+    assert driver["documents"]["vehicle_insurance"].endswith("vehicle_insurance.pdf")
+
+
+@tester.test("Documents encrypted at rest, streamed back decrypted")
+async def documents_encrypted_at_rest(api):
+    import io
+    import os
+
+    import server
+    import vault
+
+    await server.document_vault.keys.ensure_indexes()
+    driver_id = await create_driver(api)
+    scan = b"%PDF-1.4\n" + os.urandom(vault.CHUNK_SIZE * 2 + 1000)
+    await api.check(
+        "Upload large PDF", "POST", f"drivers/{driver_id}/upload-document?document_type=kbis_document", 200,
+        files={"file": ("kbis.pdf", scan, "application/pdf")}
+    )
+    driver = await api.check("Get Driver", "GET", f"drivers/{driver_id}", 200)
+    path = server.ROOT_DIR / driver["documents"]["kbis_document"]
+    at_rest = path.read_bytes()
+    assert at_rest.startswith(vault.MAGIC) and scan[:64] not in at_rest
+
+    stored = await api.request("GET", f"admin/drivers/{driver_id}/documents/kbis_document", headers=admin_headers())
+    assert stored.status_code == 200 and stored.content == scan
+    assert stored.headers["content-type"] == "application/pdf"
+    data_key = await api.db.data_keys.find_one({"driver_id": driver_id})
+    assert data_key["master_key_id"] == server.document_vault.keys.master_key_id
+
+    # Any flipped bit or missing chunk fails authentication
+    path.write_bytes(at_rest[:-1] + bytes([at_rest[-1] ^ 1]))
+    try:
+        await server.document_vault.read_bytes(path)
+        raise AssertionError("tampered document decrypted")
+    except vault.DecryptionError:
+        pass
+    path.write_bytes(at_rest[:vault.HEADER.size + vault.CHUNK_SIZE + vault.TAG_SIZE])
+    try:
+        await server.document_vault.read_bytes(path)
+        raise AssertionError("truncated document decrypted")
+    except vault.DecryptionError:
+        pass
+
+    # Sources with only read(), returning short reads (SpooledTemporaryFile before 3.11, sockets)
+    class Trickle:
+        def __init__(self, data):
+            self.data = io.BytesIO(data)
+
+        def read(self, size=-1):
+            return self.data.read(min(size, 4096))
+
+    await server.document_vault.write_file(path, driver_id, Trickle(scan))
+    assert await server.document_vault.read_bytes(path) == scan
+
+
+@tester.test("Photo upload - rotated, downscaled, metadata stripped, original kept")
+async def photo_upload_normalized(api):
+    import io
+
+    from PIL import Image
+
+    import images
+    import server
+    import vault
+
+    driver_id = await create_driver(api)
+    exif = Image.Exif()
+    exif[0x0112] = 6  # stored sideways, to be displayed rotated 90°
+    exif[0x010F] = "PhoneMaker"
+    photo = io.BytesIO()
+    Image.new("RGB", (3000, 2000), (200, 180, 160)).save(photo, "JPEG", quality=95, exif=exif.tobytes())
+
+    response = await api.check(
+        "Upload photo without extension", "POST",
+        f"drivers/{driver_id}/upload-document?document_type=identity_card_front", 200,
+        files={"file": ("photo", photo.getvalue(), "application/octet-stream")}
+    )
+    assert response["filename"] == "identity_card_front.jpg"
+    stored = await api.request("GET", f"admin/drivers/{driver_id}/documents/identity_card_front",
+                               headers=admin_headers())
+    assert stored.headers["content-type"] == "image/jpeg"
+    with Image.open(io.BytesIO(stored.content)) as image:
+        assert image.size == (images.MAX_SIDE * 2 // 3, images.MAX_SIDE)
+        assert not image.getexif()
+    originals = list((server.ORIGINALS_DIR / driver_id).iterdir())
+    assert [await server.document_vault.read_bytes(original) for original in originals] == [photo.getvalue()]
+
+    response = await api.check(
+        "Upload PDF without extension", "POST",
+        f"drivers/{driver_id}/upload-document?document_type=proof_of_residence", 200,
+        files={"file": ("scan", b"%PDF-1.4\n%%EOF\n", "application/octet-stream")}
+    )
+    assert response["filename"] == "proof_of_residence.pdf"
+
+    # A damaged photo is stored as sent (encrypted as it is written), without a trip to the pool
+    from unittest import mock
+
+    damaged = b"\xff\xd8\xff\xe0" + b"\x00" * 4096
+    with mock.patch.object(images, "get_pool", side_effect=AssertionError("sent to the pool")):
+        await api.check("Upload damaged photo", "POST",
+                        f"drivers/{driver_id}/upload-document?document_type=identity_card_back", 200,
+                        files={"file": ("back.jpg", damaged, "image/jpeg")})
+    stored = server.UPLOAD_DIR / driver_id / "identity_card_back.jpg"
+    assert stored.read_bytes().startswith(vault.MAGIC)
+    assert await server.document_vault.read_bytes(stored) == damaged
+
+
+@tester.test("Identity photo reused by another driver - flagged for staff")
+async def duplicate_identity_photo(api):
+    import io
+
+    from PIL import Image
+
+    import fingerprints
+
+    def jpeg(image, **options):
+        buffer = io.BytesIO()
+        image.save(buffer, "JPEG", **options)
+        return buffer.getvalue()
+
+    def card():
+        return Image.frombytes("L", (32, 24), os.urandom(32 * 24)).resize((1600, 1200)).convert("RGB")
+
+    scan = card()
+    first, second, third = [
+        await create_driver(api, profile_with(email=f"driver{n}@test.com", phone=f"060000000{n}")) for n in range(3)
+    ]
+    uploads = {
+        first: jpeg(scan, quality=95),
+        second: jpeg(scan.resize((800, 600)), quality=60),  # the same scan, downscaled and recompressed
+        third: jpeg(card(), quality=95),
+    }
+    for driver_id, photo in uploads.items():
+        await api.check(
+            "Upload identity photo", "POST",
+            f"drivers/{driver_id}/upload-document?document_type=identity_card_front", 200,
+            files={"file": ("id.jpg", photo, "image/jpeg")}
         )
-        
-        if success2 and not response2.get('isActive'):
-            print("✅ Blacklisted SIRET API test passed")
-        else:
-            print("❌ Blacklisted SIRET API test failed")
-            return False
-        
-        # Test invalid format SIRET
-        success3, response3 = self.run_test(
-            "SIRET API - Invalid Format",
-            "GET",
-            "validate-siret/123456789",
-            200
+
+    similar = await api.check("Similar documents of the second driver", "GET",
+                              f"admin/drivers/{second}/similar-documents", 200, headers=admin_headers())
+    assert [(s["document_type"], s["similar_to"]["driver_id"]) for s in similar] == \
+        [("identity_card_front", first)], similar
+    assert similar[0]["similar_to"]["distance"] <= fingerprints.RADIUS
+    assert similar[0]["similar_to"]["profile"]["lastname"] == "Dupont"
+    assert await api.check("Nothing like the third driver's", "GET", f"admin/drivers/{third}/similar-documents",
+                           200, headers=admin_headers()) == []
+    await api.check("Staff only", "GET", f"admin/drivers/{second}/similar-documents", 401)
+
+    stored = await api.db.document_fingerprints.find_one({"driver_id": second})
+    assert [match["driver_id"] for match in stored["matches"]] == [first]
+
+
+@tester.test("Dossier export - streamed ZIP with manifest, per driver and per city")
+async def dossier_export(api):
+    import hashlib
+    import io
+    import json
+    import zipfile
+
+    paris = await create_driver(api)
+    other = await create_driver(api, profile_with(email="paul@test.com", phone="0611111111"))
+    lyon = await create_driver(api, profile_with(email="lea@test.com", phone="0622222222",
+                                                 address="3 Rue de la République, 69001 Lyon"))
+    scan = b"%PDF-1.4\n" + os.urandom(600_000)
+    await api.check("Upload document", "POST", f"drivers/{paris}/upload-document?document_type=kbis_document", 200,
+                    files={"file": ("kbis.pdf", scan, "application/pdf")})
+    await api.db.drivers.update_one({"id": paris}, {"$set": {
+        "documents.vehicle_insurance": "uploads/gone/vehicle_insurance.pdf",
+        "documents.civil_liability_insurance": "s3://bucket/documents/rc.pdf",
+    }})
+
+    response = await api.request("GET", f"admin/drivers/{paris}/dossier.zip", headers=admin_headers())
+    assert response.status_code == 200 and response.headers["content-type"] == "application/zip"
+    with zipfile.ZipFile(io.BytesIO(response.content)) as archive:
+        assert archive.testzip() is None
+        assert archive.namelist() == [f"{paris}/kbis_document.pdf", f"{paris}/manifest.json"]
+        assert archive.read(f"{paris}/kbis_document.pdf") == scan
+        manifest = json.loads(archive.read(f"{paris}/manifest.json"))
+    assert manifest["driver"]["id"] == paris and manifest["driver"]["profile"]["city"] == "Paris"
+    documents = {entry["document"]: entry for entry in manifest["documents"]}
+    assert documents["kbis_document"]["sha256"] == hashlib.sha256(scan).hexdigest()
+    assert documents["vehicle_insurance"]["missing"] == "file not found"
+    assert documents["civil_liability_insurance"]["missing"] == "stored outside the server"
+
+    response = await api.request("GET", "admin/dossiers.zip", params={"city": "Paris"}, headers=admin_headers())
+    assert response.status_code == 200
+    with zipfile.ZipFile(io.BytesIO(response.content)) as archive:
+        folders = {name.split("/")[0] for name in archive.namelist()}
+    assert folders == {paris, other} and lyon not in folders, folders
+    await api.check("No driver there", "GET", "admin/dossiers.zip?city=Brest", 404, headers=admin_headers())
+    await api.check("Unknown driver", "GET", "admin/drivers/nobody/dossier.zip", 404, headers=admin_headers())
+    await api.check("Staff only", "GET", f"admin/drivers/{paris}/dossier.zip", 401)
+
+
+@tester.test("Live tracking - batched points, latest position, flush to history")
+async def live_tracking(api):
+    import server
+    import tracking
+
+    tracker = server.location_tracker
+    await tracker.ensure_indexes()
+    driver_id = await create_driver(api)
+    now = datetime.utcnow().replace(microsecond=0)
+    points = [
+        {"lat": 48.8566, "lng": 2.3522, "recorded_at": (now - timedelta(seconds=10)).isoformat(), "speed": 4.2},
+        {"lat": 48.8570, "lng": 2.3530, "recorded_at": (now - timedelta(seconds=5)).isoformat() + "Z"},
+        {"lat": 48.8575, "lng": 2.3540, "recorded_at": (now + timedelta(hours=2)).isoformat()},  # phone clock off
+    ]
+    url = f"drivers/{driver_id}/locations"
+    own = driver_headers(driver_id)
+    await api.check("Unknown driver", "POST", "drivers/nobody/locations", 404, data={"points": points},
+                    headers=driver_headers("nobody"))
+    await api.check("Not active yet", "POST", url, 403, data={"points": points}, headers=own)
+    await api.db.drivers.update_one({"id": driver_id}, {"$set": {"status": "active"}})
+
+    await api.check("Report without token", "POST", url, 401, data={"points": points})
+    await api.check("Report as another driver", "POST", url, 403, data={"points": points},
+                    headers=driver_headers("someone-else"))
+    await api.check("Report as staff", "POST", url, 403, data={"points": points}, headers=admin_headers())
+    response = await api.check("Report points", "POST", url, 202, data={"points": points}, headers=own)
+    assert response == {"accepted": 2}, response
+    location = f"drivers/{driver_id}/location"
+    await api.check("Position without token", "GET", location, 401)
+    await api.check("Position of another driver", "GET", location, 403, headers=driver_headers("someone-else"))
+    position = await api.check("Latest position", "GET", location, 200, headers=own)
+    assert (position["lat"], position["lng"]) == (48.8570, 2.3530), position
+    assert await api.check("Position for staff", "GET", location, 200, headers=admin_headers()) == position
+    await api.check("Bad latitude", "POST", url, 422, data={"points": [{**points[0], "lat": 120}]}, headers=own)
+    await api.check("Batch too large", "POST", url, 422, data={"points": [points[0]] * 501}, headers=own)
+    await api.check("No position yet", "GET", "drivers/nobody/location", 404, headers=admin_headers())
+
+    assert await tracker.flush() >= 2
+    history = await api.db[tracking.COLLECTION].find({"driver_id": driver_id}).to_list(None)
+    assert sorted(point["location"]["coordinates"] for point in history) == [[2.3522, 48.8566], [2.353, 48.857]]
+    stored = await api.db.driver_positions.find_one({"driver_id": driver_id})
+    assert stored["recorded_at"] == now - timedelta(seconds=5)
+    dispatch = await api.check("Dispatch map", "GET", "admin/locations", 200, headers=admin_headers())
+    assert [p["driver_id"] for p in dispatch] == [driver_id], dispatch
+
+    # The database falls behind: points are refused until the buffer drains
+    tracker.max_buffered, max_buffered = 0, tracker.max_buffered
+    try:
+        response = await api.request("POST", url, json={"points": points[:1]}, headers=own)
+        assert response.status_code == 503 and response.headers["retry-after"] == "5", response.text
+    finally:
+        tracker.max_buffered = max_buffered
+
+
+@tester.test("Resumable upload - chunks, resume after a drop, checksum")
+async def resumable_upload(api):
+    import hashlib
+    from datetime import datetime, timedelta
+
+    import server
+    import uploads
+
+    driver_id = await create_driver(api)
+    scan = bytes(range(256)) * 1024
+    session = await api.check("Create session", "POST", f"drivers/{driver_id}/uploads", 200, data={
+        "document_type": "vehicle_insurance", "filename": "assurance.pdf", "size": len(scan),
+        "sha256": hashlib.sha256(scan).hexdigest(),
+    })
+    url = f"drivers/{driver_id}/uploads/{session['id']}"
+    await api.check("Complete too early", "POST", f"{url}/complete", 409)
+    chunk = await api.check("First chunk", "PUT", f"{url}?offset=0", 200, content=scan[:100_000])
+    assert chunk["offset"] == 100_000
+
+    # The client lost the response: it asks where to resume, a stale offset is refused
+    await api.check("Stale offset", "PUT", f"{url}?offset=0", 409, content=scan[:100_000])
+    resume = await api.check("Session status", "GET", url, 200)
+    assert resume["offset"] == 100_000
+    await api.check("Too large", "PUT", f"{url}?offset=100000", 413, content=scan[100_000:] + b"x")
+    resume = await api.check("Session status after overflow", "GET", url, 200)
+    await api.check("Remaining bytes", "PUT", f"{url}?offset={resume['offset']}", 200,
+                    content=scan[resume["offset"]:])
+    done = await api.check("Complete", "POST", f"{url}/complete", 200)
+    assert done["filename"] == "vehicle_insurance.pdf"
+    stored = await api.request("GET", f"admin/drivers/{driver_id}/documents/vehicle_insurance",
+                               headers=admin_headers())
+    assert stored.content == scan
+    await api.check("Session consumed", "GET", url, 404)
+
+    corrupt = await api.check("Session with a wrong checksum", "POST", f"drivers/{driver_id}/uploads", 200, data={
+        "document_type": "kbis_document", "filename": "kbis.pdf", "size": 4, "sha256": "0" * 64,
+    })
+    url = f"drivers/{driver_id}/uploads/{corrupt['id']}"
+    await api.check("Whole file", "PUT", f"{url}?offset=0", 200, content=b"%PDF")
+    await api.check("Checksum mismatch", "POST", f"{url}/complete", 422)
+
+    abandoned = await api.check("Abandoned session", "POST", f"drivers/{driver_id}/uploads", 200, data={
+        "document_type": "kbis_document", "filename": "kbis.pdf", "size": 10,
+    })
+    swept = await uploads.sweep(api.db, server.UPLOAD_DIR, now=datetime.utcnow() + timedelta(days=2))
+    assert swept["sessions"] == 1
+    assert not uploads.part_path(server.UPLOAD_DIR, abandoned["id"]).exists()
+
+
+@tester.test("Direct upload - presigned URL, verified on completion")
+async def direct_upload(api):
+    import hashlib
+
+    import server
+
+    driver_id = await create_driver(api)
+    scan = b"%PDF-1.4\n" + bytes(200_000) + b"%%EOF\n"
+
+    def announce(content, **overrides):
+        return dict({"document_type": "vehicle_insurance", "filename": "assurance.pdf",
+                     "content_type": "application/pdf", "size": len(content),
+                     "sha256": hashlib.sha256(content).hexdigest()}, **overrides)
+
+    await api.check("Unsupported type", "POST", f"drivers/{driver_id}/documents/presign", 415,
+                    data=announce(scan, content_type="text/html"))
+    upload = await api.check("Presign", "POST", f"drivers/{driver_id}/documents/presign", 200, data=announce(scan))
+    assert upload["method"] == "PUT"
+    complete = f"drivers/{driver_id}/documents/{upload['id']}/complete"
+    await api.check("Complete before the PUT", "POST", complete, 409)
+
+    tampered = await api.http.put(upload["url"], content=scan[:-1] + b"!", headers=upload["headers"])
+    assert tampered.status_code == 400, tampered.text
+    forged = await api.http.put(upload["url"], content=scan, headers={"Content-Type": "image/png"})
+    assert forged.status_code == 403, forged.text
+    stored = await api.http.put(upload["url"], content=scan, headers=upload["headers"])
+    assert stored.status_code == 200, stored.text
+
+    done = await api.check("Complete", "POST", complete, 200)
+    assert done["sha256"] == hashlib.sha256(scan).hexdigest()
+    driver = await api.check("Get Driver", "GET", f"drivers/{driver_id}", 200)
+    assert (server.ROOT_DIR / driver["documents"]["vehicle_insurance"]).read_bytes() == scan
+    await api.check("Completed once", "POST", complete, 404)
+
+    # Signed for a PDF, but the bytes are not one: refused and deleted on completion
+    fake = b"<html>" + bytes(100)
+    upload = await api.check("Presign fake PDF", "POST", f"drivers/{driver_id}/documents/presign", 200,
+                             data=announce(fake))
+    assert (await api.http.put(upload["url"], content=fake, headers=upload["headers"])).status_code == 200
+    rejected = await api.check("Complete fake PDF", "POST", f"drivers/{driver_id}/documents/{upload['id']}/complete",
+                               422)
+    assert "content type" in rejected["detail"]
+
+
+@tester.test("KYC contract - PDF rendered and stored")
+async def kyc_contract_generation(api):
+    import server
+
+    driver_id = await create_driver(api)
+    await api.check("Generate before approval", "POST", f"drivers/{driver_id}/generate-kyc-contract", 400)
+    await api.check("Approve driver", "PUT", f"drivers/{driver_id}", 200, data={"status": "approved"})
+    response = await api.check("Generate KYC contract", "POST", f"drivers/{driver_id}/generate-kyc-contract", 200)
+    assert response["contract_data"]["address"] == "123 Rue de la Paix, 75001 Paris, France"
+    pdf = await server.document_vault.read_bytes(server.ROOT_DIR / response["document"])
+    assert pdf.startswith(b"%PDF-1.4") and pdf.rstrip().endswith(b"%%EOF")
+    assert response["document"].endswith(f"kyc_contract_{response['sha256'][:16]}.pdf")
+
+    assert response["status"] == "contract_pending"
+    kyc = await api.check("KYC status", "GET", f"drivers/{driver_id}/kyc-status", 200)
+    assert kyc["kyc_status"]["contract_generated"] and kyc["kyc_status"]["account_status"] == "contract_pending"
+
+    # Changed while the contract renders: 409, nothing overwritten and no events
+    import contracts
+    from unittest import mock
+
+    other = await create_driver(api, profile_with(email="rendu@test.com", phone="0698765421"))
+    await api.check("Approve driver", "PUT", f"drivers/{other}", 200, data={"status": "approved"})
+    render = contracts.generate_contract
+
+    async def changed_meanwhile(driver, *args, **kwargs):
+        if driver["id"] != other:  # tests run concurrently, with the module patched for all
+            return await render(driver, *args, **kwargs)
+        await api.check("Commission rate", "PUT", f"admin/drivers/{other}/commission-rate", 200,
+                        data={"commission_rate": 10.0}, headers=admin_headers())
+        await api.db.drivers.update_one({"id": other}, {"$set": {"status": "rejected"}})
+        return await render(driver, *args, **kwargs)
+
+    with mock.patch.object(contracts, "generate_contract", changed_meanwhile):
+        await api.check("Generate for a driver rejected meanwhile", "POST", f"drivers/{other}/generate-kyc-contract", 409)
+    driver = await api.db.drivers.find_one({"id": other})
+    assert driver["status"] == "rejected" and driver["contract"]["commission_rate"] == 10.0
+    assert not driver["contract"]["kyc_contract_generated"]
+    assert await api.db.outbox.count_documents({"driver_id": other, "type": "driver.kyc_contract_generated"}) == 0
+
+
+@tester.test("KYC contract - Batch generation for approved drivers")
+async def kyc_contract_batch(api):
+    approved = [await create_driver(api, profile_with(email=f"jean{i}@test.com", phone=f"061234567{i}"))
+                for i in range(3)]
+    for driver_id in approved[:2]:
+        await api.check("Approve driver", "PUT", f"drivers/{driver_id}", 200, data={"status": "approved"})
+    admin = admin_headers()
+    result = await api.check("Batch generate", "POST", "admin/kyc-contracts/generate", 200, headers=admin)
+    assert result == {"generated": 2, "failed": 0}, result
+    result = await api.check("Batch generate again", "POST", "admin/kyc-contracts/generate", 200, headers=admin)
+    assert result["generated"] == 0
+
+    # Rejected while its contract renders: not overwritten, and no events
+    import contracts
+    import server
+    from unittest import mock
+
+    rejected = await create_driver(api, profile_with(email="rejet@test.com", phone="0698765431"))
+    await api.check("Approve driver", "PUT", f"drivers/{rejected}", 200, data={"status": "approved"})
+    render = contracts.generate_contract
+
+    async def rejected_meanwhile(driver, *args, **kwargs):
+        if driver["id"] == rejected:  # tests run concurrently, with the module patched for all
+            await api.db.drivers.update_one({"id": driver["id"]}, {"$set": {"status": "rejected"}})
+        return await render(driver, *args, **kwargs)
+
+    with mock.patch.object(contracts, "generate_contract", rejected_meanwhile):
+        result = await contracts.generate_pending_contracts(api.db, server.UPLOAD_DIR, server.ROOT_DIR)
+    assert result == {"generated": 0, "failed": 0}, result
+    assert (await api.db.drivers.find_one({"id": rejected}))["status"] == "rejected"
+    assert await api.db.outbox.count_documents({"driver_id": rejected, "type": "driver.kyc_contract_generated"}) == 0
+
+
+@tester.test("Events - Lifecycle changes delivered from the outbox")
+async def outbox_events(api):
+    import events
+
+    driver_id = await create_driver(api)
+    await api.check("Approve driver", "PUT", f"drivers/{driver_id}", 200, data={"status": "approved"})
+    await api.check("Generate KYC contract", "POST", f"drivers/{driver_id}/generate-kyc-contract", 200)
+    response = await api.check("Confirm signature", "POST", f"drivers/{driver_id}/confirm-kyc-signature", 200)
+    assert response["message"].startswith("Contrat KYC validé")
+
+    bus, webhook = events.EventBus(), events.WebhookSink()
+    queue = bus.subscribe()
+    dispatcher = events.OutboxDispatcher(lambda: api.db, [bus, webhook], batch_size=4)
+    assert (await dispatcher.metrics())["sinks"]["bus"]["lag_events"] == 7
+    assert await dispatcher.dispatch_once() == 0  # not settled yet
+    settled = datetime.utcnow() + timedelta(seconds=3)
+    while await dispatcher.dispatch_once(now=settled):
+        pass
+    types = [event["type"] for event in webhook.delivered]
+    assert types == [
+        "driver.created", "driver.updated", "driver.status_changed", "driver.kyc_contract_generated",
+        "driver.status_changed", "driver.kyc_contract_signed", "driver.status_changed",
+    ], types
+    assert queue.qsize() == 7
+    assert webhook.delivered[-1]["payload"] == {"previous": "contract_pending", "status": "active"}
+    metrics = await dispatcher.metrics()
+    assert all(sink["lag_events"] == 0 and sink["delivered"] == 7 for sink in metrics["sinks"].values()), metrics
+
+    # Another worker's event, written late in a second already seen, sorts before a delivered one
+    from bson import ObjectId
+
+    now = settled + timedelta(seconds=10)
+    second = ObjectId.from_datetime(now).binary[:4]
+    await api.db.outbox.insert_one({**events.driver_event("driver.updated", driver_id, fields=["late"]),
+                                    "_id": ObjectId(second + b"\xff" * 8), "created_at": now - timedelta(seconds=5)})
+    assert await dispatcher.dispatch_once(now=now) == 0
+    await api.db.outbox.insert_one({**events.driver_event("driver.updated", driver_id, fields=["later"]),
+                                    "_id": ObjectId(second + b"\x00" * 8)})
+    assert await dispatcher.dispatch_once(now=now + timedelta(seconds=3)) == 4
+    assert [event["payload"]["fields"] for event in webhook.delivered[7:]] == [["later"], ["late"]]
+
+    # Pruned once old and consumed by every sink
+    expired = now + events.OUTBOX_RETENTION + timedelta(days=1)
+    lagging = events.OutboxDispatcher(lambda: api.db, [bus, webhook, events.WebhookSink()])
+    lagging.sinks[-1].name = "new-sink"
+    assert await lagging.prune(now=expired) == 0
+    assert await dispatcher.prune(now=now) == 0
+    assert await dispatcher.prune(now=expired) == 9
+
+
+
+@tester.test("Live events - Status changes pushed to the dashboard stream")
+async def live_driver_events(api):
+    import live
+
+    driver_id = await create_driver(api)
+    await api.check("Events of unknown driver", "GET", "drivers/unknown/events", 404)
+    hub = live.DriverEventHub(lambda: api.db, per_driver=1)
+    queue = hub.subscribe(driver_id)
+    try:
+        hub.subscribe(driver_id)
+        raise AssertionError("per-driver subscriber limit not enforced")
+    except live.HubFull:
+        pass
+
+    await hub.poll_once(api.db)  # first subscriber: starts from the newest event
+    await api.check("Approve driver", "PUT", f"drivers/{driver_id}", 200, data={"status": "approved"})
+    assert await hub.poll_once(api.db) == 2 and await hub.poll_once(api.db) == 0
+    stream = hub.stream(driver_id, queue)
+    chunks = [await stream.__anext__() for _ in range(3)]
+    assert chunks[0].startswith("retry:") and "event: driver.updated" in chunks[1], chunks
+    assert "event: driver.status_changed" in chunks[2] and '"status": "approved"' in chunks[2], chunks
+    await stream.aclose()
+    assert hub.count == 0 and not hub.subscribers
+
+
+@tester.test("Notifications - Contract emails sent with retries and dead-lettering")
+async def notification_worker(api):
+    import events
+    import notifications
+
+    await notifications.ensure_indexes(api.db)
+    driver_id = await create_driver(api)
+    await api.check("Approve driver", "PUT", f"drivers/{driver_id}", 200, data={"status": "approved"})
+    await api.check("Generate KYC contract", "POST", f"drivers/{driver_id}/generate-kyc-contract", 200)
+
+    email, sms = notifications.FakeProvider("email", fail=1), notifications.FakeProvider("sms", fail=10)
+    worker = notifications.NotificationWorker(lambda: api.db, {"email": email, "sms": sms},
+                                              max_attempts=2, backoff=0)
+    sink = notifications.NotificationSink(lambda: api.db, on_queued=worker.wake)
+    outbox = await api.db.outbox.find().sort("_id", 1).to_list(None)
+    await sink.send(outbox)
+    await sink.send(outbox)  # at-least-once redelivery queues nothing new
+    assert await api.db.notifications.count_documents({}) == 3
+
+    assert await worker.process_once() == {"sent": 1, "failed": 2, "skipped": 0}
+    assert await worker.process_once() == {"sent": 1, "failed": 1, "skipped": 0}
+    assert await worker.process_once() == {"sent": 0, "failed": 0, "skipped": 0}
+    assert sorted(message["template"] for message in email.sent) == ["kyc_contract", "status_approved"]
+    contract_email = next(message for message in email.sent if message["template"] == "kyc_contract")
+    assert contract_email["subject"] == "Votre contrat de prestation Pikkle"
+    assert contract_email["body"].startswith("Bonjour Jean,") and contract_email["attachment"].endswith(".pdf")
+    assert await worker.metrics() == {"email": {"sent": 2}, "sms": {"dead": 1}}
+
+    # Without an SMS provider, SMS are closed as skipped instead of piling up as pending
+    await notifications.enqueue(api.db, [notifications.notification(
+        "event-without-provider", driver_id, "account_active", "sms", "0612345678", {"firstname": "Jean"})])
+    email_only = notifications.NotificationWorker(lambda: api.db, {"email": email})
+    assert await email_only.process_once() == {"sent": 0, "failed": 0, "skipped": 1}
+    skipped = await api.db.notifications.find_one({"event_id": "event-without-provider"})
+    assert skipped["status"] == "skipped" and skipped["finished_at"]
+    # Finished notifications, sent, skipped or dead, expire after the retention period
+    assert await api.db.notifications.count_documents({"finished_at": None}) == 0
+    indexes = await api.db.notifications.index_information()
+    assert any(index["key"] == [("finished_at", 1)] and index.get("expireAfterSeconds") == 30 * 24 * 3600
+               for index in indexes.values())
+
+    # Over SMTP the contract, encrypted at rest, is attached decrypted
+    import server
+    from unittest import mock
+
+    with mock.patch.dict(os.environ, {"SMTP_HOST": ""}):
+        assert notifications.providers_from_env(server.ROOT_DIR) == {}  # nothing faked outside tests
+
+    smtp = mock.MagicMock()
+    with mock.patch.object(notifications.smtplib, "SMTP", return_value=smtp):
+        provider = notifications.SmtpProvider("smtp.test", server.ROOT_DIR, document_vault=server.document_vault)
+        assert await provider.send_batch([contract_email]) == [None]
+    sent = smtp.__enter__.return_value.send_message.call_args.args[0]
+    attachment = next(sent.iter_attachments())
+    assert attachment.get_content().startswith(b"%PDF-1.4")
+
+
+@tester.test("Search - Drivers found by name, email, phone or SIRET")
+async def driver_search(api):
+    helene = await create_driver(api, profile_with(
+        firstname="Hélène", lastname="Dupré", email="Helene.Dupre@test.com", phone="06 11 22 33 44"))
+    dupont = await create_driver(api)
+    await api.check("Add SIRET", "PUT", f"drivers/{dupont}", 200,
+                    data={"business_info": {"siret": "732 829 320 00074", "company_name": "Jean Dupont EI",
+                                            "business_address": "123 Rue de la Paix, 75001 Paris"}})
+
+    admin = admin_headers()
+
+    async def ids(q):
+        return [driver["id"] for driver in await api.check(f"Search {q!r}", "GET", "admin/drivers/search", 200,
+                                                            params={"q": q}, headers=admin)]
+
+    assert await ids("helene") == [helene]
+    assert set(await ids("DUP")) == {helene, dupont}
+    assert await ids("dupre") == [helene]  # exact name match ranks first
+    assert await ids("jean dup") == [dupont]
+    assert await ids("06 11 22") == [helene] and await ids("+33611") == [helene]
+    assert await ids("helene.dupre@test") == [helene]
+    assert await ids("732829320") == [dupont]
+    assert await ids("martin") == []
+    await api.check("Query too short", "GET", "admin/drivers/search", 400, params={"q": "a"}, headers=admin)
+
+
+@tester.test("Analytics - Funnel served from daily rollups")
+async def registration_funnel(api):
+    import analytics
+
+    paris = await create_driver(api)
+    await create_driver(api, profile_with(email="marie@test.com", phone="0698765432",
+                                          address="5 Quai Saint-Antoine, 69002 Lyon"))
+    for step in (2, 3, 4):
+        await api.check(f"Step {step}", "PUT", f"drivers/{paris}", 200, data={"registration_step": step})
+    await api.check("Jump to step 6", "PUT", f"drivers/{paris}", 200,
+                    data={"registration_step": 6, "status": "under_review"})
+
+    sink = analytics.RollupSink(lambda: api.db)
+    outbox = await api.db.outbox.find().sort("_id", 1).to_list(None)
+    await sink.send(outbox)
+    await sink.send(outbox)  # redelivery is not counted twice
+
+    admin = admin_headers()
+    report = await api.check("Funnel", "GET", "admin/funnel", 200, headers=admin)
+    assert report["created"] == 2
+    assert [step["drivers"] for step in report["steps"]] == [2, 1, 1, 1, 1, 1], report["steps"]
+    assert report["steps"][1]["from_previous"] == 50.0
+    assert report["statuses"] == {"pending": 2, "under_review": 1}
+    assert report["cities"] == {"Paris": {"created": 1, "completed": 1}, "Lyon": {"created": 1, "completed": 0}}
+    lyon_only = await api.check("Funnel for Lyon", "GET", "admin/funnel", 200, params={"city": "Lyon"},
+                                headers=admin)
+    assert lyon_only["created"] == 1 and lyon_only["steps"][1]["drivers"] == 0
+    await api.check("Invalid period", "GET", "admin/funnel", 400,
+                    params={"start": "2026-10-02", "end": "2026-10-01"}, headers=admin)
+
+    frame = analytics.export_frame(await api.db.stats_daily.find().to_list(None))
+    totals = frame[(frame.city == "*") & (frame.metric == "step")].set_index("key")["count"]
+    assert totals.to_dict() == {"1": 2, "2": 1, "3": 1, "4": 1, "5": 1, "6": 1}
+
+
+@tester.test("Address - Postal code checked against the gazetteer")
+async def postal_code_gazetteer(api):
+    driver_id = await create_driver(api, profile_with(address="10 bis Rue de Lyon, 42000 St-Étienne"))
+    profile = (await api.check("Get Driver", "GET", f"drivers/{driver_id}", 200))["profile"]
+    assert {key: profile[key] for key in ("street_number", "street_name", "postal_code", "city", "country")} == {
+        "street_number": "10 bis", "street_name": "Rue de Lyon", "postal_code": "42000",
+        "city": "Saint Etienne", "country": "France"}
+    moved = profile_with(address="4 Place Bellecour 69002")
+    profile = (await api.check("Move", "PUT", f"drivers/{driver_id}", 200, data=moved))["profile"]
+    assert (profile["postal_code"], profile["city"]) == ("69002", "Lyon")
+    await api.check("Postcode of another city", "POST", "drivers", 400,
+                    data=profile_with(email="bordeaux@test.com", phone="0612121212",
+                                      address="10 Rue Sainte-Catherine, 33000 Lyon"))
+
+
+@tester.test("Address - Full gazetteer fetched at deploy time, cached outside the source tree")
+async def gazetteer_fetch(api):
+    import tempfile
+    from pathlib import Path
+    from unittest import mock
+
+    import httpx
+
+    import gazetteer
+
+    # As served by La Poste: Latin-1, extra columns
+    export = ("#Code_commune_INSEE;Nom_de_la_commune;Code_postal;Libellé_d_acheminement;Ligne_5\n"
+              "42218;SAINT-ÉTIENNE;42000;ST ETIENNE;\n"
+              + "".join(f"{code:05d};COMMUNE {code};{code:05d};COMMUNE {code};\n" for code in range(1000, 7000))
+              ).encode("latin-1")
+
+    def download(content):
+        return mock.patch.object(httpx, "get", return_value=httpx.Response(
+            200, content=content, request=httpx.Request("GET", gazetteer.SOURCE_URL)))
+
+    with tempfile.TemporaryDirectory() as source, tempfile.TemporaryDirectory() as cache, \
+            mock.patch.dict(os.environ, {"GAZETTEER_CACHE_DIR": cache}):
+        output = Path(source) / "laposte_hexasmal_full.csv"
+        with download(export):
+            full = gazetteer.fetch(output=output)
+        assert full.serves("42000", "Saint-Étienne") and full.cities("06999") == ["Commune 6999"]
+        assert os.listdir(source) == [output.name], "nothing written next to the source file"
+        assert len(os.listdir(cache)) == 1
+        with mock.patch.object(gazetteer.Gazetteer, "parse", side_effect=AssertionError("cache not used")):
+            assert gazetteer.Gazetteer.load(output).cities("06999") == ["Commune 6999"]
+
+        # A truncated download is refused and the installed file kept
+        with download(export[:2000]):
+            try:
+                gazetteer.fetch(output=output)
+                raise AssertionError("partial file installed")
+            except ValueError:
+                pass
+        assert output.read_text(encoding="utf-8").count("\n") == 6002
+
+
+@tester.test("Compliance - Expiring documents reminded, expired ones suspend")
+async def compliance_sweep(api):
+    import compliance
+    import notifications
+
+    driver_id = await create_driver(api)
+    expires_on = date.today() + timedelta(days=20)
+    upload = f"drivers/{driver_id}/upload-document?document_type=vehicle_insurance"
+    insurance = {"file": ("insurance.pdf", b"%PDF-1.4\n%%EOF\n", "application/pdf")}
+    await api.check("Expired upload", "POST", f"{upload}&expires_at=2020-01-01", 400, files=insurance)
+    await api.check("Upload with expiry", "POST", f"{upload}&expires_at={expires_on}", 200, files=insurance)
+    await api.check("Activate", "PUT", f"drivers/{driver_id}", 200, data={"status": "active"})
+    expires_at = compliance.expiry_datetime(expires_on)
+    driver = await api.db.drivers.find_one({"id": driver_id})
+    # The 30-day reminder was already past at upload time
+    assert driver["compliance_check_at"] == expires_at - timedelta(days=7)
+
+    assert await compliance.sweep(api.db, now=expires_at - timedelta(days=8)) == {
+        "drivers": 0, "reminders": 0, "suspended": 0}
+    assert await compliance.sweep(api.db, now=expires_at - timedelta(days=6)) == {
+        "drivers": 1, "reminders": 1, "suspended": 0}
+    # Reinstated by staff while the sweep reviews it: no suspension, reviewed again next sweep
+    from unittest import mock
+
+    commit = compliance.events.commit
+
+    async def reinstated_meanwhile(db, write, outbox):
+        await db.drivers.update_one({"id": driver_id}, {"$set": {"status": "approved"}})
+        return await commit(db, write, outbox)
+
+    with mock.patch.object(compliance.events, "commit", reinstated_meanwhile):
+        assert await compliance.sweep(api.db, now=expires_at + timedelta(hours=1)) == {
+            "drivers": 1, "reminders": 0, "suspended": 0}
+    assert await api.db.outbox.count_documents({"driver_id": driver_id, "payload.status": "suspended"}) == 0
+    assert await compliance.sweep(api.db, now=expires_at + timedelta(hours=1)) == {
+        "drivers": 1, "reminders": 0, "suspended": 1}
+    driver = await api.db.drivers.find_one({"id": driver_id})
+    assert driver["status"] == "suspended" and driver["compliance_check_at"] is None
+    assert await compliance.sweep(api.db, now=expires_at + timedelta(days=1)) == {
+        "drivers": 0, "reminders": 0, "suspended": 0}
+
+    await notifications.ensure_indexes(api.db)
+    await notifications.NotificationSink(lambda: api.db).send(await api.db.outbox.find().to_list(None))
+    queued = {(n["template"], n["channel"]): n async for n in api.db.notifications.find({"driver_id": driver_id})}
+    assert set(queued) >= {("document_expiring", "email"), ("account_suspended", "email")}
+    assert f"expire le {expires_on:%d/%m/%Y}" in queued["document_expiring", "sms"]["body"]
+    assert queued["document_expiring", "email"]["subject"] == "Votre document « Assurance véhicule » expire bientôt"
+
+
+@tester.test("Compliance - Driver awaiting the contract is suspended on expiry")
+async def compliance_contract_pending(api):
+    import compliance
+
+    driver_id = await create_driver(api, profile_with(email="attente.contrat@test.com", phone="0611224455"))
+    expires_on = date.today() + timedelta(days=3)
+    upload = f"drivers/{driver_id}/upload-document?document_type=vehicle_insurance&expires_at={expires_on}"
+    insurance = {"file": ("insurance.pdf", b"%PDF-1.4\n%%EOF\n", "application/pdf")}
+    await api.check("Upload with expiry", "POST", upload, 200, files=insurance)
+    # As stored by contracts.contract_update once the KYC contract is generated
+    await api.db.drivers.update_one({"id": driver_id}, {"$set": {"status": "contract_pending"}})
+
+    expires_at = compliance.expiry_datetime(expires_on)
+    assert await compliance.sweep(api.db, now=expires_at + timedelta(hours=1)) == {
+        "drivers": 1, "reminders": 0, "suspended": 1}
+    assert (await api.db.drivers.find_one({"id": driver_id}))["status"] == "suspended"
+
+
+@tester.test("Auth - Driver login, bearer tokens and admin routes")
+async def authentication(api):
+    from unittest import mock
+
+    import auth
+    import server
+
+    await auth.ensure_indexes(api.db)
+    driver_id = await create_driver(api)
+    account = {"email": "jean.dupont@test.com", "password": "s3cret-pass"}
+    await api.check("Password too short", "POST", "auth/register", 400, data={**account, "password": "short"})
+    await api.check("Unknown driver", "POST", "auth/register", 404, data={**account, "email": "nobody@test.com"})
+    await api.check("Register", "POST", "auth/register", 202, data=account)
+    await api.check("Login before confirming", "POST", "auth/login", 401, data=account)
+    await api.check("Register again", "POST", "auth/register", 202, data=account)
+    sent = await api.db.notifications.find(
+        {"driver_id": driver_id, "template": "account_verification"}).sort("created_at", 1).to_list(None)
+    assert [message["to"] for message in sent] == ["jean.dupont@test.com"] * 2
+    first, code = (message["body"].split("\n\n")[2].strip() for message in sent)
+    await api.check("Superseded code", "POST", "auth/register/confirm", 400, data={"token": first})
+    await api.check("Wrong code", "POST", "auth/register/confirm", 400, data={"token": "guess"})
+    await api.check("Confirm", "POST", "auth/register/confirm", 200, data={"token": code})
+    await api.check("Code used twice", "POST", "auth/register/confirm", 400, data={"token": code})
+    await api.check("Register twice", "POST", "auth/register", 400, data=account)
+    await api.check("Wrong password", "POST", "auth/login", 401, data={**account, "password": "wrong-pass"})
+    await api.check("Unknown account", "POST", "auth/login", 401, data={**account, "email": "nobody@test.com"})
+    token = (await api.check("Login", "POST", "auth/login", 200,
+                             data={**account, "email": "Jean.Dupont@test.com"}))["access_token"]
+
+    bearer = {"Authorization": f"Bearer {token}"}
+    hits = server.token_service.hits
+    me = await api.check("Me", "GET", "auth/me", 200, headers=bearer)
+    assert me["role"] == "driver" and me["driver_id"] == driver_id
+    await api.check("Me again", "GET", "auth/me", 200, headers=bearer)
+    assert server.token_service.hits > hits  # the second request skipped signature verification
+    await api.check("No token", "GET", "auth/me", 401)
+    await api.check("Forged token", "GET", "auth/me", 401, headers={"Authorization": f"Bearer {token[:-2]}xx"})
+    await api.check("Admin route without token", "GET", "admin/funnel", 401)
+    await api.check("Admin route as driver", "GET", "admin/funnel", 403, headers=bearer)
+
+    # Outside development every worker must share the signing secret
+    with mock.patch.dict(os.environ, {"JWT_SECRET": "", "JWT_ALGORITHM": "HS256"}):
+        try:
+            auth.TokenService.from_env()
+            assert False, "started without JWT_SECRET"
+        except RuntimeError:
+            pass
+        assert auth.TokenService.from_env(development=True)
+
+
+@tester.test("Jobs - Forked workers hold leases under their own id")
+async def job_lease_per_worker(api):
+    from unittest import mock
+
+    import jobs
+
+    master = jobs.worker_id()
+    assert jobs.worker_id() == master
+    assert await jobs.acquire_lease(api.db, "job:test", timedelta(minutes=5))
+    # A worker forked from the master: same module state, another pid
+    with mock.patch.object(jobs.os, "getpid", return_value=os.getpid() + 1):
+        assert jobs.worker_id() != master
+        assert not await jobs.acquire_lease(api.db, "job:test", timedelta(minutes=5))
+
+
+# PHASE 5: Validation Security Tests
+
+@tester.test("Email Jetable - Should REJECT")
+async def validation_disposable_emails(api):
+    for email in ["test@10minutemail.com", "user@guerrillamail.com", "fake@tempmail.org",
+                  "test@mailinator.com", "user@yopmail.com", "test@fake-domain-xyz.com"]:
+        response = await api.check(
+            f"Disposable Email Validation - Should Reject: {email}", "POST", "drivers", 400,
+            data=profile_with(email=email)
         )
-        
-        if success3 and not response3.get('isValid'):
-            print("✅ Invalid format SIRET API test passed")
-        else:
-            print("❌ Invalid format SIRET API test failed")
-            return False
-        
-        return True
-
-    def test_validation_positive_cases(self):
-        """Test that valid data passes validation"""
-        valid_data = {
-            "profile": {
-                "firstname": "Jean",
-                "lastname": "Dupont",
-                "email": "jean.dupont@gmail.com", 
-                "phone": "0612345678",
-                "address": "123 Rue de la Paix, 75001 Paris"
-            }
-        }
-        
-        success, response = self.run_test(
-            "Valid Data - Should Pass",
-            "POST",
-            "drivers",
-            200,
-            data=valid_data
+        assert "jetable" in str(response), f"Disposable email not blocked: {email}"
+
+
+@tester.test("Email invalide - Should REJECT")
+async def validation_email_invalid(api):
+    for email in ["test", "test@", "@test.com", "test.com", "test@test"]:
+        # Pydantic validation returns 422
+        response = await api.check(
+            f"Email Validation - Invalid: {email}", "POST", "drivers", 422, data=profile_with(email=email)
         )
-        
-        if success and 'id' in response:
-            # Test valid SIRET update
-            valid_siret_data = {
-                "business_info": {
-                    "siret": "12345678901234",
-                    "company_name": "Jean Dupont Auto-Entrepreneur", 
-                    "business_address": "123 Rue de la Paix, 75001 Paris"
-                }
-            }
-            
-            success2, _ = self.run_test(
-                "Valid SIRET - Should Pass",
-                "PUT",
-                f"drivers/{response['id']}",
-                200,
-                data=valid_siret_data
-            )
-            
-            return success2
-        
-        return False
-
-    def test_bypass_prevention(self):
-        """Test that validation cannot be bypassed"""
-        # Try to create with random data like "aaa", "bbb", "ccc"
-        bypass_data = {
-            "profile": {
-                "firstname": "aaa",
-                "lastname": "bbb", 
-                "email": "ccc",
-                "phone": "ddd",
-                "address": "fake address"
-            }
-        }
-        
-        success, response = self.run_test(
-            "Bypass Prevention - Random Data",
-            "POST",
-            "drivers",
-            422,  # Should fail with validation error
-            data=bypass_data
+        assert "email" in str(response), f"Email validation failed for: {email}"
+
+
+@tester.test("Phone Surtaxé / invalide - Should REJECT")
+async def validation_phone_invalid(api):
+    for phone in ["123", "+33123456789", "1234567890", "0812345678", "0823456789", "0834567890", "0012345678"]:
+        response = await api.check(
+            f"Phone Validation - Invalid: {phone}", "POST", "drivers", 400,
+            data=profile_with(email="jean@test.com", phone=phone)
+        )
+        assert "téléphone" in str(response), f"Phone validation failed for: {phone}"
+
+
+@tester.test("Phone Valid - Should ACCEPT")
+async def validation_phone_valid(api):
+    for index, phone in enumerate(["0612345678", "0787654321", "0123456789", "0445678901", "0987654321"]):
+        # Distinct emails, otherwise the uniqueness check rejects the second driver
+        response = await api.check(
+            f"Phone Validation - Valid: {phone}", "POST", "drivers", 200,
+            data=profile_with(email=f"jean{index}@test.com", phone=phone)
+        )
+        assert 'id' in response, f"Valid phone rejected: {phone}"
+
+
+@tester.test("SIRET API Validation")
+async def siret_api_validation(api):
+    response = await api.check("SIRET API - Valid SIRET", "GET", "validate-siret/73282932000074", 200)
+    assert response.get('isValid') and response.get('isActive'), "Valid SIRET API test failed"
+
+    response = await api.check("SIRET API - Blacklisted SIRET", "GET", "validate-siret/12345678901234", 200)
+    assert not response.get('isActive'), "Blacklisted SIRET API test failed"
+
+    response = await api.check("SIRET API - Invalid Format", "GET", "validate-siret/123456789", 200)
+    assert not response.get('isValid'), "Invalid format SIRET API test failed"
+
+
+@tester.test("Name Validation - Too short")
+async def validation_names_too_short(api):
+    for names in [{"firstname": "A", "lastname": "Dupont"}, {"firstname": "Jean", "lastname": "B"},
+                  {"firstname": "", "lastname": "Dupont"}, {"firstname": "Jean", "lastname": ""}]:
+        response = await api.check(
+            f"Name Validation - Invalid: {names['firstname']}/{names['lastname']}", "POST", "drivers", 400,
+            data=profile_with(email="jean@test.com", **names)
         )
-        
-        if success and "email" in str(response):
-            print("✅ Bypass prevention working - random data rejected")
-            return True
-        else:
-            print("❌ Bypass prevention failed - random data accepted")
-            return False
-
-def main():
-    print("🚀 Starting Pikkles API Backend Tests")
-    print("=" * 50)
-    
-    # Setup
-    tester = PikklesAPITester()
-    
-    # Run basic endpoint tests
-    print("\n📋 PHASE 1: Basic API Tests")
-    tester.test_health_check()
-    tester.test_api_root()
-    
-    # Run driver CRUD tests
-    print("\n📋 PHASE 2: Driver CRUD Tests - 6 Steps Flow")
-    if tester.test_create_driver_step1():
-        tester.test_get_driver()
-        tester.test_update_driver_step2()
-        tester.test_update_driver_step3_insurance()
-        tester.test_update_driver_step4_siret()
-        tester.test_update_driver_step5_bank()
-        tester.test_update_driver_step6_final()
-        
-        # Test dashboard endpoints with insurance info
-        print("\n📋 PHASE 3: Dashboard API Tests")
-        tester.test_get_driver_stats()
-        tester.test_get_driver_payments()
-        
-        # Test new insurance and SIRET functionality
-        print("\n📋 PHASE 4: New Features Tests")
-        tester.test_siret_validation()
-        tester.test_insurance_document_upload()
-    else:
-        print("❌ Driver creation failed, skipping dependent tests")
-    
-    # Run validation tests
-    print("\n📋 PHASE 5: Validation Security Tests")
-    print("\n🔒 Phase 5.1: Email Jetable Tests (Should REJECT)")
-    tester.test_validation_disposable_emails()
-    
-    print("\n🔒 Phase 5.2: Phone Surtaxé Tests (Should REJECT)")
-    tester.test_validation_email_invalid()
-    tester.test_validation_phone_invalid()
-    
-    print("\n🔒 Phase 5.3: Phone Valid Tests (Should ACCEPT)")
-    tester.test_validation_phone_valid()
-    
-    print("\n🔒 Phase 5.4: SIRET API Validation Tests")
-    tester.test_siret_api_validation()
-    
-    print("\n🔒 Phase 5.5: Other Validation Tests")
-    tester.test_validation_names_too_short()
-    tester.test_validation_positive_cases()
-    tester.test_bypass_prevention()
-    
-    # Run error handling tests
-    print("\n📋 PHASE 6: Error Handling Tests")
-    tester.test_get_nonexistent_driver()
-    
-    # Print final results
-    print("\n" + "=" * 50)
-    print(f"📊 FINAL RESULTS")
-    print(f"Tests passed: {tester.tests_passed}/{tester.tests_run}")
-    
-    if tester.tests_passed == tester.tests_run:
-        print("🎉 All tests passed!")
-        return 0
-    else:
-        print(f"⚠️  {tester.tests_run - tester.tests_passed} tests failed")
-        return 1
+        assert "prénom" in str(response) or "nom" in str(response), f"Name validation failed for: {names}"
+
+
+@tester.test("Valid Data - Should Pass")
+async def validation_positive_cases(api):
+    driver_id = await create_driver(api, profile_with(email="jean.dupont@gmail.com"))
+    await api.check("Valid SIRET - Should Pass", "PUT", f"drivers/{driver_id}", 200, data={
+        "business_info": {
+            "siret": "12345678901234",
+            "company_name": "Jean Dupont Auto-Entrepreneur",
+            "business_address": "123 Rue de la Paix, 75001 Paris"
+        }
+    })
+
+
+@tester.test("Bypass Prevention - Random Data")
+async def bypass_prevention(api):
+    response = await api.check("Bypass Prevention - Random Data", "POST", "drivers", 422, data={
+        "profile": {
+            "firstname": "aaa",
+            "lastname": "bbb",
+            "email": "ccc",
+            "phone": "ddd",
+            "address": "fake address"
+        }
+    })
+    assert "email" in str(response), "Bypass prevention failed - random data accepted"
+
+
+@tester.test("Duplicate email is rejected")
+async def duplicate_email(api):
+    await create_driver(api)
+    response = await api.check("Duplicate email", "POST", "drivers", 400,
+                               data=profile_with(phone="0698765432"))
+    assert "Email déjà utilisé" in str(response)
+
+
+# PHASE 5.6: Idempotency-Key Tests
+
+@tester.test("Idempotency - Retried POST /drivers is replayed")
+async def idempotent_driver_creation(api):
+    headers = {"Idempotency-Key": "create-jean-1"}
+    first = await api.request("POST", "drivers", json=STEP1_PROFILE, headers=headers)
+    retry = await api.request("POST", "drivers", json=STEP1_PROFILE, headers=headers)
+    assert first.status_code == retry.status_code == 200
+    assert retry.headers.get("idempotent-replayed") == "true"
+    assert first.json()["id"] == retry.json()["id"], "Retry created a second driver"
+
+
+@tester.test("Idempotency - Key is tied to the request body and caller")
+async def idempotent_key_scope(api):
+    from idempotency import BodyDigest
+
+    headers = {"Idempotency-Key": "create-jean-3"}
+    first = await api.request("POST", "drivers", json=STEP1_PROFILE, headers=headers)
+    assert first.status_code == 200
+    other = profile_with(email="autre.cle@example.com", phone="0611223399")
+    reused = await api.request("POST", "drivers", json=other, headers=headers)
+    assert reused.status_code == 422, reused.text
+    assert await api.db.drivers.count_documents({"profile.email": "autre.cle@example.com"}) == 0
+
+    # Same key from another caller is its own request, not a replay of the first
+    caller = await api.request("POST", "drivers", json=other, headers={**headers, **admin_headers()})
+    assert caller.status_code == 200 and caller.headers.get("idempotent-replayed") is None
+
+    # Multipart boundaries change from one attempt to the next; the digest ignores them
+    def digest(boundary, chunk):
+        body = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"\r\n\r\n"
+                f"contenu\r\n--{boundary}--\r\n").encode()
+        hashed = BodyDigest(f"multipart/form-data; boundary={boundary}".encode())
+        for start in range(0, len(body), chunk):
+            hashed.feed(body[start:start + chunk])
+        return hashed.hexdigest()
+
+    assert digest("a1b2c3d4e5", 7) == digest("f6e5d4c3b2", 3) == digest("0123456789", 1000)
+
+
+@tester.test("Idempotency - Stale markers and expired records are taken over")
+async def idempotent_stale_records(api):
+    import idempotency
+    import server
+
+    store = server.idempotency_store
+    headers = {"Idempotency-Key": "create-jean-4"}
+    scoped_key = "POST /api/drivers?:-:create-jean-4"
+    # Left by a worker killed mid-request two hours ago
+    await api.db.idempotency_keys.insert_one(
+        {"_id": scoped_key, "status": "in_progress", "created_at": datetime.utcnow() - timedelta(hours=2)})
+    first = await api.request("POST", "drivers", json=STEP1_PROFILE, headers=headers)
+    assert first.status_code == 200, first.text
+    assert (await api.db.idempotency_keys.find_one({"_id": scoped_key}))["status"] == "completed"
+
+    # Past the TTL, neither the LRU nor a record the TTL index has not removed yet is replayed
+    expired = datetime.utcnow() - timedelta(seconds=idempotency.KEY_TTL_SECONDS + 60)
+    store._lru[scoped_key]["created_at"] = expired
+    await api.db.idempotency_keys.update_one({"_id": scoped_key}, {"$set": {"created_at": expired}})
+    retry = await api.request("POST", "drivers", json=STEP1_PROFILE, headers=headers)
+    assert retry.headers.get("idempotent-replayed") is None
+    assert retry.status_code == 400, retry.text  # executed again: the e-mail is now taken
+
+
+@tester.test("Idempotency - Concurrent duplicates execute once")
+async def idempotent_concurrent_duplicates(api):
+    headers = {"Idempotency-Key": "create-jean-2"}
+    responses = await asyncio.gather(
+        *(api.request("POST", "drivers", json=STEP1_PROFILE, headers=headers) for _ in range(5))
+    )
+    assert {r.status_code for r in responses} == {200}, [r.text for r in responses]
+    assert len({r.json()["id"] for r in responses}) == 1
+    assert sum(r.headers.get("idempotent-replayed") == "true" for r in responses) == 4
+
+
+# PHASE 5.7: Rate Limiting Tests
+
+@tester.test("Rate limit - validate-siret burst is throttled")
+async def rate_limit_validate_siret(api):
+    statuses = []
+    for _ in range(31):
+        response = await api.request("GET", "validate-siret/73282932000074")
+        statuses.append(response.status_code)
+    assert statuses[:30] == [200] * 30, statuses
+    assert response.status_code == 429
+    assert int(response.headers["retry-after"]) >= 1
+
+
+@tester.test("Rate limit - Driver routes are limited per client and per driver, idle buckets dropped as requests come")
+async def rate_limit_driver_routes(api):
+    from rate_limit import InMemoryBackend, RateLimitMiddleware
+
+    import server
+
+    clock = [0.0]
+    backend = InMemoryBackend(clock=lambda: clock[0])
+    statuses = []
+
+    async def app(scope, receive, send):
+        statuses.append(200)
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            statuses.append(message["status"])
+
+    limited = RateLimitMiddleware(app, server.RATE_LIMITS, backend=backend)
+
+    def upload(client, driver_id="chauffeur-1"):
+        return limited({"type": "http", "method": "POST", "path": f"/api/drivers/{driver_id}/upload-document",
+                        "headers": [], "client": (client, 50000)}, None, send)
+
+    for _ in range(21):
+        await upload("10.0.0.1")
+    assert statuses[-1] == 429 and statuses[:-1] == [200] * 20, statuses
+    # Someone else exhausting the driver's bucket does not lock the driver out
+    await upload("10.0.0.2")
+    assert statuses[-1] == 200
+
+    # Cycling through driver ids: the client's own bucket covers 5 drivers' worth
+    for client in range(101):
+        await upload("10.0.0.3", driver_id=f"chauffeur-{client}")
+    assert statuses[-1] == 429 and statuses[-101:-1] == [200] * 100
+
+    clock[0] += 3600
+    for client in range(100):
+        await upload(f"10.1.0.{client}", driver_id=f"chauffeur-{client}")
+    assert len(backend) == 200, "one bucket per client, one per client and driver"
+    clock[0] += 3600
+    await upload("10.2.0.1")
+    assert len(backend) == 198, "each request drops a few idle buckets, not all of them"
+    for _ in range(60):
+        await upload("10.2.0.1")
+    assert len(backend) == 2
+
+
+# PHASE 6: Error Handling Tests
+
+@tester.test("Get Non-existent Driver")
+async def get_nonexistent_driver(api):
+    await api.check("Get Non-existent Driver", "GET", "drivers/nonexistent-id-12345", 404)
+
+
+def test_backend_suite():
+    tester.assert_all_pass()
+
 
 if __name__ == "__main__":
-    sys.exit(main())
\ No newline at end of file
+    sys.exit(tester.main())
@@ -0,0 +1,107 @@
+"""Per-request cost of token verification and event-loop stalls during logins.
+
+* ``verify``: microseconds per ``TokenService.verify`` for HS256 and RS256
+  tokens, first sight (signature checked) vs repeat (LRU hit). Fails when
+  a repeat verification exceeds ``--budget-us``.
+* ``login``: ``--logins`` concurrent bcrypt checks at ``--rounds``, run in
+  the hashing pool vs inline on the loop, with the worst delay seen by a
+  10 ms ticker running next to them.
+
+    python benchmarks/auth_bench.py --rounds 12
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from cryptography.hazmat.primitives import serialization  # noqa: E402
+from cryptography.hazmat.primitives.asymmetric import rsa  # noqa: E402
+
+
+def rsa_pems():
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    private = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                serialization.NoEncryption()).decode()
+    public = key.public_key().public_bytes(serialization.Encoding.PEM,
+                                           serialization.PublicFormat.SubjectPublicKeyInfo).decode()
+    return private, public
+
+
+def verify_costs(auth, tokens_count: int):
+    services = {
+        "HS256": auth.TokenService({"k1": ("x" * 32, "x" * 32)}, "k1", "HS256"),
+        "RS256": auth.TokenService({"k1": rsa_pems()}, "k1", "RS256"),
+    }
+    results = {}
+    for name, service in services.items():
+        tokens = [service.issue(f"user-{i}", "driver") for i in range(tokens_count)]
+        timings = []
+        for _ in range(2):  # first pass verifies signatures, second hits the LRU
+            start = time.perf_counter()
+            for token in tokens:
+                service.verify(token)
+            timings.append((time.perf_counter() - start) / len(tokens) * 1e6)
+        results[name] = timings
+    return results
+
+
+async def login_stall(auth, logins: int, inline: bool):
+    password_hash = auth.pwd_context.hash("correct horse")
+    worst = 0.0
+    done = asyncio.Event()
+
+    async def ticker():
+        nonlocal worst
+        while not done.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(0.01)
+            worst = max(worst, time.perf_counter() - start - 0.01)
+
+    async def login():
+        if inline:
+            auth.pwd_context.verify("correct horse", password_hash)
+        else:
+            await auth.verify_password("correct horse", password_hash)
+
+    task = asyncio.create_task(ticker())
+    start = time.perf_counter()
+    await asyncio.gather(*(login() for _ in range(logins)))
+    elapsed = time.perf_counter() - start
+    done.set()
+    await task
+    return elapsed * 1000, worst * 1000
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tokens", type=int, default=2000)
+    parser.add_argument("--logins", type=int, default=8)
+    parser.add_argument("--rounds", type=int, default=10, help="bcrypt cost")
+    parser.add_argument("--budget-us", type=float, default=20.0, help="repeat verification budget")
+    args = parser.parse_args(argv)
+    os.environ["AUTH_BCRYPT_ROUNDS"] = str(args.rounds)
+    import auth
+
+    failed = False
+    print(f"{'verify':<8} {'first us':>10} {'repeat us':>10}")
+    for name, (first, repeat) in verify_costs(auth, args.tokens).items():
+        print(f"{name:<8} {first:>10.1f} {repeat:>10.2f}")
+        failed |= repeat > args.budget_us
+
+    print(f"\n{args.logins} concurrent logins, bcrypt cost {args.rounds}")
+    for label, inline in (("pool", False), ("inline", True)):
+        elapsed, stall = asyncio.run(login_stall(auth, args.logins, inline))
+        print(f"{label:<8} total {elapsed:8.1f} ms   worst loop stall {stall:8.1f} ms")
+    auth.shutdown_pool()
+    if failed:
+        print(f"repeat verification over the {args.budget_us}us budget")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
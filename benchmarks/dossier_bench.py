@@ -0,0 +1,121 @@
+"""Memory and throughput of streamed dossier exports.
+
+Writes ``--drivers`` drivers with ``--files`` documents each, ``--size-mb``
+in total, then streams their dossiers with ``dossiers.stream_dossiers``
+into a counter (no HTTP, no disk writes), plaintext and then encrypted
+with a vault. Reports MB/s and the peak of Python allocations
+(``tracemalloc``) during the stream, and fails when that peak exceeds
+``--max-peak-mb``: it grows with the number of files (the central
+directory), not with their size. The
+archives are then read back with ``zipfile``, in a separate run, when
+small enough to hold in memory.
+
+    python benchmarks/dossier_bench.py --size-mb 2048 --drivers 200 --files 8
+"""
+import argparse
+import asyncio
+import io
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import zipfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import dossiers  # noqa: E402
+import vault  # noqa: E402
+
+
+def make_tree(root: Path, drivers: int, files: int, file_size: int):
+    records = []
+    block = os.urandom(1024 * 1024)
+    for number in range(drivers):
+        driver_id = f"driver-{number:05d}"
+        folder = root / "uploads" / driver_id
+        folder.mkdir(parents=True)
+        documents = {}
+        for index in range(files):
+            path = folder / f"document_{index}.pdf"
+            with open(path, "wb") as f:
+                for offset in range(0, file_size, len(block)):
+                    f.write(block[:min(len(block), file_size - offset)])
+            documents[f"document_{index}"] = str(path.relative_to(root))
+        records.append({"id": driver_id, "documents": documents, "status": "approved"})
+    return records
+
+
+async def drivers(records):
+    for record in records:
+        yield record
+
+
+async def export(records, root: Path, document_vault):
+    total = 0
+    tracemalloc.start()
+    start = time.perf_counter()
+    async for data in dossiers.stream_dossiers(drivers(records), root, document_vault):
+        total += len(data)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return total, elapsed, peak
+
+
+async def check_archive(records, root: Path, document_vault):
+    archive = io.BytesIO()
+    async for data in dossiers.stream_dossiers(drivers(records), root, document_vault):
+        archive.write(data)
+    with zipfile.ZipFile(archive) as archive:
+        assert archive.testzip() is None
+        assert len(archive.namelist()) == sum(len(record["documents"]) + 1 for record in records)
+
+
+async def sealed_vault(root: Path):
+    from mongomock_motor import AsyncMongoMockClient
+
+    db = AsyncMongoMockClient()["dossier_bench"]
+    keys = vault.DataKeys(lambda: db, os.urandom(32))
+    await keys.ensure_indexes()
+    document_vault = vault.Vault(keys)
+    await vault.seal_tree(document_vault, root / "uploads")
+    return document_vault
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size-mb", type=int, default=1024)
+    parser.add_argument("--drivers", type=int, default=100)
+    parser.add_argument("--files", type=int, default=8)
+    parser.add_argument("--max-peak-mb", type=float, default=16.0)
+    args = parser.parse_args(argv)
+
+    file_size = args.size_mb * 1024 * 1024 // (args.drivers * args.files)
+    failed = False
+    print(f"{args.drivers} drivers x {args.files} files of {file_size / 2 ** 20:.2f} MB")
+    print(f"{'run':<10} {'archive MB':>11} {'MB/s':>7} {'peak MB':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        records = make_tree(root, args.drivers, args.files, file_size)
+
+        async def run_all():
+            nonlocal failed
+            for name in ("plaintext", "encrypted"):
+                document_vault = await sealed_vault(root) if name == "encrypted" else None
+                total, elapsed, peak = await export(records, root, document_vault)
+                print(f"{name:<10} {total / 2 ** 20:>11.0f} {total / 2 ** 20 / elapsed:>7.0f} {peak / 2 ** 20:>8.1f}")
+                failed |= peak / 2 ** 20 > args.max_peak_mb
+                if args.size_mb <= 256:
+                    await check_archive(records, root, document_vault)
+
+        asyncio.run(run_all())
+    if failed:
+        print(f"peak memory over {args.max_peak_mb:g} MB")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,187 @@
+"""Near-duplicate lookups among the fleet's identity fingerprints.
+
+Two parts:
+
+* ``robustness``: ``--documents`` synthetic ID card photos (card, portrait
+  and text lines placed at random on a noisy background) are normalized
+  like uploads, then re-sent recompressed, downscaled, brightened and
+  cropped. Reports the largest distance between a photo and each kind of
+  variant, and how many pairs of different photos fall within
+  ``fingerprints.RADIUS``; fails if a variant other than the crop (which
+  pHash does not survive) is farther than that, or over 1% of the pairs
+  are within it. The synthetic cards share one simple template, so they
+  are closer to each other than real photos are.
+* ``lookup``: ``--fleet`` random fingerprints in a ``HammingIndex``, then
+  queries (unseen fingerprints and near-duplicates of stored ones) timed
+  against a linear scan of the same fingerprints. Random fingerprints
+  spread evenly over the bands; real ones cluster a little, which adds
+  candidates per probe.
+
+    python benchmarks/fingerprint_bench.py --fleet 1000000 --documents 20
+"""
+import argparse
+import asyncio
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import fingerprints  # noqa: E402
+import images  # noqa: E402
+
+
+def document_photo(seed: int, width: int = 3000, height: int = 4000) -> bytes:
+    from PIL import Image, ImageDraw, ImageFilter
+
+    rng = random.Random(seed)
+    shade = tuple(rng.randint(40, 200) for _ in range(3))
+    noise = Image.effect_noise((width // 8, height // 8), 30).resize((width, height)).convert("RGB")
+    photo = Image.blend(Image.new("RGB", (width, height), shade), noise, 0.4)
+    draw = ImageDraw.Draw(photo)
+    card_width = int(width * rng.uniform(0.55, 0.85))
+    card_height = int(card_width * 0.63)
+    left = rng.randint(0, width - card_width)
+    top = rng.randint(0, height - card_height)
+    draw.rounded_rectangle((left, top, left + card_width, top + card_height), radius=card_width // 30,
+                           fill=tuple(rng.randint(170, 245) for _ in range(3)))
+    portrait = card_width // 4
+    draw.rectangle((left + portrait // 4, top + card_height // 4, left + portrait * 5 // 4,
+                    top + card_height // 4 + portrait * 4 // 3), fill=tuple(rng.randint(50, 150) for _ in range(3)))
+    for row in range(6):
+        y = top + card_height // 4 + row * card_height // 10
+        x = left + portrait * 3 // 2
+        draw.line((x, y, x + rng.randint(card_width // 8, card_width // 2), y), fill=(20, 20, 50),
+                  width=max(2, card_height // 60))
+    photo = photo.filter(ImageFilter.GaussianBlur(1))
+    buffer = io.BytesIO()
+    photo.save(buffer, "JPEG", quality=92)
+    return buffer.getvalue()
+
+
+def variants(data: bytes):
+    from PIL import Image, ImageEnhance
+
+    def encode(image, quality=85):
+        buffer = io.BytesIO()
+        image.save(buffer, "JPEG", quality=quality)
+        return buffer.getvalue()
+
+    with Image.open(io.BytesIO(data)) as image:
+        image = image.convert("RGB")
+        width, height = image.size
+        yield "quality 50", encode(image, 50)
+        yield "half size", encode(image.resize((width // 2, height // 2)))
+        yield "brighter", encode(ImageEnhance.Brightness(image).enhance(1.15))
+        margin_x, margin_y = width // 50, height // 50
+        yield "crop 2%", encode(image.crop((margin_x, margin_y, width - margin_x, height - margin_y)))
+
+
+async def fingerprint(tmp: str, name: str, data: bytes) -> int:
+    path = Path(tmp) / "uploads" / name / "identity_card_front.jpg"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    stored, _ = await images.normalize_document(path, Path(tmp) / "originals")
+    return await fingerprints.compute(stored)
+
+
+async def robustness(documents: int):
+    same, different = {}, []
+    with tempfile.TemporaryDirectory() as tmp:
+        hashes = []
+        for seed in range(documents):
+            data = document_photo(seed)
+            value = await fingerprint(tmp, f"doc{seed}", data)
+            hashes.append(value)
+            for variant, variant_data in variants(data):
+                distance = (await fingerprint(tmp, f"doc{seed}-{variant}", variant_data) ^ value).bit_count()
+                same[variant] = max(distance, same.get(variant, 0))
+        for i, first in enumerate(hashes):
+            for second in hashes[i + 1:]:
+                different.append((first ^ second).bit_count())
+    images.shutdown_pool()
+    return same, different
+
+
+def best_of(repeat: int, func) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def resident_mb() -> float:
+    # Current, not peak, resident memory: the robustness part peaks higher (Linux only)
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+
+
+def lookup(fleet: int, queries: int, scans: int):
+    rng = random.Random(0)
+    hashes = [rng.getrandbits(64) for _ in range(fleet)]
+    rss = resident_mb()
+    start = time.perf_counter()
+    index = fingerprints.HammingIndex()
+    for number, value in enumerate(hashes):
+        index.add((f"driver-{number}", "identity_card_front"), value)
+    build = time.perf_counter() - start
+    memory = resident_mb() - rss
+
+    def near(value):
+        for bit in rng.sample(range(64), rng.randint(0, fingerprints.RADIUS)):
+            value ^= 1 << bit
+        return value
+
+    unseen = [rng.getrandbits(64) for _ in range(queries)]
+    duplicates = [near(rng.choice(hashes)) for _ in range(queries)]
+    found = []
+    timings = {
+        "unseen": best_of(3, lambda: [index.search(value) for value in unseen]) / queries,
+        "near-duplicate": best_of(3, lambda: found.__setitem__(
+            slice(None), [index.search(value) for value in duplicates])) / queries,
+    }
+    scan = best_of(1, lambda: [[h for h in hashes if (h ^ value).bit_count() <= fingerprints.RADIUS]
+                               for value in duplicates[:scans]]) / scans
+    return build, memory, timings, scan, sum(1 for matches in found if matches) / queries
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--fleet", type=int, default=1_000_000)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--scans", type=int, default=5, help="queries timed with a linear scan")
+    parser.add_argument("--documents", type=int, default=12, help="synthetic photos, 0 to skip")
+    args = parser.parse_args(argv)
+
+    failed = False
+    if args.documents and images.available():
+        same, different = asyncio.run(robustness(args.documents))
+        print(f"robustness: {args.documents} photos, radius {fingerprints.RADIUS}")
+        for variant, distance in same.items():
+            print(f"  {variant:<16} largest distance  {distance:>3}")
+            failed |= distance > fingerprints.RADIUS and not variant.startswith("crop")
+        close = sum(distance <= fingerprints.RADIUS for distance in different) / len(different)
+        print(f"  {'other photo':<16} smallest distance {min(different):>3}, "
+              f"median {sorted(different)[len(different) // 2]}, {close:.1%} of pairs within radius")
+        failed |= close > 0.01
+    elif args.documents:
+        print("Pillow is not installed, robustness skipped")
+
+    build, memory, timings, scan, recall = lookup(args.fleet, args.queries, args.scans)
+    print(f"lookup: {args.fleet} fingerprints, built in {build:.1f} s, ~{memory:.0f} MB")
+    for name, seconds in timings.items():
+        print(f"  {name:<15} {seconds * 1e6:>8.1f} µs/query")
+    print(f"  {'linear scan':<15} {scan * 1e6:>8.0f} µs/query")
+    print(f"  near-duplicates found: {recall:.1%}")
+    failed |= recall < 1
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,83 @@
+"""Load time and lookup cost of the postal code gazetteer at full size.
+
+The first load parses the file and writes the compiled cache; the budget
+applies to later loads, i.e. every process start after the first.
+
+Without ``--file`` a synthetic export shaped like the La Poste file (39k
+rows, ~35k communes, multi-word names) is generated, so the load budget
+can be checked without the real dataset.
+
+    python benchmarks/gazetteer_bench.py --file laposte_hexasmal.csv --budget-ms 100
+"""
+import argparse
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from gazetteer import Gazetteer  # noqa: E402
+
+SYLLABLES = ["BA", "BE", "CHA", "COU", "DI", "FON", "GRA", "LA", "LON", "MAR", "MON", "NEU", "PI", "RI",
+             "ROCHE", "SAU", "TOUR", "VAL", "VIL", "VER"]
+PARTICLES = ["SUR", "EN", "LES", "SOUS", "DE"]
+
+
+def synthetic_file(path: Path, rows: int, rng: random.Random):
+    def word():
+        return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+
+    with open(path, "w", encoding="utf-8") as handle:
+        handle.write("Code_commune_INSEE;Nom_de_la_commune;Code_postal;Libellé_d_acheminement;Ligne_5\n")
+        for index in range(rows):
+            name = word() if rng.random() < 0.6 else f"{rng.choice(['ST', 'LE', word()])} {rng.choice(PARTICLES)} {word()}"
+            postcode = f"{rng.randrange(1000, 98000):05d}"
+            handle.write(f"{index:05d};{name};{postcode};{name};\n")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--file", type=Path, help="La Poste export to load (default: synthetic)")
+    parser.add_argument("--rows", type=int, default=39_000)
+    parser.add_argument("--budget-ms", type=float, default=100.0, help="load time budget")
+    parser.add_argument("--lookups", type=int, default=100_000)
+    args = parser.parse_args(argv)
+
+    rng = random.Random(7)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.file
+        if path is None:
+            path = Path(tmp) / "hexasmal.csv"
+            synthetic_file(path, args.rows, rng)
+        loads = []
+        for _ in range(5):
+            start = time.perf_counter()
+            gazetteer = Gazetteer.load(path, cache_dir=Path(tmp))
+            loads.append((time.perf_counter() - start) * 1000)
+
+    postcodes = [f"{rng.randrange(1000, 98000):05d}" for _ in range(args.lookups)]
+    start = time.perf_counter()
+    for postcode in postcodes:
+        gazetteer.city_ids(postcode)
+    lookup_us = (time.perf_counter() - start) / args.lookups * 1e6
+
+    addresses = [f"{rng.randint(1, 200)} rue {gazetteer.name(rng.randrange(len(gazetteer)))}, "
+                 f"{postcodes[i]} {gazetteer.name(rng.randrange(len(gazetteer)))}" for i in range(10_000)]
+    start = time.perf_counter()
+    for address in addresses:
+        gazetteer.find_cities(address)
+    match_us = (time.perf_counter() - start) / len(addresses) * 1e6
+
+    load_ms = min(loads)
+    print(f"{gazetteer.size} postcodes, {len(gazetteer)} city names")
+    print(f"cold parse: {loads[0]:.1f} ms   load: {load_ms:.1f} ms (best of 5, cached)   postcode lookup: {lookup_us:.2f} us   address match: {match_us:.1f} us")
+    if load_ms > args.budget_ms:
+        print(f"load time over the {args.budget_ms}ms budget")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
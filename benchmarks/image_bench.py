@@ -0,0 +1,97 @@
+"""Size and time of document photo normalization.
+
+Synthesizes phone-like photos (a textured card on a noisy background,
+EXIF orientation set, saved at quality 95 like most phone cameras) at a
+few resolutions, normalizes each one with ``images.normalize`` and
+reports bytes before/after and milliseconds (best of 3), with and without
+JPEG draft decoding. Fails if a photo does not shrink at least
+``--min-ratio`` times.
+
+    python benchmarks/image_bench.py --sizes 3000x4000,6000x8000
+"""
+import argparse
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import images  # noqa: E402
+
+
+def phone_photo(width: int, height: int, seed: int = 0) -> bytes:
+    from PIL import Image, ImageDraw, ImageFilter
+
+    rng = random.Random(seed)
+    noise = Image.effect_noise((width // 4, height // 4), 40).resize((width, height)).convert("RGB")
+    photo = Image.blend(Image.new("RGB", (width, height), (120, 110, 95)), noise, 0.5)
+    draw = ImageDraw.Draw(photo)
+    left, top = width // 8, height // 4
+    draw.rounded_rectangle((left, top, width - left, height - top), radius=width // 40, fill=(225, 230, 240))
+    for row in range(12):
+        y = top + (row + 1) * (height // 2) // 14
+        draw.line((left * 2, y, left * 2 + rng.randint(width // 5, width // 2), y),
+                  fill=(30, 30, 60), width=max(2, height // 300))
+    photo = photo.filter(ImageFilter.GaussianBlur(1))
+    exif = Image.Exif()
+    exif[0x0112] = 6  # rotated 90°, as a phone held upright stores it
+    buffer = io.BytesIO()
+    photo.save(buffer, "JPEG", quality=95, exif=exif.tobytes())
+    return buffer.getvalue()
+
+
+def timed(source: str, destination: str, image_format: str, draft: bool, repeat: int = 3):
+    from PIL import JpegImagePlugin
+
+    original_draft = JpegImagePlugin.JpegImageFile.draft
+    if not draft:
+        JpegImagePlugin.JpegImageFile.draft = lambda self, mode, size: None
+    try:
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            info = images.normalize(source, destination, image_format)
+            best = min(best, (time.perf_counter() - start) * 1000)
+        return info, best
+    finally:
+        JpegImagePlugin.JpegImageFile.draft = original_draft
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="3000x4000,4284x5712", help="comma-separated WxH")
+    parser.add_argument("--min-ratio", type=float, default=5.0)
+    args = parser.parse_args(argv)
+    if not images.available():
+        print("Pillow is not installed")
+        return 1
+
+    failed = False
+    print(f"{'photo':<11} {'format':<6} {'before KB':>10} {'after KB':>9} {'ratio':>6} "
+          f"{'ms':>7} {'no-draft ms':>12}  output")
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.sizes.split(","):
+            width, height = (int(side) for side in size.split("x"))
+            source = os.path.join(tmp, f"{size}.jpg")
+            Path(source).write_bytes(phone_photo(width, height))
+            before = os.path.getsize(source)
+            for image_format in images.FORMATS:
+                destination = os.path.join(tmp, f"{size}{images.FORMATS[image_format]}")
+                info, elapsed = timed(source, destination, image_format, draft=True)
+                _, slow = timed(source, destination, image_format, draft=False)
+                ratio = before / info["bytes"]
+                failed |= ratio < args.min_ratio
+                print(f"{size:<11} {image_format:<6} {before / 1024:>10.0f} {info['bytes'] / 1024:>9.0f} "
+                      f"{ratio:>6.1f} {elapsed:>7.0f} {slow:>12.0f}  {info['size'][0]}x{info['size'][1]}")
+    if failed:
+        print(f"a photo shrank less than {args.min_ratio:g}x")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
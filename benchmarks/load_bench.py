@@ -0,0 +1,268 @@
+"""Load benchmark for the Pikkles API.
+
+Drives the full 6-step registration flow, document uploads, dashboard reads
+and course applications for many virtual drivers concurrently, then reports
+p50/p95/p99 latency and throughput per endpoint.
+
+By default the app runs in process against mongomock-motor (see
+``backend/local_stack.py``); ``--mongo-url`` uses a local mongod instead and
+``--base-url`` targets an already running server.
+
+Results are compared to ``baselines.json``; a p95 or throughput regression
+beyond ``--tolerance`` makes the run exit with status 1.
+
+    python benchmarks/load_bench.py --drivers 200 --concurrency 50
+    python benchmarks/load_bench.py --update-baseline
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import sys
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from datetime import datetime
+from pathlib import Path
+
+import httpx
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT_DIR / "backend"))
+
+BASELINE_FILE = Path(__file__).resolve().parent / "baselines.json"
+
+# Fake document payloads: a JPEG header and a minimal PDF, padded to a realistic size
+JPEG_BYTES = b"\xff\xd8\xff\xe0" + b"\x00" * (256 * 1024)
+PDF_BYTES = b"%PDF-1.4\n" + b"%" * (128 * 1024) + b"\n%%EOF\n"
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not samples:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(samples)))
+    return samples[rank - 1]
+
+
+class Recorder:
+    """Collect latencies (ms) and failures per endpoint name."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    async def call(self, client, name, method, url, expected=200, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+        except httpx.HTTPError:
+            self.errors[name] += 1
+            return None
+        self.latencies[name].append((time.perf_counter() - start) * 1000)
+        if response.status_code != expected:
+            self.errors[name] += 1
+            return None
+        return response
+
+    def summary(self, elapsed):
+        report = {}
+        for name in sorted(set(self.latencies) | set(self.errors)):
+            samples = sorted(self.latencies[name])
+            report[name] = {
+                "count": len(samples),
+                "errors": self.errors[name],
+                "p50_ms": round(percentile(samples, 50), 2),
+                "p95_ms": round(percentile(samples, 95), 2),
+                "p99_ms": round(percentile(samples, 99), 2),
+                "throughput_rps": round(len(samples) / elapsed, 1) if elapsed else 0.0,
+            }
+        return report
+
+
+async def driver_journey(client, recorder, index, run_id):
+    """One driver going through registration, uploads, dashboard and courses."""
+    phone = f"06{(run_id * 100000 + index) % 100000000:08d}"
+    response = await recorder.call(client, "POST /drivers", "POST", "/api/drivers", json={
+        "profile": {
+            "firstname": "Jean",
+            "lastname": "Dupont",
+            "email": f"bench.{run_id}.{index}@pikkle.fr",
+            "phone": phone,
+            "date_of_birth": "1990-01-15",
+            "address": "123 Rue de la Paix, 75001 Paris",
+        },
+        "registration_step": 1,
+    })
+    if response is None:
+        return
+    driver_id = response.json()["id"]
+    driver_url = f"/api/drivers/{driver_id}"
+
+    steps = [
+        {"documents": {
+            "identity_card_front": "uploads/bench/identity_front.jpg",
+            "identity_card_back": "uploads/bench/identity_back.jpg",
+            "proof_of_residence": "uploads/bench/proof_residence.pdf",
+        }, "registration_step": 2},
+        {"documents": {
+            "civil_liability_insurance": "uploads/bench/civil_liability.pdf",
+            "vehicle_insurance": "uploads/bench/vehicle_insurance.pdf",
+            "vehicle_contract": "uploads/bench/vehicle_contract.pdf",
+        }, "registration_step": 3},
+        {"business_info": {
+            "siret": "73282932000074",
+            "company_name": "Jean Dupont Auto-Entrepreneur",
+            "business_address": "123 Rue de la Paix, 75001 Paris",
+        }, "registration_step": 4},
+        {"bank_info": {
+            "bank_name": "Crédit Agricole",
+            "iban": "FR1420041010050500013M02606",
+            "bic": "AGRIFRPP",
+            "account_holder_name": "Jean Dupont",
+        }, "registration_step": 5},
+        {"contract": {
+            "auto_entrepreneur_status": True,
+            "accepts_cgu": True,
+            "accepts_privacy_policy": True,
+            "accepts_app_download": True,
+            "signature_date": datetime.utcnow().isoformat(),
+        }, "registration_step": 6, "status": "under_review"},
+    ]
+    await recorder.call(client, "GET /drivers/{id}", "GET", driver_url)
+    await recorder.call(client, "GET /validate-siret/{siret}", "GET", "/api/validate-siret/73282932000074")
+    for step in steps:
+        await recorder.call(client, "PUT /drivers/{id}", "PUT", driver_url, json=step)
+
+    for document_type, filename, payload, mime in (
+        ("identity_card_front", "identity_card_front.jpg", JPEG_BYTES, "image/jpeg"),
+        ("vehicle_insurance", "vehicle_insurance.pdf", PDF_BYTES, "application/pdf"),
+    ):
+        await recorder.call(
+            client, "POST /drivers/{id}/upload-document", "POST",
+            f"{driver_url}/upload-document",
+            params={"document_type": document_type},
+            files={"file": (filename, payload, mime)},
+        )
+
+    await recorder.call(client, "GET /drivers/{id}/stats", "GET", f"{driver_url}/stats")
+    await recorder.call(client, "GET /drivers/{id}/payments", "GET", f"{driver_url}/payments")
+    await recorder.call(client, "GET /drivers/{id}/kyc-status", "GET", f"{driver_url}/kyc-status")
+    await recorder.call(client, "GET /courses", "GET", "/api/courses")
+    await recorder.call(
+        client, "POST /courses/{id}/apply", "POST", f"/api/courses/{index % 2 + 1}/apply",
+        json={"user_id": driver_id},
+    )
+
+
+@asynccontextmanager
+async def open_clients(args):
+    """Yield ``client_for(index)``: one HTTP client per virtual driver."""
+    if args.base_url:
+        async with httpx.AsyncClient(base_url=args.base_url, timeout=30) as client:
+            yield lambda index: client
+        return
+
+    from local_stack import local_stack
+    async with local_stack(mongo_url=args.mongo_url) as app:
+        clients = {}
+
+        def client_for(index):
+            # Each driver gets its own client address, like distinct phones hitting
+            # the per-IP rate limits in production
+            if index not in clients:
+                ip = f"10.{index // 65536 % 256}.{index // 256 % 256}.{index % 256}"
+                transport = httpx.ASGITransport(app=app, client=(ip, 50000))
+                clients[index] = httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=30)
+            return clients[index]
+
+        try:
+            yield client_for
+        finally:
+            for client in clients.values():
+                await client.aclose()
+
+
+async def run(args):
+    recorder = Recorder()
+    semaphore = asyncio.Semaphore(args.concurrency)
+    run_id = int(time.time()) % 1000
+
+    async def bounded(index):
+        async with semaphore:
+            await driver_journey(client_for(index), recorder, index, run_id)
+
+    async with open_clients(args) as client_for:
+        # Warm-up pass so import and first-request costs stay out of the numbers
+        await driver_journey(client_for(args.drivers), Recorder(), args.drivers, run_id)
+        start = time.perf_counter()
+        await asyncio.gather(*(bounded(i) for i in range(args.drivers)))
+        elapsed = time.perf_counter() - start
+    return recorder.summary(elapsed), elapsed
+
+
+def compare(report, baseline, tolerance):
+    """Return a list of human readable regressions against the baseline."""
+    regressions = []
+    for name, current in report.items():
+        if current["errors"]:
+            regressions.append(f"{name}: {current['errors']} failed requests")
+        reference = baseline.get(name)
+        if not reference:
+            continue
+        if current["p95_ms"] > reference["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {current['p95_ms']}ms > baseline {reference['p95_ms']}ms")
+        if current["throughput_rps"] < reference["throughput_rps"] * (1 - tolerance):
+            regressions.append(
+                f"{name}: throughput {current['throughput_rps']}/s < baseline {reference['throughput_rps']}/s"
+            )
+    return regressions
+
+
+def print_report(report, elapsed):
+    header = f"{'endpoint':<40} {'count':>6} {'err':>4} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'req/s':>8}"
+    print(header)
+    print("-" * len(header))
+    for name, row in report.items():
+        print(f"{name:<40} {row['count']:>6} {row['errors']:>4} {row['p50_ms']:>8} "
+              f"{row['p95_ms']:>8} {row['p99_ms']:>8} {row['throughput_rps']:>8}")
+    print(f"\nTotal: {sum(r['count'] for r in report.values())} requests in {elapsed:.2f}s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--drivers", type=int, default=200, help="virtual drivers to register")
+    parser.add_argument("--concurrency", type=int, default=50, help="drivers in flight at once")
+    parser.add_argument("--mongo-url", help="use a local mongod instead of mongomock")
+    parser.add_argument("--base-url", help="benchmark a running server instead of the in-process app")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_FILE)
+    parser.add_argument("--tolerance", type=float, default=0.5, help="allowed relative regression")
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--json", type=Path, help="also write the report to this file")
+    args = parser.parse_args(argv)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    report, elapsed = asyncio.run(run(args))
+    print_report(report, elapsed)
+    if args.json:
+        args.json.write_text(json.dumps(report, indent=2))
+
+    if args.update_baseline:
+        args.baseline.write_text(json.dumps(report, indent=2, sort_keys=True) + "\n")
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    baseline = json.loads(args.baseline.read_text()) if args.baseline.exists() else {}
+    regressions = compare(report, baseline, args.tolerance)
+    if regressions:
+        print("\n⚠️  Regressions detected:")
+        for line in regressions:
+            print(f"   {line}")
+        return 1
+    print("\n✅ No regression against baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
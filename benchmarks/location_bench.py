@@ -0,0 +1,146 @@
+"""Ingestion rate of GPS points through ``POST /drivers/{id}/locations``.
+
+Runs the app in process (see ``backend/local_stack.py``), marks
+``--drivers`` drivers active, then posts ``--requests`` batches per driver,
+for each batch size in ``--batches``, through the whole middleware stack
+(rate limits, idempotency, CORS) and the token check, with the tracker's
+flush task running. The time spent inside the app and inside flushes is timed apart from the
+in-process HTTP client, for a rate per worker: request path (parsing,
+status check, buffering), flushes (``insert_many`` plus the position
+upserts), and the two together. Requests refused with a 503 (buffer full)
+are counted, not failed. Fails when the request path ingests fewer than
+``--target`` points/s, or when points are lost.
+
+By default the flushes go to mongomock, which filters in Python: its
+flush rate says nothing of a real server's; ``--mongo-url`` uses a real
+mongod.
+
+    python benchmarks/location_bench.py --batches 10,50,200 --mongo-url mongodb://localhost:27017
+"""
+import argparse
+import asyncio
+import logging
+import sys
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import httpx
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from local_stack import local_stack  # noqa: E402
+
+
+def batch(size: int, offset: int):
+    start = datetime.utcnow() - timedelta(seconds=size + offset)
+    return {"points": [
+        {"lat": 48.85 + i * 1e-5, "lng": 2.35 + i * 1e-5, "recorded_at": (start + timedelta(seconds=i)).isoformat(),
+         "accuracy": 5.0, "speed": 8.3, "heading": 90.0}
+        for i in range(size)
+    ]}
+
+
+class Phones:
+    """ASGI wrapper giving each driver its own client address, as when reporting from their phone:
+    the rate limits count requests per address."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        driver_id = scope["path"].split("/")[3]
+        return await self.app({**scope, "client": (f"phone-{driver_id}", 50000)}, receive, send)
+
+
+class Timed:
+    """ASGI wrapper adding up the time spent in the app (requests are sent one at a time), less
+    the time of what ``elsewhere`` counts, such as flushes run while a request awaits."""
+
+    def __init__(self, app, elsewhere):
+        self.app = app
+        self.elsewhere = elsewhere
+        self.elapsed = 0.0
+
+    async def __call__(self, scope, receive, send):
+        start, before = time.perf_counter(), self.elsewhere()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.elapsed += time.perf_counter() - start - (self.elsewhere() - before)
+
+
+async def run(size: int, drivers: int, requests: int, mongo_url):
+    import server
+
+    async with local_stack(mongo_url=mongo_url) as app:
+        logging.getLogger("httpx").setLevel(logging.WARNING)
+        tracker = server.location_tracker
+        flushing = 0.0
+        flush = tracker.flush
+
+        async def timed_flush():
+            nonlocal flushing
+            start = time.perf_counter()
+            try:
+                return await flush()
+            finally:
+                flushing += time.perf_counter() - start
+
+        tracker.flush = timed_flush
+        await tracker.ensure_indexes()
+        ids = [f"bench-{number}" for number in range(drivers)]
+        await server.db.drivers.insert_many([{"id": driver_id, "status": "active"} for driver_id in ids])
+        payloads = [batch(size, offset) for offset in range(requests)]
+        tokens = {driver_id: {"Authorization": f"Bearer {server.token_service.issue(driver_id, 'driver', driver_id)}"}
+                  for driver_id in ids}
+        timed = Timed(Phones(app), lambda: flushing)
+        tracker.start()
+        statuses = Counter()
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=timed), base_url="http://bench") as http:
+            start = time.perf_counter()
+            for payload in payloads:
+                for driver_id in ids:
+                    response = await http.post(f"/api/drivers/{driver_id}/locations", json=payload,
+                                               headers=tokens[driver_id])
+                    statuses[response.status_code] += 1
+            await tracker.stop()  # the last points
+            elapsed = time.perf_counter() - start
+        written = await server.db[server.tracking.COLLECTION].count_documents({})
+        return {"statuses": statuses, "elapsed": elapsed, "app": timed.elapsed, "flushing": flushing,
+                "received": tracker.received, "written": written}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--batches", default="10,50,200", help="points per request")
+    parser.add_argument("--drivers", type=int, default=500)
+    parser.add_argument("--requests", type=int, default=4, help="per driver, within the rate limit burst")
+    parser.add_argument("--target", type=float, default=10_000, help="points/s")
+    parser.add_argument("--mongo-url")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+
+    failed = False
+    print(f"{args.drivers} drivers x {args.requests} requests, {'mongod' if args.mongo_url else 'mongomock'}; "
+          f"points/s")
+    print(f"{'batch':>6} {'requests':>9} {'flushes':>8} {'worker':>8} {'end to end':>11} {'503':>5} {'written':>8}")
+    for size in (int(size) for size in args.batches.split(",")):
+        result = asyncio.run(run(size, args.drivers, args.requests, args.mongo_url))
+        received = result["received"]
+        request_rate = received / result["app"]
+        statuses = result["statuses"]
+        print(f"{size:>6} {request_rate:>9.0f} {received / result['flushing']:>8.0f} "
+              f"{received / (result['app'] + result['flushing']):>8.0f} {received / result['elapsed']:>11.0f} "
+              f"{statuses[503]:>5} {result['written']:>8}")
+        failed |= set(statuses) - {202, 503} != set() or result["written"] != received
+        failed |= request_rate < args.target
+    if failed:
+        print(f"errors, lost points, or under {args.target:g} points/s")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,68 @@
+"""Per-request overhead of ``RateLimitMiddleware`` with the in-memory backend.
+
+Calls a no-op ASGI app directly, with and without the middleware, across
+many distinct client IPs, and fails if the added cost exceeds the budget.
+
+    python benchmarks/rate_limit_bench.py --requests 200000 --budget-us 50
+"""
+import argparse
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from rate_limit import InMemoryBackend, RateLimitMiddleware, RouteLimit  # noqa: E402
+
+LIMITS = [
+    RouteLimit.per_minute("validate-siret", "GET", r"/api/validate-siret/[^/]+", burst=30, per_minute=60),
+    RouteLimit.per_minute("create-driver", "POST", r"/api/drivers", burst=20, per_minute=20),
+    RouteLimit.per_minute(
+        "upload-document", "POST", r"/api/drivers/(?P<driver_id>[^/]+)/upload-document", burst=20, per_minute=30
+    ),
+]
+
+
+async def noop_app(scope, receive, send):
+    pass
+
+
+async def noop_send(message):
+    pass
+
+
+async def timed(app, scopes):
+    start = time.perf_counter()
+    for scope in scopes:
+        await app(scope, None, noop_send)
+    return time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200_000)
+    parser.add_argument("--clients", type=int, default=10_000)
+    parser.add_argument("--budget-us", type=float, default=50.0)
+    args = parser.parse_args(argv)
+
+    scopes = [{
+        "type": "http",
+        "method": "GET",
+        "path": "/api/validate-siret/73282932000074",
+        "headers": [],
+        "client": (f"10.0.{i % args.clients // 256}.{i % 256}", 50000),
+    } for i in range(args.requests)]
+
+    limited = RateLimitMiddleware(noop_app, LIMITS, backend=InMemoryBackend())
+    baseline = asyncio.run(timed(noop_app, scopes))
+    with_limits = asyncio.run(timed(limited, scopes))
+    overhead_us = (with_limits - baseline) / args.requests * 1e6
+
+    print(f"{args.requests} requests, {len(limited.backend)} buckets")
+    print(f"overhead per request: {overhead_us:.2f} µs (budget {args.budget_us} µs)")
+    return 0 if overhead_us <= args.budget_us else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
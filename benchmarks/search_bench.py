@@ -0,0 +1,120 @@
+"""Latency of ``search.search_drivers`` on a large drivers collection.
+
+Seeds ``--drivers`` synthetic drivers (names with accents, phones, SIRETs)
+with their ``search_keys``, then runs name, name-prefix, email, phone and
+SIRET queries and reports p50/p95/p99 per kind. Fails when a p95 exceeds
+``--budget-ms``.
+
+The budget is only meaningful against a real mongod (``--mongo-url``):
+mongomock has no indexes and scans every document, so the default run uses
+fewer drivers and only reports.
+
+    python benchmarks/search_bench.py --mongo-url mongodb://localhost:27017 --drivers 100000
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import sys
+import time
+import uuid
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import search  # noqa: E402
+from local_stack import make_database  # noqa: E402
+
+FIRSTNAMES = ["Jean", "Hélène", "Amélie", "François", "Zoé", "Mohamed", "Chloé", "Léa", "Noël", "Inès",
+              "Thomas", "Camille", "Loïc", "Maëlle", "Jérôme", "Aurélien", "Sébastien", "Océane"]
+LASTNAMES = ["Dupont", "Durand", "Lefèvre", "Moreau", "Girard", "Bérénger", "Müller", "Nguyen", "Côté",
+             "Martin", "Bernard", "Petit", "Robert", "Richard", "Faure", "Mercier", "Blanc", "Garnier"]
+
+
+def make_driver(index: int, rng: random.Random) -> dict:
+    firstname = rng.choice(FIRSTNAMES)
+    lastname = f"{rng.choice(LASTNAMES)}{'' if index % 3 else '-' + rng.choice(LASTNAMES)}{index % 997}"
+    driver = {
+        "id": str(uuid.uuid4()),
+        "profile": {
+            "firstname": firstname,
+            "lastname": lastname,
+            "email": f"{search.fold(firstname)}.{index}@example.fr",
+            "phone": f"06{index:08d}",
+        },
+        "business_info": {"siret": f"{rng.randrange(10 ** 13, 10 ** 14)}"},
+        "status": "pending",
+        "registration_step": rng.randint(1, 6),
+    }
+    driver["search_keys"] = search.search_keys(driver)
+    return driver
+
+
+async def seed(db, count: int, rng: random.Random):
+    batch = []
+    for index in range(count):
+        batch.append(make_driver(index, rng))
+        if len(batch) == 5000:
+            await db.drivers.insert_many(batch)
+            batch = []
+    if batch:
+        await db.drivers.insert_many(batch)
+    await search.ensure_indexes(db)
+
+
+def queries(count: int, drivers: int, rng: random.Random):
+    for _ in range(count):
+        index = rng.randrange(drivers)
+        yield "name", f"{rng.choice(FIRSTNAMES)} {rng.choice(LASTNAMES)}{index % 997}"
+        yield "prefix", rng.choice(LASTNAMES)[:3]
+        yield "email", f"jean.{index}@example"
+        yield "phone", f"06 {index:08d}"[:8]
+        yield "siret", str(rng.randrange(10 ** 8, 10 ** 9))
+
+
+async def run(args):
+    rng = random.Random(42)
+    client, db = make_database(args.mongo_url)
+    try:
+        start = time.perf_counter()
+        await seed(db, args.drivers, rng)
+        print(f"Seeded {args.drivers} drivers in {time.perf_counter() - start:.1f}s")
+        await search.search_drivers(db, "dupont")  # warm-up
+        timings = {}
+        for kind, q in queries(args.queries, args.drivers, rng):
+            start = time.perf_counter()
+            await search.search_drivers(db, q)
+            timings.setdefault(kind, []).append((time.perf_counter() - start) * 1000)
+    finally:
+        await client.drop_database(db.name)
+    return timings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mongo-url", help="use a local mongod instead of mongomock")
+    parser.add_argument("--drivers", type=int, help="default: 100000 with --mongo-url, 5000 otherwise")
+    parser.add_argument("--queries", type=int, default=50, help="queries per kind")
+    parser.add_argument("--budget-ms", type=float, default=20.0, help="p95 budget (enforced with --mongo-url)")
+    args = parser.parse_args(argv)
+    args.drivers = args.drivers or (100_000 if args.mongo_url else 5000)
+
+    timings = asyncio.run(run(args))
+    failed = []
+    print(f"{'query':<8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for kind, values in timings.items():
+        cuts = statistics.quantiles(values, n=100)
+        p50, p95, p99 = statistics.median(values), cuts[94], cuts[98]
+        print(f"{kind:<8} {p50:>8.2f} {p95:>8.2f} {p99:>8.2f}")
+        if p95 > args.budget_ms:
+            failed.append(kind)
+    if failed and args.mongo_url:
+        print(f"p95 over {args.budget_ms}ms budget: {', '.join(failed)}")
+        return 1
+    if not args.mongo_url:
+        print("mongomock run: latencies include full collection scans, budget not enforced")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
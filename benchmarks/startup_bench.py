@@ -0,0 +1,85 @@
+"""Cold-start time of the API, phase by phase.
+
+Each run is a fresh interpreter (nothing cached in ``sys.modules``) that
+times, in order:
+
+* ``import models``: the pydantic models alone, what CLIs and workers pay;
+* ``import server``: every route module, with no connection or disk access;
+* ``create_app``: settings, middlewares and background workers;
+* ``first request``: ``GET /api/health`` through the ASGI stack.
+
+Reports the median of ``--runs`` runs per phase and fails when the total
+exceeds ``--budget-ms``.
+
+    python benchmarks/startup_bench.py --runs 7 --budget-ms 1500
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+
+PROBE = r"""
+import asyncio, json, sys, tempfile, time
+from pathlib import Path
+sys.path.insert(0, sys.argv[1])
+timings = {}
+start = time.perf_counter()
+import models
+timings["import models"] = time.perf_counter() - start
+start = time.perf_counter()
+import server
+from settings import Settings
+timings["import server"] = time.perf_counter() - start
+start = time.perf_counter()
+tmp = Path(tempfile.mkdtemp(prefix="pikkles-startup-"))
+app = server.create_app(Settings(environment="development", root_dir=tmp, upload_dir=tmp / "uploads"))
+timings["create_app"] = time.perf_counter() - start
+
+async def first_request():
+    import httpx
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://startup") as client:
+        assert (await client.get("/api/health")).status_code == 200
+
+start = time.perf_counter()
+asyncio.run(first_request())
+timings["first request"] = time.perf_counter() - start
+print(json.dumps({name: seconds * 1000 for name, seconds in timings.items()}))
+"""
+
+
+def run_once() -> dict:
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE, str(BACKEND_DIR)],
+        cwd=BACKEND_DIR, check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=1500.0, help="median total cold start")
+    args = parser.parse_args(argv)
+
+    runs = [run_once() for _ in range(args.runs)]
+    phases = list(runs[0])
+    totals = [sum(run.values()) for run in runs]
+    print(f"{'phase':<14} {'median ms':>10} {'min ms':>8} {'max ms':>8}")
+    for phase in phases:
+        values = [run[phase] for run in runs]
+        print(f"{phase:<14} {statistics.median(values):>10.1f} {min(values):>8.1f} {max(values):>8.1f}")
+    total = statistics.median(totals)
+    print(f"{'total':<14} {total:>10.1f} {min(totals):>8.1f} {max(totals):>8.1f}")
+    if total > args.budget_ms:
+        print(f"cold start over the {args.budget_ms:g} ms budget")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,196 @@
+"""Throughput of encrypted document storage against plaintext storage.
+
+Three measurements, best of ``--repeat``:
+
+* ``cipher``: AES-GCM alone, sealing and opening ``CHUNK_SIZE`` chunks
+  in memory.
+* ``file``: raw write and read of a ``--size-mb`` file through the page
+  cache, ``shutil.copyfileobj`` against ``vault.encrypt_stream`` and
+  ``vault.decrypt_chunks``, for each chunk size. Reading a cached file is
+  a memory copy that AES-GCM cannot keep up with: this is the worst case.
+* ``api``: an upload through ``POST /upload-document`` and a download
+  through the admin document route, in process, on an app without and
+  with a master key (alternated). On a small VM its run-to-run noise is
+  tens of percent; read it over a few runs.
+
+The target is under ``--budget`` (10%) of overhead over plaintext I/O:
+the run fails when an API upload or download exceeds it. File reads are
+reported but not checked, AES-GCM cannot match a memory copy. For
+reference, the cipher time is also shown against the time to move the
+file over a ``--link-mbps`` link (1 Gb/s by default).
+
+    python benchmarks/vault_bench.py --size-mb 16 --chunks 64,256,1024
+"""
+import argparse
+import asyncio
+import base64
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM  # noqa: E402
+
+import vault  # noqa: E402
+
+
+def best_of(repeat: int, func) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def cipher_rates(source: str, repeat: int):
+    aead = AESGCM(AESGCM.generate_key(256))
+    with open(source, "rb") as f:
+        chunks = list(iter(lambda: f.read(vault.CHUNK_SIZE), b""))
+    nonce = os.urandom(12)
+    sealed = [aead.encrypt(nonce, chunk, None) for chunk in chunks]
+
+    # Each output dropped before the next, as when streaming
+    def seal():
+        for chunk in chunks:
+            aead.encrypt(nonce, chunk, None)
+
+    def open_():
+        for chunk in sealed:
+            aead.decrypt(nonce, chunk, None)
+
+    return best_of(repeat, seal), best_of(repeat, open_)
+
+
+def measure(tmp: str, source: str, chunk_size: int, repeat: int):
+    aead, key_id = AESGCM(AESGCM.generate_key(256)), os.urandom(16)
+    plain, sealed = os.path.join(tmp, "plain.bin"), os.path.join(tmp, "sealed.bin")
+
+    def write_plain():
+        with open(source, "rb") as src, open(plain, "wb") as dst:
+            shutil.copyfileobj(src, dst, chunk_size)
+            dst.flush()
+            os.fsync(dst.fileno())
+
+    def write_sealed():
+        with open(source, "rb") as src, open(sealed, "wb") as dst:
+            vault.encrypt_stream(src, dst, aead, key_id, chunk_size)
+            dst.flush()
+            os.fsync(dst.fileno())
+
+    def read_plain():
+        with open(plain, "rb") as src:
+            while src.read(chunk_size):
+                pass
+
+    def read_sealed():
+        with open(sealed, "rb") as src:
+            header, _, prefix, size = vault.read_header(src)
+            for _ in vault.decrypt_chunks(src, aead, header, prefix, size):
+                pass
+
+    return {
+        "write": (best_of(repeat, write_plain), best_of(repeat, write_sealed)),
+        "read": (best_of(repeat, read_plain), best_of(repeat, read_sealed)),
+    }
+
+
+async def api_timings(tmp: str, megabytes: int, repeat: int, encrypted: bool):
+    import httpx
+    from mongomock_motor import AsyncMongoMockClient
+
+    import server
+    from settings import Settings
+
+    root = Path(tmp) / ("sealed" if encrypted else "plain")
+    key = base64.b64encode(os.urandom(32)).decode() if encrypted else None
+    app = server.create_app(Settings(environment="development", root_dir=root, upload_dir=root / "uploads",
+                                     document_master_key=key))
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    server.db = AsyncMongoMockClient()["vault_bench"]
+    if server.document_vault is not None:
+        await server.document_vault.keys.ensure_indexes()
+    driver_id = "bench-driver"
+    await server.db.drivers.insert_one({"id": driver_id, "documents": {}})
+    scan = b"%PDF-1.4\n" + os.urandom(megabytes * 1024 * 1024)
+    admin = {"Authorization": f"Bearer {server.token_service.issue('bench', 'admin')}"}
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+        async def upload():
+            response = await client.post(f"/api/drivers/{driver_id}/upload-document",
+                                         params={"document_type": "kbis_document"},
+                                         files={"file": ("kbis.pdf", scan, "application/pdf")})
+            assert response.status_code == 200, response.text
+
+        async def download():
+            async with client.stream("GET", f"/api/admin/drivers/{driver_id}/documents/kbis_document",
+                                     headers=admin) as response:
+                assert response.status_code == 200
+                async for _ in response.aiter_bytes():
+                    pass
+
+        timings = {}
+        for name, func in (("upload", upload), ("download", download)):
+            best = float("inf")
+            for _ in range(repeat):
+                start = time.perf_counter()
+                await func()
+                best = min(best, time.perf_counter() - start)
+            timings[name] = best
+    return timings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size-mb", type=int, default=16)
+    parser.add_argument("--chunks", default=f"64,{vault.CHUNK_SIZE // 1024},1024", help="chunk sizes in KiB")
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument("--budget", type=float, default=0.10, help="max overhead over plaintext API transfers")
+    parser.add_argument("--link-mbps", type=float, default=1000.0, help="network link, megabits per second")
+    args = parser.parse_args(argv)
+
+    failed = False
+    megabytes = args.size_mb
+    print(f"{megabytes} MB file, best of {args.repeat}")
+    print(f"{'level':<6} {'chunk KiB':>9} {'op':<8} {'plain MB/s':>11} {'sealed MB/s':>12} {'overhead':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "source.bin")
+        with open(source, "wb") as f:
+            for _ in range(megabytes):
+                f.write(os.urandom(1024 * 1024))
+        seal, open_ = cipher_rates(source, args.repeat)
+        print(f"{'cipher':<6} seal {megabytes / seal:.0f} MB/s, open {megabytes / open_:.0f} MB/s")
+        for kib in (int(size) for size in args.chunks.split(",")):
+            for op, (plain, sealed) in measure(tmp, source, kib * 1024, args.repeat).items():
+                print(f"{'file':<6} {kib:>9} {op:<8} {megabytes / plain:>11.0f} {megabytes / sealed:>12.0f} "
+                      f"{sealed / plain - 1:>8.1%}")
+
+        # Alternated, so neither side benefits from running warmer
+        plain, sealed = {}, {}
+        for _ in range(2):
+            for timings, encrypted in ((plain, False), (sealed, True)):
+                for op, seconds in asyncio.run(api_timings(tmp, megabytes, args.repeat, encrypted)).items():
+                    timings[op] = min(seconds, timings.get(op, seconds))
+        for op in plain:
+            overhead = sealed[op] / plain[op] - 1
+            print(f"{'api':<6} {vault.CHUNK_SIZE // 1024:>9} {op:<8} {megabytes / plain[op]:>11.0f} "
+                  f"{megabytes / sealed[op]:>12.0f} {overhead:>8.1%}")
+            failed |= overhead > args.budget
+    link = megabytes * 1024 * 1024 * 8 / (args.link_mbps * 1e6)
+    for op, seconds in (("upload", seal), ("download", open_)):
+        print(f"{op:<8} over {args.link_mbps:g} Mb/s: {link * 1000:.0f} ms transfer, +{seconds * 1000:.1f} ms "
+              f"encryption ({seconds / link:.1%})")
+    if failed:
+        print(f"target not met: API transfers over {args.budget:.0%} slower than plaintext")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
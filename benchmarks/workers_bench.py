@@ -0,0 +1,130 @@
+"""Throughput of the production launcher with 1 vs N workers.
+
+Starts ``backend/serve.py --local`` (mongomock, one database per worker)
+for each worker count, drives it over real sockets with ``--concurrency``
+keep-alive connections for ``--duration`` seconds, and reports requests
+per second and latency percentiles. The request mix is read-only (health,
+course list, driver lookups, admin search), so every worker answers the
+same way whatever database it holds.
+
+The load generator shares the machine: on a host with few cores it
+competes with the workers, and results only mean something when the
+cores outnumber the workers.
+
+    python benchmarks/workers_bench.py --workers 1,4 --duration 10
+"""
+import argparse
+import asyncio
+import os
+import random
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from pathlib import Path
+
+import httpx
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+JWT_SECRET = "workers-bench-secret-0123456789abcdef"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def admin_token() -> str:
+    os.environ["JWT_SECRET"] = JWT_SECRET
+    import auth
+    return auth.TokenService.from_env().issue("bench", "admin")
+
+
+def requests_mix(rng: random.Random):
+    return rng.choice([
+        ("GET", "/api/health", {}),
+        ("GET", "/api/courses", {}),
+        ("GET", f"/api/drivers/{uuid.uuid4()}", {}),
+        ("GET", "/api/admin/drivers/search", {"params": {"q": rng.choice(["dupont", "06 12", "jean@"])}}),
+    ])
+
+
+async def wait_ready(base_url: str, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get("/api/health")).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError("server did not start")
+
+
+async def drive(base_url: str, concurrency: int, duration: float, token: str):
+    latencies, errors = [], 0
+    deadline = time.monotonic() + duration
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    headers = {"Authorization": f"Bearer {token}"}
+
+    async def user(client, rng):
+        nonlocal errors
+        while time.monotonic() < deadline:
+            method, url, kwargs = requests_mix(rng)
+            start = time.perf_counter()
+            response = await client.request(method, url, headers=headers, **kwargs)
+            latencies.append((time.perf_counter() - start) * 1000)
+            errors += response.status_code not in (200, 404)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(user(client, random.Random(i)) for i in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return latencies, errors, elapsed
+
+
+def run(workers: int, args, token: str):
+    port = free_port()
+    env = {**os.environ, "JWT_SECRET": JWT_SECRET}
+    process = subprocess.Popen(
+        [sys.executable, "serve.py", "--local", "--workers", str(workers), "--port", str(port),
+         "--host", "127.0.0.1", "--no-access-log"],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        base_url = f"http://127.0.0.1:{port}"
+        asyncio.run(wait_ready(base_url))
+        return asyncio.run(drive(base_url, args.concurrency, args.duration, token))
+    finally:
+        process.send_signal(signal.SIGTERM)
+        process.wait(timeout=60)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", default=f"1,{max(2, os.cpu_count() or 1)}",
+                        help="comma-separated worker counts")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10.0)
+    args = parser.parse_args(argv)
+
+    token = admin_token()
+    print(f"{os.cpu_count()} CPUs, {args.concurrency} connections, {args.duration:g}s per run")
+    print(f"{'workers':>7} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for workers in (int(count) for count in args.workers.split(",")):
+        latencies, errors, elapsed = run(workers, args, token)
+        cuts = statistics.quantiles(latencies, n=100)
+        print(f"{workers:>7} {len(latencies) / elapsed:>9.0f} {statistics.median(latencies):>8.2f} "
+              f"{cuts[94]:>8.2f} {cuts[98]:>8.2f} {errors:>7}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -29,11 +29,26 @@ const DriverDashboard = ({ driver }) => {
   const [stats, setStats] = useState(null);
   const [payments, setPayments] = useState([]);
   const [loading, setLoading] = useState(true);
+  const [status, setStatus] = useState(driver.status);
 
   useEffect(() => {
+    setStatus(driver.status);
     fetchDashboardData();
   }, [driver]);
 
+  // Mises à jour en direct (Server-Sent Events) au lieu de recharger la page
+  useEffect(() => {
+    const source = new EventSource(`${API}/drivers/${driver.id}/events`);
+    source.addEventListener('driver.status_changed', (event) => {
+      setStatus(JSON.parse(event.data).payload.status);
+      fetchDashboardData();
+    });
+    ['driver.updated', 'driver.kyc_contract_generated', 'driver.kyc_contract_signed'].forEach((type) =>
+      source.addEventListener(type, fetchDashboardData)
+    );
+    return () => source.close();
+  }, [driver.id]);
+
   const fetchDashboardData = async () => {
     try {
       const [statsResponse, paymentsResponse] = await Promise.all([
@@ -106,7 +121,7 @@ const DriverDashboard = ({ driver }) => {
               </p>
             </div>
             <div className="mt-4 md:mt-0">
-              {getStatusBadge(driver.status)}
+              {getStatusBadge(status)}
             </div>
           </div>
         </div>
@@ -171,7 +186,7 @@ const DriverDashboard = ({ driver }) => {
         </div>
 
         {/* Status Alert with KYC */}
-        {driver.status === 'under_review' && (
+        {status === 'under_review' && (
           <Card className="mb-8 border-amber-200 bg-amber-50">
             <CardContent className="p-4">
               <div className="flex items-center space-x-3">
@@ -187,7 +202,7 @@ const DriverDashboard = ({ driver }) => {
           </Card>
         )}
         
-        {driver.status === 'contract_pending' && (
+        {status === 'contract_pending' && (
           <Card className="mb-8 border-blue-200 bg-blue-50">
             <CardContent className="p-4">
               <div className="flex items-center space-x-3">
@@ -204,7 +219,7 @@ const DriverDashboard = ({ driver }) => {
           </Card>
         )}
 
-        {driver.status === 'active' && (
+        {status === 'active' && (
           <Card className="mb-8 border-green-200 bg-green-50">
             <CardContent className="p-4">
               <div className="flex items-center space-x-3">